@@ -1,10 +1,76 @@
 from enum import Enum
-from typing import Union
+from typing import Iterable, Union
 
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.db import models, router
+from django.utils import timezone
+import reversion
+from reversion.models import Revision, Version
 
 from accounts.utils import get_robot_user, is_robot_user
 from images.models import Image
+from labels.models import LocalLabel
+
+
+def create_versions_in_bulk(annotations: list['Annotation']):
+    """
+    Bulk-saving annotations skips signal firing, and thus skips
+    django-reversion's Version creation. This creates the equivalent
+    Versions with one Revision insert and one bulk Version insert, if a
+    revision is active (same condition as for the signals).
+
+    The Versions are put in their own Revision, which gets the active
+    revision's user and comment.
+    """
+    if not annotations or not reversion.is_active():
+        return
+
+    model = annotations[0].__class__
+    content_type = ContentType.objects.get_for_model(model)
+    model_db = router.db_for_write(model)
+
+    # Mirror Annotation.__str__() without running a label code
+    # query per annotation.
+    label_codes = dict(
+        ((labelset_id, label_id), code)
+        for labelset_id, label_id, code in
+        LocalLabel.objects.filter(
+            labelset_id__in=set(
+                annotation.source.labelset_id for annotation in annotations),
+            global_label_id__in=set(
+                annotation.label_id for annotation in annotations),
+        ).values_list('labelset_id', 'global_label_id', 'code')
+    )
+
+    revision = Revision(
+        date_created=timezone.now(),
+        user=reversion.get_user(),
+        comment=reversion.get_comment(),
+    )
+    revision.save()
+
+    versions = []
+    for annotation in annotations:
+        code = label_codes.get(
+            (annotation.source.labelset_id, annotation.label_id))
+        versions.append(Version(
+            revision=revision,
+            content_type=content_type,
+            object_id=str(annotation.pk),
+            db=model_db,
+            format='json',
+            serialized_data=serializers.serialize('json', [annotation]),
+            object_repr=(
+                f"{annotation.image} - {annotation.point.point_number}"
+                f" - {code}"),
+        ))
+    Version.objects.bulk_create(versions)
+
+
+def update_progress_fields_for_images(image_ids: Iterable[int]):
+    for image in Image.objects.filter(pk__in=set(image_ids)):
+        image.annoinfo.update_annotation_progress_fields()
 
 
 class AnnotationQuerySet(models.QuerySet):
@@ -36,18 +102,50 @@ class AnnotationQuerySet(models.QuerySet):
 
         return return_values
 
-    def bulk_create(self, *args, **kwargs):
-        raise NotImplementedError(
-            "Bulk creation would skip django-reversion signals.")
+    def bulk_create_with_versions(self, annotations, **kwargs):
+        """
+        Bulk-create Annotations, and create their django-reversion Versions
+        in bulk. This does not update the images' annotation progress fields.
+        """
+        new_annotations = super().bulk_create(annotations, **kwargs)
+        create_versions_in_bulk(new_annotations)
+        return new_annotations
 
-        # new_annotations = super().bulk_create(*args, **kwargs)
-        #
-        # images = Image.objects.filter(
-        #     annotation__in=new_annotations).distinct()
-        # for image in images:
-        #     image.annoinfo.update_annotation_progress_fields()
-        #
-        # return new_annotations
+    def bulk_update_with_versions(self, annotations, fields, **kwargs):
+        """
+        Bulk-update Annotations, and create their django-reversion Versions
+        in bulk. This does not update the images' annotation progress fields.
+
+        Note that bulk_update() doesn't apply auto_now, so the caller
+        should set annotation_date and include it in the fields.
+        """
+        return_value = super().bulk_update(annotations, fields, **kwargs)
+        create_versions_in_bulk(annotations)
+        return return_value
+
+    def bulk_create(self, annotations, **kwargs):
+        """
+        Batch-create Annotations. Signals are skipped, so we create the
+        django-reversion Versions and update the images' annotation
+        progress fields here.
+        """
+        new_annotations = self.bulk_create_with_versions(
+            annotations, **kwargs)
+        update_progress_fields_for_images(
+            annotation.image_id for annotation in new_annotations)
+        return new_annotations
+
+    def bulk_update(self, annotations, fields, **kwargs):
+        """
+        Batch-update Annotations. Signals are skipped, so we create the
+        django-reversion Versions and update the images' annotation
+        progress fields here.
+        """
+        return_value = self.bulk_update_with_versions(
+            annotations, fields, **kwargs)
+        update_progress_fields_for_images(
+            annotation.image_id for annotation in annotations)
+        return return_value
 
 
 class AnnotationManager(models.Manager):
@@ -128,3 +226,91 @@ class AnnotationManager(models.Manager):
 
         # Else, there's nothing to save, so don't do anything.
         return self.UpdateResultsCodes.NO_CHANGE.value
+
+    def update_point_annotations_if_applicable(
+        self,
+        image: Image,
+        points_and_labels: Iterable[tuple['Point', 'Label']],
+        now_confirmed: bool,
+        user_or_robot_version: Union['User', 'Classifier'],
+    ) -> dict[int, str]:
+        """
+        Bulk version of update_point_annotation_if_applicable(), for
+        Points of a single Image. Same logic on which annotations should be
+        updated or not.
+
+        Existing annotations are loaded in one query, and changes are
+        written with one bulk insert, one bulk update, and bulk
+        django-reversion Version creation. The image's annotation progress
+        fields are updated once at the end.
+
+        :param image: Image which the Points belong to.
+        :param points_and_labels: (Point, Label) pairs to save.
+        :param now_confirmed: see update_point_annotation_if_applicable().
+        :param user_or_robot_version: see
+          update_point_annotation_if_applicable().
+        :return: Dict of Point ID -> string saying what the resulting
+          action was.
+        """
+        robot_user = get_robot_user()
+        if now_confirmed:
+            user = user_or_robot_version
+            robot_version = None
+        else:
+            user = robot_user
+            robot_version = user_or_robot_version
+
+        existing_annotations = dict(
+            (annotation.point_id, annotation)
+            for annotation in self.filter(image=image))
+        now = timezone.now()
+
+        results = dict()
+        annotations_to_create = []
+        annotations_to_update = []
+
+        for point, label in points_and_labels:
+            annotation = existing_annotations.get(point.pk)
+
+            if annotation is None:
+                # This point doesn't have an annotation in the database yet.
+                annotations_to_create.append(self.model(
+                    point=point, image=image, source=image.source,
+                    label=label, user=user, robot_version=robot_version))
+                results[point.pk] = self.UpdateResultsCodes.ADDED.value
+                continue
+
+            previously_confirmed = annotation.user_id != robot_user.pk
+
+            if previously_confirmed and not now_confirmed:
+                # Never overwrite confirmed with unconfirmed.
+                results[point.pk] = self.UpdateResultsCodes.NO_CHANGE.value
+
+            elif (not previously_confirmed and now_confirmed) \
+                    or (label.pk != annotation.label_id):
+                annotation.point = point
+                annotation.image = image
+                annotation.source = image.source
+                annotation.label = label
+                annotation.user = user
+                if not now_confirmed:
+                    annotation.robot_version = robot_version
+                annotation.annotation_date = now
+                annotations_to_update.append(annotation)
+                results[point.pk] = self.UpdateResultsCodes.UPDATED.value
+
+            else:
+                results[point.pk] = self.UpdateResultsCodes.NO_CHANGE.value
+
+        queryset = self.get_queryset()
+        if annotations_to_create:
+            queryset.bulk_create_with_versions(annotations_to_create)
+        if annotations_to_update:
+            queryset.bulk_update_with_versions(
+                annotations_to_update,
+                ['label', 'user', 'robot_version', 'annotation_date'])
+
+        if annotations_to_create or annotations_to_update:
+            image.annoinfo.update_annotation_progress_fields()
+
+        return results
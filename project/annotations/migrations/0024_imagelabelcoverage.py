@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0004_more_concise_regex_validators'),
+        ('images', '0001_squashed_0033_remove_image_annotation_progress'),
+        ('annotations', '0023_populate_annoinfo_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageLabelCoverage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annotation_count', models.PositiveIntegerField(default=0)),
+                ('confirmed_count', models.PositiveIntegerField(default=0)),
+                ('image', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='label_coverages', to='images.image')),
+                ('label', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='labels.label')),
+                ('source', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='images.source')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='imagelabelcoverage',
+            constraint=models.UniqueConstraint(fields=('image', 'label'), name='unique_image_label_coverage'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Q
+from tqdm import tqdm
+
+
+def populate_label_coverages(apps, schema_editor):
+    """
+    Populate ImageLabelCoverages from existing Annotations, one source at
+    a time. This can take a while.
+    """
+    Annotation = apps.get_model('annotations', 'Annotation')
+    ImageLabelCoverage = apps.get_model('annotations', 'ImageLabelCoverage')
+    Source = apps.get_model('images', 'Source')
+
+    for source_id in tqdm(
+        Source.objects.order_by('pk').values_list('pk', flat=True),
+        disable=settings.TQDM_DISABLE,
+    ):
+        label_counts = (
+            Annotation.objects.filter(source_id=source_id)
+            .order_by()
+            .values('image_id', 'label_id')
+            .annotate(
+                annotation_count=Count('pk'),
+                confirmed_count=Count(
+                    'pk',
+                    filter=~Q(user__username=settings.ROBOT_USERNAME)),
+            )
+        )
+        ImageLabelCoverage.objects.bulk_create(
+            [
+                ImageLabelCoverage(
+                    image_id=values['image_id'],
+                    source_id=source_id,
+                    label_id=values['label_id'],
+                    annotation_count=values['annotation_count'],
+                    confirmed_count=values['confirmed_count'],
+                )
+                for values in label_counts
+            ],
+            batch_size=5000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotations', '0024_imagelabelcoverage'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            populate_label_coverages, migrations.RunPython.noop),
+    ]
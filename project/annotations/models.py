@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q
 
 from images.models import Image, Point, Source
+from images.utils import invalidate_image_order_indexes_on_commit
 from labels.models import Label, LocalLabel
 from vision_backend.models import Classifier
 from vision_backend.utils import queue_source_check
@@ -32,13 +35,65 @@ class Annotation(models.Model):
             global_label=self.label, labelset=self.source.labelset)
         return local_label.code
 
+    @property
+    def is_confirmed(self):
+        return not (
+            self.user is not None
+            and self.user.username == settings.ROBOT_USERNAME)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember these as loaded, so that save() only has to look up the
+        # previous values when they've changed.
+        instance._loaded_label_and_user = (
+            instance.__dict__.get('label_id'),
+            instance.__dict__.get('user_id'))
+        return instance
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.image.annoinfo.update_annotation_progress_fields()
+        changed = True
+        if self.pk:
+            changed = (
+                getattr(self, '_loaded_label_and_user', None)
+                != (self.label_id, self.user_id))
+
+        with transaction.atomic():
+            previous = None
+            if self.pk and changed:
+                previous = (
+                    Annotation.objects.filter(pk=self.pk)
+                    .values('label_id', 'user__username').first())
+
+            super().save(*args, **kwargs)
+
+            # Update the label coverages incrementally, rather than
+            # recomputing the image's coverages on each point's save.
+            if previous:
+                confirmed = self.is_confirmed
+                previous_confirmed = (
+                    previous['user__username'] != settings.ROBOT_USERNAME)
+                if (previous['label_id'], previous_confirmed) != (
+                        self.label_id, confirmed):
+                    ImageLabelCoverage.adjust(
+                        self, previous['label_id'], previous_confirmed, -1)
+                    ImageLabelCoverage.adjust(
+                        self, self.label_id, confirmed, 1)
+            elif changed:
+                ImageLabelCoverage.adjust(
+                    self, self.label_id, self.is_confirmed, 1)
+        self._loaded_label_and_user = (self.label_id, self.user_id)
+
+        self.image.annoinfo.update_annotation_progress_fields(
+            label_coverages=False)
 
     def delete(self, *args, **kwargs):
-        return_values = super().delete(*args, **kwargs)
-        self.image.annoinfo.update_annotation_progress_fields()
+        with transaction.atomic():
+            return_values = super().delete(*args, **kwargs)
+            ImageLabelCoverage.adjust(
+                self, self.label_id, self.is_confirmed, -1)
+        self.image.annoinfo.update_annotation_progress_fields(
+            label_coverages=False)
         return return_values
 
     def __str__(self):
@@ -74,13 +129,15 @@ class ImageAnnotationInfo(models.Model):
         # this case.
         related_name='+')
 
-    def update_annotation_progress_fields(self):
+    def update_annotation_progress_fields(self, label_coverages=True):
         """
         Ensure the redundant annotation-progress fields (which exist for
         performance reasons) are up to date.
 
         This should be called after saving, deleting, bulk-deleting, or
-        bulk-creating Annotations or Points.
+        bulk-creating Annotations or Points. Pass label_coverages=False if
+        the image's ImageLabelCoverages have already been updated (or
+        don't need updating).
         """
         # Update the last_annotation.
         # If there are no annotations, then first() returns None.
@@ -94,6 +151,11 @@ class ImageAnnotationInfo(models.Model):
 
         self.save()
 
+        if label_coverages:
+            self.update_label_coverages()
+        invalidate_image_order_indexes_on_commit(
+            self.image.source_id, annotations_only=True)
+
         if self.confirmed and not previously_confirmed:
 
             # With a new image confirmed, let's see if a new robot can be
@@ -106,6 +168,35 @@ class ImageAnnotationInfo(models.Model):
             # can be added.
             queue_source_check(self.image.source.pk)
 
+    def update_label_coverages(self):
+        """
+        Recompute this image's ImageLabelCoverage rows from its annotations.
+        """
+        label_counts = (
+            self.image.annotation_set.order_by()
+            .values('label_id')
+            .annotate(
+                annotation_count=Count('pk'),
+                confirmed_count=Count(
+                    'pk',
+                    filter=~Q(user__username=settings.ROBOT_USERNAME)),
+            )
+        )
+        coverages = [
+            ImageLabelCoverage(
+                image_id=self.image_id,
+                source_id=self.image.source_id,
+                label_id=values['label_id'],
+                annotation_count=values['annotation_count'],
+                confirmed_count=values['confirmed_count'],
+            )
+            for values in label_counts
+        ]
+
+        with transaction.atomic():
+            ImageLabelCoverage.objects.filter(image_id=self.image_id).delete()
+            ImageLabelCoverage.objects.bulk_create(coverages)
+
     @property
     def confirmed(self):
         return self.status == ImageAnnoStatuses.CONFIRMED.value
@@ -119,6 +210,76 @@ class ImageAnnotationInfo(models.Model):
         return ImageAnnoStatuses(self.status).label
 
 
+class ImageLabelCoverage(models.Model):
+    """
+    Number of annotations of a particular label in a particular image.
+    This is redundant with the Annotation table, but it's necessary for
+    the performance of source-level statistics and exports, which can then
+    aggregate one row per image and label instead of one row per point.
+
+    Kept up to date incrementally by Annotation.save() and delete(), and
+    recomputed per image by
+    ImageAnnotationInfo.update_annotation_progress_fields() after bulk
+    operations.
+    """
+    image = models.ForeignKey(
+        Image, on_delete=models.CASCADE, editable=False,
+        related_name='label_coverages')
+    source = models.ForeignKey(
+        Source, on_delete=models.CASCADE, editable=False)
+    label = models.ForeignKey(
+        Label, on_delete=models.CASCADE, editable=False)
+
+    # All annotations of this label in the image.
+    annotation_count = models.PositiveIntegerField(default=0)
+    # Only confirmed (non-robot) annotations of this label in the image.
+    confirmed_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['image', 'label'],
+                name='unique_image_label_coverage',
+            ),
+        ]
+
+    @classmethod
+    def adjust(cls, annotation, label_id, confirmed, delta):
+        """
+        Add delta (1 or -1) to the image's coverage of the given label,
+        for an annotation being added or removed.
+        """
+        counts = dict(annotation_count=F('annotation_count') + delta)
+        if confirmed:
+            counts['confirmed_count'] = F('confirmed_count') + delta
+        coverages = cls.objects.filter(
+            image_id=annotation.image_id, label_id=label_id)
+
+        with transaction.atomic():
+            if delta > 0:
+                if coverages.update(**counts):
+                    return
+                try:
+                    # Savepoint, so that a failed create doesn't break the
+                    # surrounding transaction.
+                    with transaction.atomic():
+                        cls.objects.create(
+                            image_id=annotation.image_id,
+                            label_id=label_id,
+                            source_id=annotation.source_id,
+                            annotation_count=1,
+                            confirmed_count=1 if confirmed else 0,
+                        )
+                except IntegrityError:
+                    # Another save created the row in the meantime.
+                    coverages.update(**counts)
+            else:
+                coverages.update(**counts)
+                # Like a recompute, don't keep rows for labels which are no
+                # longer in the image.
+                coverages.filter(annotation_count=0).delete()
+
+
 class AnnotationToolAccess(models.Model):
     access_date = models.DateTimeField(
         blank=True, auto_now=True, editable=False)
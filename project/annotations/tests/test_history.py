@@ -2,8 +2,12 @@
 # for views which update annotations (annotation tool, CSV upload, etc.)
 # This test module is for miscellaneous annotation history tests.
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from images.model_utils import PointGen
+from labels.models import LocalLabel
 from lib.tests.utils import BasePermissionTest, ClientTest
 from .utils import AnnotationHistoryTestMixin
 
@@ -57,3 +61,63 @@ class AnnotationHistoryAccessTest(ClientTest, AnnotationHistoryTestMixin):
                  '{name}'.format(name=self.user.username)],
             ]
         )
+
+
+class AnnotationHistoryContentTest(ClientTest, AnnotationHistoryTestMixin):
+    """
+    Test the annotation history page's contents and performance.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=3,
+        )
+        labels = cls.create_labels(cls.user, ['A', 'B', 'C'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+
+        cls.img = cls.upload_image(cls.user, cls.source)
+
+    def test_points_and_labels(self):
+        self.add_annotations(self.user, self.img, {1: 'A', 3: 'C'})
+        self.add_annotations(self.user, self.img, {2: 'B', 3: 'A'})
+
+        # Label which has since been removed from the labelset; it should
+        # be displayed by name instead of by code.
+        local_c = LocalLabel.objects.get(
+            labelset=self.source.labelset, code='C')
+        local_c.code = 'C_code'
+        local_c.save()
+        self.add_annotations(self.user, self.img, {1: 'C_code'})
+        local_c.delete()
+
+        response = self.view_history(self.user)
+        self.assert_history_table_equals(
+            response,
+            [
+                ['Point 1: C', self.user.username],
+                ['Point 2: B<br/>Point 3: A', self.user.username],
+                ['Point 1: A<br/>Point 3: C', self.user.username],
+            ]
+        )
+
+    def test_query_count_doesnt_scale_with_revisions(self):
+        self.add_annotations(self.user, self.img, {1: 'A', 2: 'B'})
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('annotation_history', args=[self.img.pk]))
+        one_revision_count = len(context.captured_queries)
+
+        for label_code in ['B', 'C', 'A', 'B', 'C']:
+            self.add_annotations(
+                self.user, self.img, {1: label_code, 3: label_code})
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('annotation_history', args=[self.img.pk]))
+        self.assertEqual(len(context.captured_queries), one_revision_count)
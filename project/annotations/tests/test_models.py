@@ -1,4 +1,11 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django_migration_testcase import MigrationTest
+from reversion import revisions
+from reversion.models import Revision, Version
 
 from accounts.utils import get_robot_user
 from images.model_utils import PointGen
@@ -9,7 +16,7 @@ from ..model_utils import (
     image_annotation_status,
     image_annotation_verbose_status,
 )
-from ..models import Annotation
+from ..models import Annotation, ImageAnnotationInfo, ImageLabelCoverage
 
 
 class ImageStatusLogicTest(ClientTest):
@@ -172,35 +179,310 @@ class AnnoInfoUpdateTest(ClientTest):
         self.image.annotation_set.delete()
         self.assertStatusEqual('unclassified')
 
-        # Whenever django-reversion is replaced and bulk creation of
-        # Annotations is viable again, the below code can be used to test
-        # bulk creation.
-
-        # annotations = [
-        #     Annotation(
-        #         source=self.image.source,
-        #         image=self.image,
-        #         point=self.image.point_set.get(point_number=1),
-        #         label=self.labels.get(name='A'),
-        #         user=get_robot_user(),
-        #     ),
-        #     Annotation(
-        #         source=self.image.source,
-        #         image=self.image,
-        #         point=self.image.point_set.get(point_number=2),
-        #         label=self.labels.get(name='A'),
-        #         user=get_robot_user(),
-        #     ),
-        #     Annotation(
-        #         source=self.image.source,
-        #         image=self.image,
-        #         point=self.image.point_set.get(point_number=3),
-        #         label=self.labels.get(name='A'),
-        #         user=get_robot_user(),
-        #     ),
-        # ]
-        # Annotation.objects.bulk_create(annotations)
-        # self.assertStatusEqual('unconfirmed')
+        annotations = [
+            Annotation(
+                source=self.image.source,
+                image=self.image,
+                point=self.image.point_set.get(point_number=number),
+                label=self.labels.get(name='A'),
+                user=get_robot_user(),
+            )
+            for number in [1, 2, 3]
+        ]
+        Annotation.objects.bulk_create(annotations)
+        self.assertStatusEqual('unconfirmed')
+
+
+class BulkUpdatePointAnnotationsTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=4,
+        )
+        cls.classifier = cls.create_robot(cls.source)
+        cls.labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, cls.labels)
+
+    def setUp(self):
+        super().setUp()
+        self.image = self.upload_image(self.user, self.source)
+        self.label_a = self.labels.get(name='A')
+        self.label_b = self.labels.get(name='B')
+
+    def update(self, labels_by_number, now_confirmed, user_or_robot):
+        points = self.image.point_set.order_by('point_number')
+        points_and_labels = [
+            (point, labels_by_number[point.point_number])
+            for point in points
+            if point.point_number in labels_by_number
+        ]
+        with revisions.create_revision():
+            results = Annotation.objects.update_point_annotations_if_applicable(
+                self.image, points_and_labels, now_confirmed, user_or_robot)
+        return dict(
+            (Point.objects.get(pk=point_id).point_number, result)
+            for point_id, result in results.items())
+
+    def test_results(self):
+        # Confirmed annotation on point 1, unconfirmed on points 2-3.
+        self.add_annotations(self.user, self.image, {1: 'A'})
+        self.update(
+            {2: self.label_a, 3: self.label_a}, False, self.classifier)
+
+        results = self.update(
+            {1: self.label_b, 2: self.label_a, 3: self.label_b,
+             4: self.label_b},
+            False, self.classifier)
+
+        self.assertDictEqual(
+            results,
+            {1: 'no change', 2: 'no change', 3: 'updated', 4: 'added'})
+        annotations = self.image.annotation_set.order_by(
+            'point__point_number')
+        self.assertListEqual(
+            [annotation.label.name for annotation in annotations],
+            ['A', 'A', 'B', 'B'])
+        self.assertEqual(
+            annotations[3].robot_version_id, self.classifier.pk)
+
+    def test_confirm_unconfirmed(self):
+        self.update(
+            {n: self.label_a for n in [1, 2, 3, 4]}, False, self.classifier)
+
+        results = self.update(
+            {n: self.label_a for n in [1, 2, 3, 4]}, True, self.user)
+
+        self.assertDictEqual(
+            results,
+            {1: 'updated', 2: 'updated', 3: 'updated', 4: 'updated'})
+        self.image.annoinfo.refresh_from_db()
+        self.assertEqual(
+            self.image.annoinfo.status, ImageAnnoStatuses.CONFIRMED.value)
+
+    def test_versions(self):
+        self.update(
+            {n: self.label_a for n in [1, 2, 3, 4]}, False, self.classifier)
+        self.update({1: self.label_b}, False, self.classifier)
+
+        annotation = self.image.annotation_set.get(point__point_number=1)
+        versions = Version.objects.get_for_object(annotation)
+        self.assertEqual(versions.count(), 2)
+        # Most recent first
+        self.assertEqual(
+            versions[0].field_dict['label_id'], self.label_b.pk)
+        self.assertEqual(
+            versions[1].field_dict['label_id'], self.label_a.pk)
+        self.assertEqual(versions[0].object_repr, str(annotation))
+        self.assertEqual(
+            Revision.objects.count(), 2,
+            "Each bulk update should get one revision")
+
+    def test_query_count_independent_of_point_count(self):
+        source_2 = self.create_source(
+            self.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=40,
+        )
+        self.create_labelset(self.user, source_2, self.labels)
+        classifier_2 = self.create_robot(source_2)
+        image_2 = self.upload_image(self.user, source_2)
+
+        def count_update_queries(image, classifier):
+            points_and_labels = [
+                (point, self.label_a) for point in image.point_set.all()]
+            with CaptureQueriesContext(connection) as context:
+                with revisions.create_revision():
+                    Annotation.objects.update_point_annotations_if_applicable(
+                        image, points_and_labels, False, classifier)
+            return len(context.captured_queries)
+
+        # Ensure the content type is cached before counting.
+        ContentType.objects.get_for_model(Annotation)
+        self.assertEqual(
+            count_update_queries(self.image, self.classifier),
+            count_update_queries(image_2, classifier_2),
+            "4-point and 40-point images should take the same number"
+            " of queries")
+
+
+class ImageLabelCoverageTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=3,
+        )
+
+        cls.labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, cls.labels)
+        cls.classifier = cls.create_robot(cls.source)
+
+        cls.image = cls.upload_image(cls.user, cls.source)
+
+    def assertCoverages(self, expected):
+        """
+        :param expected: dict of label names to
+          (annotation_count, confirmed_count).
+        """
+        actual = {
+            coverage.label.name: (
+                coverage.annotation_count, coverage.confirmed_count)
+            for coverage in ImageLabelCoverage.objects.filter(
+                image=self.image)
+        }
+        self.assertDictEqual(actual, expected)
+
+    def test_annotation_save_and_delete(self):
+        self.assertCoverages({})
+
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+        self.assertCoverages({'A': (2, 2), 'B': (1, 1)})
+
+        annotation = self.image.annotation_set.get(point__point_number=3)
+        annotation.label = self.labels.get(name='A')
+        annotation.save()
+        self.assertCoverages({'A': (3, 3)})
+
+        annotation.delete()
+        self.assertCoverages({'A': (2, 2)})
+
+    def test_save_updates_incrementally(self):
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+
+        annotation = self.image.annotation_set.get(point__point_number=1)
+        annotation.label = self.labels.get(name='B')
+        with mock.patch.object(
+            ImageAnnotationInfo, 'update_label_coverages'
+        ) as mock_recompute:
+            annotation.save()
+        mock_recompute.assert_not_called()
+        self.assertCoverages({'A': (1, 1), 'B': (2, 2)})
+
+    def test_unchanged_save(self):
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+
+        annotation = self.image.annotation_set.get(point__point_number=1)
+        with mock.patch.object(
+            ImageLabelCoverage, 'adjust'
+        ) as mock_adjust:
+            annotation.save()
+        mock_adjust.assert_not_called()
+        self.assertCoverages({'A': (2, 2), 'B': (1, 1)})
+
+    def test_changed_twice_after_load(self):
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+
+        annotation = self.image.annotation_set.get(point__point_number=1)
+        annotation.label = self.labels.get(name='B')
+        annotation.save()
+        annotation.label = self.labels.get(name='A')
+        annotation.save()
+        self.assertCoverages({'A': (2, 2), 'B': (1, 1)})
+
+    def test_robot_annotation_confirmed_by_save(self):
+        self.add_robot_annotations(
+            self.classifier, self.image, {1: 'A', 2: 'B', 3: 'B'})
+
+        annotation = self.image.annotation_set.get(point__point_number=2)
+        annotation.user = self.user
+        annotation.save()
+        self.assertCoverages({'A': (1, 0), 'B': (2, 1)})
+
+    def test_robot_annotations(self):
+        self.add_robot_annotations(
+            self.classifier, self.image, {1: 'A', 2: 'B', 3: 'B'})
+        self.assertCoverages({'A': (1, 0), 'B': (2, 0)})
+
+        # Confirm one point.
+        self.add_annotations(self.user, self.image, {2: 'A'})
+        self.assertCoverages({'A': (2, 1), 'B': (1, 0)})
+
+    def test_bulk_delete(self):
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+        self.image.annotation_set.filter(label__name='A').delete()
+        self.assertCoverages({'B': (1, 1)})
+
+    def test_image_delete(self):
+        self.add_annotations(self.user, self.image, {1: 'A', 2: 'A', 3: 'B'})
+        self.image.delete()
+        self.assertFalse(
+            ImageLabelCoverage.objects.filter(source=self.source).exists())
+
+
+class PopulateImageLabelCoverageTest(MigrationTest):
+
+    before = [
+        ('accounts', '0001_squashed_0012_field_string_attributes_to_unicode'),
+        ('annotations', '0024_imagelabelcoverage')]
+    after = [
+        ('annotations', '0025_populate_imagelabelcoverage')]
+
+    def test(self):
+        User = self.get_model_before('auth.User')
+        Source = self.get_model_before('images.Source')
+        Metadata = self.get_model_before('images.Metadata')
+        Image = self.get_model_before('images.Image')
+        Point = self.get_model_before('images.Point')
+        LabelGroup = self.get_model_before('labels.LabelGroup')
+        Label = self.get_model_before('labels.Label')
+        Annotation = self.get_model_before('annotations.Annotation')
+
+        user = User(username='testuser')
+        user.save()
+        robot_user, _ = User.objects.get_or_create(username='robot')
+        group = LabelGroup(name="Group1", code='g1')
+        group.save()
+        label_a = Label(name="A", default_code='A', group=group)
+        label_a.save()
+        label_b = Label(name="B", default_code='B', group=group)
+        label_b.save()
+        source = Source(name="Test source")
+        source.save()
+        metadata = Metadata()
+        metadata.save()
+        image = Image(
+            original_file=sample_image_as_file('a.png'),
+            uploaded_by=user,
+            point_generation_method=source.default_point_generation_method,
+            metadata=metadata,
+            source=source,
+        )
+        image.save()
+
+        for number, label, annotator in [
+            (1, label_a, user),
+            (2, label_a, robot_user),
+            (3, label_b, robot_user),
+        ]:
+            point = Point(image=image, row=1, column=1, point_number=number)
+            point.save()
+            Annotation(
+                source=source, image=image, point=point,
+                user=annotator, label=label).save()
+
+        self.run_migration()
+
+        ImageLabelCoverage = self.get_model_after(
+            'annotations.ImageLabelCoverage')
+        coverages = {
+            coverage.label_id: (
+                coverage.annotation_count, coverage.confirmed_count)
+            for coverage in ImageLabelCoverage.objects.filter(
+                image_id=image.pk)
+        }
+        self.assertDictEqual(
+            coverages, {label_a.pk: (2, 1), label_b.pk: (1, 0)})
 
 
 class PopulateAnnoInfoStatusTest(MigrationTest):
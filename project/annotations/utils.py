@@ -1,13 +1,16 @@
+from collections import defaultdict
 import datetime
 import operator
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.utils import timezone
+from reversion.models import Version
 from accounts.utils import is_robot_user, get_alleviate_user
-from .models import Annotation
+from .models import Annotation, AnnotationToolAccess
 from images.model_utils import PointGen
 from images.models import Point
+from labels.models import Label
 
 
 def image_has_any_confirmed_annotations(image):
@@ -61,16 +64,22 @@ def get_annotation_user_display(anno):
         return anno.user.username
 
 
-def get_annotation_version_user_display(anno_version, date_created):
+def get_annotation_version_user_display(
+        anno_version, date_created, users=None):
     """
     anno_version - a reversion.Version model; a previous or current version
     of an annotations.Annotation model.
     date_created - creation date of the Version.
+    users - optional dict of user ID to User, for when the caller has
+    already fetched the relevant users.
 
     Returns a string representing the user who made the annotation.
     """
     user_id = anno_version.field_dict['user_id']
-    user = User.objects.get(pk=user_id)
+    if users is None:
+        user = User.objects.get(pk=user_id)
+    else:
+        user = users.get(user_id)
 
     if not user:
         return "(Unknown user)"
@@ -102,6 +111,110 @@ def get_annotation_version_user_display(anno_version, date_created):
         return user.username
 
 
+def get_annotation_history_event_log(image):
+    """
+    Returns a list of annotation history entries for the given image, most
+    recent first. Each entry is a dict of date, user (display string), and
+    events (list of strings).
+
+    This uses a constant number of queries regardless of how many
+    revisions the image has.
+    """
+    source = image.source
+
+    # Annotation PK -> point number, from one Point join.
+    annotation_point_numbers = dict(
+        Annotation.objects.filter(image=image)
+        .values_list('pk', 'point__point_number'))
+
+    # Get the annotation Versions whose annotation PKs correspond to the
+    # relevant image, along with their Revisions.
+    # Version.object_id is a character-varying field, so we have to convert
+    # integer primary keys to strings in order to compare with this field.
+    #
+    # This part is PERFORMANCE SENSITIVE. Historically, it has taken 1 second
+    # to 10 minutes for the same data depending on the implementation. Re-test
+    # on the staging server (which has a large Version table) after changing
+    # anything here.
+    annotation_id_strs = [str(pk) for pk in annotation_point_numbers]
+    versions = (
+        Version.objects.get_for_model(Annotation)
+        .filter(object_id__in=annotation_id_strs)
+        .select_related('revision')
+    )
+
+    versions_by_revision = defaultdict(list)
+    revisions = dict()
+    for version in versions:
+        versions_by_revision[version.revision_id].append(version)
+        revisions[version.revision_id] = version.revision
+
+    # Resolve the labels and users referenced by the versions, in bulk.
+    label_ids = set()
+    user_ids = set()
+    for version in versions:
+        label_ids.add(version.field_dict['label_id'])
+        user_ids.add(version.field_dict['user_id'])
+
+    label_displays = dict(
+        source.labelset.get_labels().filter(global_label_id__in=label_ids)
+        .values_list('global_label_id', 'code'))
+    # Labels which were removed from the labelset
+    label_displays |= dict(
+        Label.objects.filter(pk__in=label_ids - label_displays.keys())
+        .values_list('pk', 'name'))
+    users = User.objects.in_bulk(user_ids)
+
+    event_log = []
+
+    # Most recent revision first, to break ties between equal dates the
+    # same way as the revisions' default ordering.
+    for revision_id in sorted(revisions, reverse=True):
+        revision = revisions[revision_id]
+
+        # Sort by the point number of the annotation
+        rev_versions = sorted(
+            versions_by_revision[revision_id],
+            key=lambda v_: annotation_point_numbers[int(v_.object_id)])
+
+        # Create a log entry for this Revision
+        events = []
+        for v in rev_versions:
+            global_label_pk = v.field_dict['label_id']
+            # If the label was deleted from the site, we only have the ID.
+            label_display = label_displays.get(
+                global_label_pk, f"(Label of ID {global_label_pk})")
+
+            events.append("Point {num}: {label}".format(
+                num=annotation_point_numbers[int(v.object_id)],
+                label=label_display))
+
+        event_log.append(
+            dict(
+                date=revision.date_created,
+                # Any Version will do
+                user=get_annotation_version_user_display(
+                    rev_versions[0], revision.date_created, users=users),
+                events=events,
+            )
+        )
+
+    for access in AnnotationToolAccess.objects.filter(
+            image=image).select_related('user'):
+        # Create a log entry for each annotation tool access
+        event_str = "Accessed annotation tool"
+        event_log.append(
+            dict(
+                date=access.access_date,
+                user=access.user.username,
+                events=[event_str],
+            )
+        )
+
+    event_log.sort(key=lambda x: x['date'], reverse=True)
+    return event_log
+
+
 def apply_alleviate(img, label_scores_all_points):
     """
     Apply alleviate to a particular image: auto-accept top machine suggestions
@@ -10,7 +10,6 @@ from django.views.decorators.http import require_POST
 from easy_thumbnails.files import get_thumbnailer
 import reversion
 from reversion.revisions import create_revision
-from reversion.models import Version, Revision
 
 from .forms import (
     AnnotationForm, AnnotationAreaPixelsForm, AnnotationToolSettingsForm,
@@ -18,12 +17,12 @@ from .forms import (
 from .model_utils import AnnotationAreaUtils
 from .models import Annotation, AnnotationToolAccess, AnnotationToolSettings
 from .utils import (
-    apply_alleviate, get_annotation_version_user_display)
+    apply_alleviate, get_annotation_history_event_log)
 from images.models import Source, Image, Point
 from images.utils import (
     generate_points, get_next_image, get_date_and_aux_metadata_table,
-    get_prev_image, get_image_order_placement)
-from labels.models import Label
+    get_prev_image, get_image_order_index, get_image_order_placement)
+from jobs.utils import queue_job
 from lib.decorators import (
     image_permission_required, image_annotation_area_must_be_editable,
     image_labelset_required, login_required_ajax, source_permission_required)
@@ -142,7 +141,9 @@ def batch_delete_annotations_ajax(request, source_id):
         ))
 
     image_set = image_form.get_images()
-    image_count = image_set.count()
+    image_count = len(get_image_order_index(
+        image_set, source.pk,
+        annotation_dependent=image_form.depends_on_annotations()))
 
     # Delete annotations.
     Annotation.objects.filter(image__in=image_set).delete()
@@ -170,7 +171,9 @@ def annotation_tool(request, image_id):
 
     # The set of images we're annotating.
     # Ensure it has an unambiguous ordering.
-    image_set = source.image_set.order_by('metadata__name', 'pk')
+    image_set = source.image_set.not_pending_deletion().order_by(
+        'metadata__name', 'pk')
+    annotation_dependent = False
     hidden_image_set_form = None
     applied_search_display = None
 
@@ -178,14 +181,24 @@ def annotation_tool(request, image_id):
     if image_form:
         if image_form.is_valid():
             image_set = image_form.get_images()
+            annotation_dependent = image_form.depends_on_annotations()
             hidden_image_set_form = HiddenForm(forms=[image_form])
             applied_search_display = image_form.get_applied_search_display()
 
+    # The image set's cached ordering, so that navigation doesn't have to
+    # re-run the search.
+    image_set_index = get_image_order_index(
+        image_set, source.pk, annotation_dependent=annotation_dependent)
+    image_set_size = len(image_set_index)
+
     # Get the next and previous images in the image set.
-    prev_image = get_prev_image(image, image_set, wrap=True)
-    next_image = get_next_image(image, image_set, wrap=True)
+    prev_image = get_prev_image(
+        image, image_set, wrap=True, index=image_set_index)
+    next_image = get_next_image(
+        image, image_set, wrap=True, index=image_set_index)
     # Get the image's ordered placement in the image set, e.g. 5th.
-    image_set_order_placement = get_image_order_placement(image, image_set)
+    image_set_order_placement = get_image_order_placement(
+        image, image_set, index=image_set_index)
 
     # Get the settings object for this user.
     # If there is no such settings object, then populate the form with
@@ -273,7 +286,7 @@ def annotation_tool(request, image_id):
         'hidden_image_set_form': hidden_image_set_form,
         'next_image': next_image,
         'prev_image': prev_image,
-        'image_set_size': image_set.count(),
+        'image_set_size': image_set_size,
         'image_set_order_placement': image_set_order_placement,
         'applied_search_display': applied_search_display,
         'metadata': metadata,
@@ -380,6 +393,10 @@ def save_annotations_ajax(request, image_id):
             " annotations changed at the same time that you submitted."
             " Try again and see if it works.")))
 
+    if annotations_to_try_updating:
+        # Have patches ready for pages like Browse Patches.
+        queue_job('generate_patches', image.pk, source_id=source.pk)
+
     return JsonResponse(dict(all_done=image.annoinfo.confirmed))
 
 
@@ -460,80 +477,7 @@ def annotation_history(request, image_id):
     image = get_object_or_404(Image, id=image_id)
     source = image.source
 
-    annotations = Annotation.objects.filter(image=image)
-
-    # Get the annotation Versions whose annotation PKs correspond to the
-    # relevant image.
-    # Version.object_id is a character-varying field, so we have to convert
-    # integer primary keys to strings in order to compare with this field.
-    #
-    # This part is PERFORMANCE SENSITIVE. Historically, it has taken 1 second
-    # to 10 minutes for the same data depending on the implementation. Re-test
-    # on the staging server (which has a large Version table) after changing
-    # anything here.
-    annotation_id_strs = [
-        str(pk) for pk in annotations.values_list('pk', flat=True)]
-    versions = Version.objects.get_for_model(Annotation).filter(
-        object_id__in=annotation_id_strs)
-
-    # Get the Revisions associated with these annotation Versions.
-    revisions = Revision.objects.filter(version__in=versions).distinct()
-
-    def version_to_point_number(v_):
-        # We name the arg v_ to avoid shadowing the outer scope's v.
-        return Annotation.objects.get(pk=v_.object_id).point.point_number
-
-    event_log = []
-
-    for rev in revisions:
-        # Get Versions under this Revision
-        rev_versions = versions.filter(revision=rev)
-
-        # Sort by the point number of the annotation
-        rev_versions = list(rev_versions)
-        rev_versions.sort(key=version_to_point_number)
-
-        # Create a log entry for this Revision
-        events = []
-        for v in rev_versions:
-            point_number = version_to_point_number(v)
-            global_label_pk = v.field_dict['label_id']
-
-            label_display = source.labelset.global_pk_to_code(global_label_pk)
-            if not label_display:
-                # Label was removed from the labelset
-                try:
-                    label_display = Label.objects.get(pk=global_label_pk).name
-                except Label.DoesNotExist:
-                    # Label was deleted from the site
-                    label_display = "(Label of ID {pk})".format(
-                        pk=global_label_pk)
-
-            events.append("Point {num}: {label}".format(
-                num=point_number, label=label_display))
-
-        event_log.append(
-            dict(
-                date=rev.date_created,
-                # Any Version will do
-                user=get_annotation_version_user_display(
-                    rev_versions[0], rev.date_created),
-                events=events,
-            )
-        )
-
-    for access in AnnotationToolAccess.objects.filter(image=image):
-        # Create a log entry for each annotation tool access
-        event_str = "Accessed annotation tool"
-        event_log.append(
-            dict(
-                date=access.access_date,
-                user=access.user.username,
-                events=[event_str],
-            )
-        )
-
-    event_log.sort(key=lambda x: x['date'], reverse=True)
+    event_log = get_annotation_history_event_log(image)
 
     return render(request, 'annotations/annotation_history.html', {
         'source': source,
@@ -0,0 +1,27 @@
+from django.apps import AppConfig
+from django.db.models import F
+
+from jobs.signals import job_finished
+
+
+def count_finished_unit(sender, job, **kwargs):
+    from jobs.models import Job
+    from .models import ApiJob
+
+    if job.status == Job.Status.SUCCESS:
+        field_name = 'success_units'
+    else:
+        field_name = 'failure_units'
+    # No-op if the Job isn't an API job unit's internal job.
+    ApiJob.objects.filter(apijobunit__internal_job=job).update(
+        **{field_name: F(field_name) + 1})
+
+
+class ApiCoreConfig(AppConfig):
+    name = 'api_core'
+
+    def ready(self):
+        job_finished.connect(
+            count_finished_unit,
+            dispatch_uid='count_finished_api_job_unit',
+        )
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.10 on 2026-10-17 10:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api_core', '0009_use_new_jsonfield'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='apijob',
+            index=models.Index(fields=['create_date'], name='api_job_create_date_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.10 on 2026-10-17 11:00
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_unit_counts(apps, schema_editor):
+    ApiJob = apps.get_model('api_core', 'ApiJob')
+
+    jobs = ApiJob.objects.annotate(
+        total=Count('apijobunit'),
+        successes=Count('apijobunit', filter=Q(
+            apijobunit__internal_job__status='success')),
+        failures=Count('apijobunit', filter=Q(
+            apijobunit__internal_job__status='failure')),
+    )
+    to_update = []
+    for job in jobs.iterator():
+        job.total_units = job.total
+        job.success_units = job.successes
+        job.failure_units = job.failures
+        to_update.append(job)
+    ApiJob.objects.bulk_update(
+        to_update, ['total_units', 'success_units', 'failure_units'],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_core', '0010_apijob_create_date_index'),
+        ('jobs', '0012_job_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apijob',
+            name='failure_units',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='apijob',
+            name='success_units',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='apijob',
+            name='total_units',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            populate_unit_counts, migrations.RunPython.noop),
+    ]
@@ -20,10 +20,61 @@ class ApiJob(models.Model):
     # This can be used to report how long the job took or is taking.
     create_date = models.DateTimeField("Date created", auto_now_add=True)
 
+    # Unit counts, maintained as units are created and finished, so that
+    # the job's status can be checked without going over all its units.
+    total_units = models.PositiveIntegerField(default=0)
+    success_units = models.PositiveIntegerField(default=0)
+    failure_units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Finding old jobs to clean up.
+            models.Index(
+                fields=['create_date'], name='api_job_create_date_idx'),
+        ]
+
     PENDING = "Pending"
     IN_PROGRESS = "In Progress"
     DONE = "Done"
 
+    @staticmethod
+    def active_filter():
+        """
+        Q object for jobs which aren't done, according to the maintained
+        unit counts. A job with no units yet counts as pending.
+        """
+        return (
+            models.Q(total_units=0)
+            | models.Q(total_units__gt=(
+                models.F('success_units') + models.F('failure_units')))
+        )
+
+    def counted_status(self):
+        """
+        Like full_status(), but based on the maintained unit counts.
+        Takes at most one query, and doesn't break down the unfinished
+        units into pending and in progress.
+        """
+        finished_units = self.success_units + self.failure_units
+
+        if self.total_units > 0 and finished_units == self.total_units:
+            overall_status = self.DONE
+        elif (
+            finished_units > 0
+            or self.apijobunit_set.filter(
+                internal_job__status=Job.Status.IN_PROGRESS).exists()
+        ):
+            overall_status = self.IN_PROGRESS
+        else:
+            overall_status = self.PENDING
+
+        return dict(
+            overall_status=overall_status,
+            failure_units=self.failure_units,
+            success_units=self.success_units,
+            total_units=self.total_units,
+        )
+
     @property
     def status(self):
         """Just return the overall job status from full_status()."""
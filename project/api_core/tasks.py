@@ -3,7 +3,7 @@ from datetime import timedelta
 from django.conf import settings
 from django.utils import timezone
 
-from jobs.utils import job_runner
+from jobs.utils import cleanup_result_message, delete_in_chunks, job_runner
 from .models import ApiJob
 
 
@@ -17,18 +17,18 @@ def clean_up_old_api_jobs():
     Note that 2 is not sufficient in the corner case where a job has been
     created, but its job units haven't been created yet.
     """
-    x_days_ago = timezone.now() - timedelta(days=settings.JOB_MAX_DAYS)
-    count = 0
+    start = timezone.now()
+    wrap_up_time = start + timedelta(minutes=settings.JOB_MAX_MINUTES)
+    x_days_ago = start - timedelta(days=settings.JOB_MAX_DAYS)
 
-    for job in ApiJob.objects.filter(create_date__lt=x_days_ago):
-        units_were_modified_in_last_x_days = job.apijobunit_set.filter(
-            internal_job__modify_date__gt=x_days_ago).exists()
-        if not units_were_modified_in_last_x_days:
-            # Delete the job, and its job units should cascade-delete with it.
-            job.delete()
-            count += 1
+    # Excluding on the units relation excludes jobs having any unit
+    # which matches, in one subquery.
+    jobs_to_clean_up = (
+        ApiJob.objects.filter(create_date__lt=x_days_ago)
+        .exclude(apijobunit__internal_job__modify_date__gt=x_days_ago)
+    )
+    # Deleting a job cascade-deletes its job units.
+    count, timed_out = delete_in_chunks(jobs_to_clean_up, wrap_up_time)
+    seconds = (timezone.now() - start).total_seconds()
 
-    if count > 0:
-        return f"Cleaned up {count} old API job(s)"
-    else:
-        return "No old API jobs to clean up"
+    return cleanup_result_message(count, "old API job", seconds, timed_out)
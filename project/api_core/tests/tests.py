@@ -314,7 +314,8 @@ class JobCleanupTest(ClientTest):
         job = Job.objects.filter(
             job_name='clean_up_old_api_jobs',
             status=Job.Status.SUCCESS).latest('pk')
-        return job.result_message
+        # The first line, without the timing line.
+        return job.result_message.splitlines()[0]
 
     def test_zero_jobs_message(self):
         """
@@ -399,6 +400,10 @@ class JobCleanupTest(ClientTest):
                 type='old job, old units').exists(),
             "Should clean up old jobs if no units were modified recently")
 
+    @override_settings(JOB_CLEANUP_CHUNK_SIZE=1)
+    def test_job_selection_in_chunks(self):
+        self.test_job_selection()
+
     def test_unit_cleanup(self):
         """
         The cleanup task should also clean up associated job units.
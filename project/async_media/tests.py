@@ -6,7 +6,9 @@ from django.conf import settings
 from django.urls import reverse
 from easy_thumbnails.files import get_thumbnailer
 
+from images.model_utils import PointGen
 from lib.tests.utils import BasePermissionTest, ClientTest
+from visualization.utils import get_patch_url
 
 
 class PermissionTest(BasePermissionTest):
@@ -86,3 +88,89 @@ class BrowseImagesThumbnailsTest(ClientTest):
                 media=[dict(index=0, url=thumbnail.url)],
                 mediaRemaining=False),
             msg="Thumbnail should have been retrieved via async-media request")
+
+
+class BrowsePatchesTest(ClientTest):
+    """
+    Test the patch functionality in Browse Patches.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=3,
+        )
+        labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+        cls.browse_url = reverse('browse_patches', args=[cls.source.pk])
+
+    def test_generate_and_retrieve_patches(self):
+        img = self.upload_image(self.user, self.source)
+        self.add_annotations(self.user, img, {1: 'A', 2: 'B', 3: 'A'})
+
+        self.client.force_login(self.user)
+        response = self.client.get(self.browse_url)
+        response_soup = BeautifulSoup(response.content, 'html.parser')
+        patch_images = response_soup.find_all('img', class_='thumb')
+        request_hashes = [
+            patch_image.attrs.get('data-async-request-hash')
+            for patch_image in patch_images]
+        self.assertEqual(len(request_hashes), 3, "Sanity check")
+
+        # Generate the patches from the page's hashes.
+        data = {'hashes[]': request_hashes}
+        response = self.client.post(
+            reverse('async_media:media_ajax'), data=data)
+        self.assertDictEqual(response.json(), dict(error=None))
+
+        # Retrieve the generated patches.
+        data = dict(first_hash=request_hashes[0])
+        response = self.client.post(
+            reverse('async_media:media_poll_ajax'), data=data)
+        response_json = response.json()
+        self.assertFalse(response_json['mediaRemaining'])
+
+        # Each patch is one of this image's points' patches.
+        expected_urls = {
+            get_patch_url(point.pk) for point in img.point_set.all()}
+        self.assertSetEqual(
+            {media['url'] for media in response_json['media']},
+            expected_urls)
+        self.assertListEqual(
+            [media['index'] for media in response_json['media']],
+            [0, 1, 2])
+
+    def test_patch_generation_error(self):
+        img = self.upload_image(self.user, self.source)
+        self.add_annotations(self.user, img, {1: 'A', 2: 'B', 3: 'A'})
+
+        self.client.force_login(self.user)
+        response = self.client.get(self.browse_url)
+        response_soup = BeautifulSoup(response.content, 'html.parser')
+        patch_images = response_soup.find_all('img', class_='thumb')
+        request_hashes = [
+            patch_image.attrs.get('data-async-request-hash')
+            for patch_image in patch_images]
+
+        # The patches can't be generated without the original image.
+        img.original_file.delete(save=False)
+
+        data = {'hashes[]': request_hashes}
+        self.client.post(reverse('async_media:media_ajax'), data=data)
+
+        # The client isn't left polling for the patches; it gets
+        # placeholders instead.
+        data = dict(first_hash=request_hashes[0])
+        response = self.client.post(
+            reverse('async_media:media_poll_ajax'), data=data)
+        response_json = response.json()
+        self.assertFalse(response_json['mediaRemaining'])
+        self.assertListEqual(
+            [media['index'] for media in response_json['media']],
+            [0, 1, 2])
+        for media in response_json['media']:
+            self.assertIn('media-image-not-found', media['url'])
@@ -1,10 +1,13 @@
+from collections import defaultdict
+
 from django.core.cache import cache
+from django.core.files.storage import get_storage_class
 from django.http import JsonResponse
 from django.templatetags.static import static as to_static_path
 import easy_thumbnails.exceptions as easy_thumbnails_exceptions
 from easy_thumbnails.files import get_thumbnailer
 
-from visualization.utils import generate_patch_if_doesnt_exist, get_patch_url
+from visualization.utils import generate_patches
 from .utils import (
     delete_media_request_status,
     get_media_request_status, get_media_url,
@@ -21,6 +24,9 @@ def media_ajax(request):
     set_media_request_status(first_hash, status)
 
     error = None
+    # Patches are generated together after this loop, so that points from
+    # the same image only require decoding that image once.
+    patch_request_indexes = defaultdict(list)
 
     for index, media_hash in enumerate(hashes):
         cache_key = 'media_async_request_{hash}'.format(
@@ -52,15 +58,37 @@ def media_ajax(request):
                 # We might get here if the original image file is not found.
                 url = not_found_image
         elif details['media_type'] == 'patch':
-            # Generate the media.
-            generate_patch_if_doesnt_exist(details['point_id'])
-            url = get_patch_url(details['point_id'])
+            patch_request_indexes[details['point_id']].append(
+                (index, not_found_image))
+            continue
         else:
             url = not_found_image
             error = "Unknown media type."
 
         set_media_url(first_hash, index, url)
 
+    if patch_request_indexes:
+        storage = get_storage_class()()
+
+        def on_patch_ready(point_id, patch_relative_path):
+            url = storage.url(patch_relative_path)
+            for patch_index, _ in patch_request_indexes.pop(point_id, []):
+                set_media_url(first_hash, patch_index, url)
+
+        # Generate the media.
+        try:
+            generate_patches(
+                list(patch_request_indexes.keys()),
+                on_patch_ready=on_patch_ready)
+        finally:
+            # Points which don't exist anymore, or whose patches couldn't
+            # be generated, still need a URL set, or the client would keep
+            # polling for them. That goes for unexpected errors too, which
+            # are still raised.
+            for patch_indexes in patch_request_indexes.values():
+                for patch_index, not_found_image in patch_indexes:
+                    set_media_url(first_hash, patch_index, not_found_image)
+
     # If there was an error, report at least one of them.
     # Otherwise, no actual data to return. The client should be getting the
     # media from the polling responses.
@@ -300,6 +300,7 @@ ROBOT_MODEL_FILE_PATTERN = 'classifiers/{pk}.model'
 ROBOT_MODEL_TRAINDATA_PATTERN = 'classifiers/{pk}.traindata'
 ROBOT_MODEL_VALDATA_PATTERN = 'classifiers/{pk}.valdata'
 ROBOT_MODEL_VALRESULT_PATTERN = 'classifiers/{pk}.valresult'
+DEPLOY_FEATURE_CACHE_FILE_PATTERN = 'deploy_feature_cache/{key}.featurevector'
 
 # Naming for vision_backend.models.BatchJob
 BATCH_JOB_PATTERN = 'batch_jobs/{pk}_job_msg.json'
@@ -310,9 +311,52 @@ BATCH_RES_PATTERN = 'batch_jobs/{pk}_job_res.json'
 # implemented.
 VALSET_SELECTION_METHOD = 'id'
 
+# Max number of images to include in one feature-extraction spacer job.
+# Batching images saves on spacer job overhead, such as container startups
+# and extractor loading. However, a spacer error on one image fails the
+# whole batch (retries are not batched, so a bad image gets isolated on the
+# next attempt).
+FEATURE_EXTRACTION_BATCH_SIZE = env.int(
+    'FEATURE_EXTRACTION_BATCH_SIZE',
+    default=10 if SETTINGS_BASE in [Bases.PRODUCTION, Bases.STAGING] else 1)
+# Max total size of images (estimated as decoded RGB bytes) to include in
+# one feature-extraction spacer job.
+FEATURE_EXTRACTION_BATCH_MAX_BYTES = env.int(
+    'FEATURE_EXTRACTION_BATCH_MAX_BYTES', default=1000*1000*1000)
+
+# Max total size (in bytes of stored model files) of the classifiers each
+# worker process keeps loaded in memory for in-process classification.
+CLASSIFIER_CACHE_MAX_BYTES = env.int(
+    'CLASSIFIER_CACHE_MAX_BYTES', default=500*1000*1000)
+
+# Whether deploy API jobs cache the features of the images they process,
+# so that deploying the same image (and points) again only needs the
+# classification step. See vision_backend.feature_cache.
+DEPLOY_FEATURE_CACHE_ENABLED = env.bool(
+    'DEPLOY_FEATURE_CACHE_ENABLED', default=False)
+# Max total size of the cached feature files in storage. Least recently
+# used entries are evicted past this.
+DEPLOY_FEATURE_CACHE_MAX_BYTES = env.int(
+    'DEPLOY_FEATURE_CACHE_MAX_BYTES', default=10*1000*1000*1000)
+# Cache entries are keyed by image URL, not content, so they expire after
+# this many days in case the image at a URL changes.
+DEPLOY_FEATURE_CACHE_MAX_AGE_DAYS = env.int(
+    'DEPLOY_FEATURE_CACHE_MAX_AGE_DAYS', default=30)
+
+# When a new classifier needs to re-classify more than this many images of
+# a source, the images are classified in classify_features_batch jobs of
+# this many images each, instead of one classify_features job per image.
+CLASSIFICATION_BATCH_SIZE = env.int('CLASSIFICATION_BATCH_SIZE', default=100)
+# Number of threads used to download feature vectors within one
+# classify_features_batch job.
+CLASSIFICATION_BATCH_LOAD_THREADS = 8
+
 # This indicates the max number of scores we store per point.
 NBR_SCORES_PER_ANNOTATION = 5
 
+# Max number of Scores per insert query when saving an image's scores.
+SCORE_BULK_CREATE_BATCH_SIZE = 5000
+
 # This is the number of epochs we request the SGD solver to take over the data.
 NBR_TRAINING_EPOCHS = 10
 
@@ -359,6 +403,10 @@ else:
 
 AWS_BATCH_REGION = env('AWS_BATCH_REGION', default='us-west-2')
 
+# Max number of threads used to download spacer job results when
+# collecting jobs.
+SPACER_COLLECT_THREADS = 10
+
 
 #
 # General AWS and S3 config
@@ -691,6 +739,8 @@ ENABLE_PERIODIC_JOBS = True
 MAX_CONCURRENT_API_JOBS_PER_USER = 5
 # Days until we purge old async jobs.
 JOB_MAX_DAYS = 30
+# Days until we purge old hourly job latency histograms.
+JOB_LATENCY_METRICS_MAX_DAYS = 14
 # Page size when listing async jobs.
 JOBS_PER_PAGE = 100
 # Potentially long-running jobs should try to finish up once this
@@ -700,6 +750,33 @@ JOBS_PER_PAGE = 100
 # For example, the supervisor `stopwaitsecs` parameter for the huey
 # process can be twice this duration.
 JOB_MAX_MINUTES = 10
+# Max number of Jobs to check and create per set of queries when
+# queueing Jobs in bulk.
+JOB_BULK_QUEUE_CHUNK_SIZE = 1000
+# Max number of rows to delete per query when cleaning up old jobs.
+JOB_CLEANUP_CHUNK_SIZE = env.int('JOB_CLEANUP_CHUNK_SIZE', default=1000)
+# How run_scheduled_jobs picks the due jobs to dispatch on each run.
+# 'fifo': all due jobs, in the order they were queued.
+# 'fair_share': by priority class, then taking turns between sources,
+# subject to JOB_CONCURRENCY_LIMITS and JOB_DISPATCH_BUDGET.
+# See jobs/dispatch.py.
+JOB_DISPATCH_POLICY = env('JOB_DISPATCH_POLICY', default='fifo')
+# Fair-share priority class of each job name. Lower numbers are
+# dispatched first. Job names not listed here get JOB_DEFAULT_PRIORITY.
+JOB_PRIORITIES = {
+    # Deploy API requests; a user's waiting on these.
+    'classify_image': 0,
+    # Bulk work that's often queued by the thousands.
+    'extract_features': 2,
+    'classify_features': 2,
+    'classify_features_batch': 2,
+}
+JOB_DEFAULT_PRIORITY = 1
+# Fair-share cap on the number of in-progress jobs of each job name.
+# Job names not listed here have no cap.
+JOB_CONCURRENCY_LIMITS = {}
+# Fair-share max number of jobs dispatched per run of run_scheduled_jobs.
+JOB_DISPATCH_BUDGET = env.int('JOB_DISPATCH_BUDGET', default=500)
 
 
 #
@@ -987,6 +1064,28 @@ ALLEVIATE_USERNAME = 'Alleviate'
 
 BROWSE_DEFAULT_THUMBNAILS_PER_PAGE = 20
 
+# Number of images deleted per database transaction by the background
+# image-deletion job.
+IMAGE_DELETION_CHUNK_SIZE = env.int('IMAGE_DELETION_CHUNK_SIZE', default=100)
+# Max number of threads used to delete the deleted images' storage files.
+IMAGE_DELETION_STORAGE_THREADS = 10
+
+# Number of images whose uploaded points/annotations are saved per
+# database transaction by the background annotation-import job.
+ANNOTATION_IMPORT_CHUNK_SIZE = env.int(
+    'ANNOTATION_IMPORT_CHUNK_SIZE', default=100)
+
+# Number of threads (and key-range shards) used to list storage in the
+# audit_storage management command.
+STORAGE_AUDIT_THREADS = env.int('STORAGE_AUDIT_THREADS', default=8)
+
+# How long to cache the ordered image-ID index of a source's image search,
+# which backs Browse pagination and annotation tool navigation. Indexes
+# are also invalidated when images are uploaded, deleted, or have their
+# metadata edited.
+IMAGE_ORDER_INDEX_CACHE_SECONDS = env.int(
+    'IMAGE_ORDER_INDEX_CACHE_SECONDS', default=10*60)
+
 # Image counts required for sources to: display on the map,
 # display as medium size, and display as large size.
 MAP_IMAGE_COUNT_TIERS = env.list(
@@ -1027,6 +1126,10 @@ SELENIUM_TIMEOUTS = {
 # We filter on sources that contains these strings for map and some exports.
 LIKELY_TEST_SOURCE_NAMES = ['test', 'sandbox', 'dummy', 'tmp', 'temp', 'check']
 
+# Number of images to process per batch of queries when streaming
+# CSV exports.
+EXPORT_IMAGE_CHUNK_SIZE = 200
+
 # NewsItem categories used in NewsItem app.
 NEWS_ITEM_CATEGORIES = ['ml', 'source', 'image', 'annotation', 'account']
 
@@ -1035,6 +1138,9 @@ LABELPATCH_NCOLS = 150
 LABELPATCH_NROWS = 150
 # Patch covers this proportion of the original image's greater dimension
 LABELPATCH_SIZE_FRACTION = 0.2
+# Max number of threads used to decode images and save patches when
+# generating a batch of label patches.
+PATCH_GENERATION_THREADS = 4
 
 # Front page carousel images.
 # Count = number of images in the carousel each time you load the front page.
@@ -109,7 +109,7 @@ class MainTest(ClientTest):
         )
         response = self.batch_edit(post_data)
 
-        zf = ZipFile(BytesIO(response.content))
+        zf = ZipFile(BytesIO(response.getvalue()))
         # Use decode() to get a Unicode string
         actual_cpc_content = zf.read('1.cpc').decode()
 
@@ -162,7 +162,7 @@ class MainTest(ClientTest):
         )
         response = self.batch_edit(post_data)
 
-        zf = ZipFile(BytesIO(response.content))
+        zf = ZipFile(BytesIO(response.getvalue()))
         actual_cpc_content = zf.read('1.cpc').decode()
 
         expected_cpc_lines = self.make_cpc_lines(
@@ -210,7 +210,7 @@ class MainTest(ClientTest):
         )
         response = self.batch_edit(post_data)
 
-        zf = ZipFile(BytesIO(response.content))
+        zf = ZipFile(BytesIO(response.getvalue()))
 
         cpc_content = zf.read('0001.cpc').decode()
         self.assertTrue(
@@ -3,12 +3,15 @@ from zipfile import ZipFile
 
 from bs4 import BeautifulSoup
 from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from django.utils.html import escape as html_escape
 
 from images.model_utils import PointGen
 from images.models import Image
-from lib.tests.utils import BasePermissionTest, ClientTest
+from lib.tests.utils import (
+    BasePermissionTest, ClientTest, confirm_annotations_upload)
 from upload.tests.utils import UploadAnnotationsCsvTestMixin
 from ..utils import get_previous_cpcs_status
 
@@ -86,7 +89,7 @@ class CPCExportBaseTest(ClientTest):
 
     @staticmethod
     def export_response_to_cpc(response, cpc_filename):
-        zf = ZipFile(BytesIO(response.content))
+        zf = ZipFile(BytesIO(response.getvalue()))
         # Use decode() to get a Unicode string
         return zf.read(cpc_filename).decode()
 
@@ -95,7 +98,8 @@ class CPCExportBaseTest(ClientTest):
         self.client.post(
             reverse('cpce:upload_preview_ajax', args=[self.source.pk]),
             {'cpc_files': cpc_files, 'label_mapping': label_mapping})
-        self.client.post(
+        confirm_annotations_upload(
+            self.client,
             reverse('cpce:upload_confirm_ajax', args=[self.source.pk]))
 
     def assert_cpc_content_equal(self, actual_cpc_content, expected_lines):
@@ -916,6 +920,25 @@ class AnnotationFilterTest(CPCExportBaseTest):
         self.assert_cpc_label_lines_equal(
             actual_cpc_content, expected_point_lines)
 
+    def test_label_removed_from_labelset(self):
+        # The annotations stay, so this falls back to the default code.
+        self.source.labelset.locallabel_set.get(code='A').delete()
+
+        post_data = self.default_export_params.copy()
+        post_data.update(
+            annotation_filter='confirmed_only',
+        )
+        response = self.export_cpcs(post_data)
+        actual_cpc_content = self.export_response_to_cpc(response, '1.cpc')
+
+        expected_point_lines = [
+            '"1","A","Notes",""',
+            '"2","","Notes",""',
+            '"3","","Notes",""',
+        ]
+        self.assert_cpc_label_lines_equal(
+            actual_cpc_content, expected_point_lines)
+
 
 class LabelMappingTest(CPCExportBaseTest):
     """
@@ -1252,6 +1275,61 @@ class DiscardCPCAfterPointsChangeTest(
             msg="img2's CPC content should be unchanged")
 
 
+class QueryCountTest(CPCExportBaseTest):
+    """
+    The number of queries shouldn't depend on the number of images
+    in a chunk or the number of points per image.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user, simple_number_of_points=5, confidence_threshold=80)
+        labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+
+        robot = cls.create_robot(cls.source)
+        for number in range(1, 6+1):
+            img = cls.upload_image(
+                cls.user, cls.source, dict(filename=f'{number}.jpg'))
+            cls.add_robot_annotations(
+                robot, img,
+                {1: ('A', 60), 2: ('B', 90), 3: ('A', 81), 4: ('B', 70),
+                 5: ('A', 99)})
+            cls.add_annotations(cls.user, img, {1: 'B'})
+
+    def export_and_count_queries(self, image_name):
+        post_data = self.default_export_params.copy()
+        post_data.update(
+            image_name=image_name,
+            annotation_filter='confirmed_and_confident',
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.export_cpcs(post_data)
+            zip_content = response.getvalue()
+        return ZipFile(BytesIO(zip_content)), len(context.captured_queries)
+
+    @override_settings(EXPORT_IMAGE_CHUNK_SIZE=10)
+    def test_constant_per_chunk(self):
+        zip_file, one_image_queries = self.export_and_count_queries('1.jpg')
+        self.assertEqual(len(zip_file.namelist()), 1)
+
+        zip_file, all_images_queries = self.export_and_count_queries('')
+        self.assertEqual(len(zip_file.namelist()), 6)
+        self.assertEqual(one_image_queries, all_images_queries)
+
+        self.assert_cpc_label_lines_equal(
+            zip_file.read('6.cpc').decode(), [
+                '"1","B","Notes",""',
+                '"2","B","Notes",""',
+                '"3","A","Notes",""',
+                '"4","","Notes",""',
+                '"5","A","Notes",""',
+            ])
+
+
 class SessionErrorTest(ClientTest):
     """Test session-related error cases on the serve view."""
     @classmethod
@@ -212,7 +212,7 @@ class LabelMappingTest(ClientTest, UploadAnnotationsCpcTestMixin):
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             self.img1.point_set
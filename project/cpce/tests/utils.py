@@ -4,6 +4,7 @@ from io import StringIO
 from django.core.files.base import ContentFile
 from django.urls import reverse
 
+from lib.tests.utils import confirm_annotations_upload
 from upload.tests.utils import UploadAnnotationsTestMixin
 
 
@@ -88,6 +89,7 @@ class UploadAnnotationsCpcTestMixin(UploadAnnotationsTestMixin, ABC):
 
     def upload_annotations(self, user, source):
         self.client.force_login(user)
-        return self.client.post(
+        return confirm_annotations_upload(
+            self.client,
             reverse('cpce:upload_confirm_ajax', args=[source.pk]),
         )
@@ -1,16 +1,23 @@
 import csv
 from io import StringIO
 from pathlib import PureWindowsPath
-import re
 from typing import List, Tuple
 
 from django.conf import settings
+from django.db.models import Max
 
+from accounts.utils import get_robot_user
 from annotations.model_utils import AnnotationAreaUtils
-from export.utils import create_zip_stream_response, write_zip
+from annotations.models import Annotation
+from export.utils import (
+    add_missing_label_codes, create_zip_streaming_response, generate_zip,
+    get_label_codes)
 from images.models import Image, Point, Source
+from images.utils import ImageNameMatcher
 from lib.exceptions import FileProcessError
+from lib.utils import chunked
 from upload.utils import csv_to_dicts
+from vision_backend.models import Score
 
 
 def annotations_cpcs_to_dict(
@@ -20,13 +27,15 @@ def annotations_cpcs_to_dict(
 
     cpc_info = []
     image_names_to_cpc_filenames = dict()
+    image_matcher = ImageNameMatcher(source)
+    labelset_codes = get_labelset_codes(source)
 
     for cpc_filename, stream in cpc_names_and_streams:
 
         try:
             cpc = CpcFileContent.from_stream(stream)
             image, annotations = cpc.get_image_and_annotations(
-                source, label_mapping)
+                source, label_mapping, image_matcher, labelset_codes)
         except FileProcessError as error:
             raise FileProcessError(f"From file {cpc_filename}: {error}")
 
@@ -59,59 +68,151 @@ def annotations_cpcs_to_dict(
     return cpc_info
 
 
-def create_cpc_strings(image_set, cpc_prefs):
-    # Dict mapping from cpc filenames to cpc file contents as strings.
-    cpc_strings = dict()
+def get_labelset_codes(source):
+    # Codes are case insensitive, so we lowercase them.
+    return set(
+        code.lower()
+        for code in source.labelset.get_labels().values_list(
+            'code', flat=True)
+    )
+
+
+def generate_cpc_files(source, image_set, cpc_prefs):
+    """
+    Generates a CPC file for each image in image_set, as
+    (filepath in the export zip, CPC content string) pairs.
+
+    Images are processed in chunks of EXPORT_IMAGE_CHUNK_SIZE, with a
+    fixed number of queries per chunk, so the query count and memory usage
+    don't depend on the number of images or points.
+    """
+    label_codes = get_label_codes(source)
+    robot_user_id = get_robot_user().pk
+
+    images = image_set.select_related('metadata').iterator(
+        chunk_size=settings.EXPORT_IMAGE_CHUNK_SIZE)
+    for image_chunk in chunked(images, settings.EXPORT_IMAGE_CHUNK_SIZE):
+
+        points_by_image = get_cpc_export_points(
+            source, image_chunk, cpc_prefs['annotation_filter'],
+            label_codes, robot_user_id)
+
+        for img in image_chunk:
+            # Write .cpc contents to a stream.
+            cpc_stream = StringIO()
+            points = points_by_image.get(img.pk, [])
+
+            if img.cpc_content and img.cpc_filename:
+                # A CPC file was uploaded for this image before.
+                write_annotations_cpc_based_on_prev_cpc(
+                    cpc_stream, img, cpc_prefs, points)
+                # Use the same CPC filename that was used for this image
+                # before.
+                cpc_filename = img.cpc_filename
+            else:
+                # No CPC file was uploaded for this image before.
+                write_annotations_cpc(cpc_stream, img, cpc_prefs, points)
+                # Make a CPC filename based on the image filename, like
+                # CPCe does. PWP ensures that both forward slashes and
+                # backslashes are counted as path separators.
+                cpc_filename = image_filename_to_cpc_filename(
+                    PureWindowsPath(img.metadata.name).name)
+
+            # If the image name seems to be a relative path (not just a
+            # filename), then use those path directories on the CPC .zip
+            # filepath as well.
+            image_parent = PureWindowsPath(img.metadata.name).parent
+            # If it's a relative path, this appends the directories, else
+            # this appends nothing.
+            cpc_filepath = str(PureWindowsPath(image_parent, cpc_filename))
+            # We've used Windows paths for path-separator flexibility up to
+            # this point. Now that we're finished with path manipulations,
+            # we'll make sure all separators are forward slashes for .zip
+            # export purposes. This makes zip directory tree structures work
+            # on every OS. Forward slashes are also required by the .ZIP
+            # File Format Specification.
+            # https://superuser.com/a/1382853/
+            cpc_filepath = cpc_filepath.replace('\\', '/')
+
+            # TODO: If cpc_filepath was already used by a previous image,
+            # then we have a name conflict and need to warn / disambiguate.
+            yield cpc_filepath, cpc_stream.getvalue()
+
+
+def get_cpc_export_points(
+        source, images, annotation_filter, label_codes, robot_user_id):
+    """
+    Get the points of a chunk of images for CPC export, with a fixed
+    number of queries.
 
-    for img in image_set:
-        # Write .cpc contents to a stream.
-        cpc_stream = StringIO()
+    :return: Dict of image ID to a list of point dicts (point_number, row,
+      column, label_code), ordered by point number. label_code is as
+      determined by cpc_export_label_code().
+    """
+    image_ids = [image.pk for image in images]
 
-        if img.cpc_content and img.cpc_filename:
-            # A CPC file was uploaded for this image before.
-            write_annotations_cpc_based_on_prev_cpc(cpc_stream, img, cpc_prefs)
-            # Use the same CPC filename that was used for this image before.
-            cpc_filename = img.cpc_filename
+    annotations = dict(
+        (point_id, (label_id, user_id))
+        for point_id, label_id, user_id
+        in Annotation.objects.filter(image_id__in=image_ids)
+        .values_list('point_id', 'label_id', 'user_id')
+    )
+    add_missing_label_codes(
+        label_codes,
+        [label_id for label_id, _ in annotations.values()])
+
+    max_scores = dict()
+    if annotation_filter == 'confirmed_and_confident':
+        max_scores = dict(
+            Score.objects.filter(image_id__in=image_ids)
+            .values('point_id')
+            .annotate(max_score=Max('score'))
+            .values_list('point_id', 'max_score')
+        )
+
+    points = (
+        Point.objects.filter(image_id__in=image_ids)
+        .order_by('image_id', 'point_number')
+        .values_list('pk', 'image_id', 'point_number', 'row', 'column')
+    )
+    points_by_image = dict()
+    for point_id, image_id, point_number, row, column in points:
+        if point_id in annotations:
+            label_id, user_id = annotations[point_id]
+            if user_id == robot_user_id:
+                annotation_status = 'unconfirmed'
+            else:
+                annotation_status = 'confirmed'
+            label_code = label_codes[label_id]
         else:
-            # No CPC file was uploaded for this image before.
-            write_annotations_cpc(cpc_stream, img, cpc_prefs)
-            # Make a CPC filename based on the image filename, like CPCe does.
-            # PWP ensures that both forward slashes and backslashes are counted
-            # as path separators.
-            cpc_filename = image_filename_to_cpc_filename(
-                PureWindowsPath(img.metadata.name).name)
-
-        # If the image name seems to be a relative path (not just a filename),
-        # then use those path directories on the CPC .zip filepath as well.
-        image_parent = PureWindowsPath(img.metadata.name).parent
-        # If it's a relative path, this appends the directories, else this
-        # appends nothing.
-        cpc_filepath = str(PureWindowsPath(image_parent, cpc_filename))
-        # We've used Windows paths for path-separator flexibility up to this
-        # point. Now that we're finished with path manipulations, we'll make
-        # sure all separators are forward slashes for .zip export purposes.
-        # This makes zip directory tree structures work on every OS. Forward
-        # slashes are also required by the .ZIP File Format Specification.
-        # https://superuser.com/a/1382853/
-        cpc_filepath = cpc_filepath.replace('\\', '/')
-
-        # Convert the stream contents to a string.
-        # TODO: If cpc_filepath is already in the cpc_strings dict, then we
-        # have a name conflict and need to warn / disambiguate.
-        cpc_strings[cpc_filepath] = cpc_stream.getvalue()
-
-    return cpc_strings
-
-
-def create_zipped_cpcs_stream_response(cpc_strings, zip_filename):
-    response = create_zip_stream_response(zip_filename)
-    # Convert Unicode strings to byte strings
-    cpc_byte_strings = dict([
-        (cpc_filename, cpc_content.encode())
-        for cpc_filename, cpc_content in cpc_strings.items()
-    ])
-    write_zip(response, cpc_byte_strings)
-    return response
+            annotation_status = 'unclassified'
+            label_code = ''
+
+        points_by_image.setdefault(image_id, []).append(dict(
+            point_number=point_number,
+            row=row,
+            column=column,
+            label_code=cpc_export_label_code(
+                annotation_status, label_code,
+                # No scores means 0 confidence.
+                max_scores.get(point_id, 0),
+                source.confidence_threshold, annotation_filter),
+        ))
+    return points_by_image
+
+
+def create_zipped_cpcs_stream_response(cpc_files, zip_filename):
+    """
+    :param cpc_files: Iterable of (filepath, CPC content string) pairs.
+    """
+    return create_zip_streaming_response(
+        zip_filename,
+        # Convert Unicode strings to byte strings
+        generate_zip(
+            (cpc_filepath, cpc_content.encode())
+            for cpc_filepath, cpc_content in cpc_files
+        ),
+    )
 
 
 def image_filename_to_cpc_filename(image_filename):
@@ -128,7 +229,9 @@ def image_filename_to_cpc_filename(image_filename):
     return cpc_filename
 
 
-def point_to_cpc_export_label_code(point, annotation_filter):
+def cpc_export_label_code(
+        annotation_status, label_code, machine_confidence,
+        confidence_threshold, annotation_filter):
     """
     Normally, annotation export will export ALL annotations, including machine
     annotations of low confidence. This is usually okay because, if users want
@@ -142,7 +245,11 @@ def point_to_cpc_export_label_code(point, annotation_filter):
     So we need to filter the annotations on a point basis. That's what this
     function is for.
 
-    :param point: A Point model object.
+    :param annotation_status: The point's annotation status:
+      'confirmed', 'unconfirmed', or 'unclassified'.
+    :param label_code: Label short code of the point's annotation, or ''.
+    :param machine_confidence: Highest machine score of the point.
+    :param confidence_threshold: The source's confidence threshold.
     :param annotation_filter:
       'confirmed_only' to denote that only Confirmed annotations are accepted.
       'confirmed_and_confident' to denote that Unconfirmed annotations above
@@ -153,23 +260,25 @@ def point_to_cpc_export_label_code(point, annotation_filter):
     :return: Label short code string of the point's annotation, if there is
       an annotation which is accepted by the annotation_filter. Otherwise, ''.
     """
-    if point.annotation_status_property == 'confirmed':
+    if annotation_status == 'confirmed':
         # Confirmed annotations are always included
-        return point.label_code
+        return label_code
     elif (annotation_filter == 'confirmed_and_confident'
-          and point.annotation_status_property == 'unconfirmed'):
+          and annotation_status == 'unconfirmed'):
         # With this annotation_filter, Unconfirmed annotations are included
         # IF they're above the source's confidence threshold
-        if point.machine_confidence >= point.image.source.confidence_threshold:
-            return point.label_code
+        if machine_confidence >= confidence_threshold:
+            return label_code
 
     # The annotation filter rejects this annotation, or there is no annotation
     return ''
 
 
-def write_annotations_cpc(cpc_stream: StringIO, img: Image, cpc_prefs: dict):
+def write_annotations_cpc(
+        cpc_stream: StringIO, img: Image, cpc_prefs: dict, points: list):
     """
     Write a CPC from scratch.
+    :param points: The image's points, as from get_cpc_export_points().
     """
     code_filepath = cpc_prefs['local_code_filepath']
     image_filepath = str(PureWindowsPath(
@@ -226,24 +335,22 @@ def write_annotations_cpc(cpc_stream: StringIO, img: Image, cpc_prefs: dict):
 
     # Points.
 
-    point_objs = Point.objects.filter(image=img).order_by('point_number')
-    points = []
+    cpc_points = []
 
-    for point_obj in point_objs:
+    for point in points:
 
         # Point positions, as ints.
         # <x from left, y from top> of each point in numerical order,
         # seemingly using the x15 scaling.
         # CPCe point positions are on a scale of 15 units = 1 pixel, and
         # the positions start from 0.
-        point_left = point_obj.column * 15
-        point_top = point_obj.row * 15
+        point_left = point['column'] * 15
+        point_top = point['row'] * 15
 
         # Point identification.
         # "<point number/letter>","<label code>","Notes","<notes code>"
 
-        label_code = point_to_cpc_export_label_code(
-            point_obj, cpc_prefs['annotation_filter'])
+        label_code = point['label_code']
 
         if cpc_prefs['label_mapping'] == 'id_and_notes' and '+' in label_code:
             # Assumption: label code in CoralNet source's labelset
@@ -256,10 +363,10 @@ def write_annotations_cpc(cpc_stream: StringIO, img: Image, cpc_prefs: dict):
             cpc_id = label_code
             cpc_notes = ''
 
-        points.append(dict(
+        cpc_points.append(dict(
             x=point_left,
             y=point_top,
-            number_label=str(point_obj.point_number),
+            number_label=str(point['point_number']),
             id=cpc_id,
             notes=cpc_notes,
         ))
@@ -277,14 +384,14 @@ def write_annotations_cpc(cpc_stream: StringIO, img: Image, cpc_prefs: dict):
         display_width,
         display_height,
         annotation_area,
-        points,
+        cpc_points,
         headers,
     )
     cpc.write_cpc(cpc_stream)
 
 
 def write_annotations_cpc_based_on_prev_cpc(
-        cpc_stream: StringIO, img: Image, cpc_prefs: dict):
+        cpc_stream: StringIO, img: Image, cpc_prefs: dict, points: list):
 
     cpc = CpcFileContent.from_stream(StringIO(img.cpc_content, newline=''))
 
@@ -297,12 +404,9 @@ def write_annotations_cpc_based_on_prev_cpc(
     # Points: Replace the ID codes (and notes, if applicable)
     # with the data from CoralNet's DB.
 
-    point_objs = Point.objects.filter(image=img).order_by('point_number')
-
-    for point_index, point_obj in enumerate(point_objs):
+    for point_index, db_point in enumerate(points):
         point = cpc.points[point_index]
-        label_code = point_to_cpc_export_label_code(
-            point_obj, cpc_prefs['annotation_filter'])
+        label_code = db_point['label_code']
 
         if cpc_prefs['label_mapping'] == 'id_and_notes':
             # Get ID + Notes from CoralNet's label codes.
@@ -596,62 +700,24 @@ class CpcFileContent:
         for header in self.headers:
             writerow([quoted(header)])
 
-    def find_matching_image(self, source):
-
-        # The image filepath follows the rules of the OS running CPCe,
-        # not the rules of the server OS. So we don't use Path.
-        # CPCe only runs on Windows, so we can assume it's a Windows
-        # path. That means using PureWindowsPath (WindowsPath can only
-        # be instantiated on a Windows OS).
-        cpc_image_filepath = PureWindowsPath(self.image_filepath)
-        image_filename = cpc_image_filepath.name
-
-        # Match up the CPCe image filepath to an image name on CoralNet.
-        #
-        # Let's say the image filepath is D:\Site A\Transect 1\01.jpg
-        # Example image names:
-        # D:\Site A\Transect 1\01.jpg: best match
-        # Site A\Transect 1\01.jpg: 2nd best match
-        # Transect 1\01.jpg: 3rd best match
-        # 01.jpg: 4th best match
-        # Transect 1/01.jpg: same as with backslash
-        # /Transect 1/01.jpg: same as without leading slash
-        # 23.jpg: non-match 1
-        # 4501.jpg: non-match 2
-        # sect 1\01.jpg: non-match 3
-        # (No, it's not as good as 01.jpg, it's just a non-match)
-        #
-        # First get names consisting of 01.jpg preceded by /, \, or nothing.
-        # This avoids non-match 1 and non-match 2, presumably narrowing
-        # things down to only a few image candidates.
-        regex_escaped_filename = re.escape(image_filename)
-        name_regex = r'^(.*[\\|/])?{fn}$'.format(fn=regex_escaped_filename)
-        image_candidates = source.image_set.filter(
-            metadata__name__regex=name_regex)
-
-        # Find the best match while avoiding non-match 3. To do so, we
-        # basically iterate over best match, 2nd best match, 3rd best
-        # match, etc. and see if they exist.
-        parts_to_match = cpc_image_filepath.parts
-        while len(parts_to_match) > 0:
-            for image_candidate in image_candidates:
-                candidate_parts = PureWindowsPath(
-                    image_candidate.metadata.name).parts
-                # Ignore leading slashes.
-                if candidate_parts[0] == '\\':
-                    candidate_parts = candidate_parts[1:]
-                # See if it's a match.
-                if parts_to_match == candidate_parts:
-                    # It's a match.
-                    return image_candidate
-            # No match this time; try to match one fewer part.
-            parts_to_match = parts_to_match[1:]
+    def find_matching_image(self, source, image_matcher=None):
+        """
+        Match up the CPCe image filepath to an image name on CoralNet.
+        See ImageNameMatcher for the matching rules. When processing many
+        .cpc files for the same source, pass the same image_matcher to
+        each call, so that the source's image names are only loaded once.
+        """
+        if image_matcher is None:
+            image_matcher = ImageNameMatcher(source)
+        image_id = image_matcher.match(self.image_filepath)
 
         # There could be no matching image names in the source, in which
         # case this would be None. It could be an image the user is
         # planning to upload later, or an image they're not planning
         # to upload but are still tracking in their records.
-        return None
+        if image_id is None:
+            return None
+        return Image.objects.select_related('metadata').get(pk=image_id)
 
     def get_image_dir(self, image_id: int) -> str:
         """
@@ -705,11 +771,15 @@ class CpcFileContent:
                 "Could not establish an integer scale factor from line 1.")
         return x_scale
 
-    def get_image_and_annotations(self, source, label_mapping):
+    def get_image_and_annotations(
+            self, source, label_mapping, image_matcher=None,
+            labelset_codes=None):
         """
         Process the .cpc info as annotations for an image in the given source.
+        labelset_codes, if given, is the set of the source's label codes
+        in lowercase.
         """
-        image = self.find_matching_image(source)
+        image = self.find_matching_image(source, image_matcher)
         if not image:
             return None, []
 
@@ -788,8 +858,9 @@ class CpcFileContent:
 
             if label_code:
                 # Check that the label is in the labelset
-                global_label = source.labelset.get_global_by_code(label_code)
-                if not global_label:
+                if labelset_codes is None:
+                    labelset_codes = get_labelset_codes(source)
+                if label_code.lower() not in labelset_codes:
                     raise FileProcessError(
                         f"Point {point_number}:"
                         f" No label of code {label_code} found"
@@ -1,14 +1,16 @@
 from io import StringIO
 import json
 
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import HttpResponseRedirect, JsonResponse, QueryDict
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
 from django.views.decorators.http import require_GET, require_POST
 
-from export.utils import get_request_images
+from export.utils import get_request_images, get_search_images
 from images.models import Source
 from lib.decorators import (
     login_required_ajax,
@@ -32,8 +34,8 @@ from .utils import (
     CpcFileContent,
     cpc_editor_csv_to_dicts,
     cpc_edit_labels,
-    create_cpc_strings,
     create_zipped_cpcs_stream_response,
+    generate_cpc_files,
 )
 
 
@@ -102,9 +104,10 @@ def upload_preview_ajax(request, source_id):
 
 
 class CpcAnnotationsUploadConfirmView(AnnotationsUploadConfirmView):
-    cpc_info = None
 
     def extra_source_level_actions(self, request, source):
+        # The CPC contents are saved to the images along with the points,
+        # for future CPC exports.
         self.cpc_files = request.session.pop('cpc_files', None)
 
         # Save some defaults for future CPC exports. Here we get the code
@@ -121,16 +124,6 @@ class CpcAnnotationsUploadConfirmView(AnnotationsUploadConfirmView):
         source.cpce_image_dir = cpc.get_image_dir(image_id)
         source.save()
 
-    def update_image_and_metadata_fields(self, image, new_points):
-        super().update_image_and_metadata_fields(image, new_points)
-
-        # Save uploaded CPC contents for future CPC exports.
-        # Note: Since cpc_files went through session serialization,
-        # the integer dict keys became stringified.
-        image.cpc_content = self.cpc_files[str(image.pk)]['cpc_content']
-        image.cpc_filename = self.cpc_files[str(image.pk)]['filename']
-        image.save()
-
 
 @source_permission_required(
     'source_id', perm=Source.PermTypes.EDIT.code, ajax=True)
@@ -157,15 +150,18 @@ def export_prepare_ajax(request, source_id):
         ))
 
     cpc_prefs = cpc_export_form.cleaned_data
-    # Create a dict of filenames to CPC-file-content strings
-    cpc_strings = create_cpc_strings(image_set, cpc_prefs)
     # Save CPC prefs to the database for use next time
     source.cpce_code_filepath = cpc_prefs['local_code_filepath']
     source.cpce_image_dir = cpc_prefs['local_image_dir']
     source.save()
 
+    # The CPCs are generated while they're being served, so here we just
+    # save what's needed to do that: the image search and the CPC prefs.
     session_data_timestamp = save_session_data(
-        request.session, 'cpc_export', cpc_strings)
+        request.session, 'cpc_export', dict(
+            image_search=request.POST.urlencode(),
+            cpc_prefs=cpc_prefs,
+        ))
 
     return JsonResponse(dict(
         session_data_timestamp=session_data_timestamp,
@@ -183,11 +179,22 @@ def export_prepare_ajax(request, source_id):
 def export_serve(request, source_id, session_data):
     """
     This is the second view after requesting a CPC export.
-    Grab the previously crafted CPCs from the session, and serve them in a
-    zip file.
+    Generate the CPCs using the image search and prefs saved in the session,
+    and stream them in a zip file.
     """
+    source = get_object_or_404(Source, id=source_id)
+
+    try:
+        image_set, _ = get_search_images(
+            QueryDict(session_data['image_search']), source)
+    except ValidationError as e:
+        messages.error(request, f"Export failed: {e.message}")
+        return HttpResponseRedirect(
+            reverse('browse_images', args=[source_id]))
+
     return create_zipped_cpcs_stream_response(
-        session_data, 'annotations_cpc.zip')
+        generate_cpc_files(source, image_set, session_data['cpc_prefs']),
+        'annotations_cpc.zip')
 
 
 @login_required
@@ -257,4 +264,4 @@ def cpc_batch_editor_process_ajax(request):
     error_prefix="Batch edit failed")
 def cpc_batch_editor_file_serve(request, session_data):
     return create_zipped_cpcs_stream_response(
-        session_data, 'edited_cpcs.zip')
+        session_data.items(), 'edited_cpcs.zip')
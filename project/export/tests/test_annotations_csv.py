@@ -1,13 +1,16 @@
 import datetime
 
 from django.core.files.base import ContentFile
+from django.db import connection
+from django.shortcuts import resolve_url
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from annotations.models import Annotation
 from export.tests.utils import BaseExportTest
 from images.model_utils import PointGen
-from lib.tests.utils import BasePermissionTest
+from lib.tests.utils import BasePermissionTest, confirm_annotations_upload
 from upload.tests.utils import UploadAnnotationsCsvTestMixin
 
 
@@ -57,7 +60,7 @@ class ImageSetTest(BaseExportTest):
             '1.jpg,149,99,A',
             '1.jpg,149,299,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_all_images_multiple(self):
         """Export for 3 out of 3 images."""
@@ -86,7 +89,38 @@ class ImageSetTest(BaseExportTest):
             '3.jpg,99,99,B',
             '3.jpg,99,299,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
+
+    @override_settings(EXPORT_IMAGE_CHUNK_SIZE=2)
+    def test_multiple_image_chunks(self):
+        """Image order should be preserved across chunks."""
+        self.img1 = self.upload_image(
+            self.user, self.source,
+            dict(filename='1.jpg', width=400, height=300))
+        self.img2 = self.upload_image(
+            self.user, self.source,
+            dict(filename='2.jpg', width=400, height=400))
+        self.img3 = self.upload_image(
+            self.user, self.source,
+            dict(filename='3.jpg', width=400, height=200))
+        self.add_annotations(self.user, self.img1, {1: 'A', 2: 'B'})
+        self.add_annotations(self.user, self.img2, {1: 'B', 2: 'A'})
+        self.add_annotations(self.user, self.img3, {1: 'B', 2: 'B'})
+
+        post_data = self.default_search_params.copy()
+        post_data['sort_direction'] = 'desc'
+        response = self.export_annotations(post_data)
+
+        expected_lines = [
+            'Name,Row,Column,Label',
+            '3.jpg,99,99,B',
+            '3.jpg,99,299,B',
+            '2.jpg,199,99,B',
+            '2.jpg,199,299,A',
+            '1.jpg,149,99,A',
+            '1.jpg,149,299,B',
+        ]
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_image_subset_by_metadata(self):
         """Export for some, but not all, images."""
@@ -120,7 +154,7 @@ class ImageSetTest(BaseExportTest):
             '3.jpg,99,99,B',
             '3.jpg,99,299,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_image_subset_by_annotation_status(self):
         """Export for some, but not all, images. Different search criteria.
@@ -154,7 +188,7 @@ class ImageSetTest(BaseExportTest):
             '3.jpg,99,99,B',
             '3.jpg,99,299,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_image_empty_set(self):
         """Export for 0 images."""
@@ -170,7 +204,7 @@ class ImageSetTest(BaseExportTest):
         expected_lines = [
             'Name,Row,Column,Label',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_invalid_image_set_params(self):
         self.upload_image(self.user, self.source)
@@ -207,7 +241,7 @@ class ImageSetTest(BaseExportTest):
             '1.jpg,149,99,A',
             '1.jpg,149,299,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class AnnotationStatusTest(BaseExportTest):
@@ -237,7 +271,7 @@ class AnnotationStatusTest(BaseExportTest):
         expected_lines = [
             'Name,Row,Column,Label',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_partially_annotated(self):
         self.add_annotations(self.user, self.img1, {1: 'B'})
@@ -247,7 +281,7 @@ class AnnotationStatusTest(BaseExportTest):
             'Name,Row,Column,Label',
             '1.jpg,149,99,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_fully_annotated(self):
         self.add_annotations(self.user, self.img1, {1: 'B', 2: 'A'})
@@ -258,7 +292,24 @@ class AnnotationStatusTest(BaseExportTest):
             '1.jpg,149,99,B',
             '1.jpg,149,299,A',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
+
+    def test_label_removed_from_labelset(self):
+        self.add_annotations(self.user, self.img1, {1: 'B', 2: 'A'})
+        local_label = self.source.labelset.locallabel_set.get(code='B')
+        local_label.code = 'B_local'
+        local_label.save()
+        # The annotations stay, so this falls back to the default code.
+        local_label.delete()
+
+        response = self.export_annotations(self.default_search_params)
+
+        expected_lines = [
+            'Name,Row,Column,Label',
+            '1.jpg,149,99,B',
+            '1.jpg,149,299,A',
+        ]
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_machine_annotated(self):
         robot = self.create_robot(self.source)
@@ -270,7 +321,7 @@ class AnnotationStatusTest(BaseExportTest):
             '1.jpg,149,99,B',
             '1.jpg,149,299,A',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_part_machine_part_manual(self):
         robot = self.create_robot(self.source)
@@ -283,7 +334,7 @@ class AnnotationStatusTest(BaseExportTest):
             '1.jpg,149,99,B',
             '1.jpg,149,299,A',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class AnnotatorInfoColumnsTest(BaseExportTest, UploadAnnotationsCsvTestMixin):
@@ -321,7 +372,7 @@ class AnnotatorInfoColumnsTest(BaseExportTest, UploadAnnotationsCsvTestMixin):
             '1.jpg,149,199,B,{username},{date}'.format(
                 username=self.user.username, date=date_str),
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_imported_annotation(self):
         # Import an annotation
@@ -346,7 +397,7 @@ class AnnotatorInfoColumnsTest(BaseExportTest, UploadAnnotationsCsvTestMixin):
             'Name,Row,Column,Label,Annotator,Date annotated',
             '1.jpg,50,70,B,Imported,{date}'.format(date=date_str),
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_machine_annotation(self):
         robot = self.create_robot(self.source)
@@ -363,7 +414,7 @@ class AnnotatorInfoColumnsTest(BaseExportTest, UploadAnnotationsCsvTestMixin):
             'Name,Row,Column,Label,Annotator,Date annotated',
             '1.jpg,149,199,B,robot,{date}'.format(date=date_str),
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class MachineSuggestionColumnsTest(BaseExportTest):
@@ -399,7 +450,7 @@ class MachineSuggestionColumnsTest(BaseExportTest):
             ',Machine suggestion 2,Machine confidence 2',
             '1.jpg,149,199,B,,,,',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     @override_settings(NBR_SCORES_PER_ANNOTATION=2)
     def test_all_suggestions_filled(self):
@@ -420,7 +471,7 @@ class MachineSuggestionColumnsTest(BaseExportTest):
             ',Machine suggestion 2,Machine confidence 2',
             '1.jpg,149,199,B,B,60,A,40',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     @override_settings(NBR_SCORES_PER_ANNOTATION=3)
     def test_some_suggestions_filled(self):
@@ -439,7 +490,7 @@ class MachineSuggestionColumnsTest(BaseExportTest):
             ',Machine suggestion 3,Machine confidence 3',
             '1.jpg,149,199,B,B,60,A,40,,',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class MetadataAuxColumnsTest(BaseExportTest):
@@ -472,7 +523,7 @@ class MetadataAuxColumnsTest(BaseExportTest):
             'Name,Date,Aux1,Aux2,Aux3,Aux4,Aux5,Row,Column,Label',
             '1.jpg,,,,,,,149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_filled(self):
         self.img1.metadata.photo_date = datetime.date(2001, 2, 3)
@@ -490,7 +541,7 @@ class MetadataAuxColumnsTest(BaseExportTest):
             'Name,Date,Aux1,Aux2,Aux3,Aux4,Aux5,Row,Column,Label',
             '1.jpg,2001-02-03,Site A,Transect 1-2,Quadrant 5,,,149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_named_aux_fields(self):
         self.source.key1 = "Site"
@@ -512,7 +563,7 @@ class MetadataAuxColumnsTest(BaseExportTest):
             'Name,Date,Site,Transect,Quadrant,Aux4,Aux5,Row,Column,Label',
             '1.jpg,2001-02-03,Site A,Transect 1-2,Quadrant 5,,,149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class MetadataOtherColumnsTest(BaseExportTest):
@@ -547,7 +598,7 @@ class MetadataOtherColumnsTest(BaseExportTest):
             ',Comments,Row,Column,Label',
             '1.jpg,,,,,,,,,,,,149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_filled(self):
         self.img1.metadata.height_in_cm = 40
@@ -576,7 +627,7 @@ class MetadataOtherColumnsTest(BaseExportTest):
             ',Clear,White A,Framing set C,Card B'
             ',"Here are\nsome comments.",149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
 
 class MoreOptionalColumnsCasesTest(BaseExportTest):
@@ -636,7 +687,7 @@ class MoreOptionalColumnsCasesTest(BaseExportTest):
             ',Clear,White A,Framing set C,Card B'
             ',"Here are\nsome comments.",149,199,B',
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_another_combination_of_two_sets(self):
         self.source.key1 = "Site"
@@ -665,7 +716,7 @@ class MoreOptionalColumnsCasesTest(BaseExportTest):
             ',149,199,B,{username},{date}'.format(
                 username=self.user.username, date=date_str),
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     @override_settings(NBR_SCORES_PER_ANNOTATION=2)
     def test_all_sets(self):
@@ -719,7 +770,7 @@ class MoreOptionalColumnsCasesTest(BaseExportTest):
             ',{username},{date},B,60,A,40'.format(
                 username=self.user.username, date=date_str),
         ]
-        self.assert_csv_content_equal(response.content, expected_lines)
+        self.assert_csv_content_equal(response.getvalue(), expected_lines)
 
     def test_invalid_column_name(self):
         self.add_annotations(self.user, self.img1, {1: 'B'})
@@ -772,7 +823,7 @@ class UnicodeTest(BaseExportTest):
             'あ.jpg,149,199,い',
         ]
         self.assert_csv_content_equal(
-            response.content, expected_lines)
+            response.getvalue(), expected_lines)
 
 
 class UploadAndExportSameDataTest(BaseExportTest):
@@ -812,7 +863,8 @@ class UploadAndExportSameDataTest(BaseExportTest):
                     args=[self.source.pk]),
             {'csv_file': csv_file},
         )
-        self.client.post(
+        confirm_annotations_upload(
+            self.client,
             reverse('upload_annotations_csv_confirm_ajax',
                     args=[self.source.pk]),
         )
@@ -821,4 +873,52 @@ class UploadAndExportSameDataTest(BaseExportTest):
         post_data = self.default_search_params.copy()
         response = self.export_annotations(post_data)
 
-        self.assert_csv_content_equal(response.content, csv_lines)
+        self.assert_csv_content_equal(response.getvalue(), csv_lines)
+
+
+class QueryCountTest(BaseExportTest):
+    """The number of queries shouldn't depend on the amount of data."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.UNIFORM,
+            number_of_cell_rows=2, number_of_cell_columns=2,
+        )
+        labels = cls.create_labels(cls.user, ['A', 'B', 'C'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+        cls.robot = cls.create_robot(cls.source)
+
+    def export_and_count_queries(self):
+        post_data = self.default_search_params.copy()
+        post_data['optional_columns'] = [
+            'annotator_info', 'machine_suggestions',
+            'metadata_date_aux', 'metadata_other']
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                resolve_url('export_annotations', self.source.pk),
+                post_data)
+            content = response.getvalue().decode()
+        return len(context.captured_queries), content
+
+    def test_more_images_and_annotations(self):
+        image = self.upload_image(self.user, self.source)
+        self.add_robot_annotations(self.robot, image)
+        small_count, content = self.export_and_count_queries()
+        # Header + 4 points
+        self.assertEqual(len(content.splitlines()), 5)
+
+        for _ in range(4):
+            image = self.upload_image(self.user, self.source)
+            self.add_robot_annotations(self.robot, image)
+        large_count, content = self.export_and_count_queries()
+        # Header + 5 images x 4 points
+        self.assertEqual(len(content.splitlines()), 21)
+
+        self.assertEqual(small_count, large_count)
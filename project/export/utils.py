@@ -1,20 +1,34 @@
 import csv
+from io import StringIO
+from itertools import groupby
 from zipfile import ZipFile
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
+from annotations.models import Annotation
 from images.utils import metadata_field_names_to_labels
-from vision_backend.utils import get_label_scores_for_point
+from labels.models import Label
+from lib.utils import chunked
+from vision_backend.models import Score
 from visualization.forms import create_image_filter_form
 
 
 def get_request_images(request, source):
     if request.POST:
-        image_form = create_image_filter_form(request.POST, source)
-    else:
-        image_form = create_image_filter_form(request.GET, source)
+        return get_search_images(request.POST, source)
+    return get_search_images(request.GET, source)
+
+
+def get_search_images(search_data, source):
+    """
+    Get the images matching Browse-style image-search parameters.
+    :param search_data: QueryDict of the search parameters.
+    :return: Tuple of the image queryset and a display string of the
+      applied search.
+    """
+    image_form = create_image_filter_form(search_data, source)
 
     if image_form:
         if image_form.is_valid():
@@ -26,7 +40,8 @@ def get_request_images(request, source):
             raise ValidationError("Image-search parameters were invalid.")
         applied_search_display = image_form.get_applied_search_display()
     else:
-        image_set = source.image_set.order_by('metadata__name', 'pk')
+        image_set = source.image_set.not_pending_deletion().order_by(
+            'metadata__name', 'pk')
         applied_search_display = "Sorting by name, ascending"
     return image_set, applied_search_display
 
@@ -45,15 +60,69 @@ def create_stream_response(content_type, filename):
     return response
 
 
+def get_label_codes(source):
+    """
+    Label codes are looked up many times during an export, so get them
+    all at once. Returns a dict of global label ID to the source's code.
+    """
+    if source.labelset:
+        return dict(
+            source.labelset.locallabel_set.values_list(
+                'global_label_id', 'code'))
+    return dict()
+
+
+def add_missing_label_codes(label_codes, label_ids):
+    """
+    A label can be removed from a labelset while the source still has
+    annotations of it. Exports are streamed, so instead of failing partway
+    through, fall back to the global label's default code.
+    """
+    missing_ids = set(label_ids) - label_codes.keys()
+    if missing_ids:
+        label_codes.update(
+            Label.objects.filter(pk__in=missing_ids)
+            .values_list('pk', 'default_code'))
+
+
 def create_csv_stream_response(filename):
     return create_stream_response('text/csv', filename)
 
 
+def create_streaming_response(content_type, filename, streaming_content):
+    """
+    Create a downloadable-file HTTP response whose content is generated
+    while it's being sent, instead of being built up in memory first.
+    """
+    response = StreamingHttpResponse(
+        streaming_content, content_type=content_type)
+    response['Content-Disposition'] = \
+        'attachment;filename="{filename}"'.format(filename=filename)
+    return response
+
+
+def create_csv_streaming_response(filename, streaming_content):
+    """
+    :param streaming_content: Iterator of CSV content strings.
+    """
+    return create_streaming_response(
+        'text/csv', filename, streaming_content)
+
+
 def create_zip_stream_response(filename):
     # https://stackoverflow.com/a/29539722/
     return create_stream_response('application/zip', filename)
 
 
+def create_zip_streaming_response(filename, streaming_content):
+    """
+    :param streaming_content: Iterator of zip content byte strings, such
+      as from generate_zip().
+    """
+    return create_streaming_response(
+        'application/zip', filename, streaming_content)
+
+
 def write_zip(zip_stream, file_strings):
     """
     Write a zip file to a stream.
@@ -71,16 +140,64 @@ def write_zip(zip_stream, file_strings):
         zip_file.writestr(filepath, content_string)
 
 
-def write_annotations_csv(response, source, image_set, optional_columns):
+class ZipChunkWriter:
+    """
+    Write-only file object which collects what a ZipFile writes to it,
+    until the collected bytes are popped.
+    Since this isn't seekable, ZipFile writes each file's sizes after its
+    data instead of going back to fill them in.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def generate_zip(files):
+    """
+    Generates a zip file's content, for use as the content of a streaming
+    response. Only one file's content is held in memory at a time.
+    :param files:
+      Iterable of (filepath, byte string) pairs. Filepath is the path that
+      the file will have in the zip archive.
+    :return:
+      Iterator of byte strings; one per file, then one for the zip's
+      central directory.
+    """
+    writer = ZipChunkWriter()
+    with ZipFile(writer, 'w') as zip_file:
+        for filepath, content in files:
+            zip_file.writestr(filepath, content)
+            yield writer.pop()
+    yield writer.pop()
+
+
+def write_annotations_csv(source, image_set, optional_columns):
     """
-    :param response: Stream response object which we can write file content to.
+    Generates annotations CSV file content, for use as the content of a
+    streaming response.
+
+    Images are processed in chunks of EXPORT_IMAGE_CHUNK_SIZE, with a
+    fixed number of queries per chunk, so the query count and memory usage
+    don't depend on the number of annotations per image.
+
     :param source: The source we're exporting annotations for.
-    :param image_set: Non-empty queryset of images to write annotations for.
+    :param image_set: Queryset of images to write annotations for.
         Images should all be from the source which was also passed in.
     :param optional_columns: List of string keys indicating optional column sets
         to add.
-    :return: None. This function simply writes CSV file content to the
-        response argument.
+    :return: Iterator of CSV content strings; one for the header, then
+        one per chunk of images.
     """
     metadata_field_labels = metadata_field_names_to_labels(source)
     metadata_date_aux_fields = [
@@ -127,35 +244,100 @@ def write_annotations_csv(response, source, image_set, optional_columns):
             + other_meta_labels
             + fieldnames[insert_index:])
 
-    writer = csv.DictWriter(response, fieldnames)
+    label_codes = get_label_codes(source)
+
+    stream = StringIO()
+    writer = csv.DictWriter(stream, fieldnames)
+
+    def flush():
+        content = stream.getvalue()
+        stream.seek(0)
+        stream.truncate()
+        return content
+
     writer.writeheader()
+    yield flush()
+
+    images = image_set.select_related('metadata').iterator(
+        chunk_size=settings.EXPORT_IMAGE_CHUNK_SIZE)
+    for image_chunk in chunked(images, settings.EXPORT_IMAGE_CHUNK_SIZE):
+        write_annotations_csv_rows(
+            writer, image_chunk, optional_columns, label_codes,
+            metadata_field_labels, metadata_date_aux_fields,
+            metadata_other_fields)
+        yield flush()
+
+
+def write_annotations_csv_rows(
+    writer, images, optional_columns, label_codes,
+    metadata_field_labels, metadata_date_aux_fields, metadata_other_fields,
+):
+    """
+    Write the annotations CSV rows for a chunk of images. The annotations,
+    points, users, and scores of all the images are fetched in bulk.
+    """
+    image_ids = [image.pk for image in images]
+
+    annotations = (
+        Annotation.objects.filter(image_id__in=image_ids)
+        .order_by('image_id', 'point__point_number')
+        .values(
+            'image_id', 'point_id', 'point__row', 'point__column',
+            'label_id', 'user__username', 'annotation_date')
+    )
+    annotations_by_image = {
+        image_id: list(image_annotations)
+        for image_id, image_annotations
+        in groupby(annotations, key=lambda a: a['image_id'])
+    }
+    label_ids = set(
+        annotation['label_id']
+        for image_annotations in annotations_by_image.values()
+        for annotation in image_annotations
+    )
+
+    scores = []
+    if 'machine_suggestions' in optional_columns:
+        scores = list(
+            Score.objects.filter(image_id__in=image_ids)
+            .order_by('point_id', '-score')
+            .values_list('point_id', 'label_id', 'score')
+        )
+        label_ids.update(label_id for _, label_id, _ in scores)
+
+    add_missing_label_codes(label_codes, label_ids)
+
+    scores_by_point = dict()
+    for point_id, point_scores in groupby(scores, key=lambda s: s[0]):
+        scores_by_point[point_id] = [
+            {'label': label_codes[label_id], 'score': score}
+            for _, label_id, score in point_scores
+        ]
 
-    # One image at a time.
-    for image in image_set:
+    for image in images:
 
-        # Order image annotations by point number.
-        for annotation in image.annotation_set.order_by('point__point_number'):
+        # Annotations are ordered by point number.
+        for annotation in annotations_by_image.get(image.pk, []):
 
             # One row per annotation.
             row = {
                 "Name": image.metadata.name,
-                "Row": annotation.point.row,
-                "Column": annotation.point.column,
-                "Label": annotation.label_code,
+                "Row": annotation['point__row'],
+                "Column": annotation['point__column'],
+                "Label": label_codes[annotation['label_id']],
             }
 
             if 'annotator_info' in optional_columns:
                 # Truncate date precision at seconds
-                date_annotated = annotation.annotation_date.replace(
+                date_annotated = annotation['annotation_date'].replace(
                     microsecond=0)
                 row.update({
-                    "Annotator": annotation.user.username,
+                    "Annotator": annotation['user__username'],
                     "Date annotated": date_annotated,
                 })
 
             if 'machine_suggestions' in optional_columns:
-                label_scores = get_label_scores_for_point(
-                    annotation.point, ordered=True)
+                label_scores = scores_by_point.get(annotation['point_id'], [])
                 for i in range(settings.NBR_SCORES_PER_ANNOTATION):
                     try:
                         score = label_scores[i]
@@ -3,6 +3,7 @@ import collections
 import csv
 from io import BytesIO, StringIO
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.exceptions import ValidationError
@@ -17,13 +18,16 @@ from django.views import View
 import pyexcel
 
 from annotations.model_utils import ImageAnnoStatuses
+from annotations.models import ImageLabelCoverage
 from images.models import Source
 from images.utils import metadata_field_names_to_labels
 from lib.decorators import source_visibility_required
 from lib.forms import get_one_form_error
+from lib.utils import chunked
 from .forms import ExportAnnotationsForm, ExportImageCoversForm
 from .utils import (
     create_csv_stream_response,
+    create_csv_streaming_response,
     create_stream_response,
     get_request_images,
     write_annotations_csv,
@@ -206,38 +210,47 @@ class ImageStatsExportView(SourceCsvExportView, ABC):
         image_set = image_set.exclude(
             annoinfo__status=ImageAnnoStatuses.UNCLASSIFIED.value)
 
-        # One row per image
-        for image in image_set \
-                .select_related('annoinfo', 'features', 'metadata') \
-                .annotate(num_points=Count('point')):
-
-            num_annotated_images += 1
-
-            # Counter for annotations of each label. Initialize by giving each
-            # label a 0 count.
-            label_counter = collections.Counter({
-                label_id: 0
-                for label_id in self.label_ids_to_displays.keys()
-            })
-
-            # This runs one database query per image, but there doesn't seem to
-            # be a way to avoid that without blowing up the export's memory
-            # requirements (i.e. loading all annotations at once).
-            annotation_labels = image.annotation_set.values_list(
-                'label_id', flat=True)
-            annotation_labels = [pk for pk in annotation_labels]
-            label_counter.update(annotation_labels)
-            num_annotations_in_image = len(annotation_labels)
-
-            row = {
-                "Image ID": image.pk,
-                "Image name": image.metadata.name,
-                "Annotation status": image.annoinfo.status_display,
-                "Points": image.num_points,
-            }
-            row = self.image_loop_main_body(
-                row, label_counter, num_annotations_in_image)
-            writer.writerow(row)
+        # One row per image. Images are processed in chunks, with the label
+        # counts of each chunk fetched in one query.
+        images = (
+            image_set
+            .select_related('annoinfo', 'metadata')
+            .annotate(num_points=Count('point'))
+            .iterator(chunk_size=settings.EXPORT_IMAGE_CHUNK_SIZE)
+        )
+        for image_chunk in chunked(images, settings.EXPORT_IMAGE_CHUNK_SIZE):
+
+            label_counts_by_image = collections.defaultdict(dict)
+            for image_id, label_id, count in (
+                ImageLabelCoverage.objects
+                .filter(image_id__in=[image.pk for image in image_chunk])
+                .values_list('image_id', 'label_id', 'annotation_count')
+            ):
+                label_counts_by_image[image_id][label_id] = count
+
+            for image in image_chunk:
+
+                num_annotated_images += 1
+
+                # Counter for annotations of each label. Initialize by
+                # giving each label a 0 count.
+                label_counter = collections.Counter({
+                    label_id: 0
+                    for label_id in self.label_ids_to_displays.keys()
+                })
+                image_label_counts = label_counts_by_image[image.pk]
+                label_counter.update(image_label_counts)
+                num_annotations_in_image = sum(image_label_counts.values())
+
+                row = {
+                    "Image ID": image.pk,
+                    "Image name": image.metadata.name,
+                    "Annotation status": image.annoinfo.status_display,
+                    "Points": image.num_points,
+                }
+                row = self.image_loop_main_body(
+                    row, label_counter, num_annotations_in_image)
+                writer.writerow(row)
 
         if num_annotated_images > 1:
 
@@ -310,13 +323,12 @@ def export_annotations(request, source_id):
         return HttpResponseRedirect(
             reverse('browse_images', args=[source_id]))
 
-    response = create_csv_stream_response('annotations.csv')
-
-    write_annotations_csv(
-        response, source, image_set,
-        export_annotations_form.cleaned_data['optional_columns'])
-
-    return response
+    return create_csv_streaming_response(
+        'annotations.csv',
+        write_annotations_csv(
+            source, image_set,
+            export_annotations_form.cleaned_data['optional_columns']),
+    )
 
 
 class ImageCoversExportView(ImageStatsExportView):
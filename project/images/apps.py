@@ -0,0 +1,34 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_save
+
+
+def invalidate_indexes_on_image_upload(sender, instance, created, **kwargs):
+    from .utils import invalidate_image_order_indexes
+    if created:
+        invalidate_image_order_indexes(instance.source_id)
+
+
+def invalidate_indexes_on_metadata_edit(sender, instance, **kwargs):
+    from .models import Image
+    from .utils import invalidate_image_order_indexes
+    # A newly created Metadata has no Image yet; that case is covered
+    # when the Image is created.
+    for source_id in Image.objects.filter(
+            metadata=instance).values_list('source_id', flat=True):
+        invalidate_image_order_indexes(source_id)
+
+
+class ImagesConfig(AppConfig):
+    name = 'images'
+
+    def ready(self):
+        post_save.connect(
+            invalidate_indexes_on_image_upload,
+            sender=self.get_model('Image'),
+            dispatch_uid='invalidate_indexes_on_image_upload',
+        )
+        post_save.connect(
+            invalidate_indexes_on_metadata_edit,
+            sender=self.get_model('Metadata'),
+            dispatch_uid='invalidate_indexes_on_metadata_edit',
+        )
@@ -0,0 +1,61 @@
+import csv
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from images.storage_audit import StorageAudit
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Compare media storage against the database. Reports files the"
+        " database references but storage doesn't have (missing), and"
+        " files which nothing in the database references (orphaned)."
+        " Covers original images, feature vectors, classifier models and"
+        " valresults, and point patches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=None,
+            help="Number of threads to list storage with."
+                 " Defaults to the STORAGE_AUDIT_THREADS setting.")
+        parser.add_argument(
+            '--csv', type=str, default=None,
+            help="Path of the CSV report to write. Defaults to"
+                 " tmp/storage_audit.csv in the site directory.")
+
+    def handle(self, *args, **options):
+        csv_filepath = options['csv'] or os.path.join(
+            settings.SITE_DIR, 'tmp', 'storage_audit.csv')
+        audit = StorageAudit(threads=options['threads'])
+
+        self.stdout.write(
+            "Auditing storage. This could take a while...")
+
+        issue_count = 0
+        with open(csv_filepath, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Category", "Problem", "Filepath", "Object id"])
+
+            for issue in audit.run():
+                writer.writerow([
+                    issue.category, issue.problem, issue.key,
+                    issue.object_id])
+                issue_count += 1
+                if issue_count % 1000 == 0:
+                    self.stdout.write(f"({issue_count} issues so far)")
+
+        for category, counts in sorted(audit.counts.items()):
+            self.stdout.write(
+                f"{category}: {counts['files']} files, {counts['rows']} rows,"
+                f" {counts['missing']} missing, {counts['orphaned']} orphaned")
+
+        if issue_count == 0:
+            self.stdout.write(self.style.SUCCESS(
+                "No missing or orphaned files found."))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f"Found {issue_count} missing or orphaned files. A CSV of"
+                f" these was created at: {csv_filepath}"))
@@ -37,13 +37,27 @@ class ImageQuerySet(models.QuerySet):
         """Only images without feature vectors available."""
         return self.filter(features__extracted=False)
 
+    def not_pending_deletion(self):
+        """
+        Exclude images which have been marked for deletion, but haven't
+        been deleted by the delete_source_images job yet.
+        """
+        return self.filter(pending_deletion__isnull=True)
+
 
 class PointQuerySet(models.QuerySet):
 
-    def delete(self):
-        """Batch-delete Points."""
+    def delete(self, update_progress_fields=True):
+        """
+        Batch-delete Points. Pass update_progress_fields=False if the
+        caller updates the images' annotation progress fields itself,
+        such as after replacing the points.
+        """
         from .models import Image
 
+        if not update_progress_fields:
+            return super().delete()
+
         # Get all the images corresponding to these points.
         images = Image.objects.filter(point__in=self).distinct()
         # Evaluate the queryset before deleting the points.
@@ -56,13 +70,14 @@ class PointQuerySet(models.QuerySet):
 
         return return_values
 
-    def bulk_create(self, *args, **kwargs):
+    def bulk_create(self, *args, update_progress_fields=True, **kwargs):
         from .models import Image
 
         new_points = super().bulk_create(*args, **kwargs)
 
-        images = Image.objects.filter(point__in=new_points).distinct()
-        for image in images:
-            image.annoinfo.update_annotation_progress_fields()
+        if update_progress_fields:
+            images = Image.objects.filter(point__in=new_points).distinct()
+            for image in images:
+                image.annoinfo.update_annotation_progress_fields()
 
         return new_points
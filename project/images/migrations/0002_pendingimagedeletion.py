@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0001_squashed_0033_remove_image_annotation_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingImageDeletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_date', models.DateTimeField(auto_now_add=True)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_deletion', to='images.image')),
+                ('source', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='images.source')),
+            ],
+        ),
+    ]
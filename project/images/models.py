@@ -411,16 +411,32 @@ class Source(models.Model):
             return False, "Source has classifier disabled"
 
         nbr_confirmed_images_with_features = (
-            self.image_set.confirmed().with_features().count()
+            self.image_set.not_pending_deletion().confirmed()
+            .with_features().count()
         )
-        if (nbr_confirmed_images_with_features
-                < settings.TRAINING_MIN_IMAGES):
-            return False, "Not enough annotated images for initial training"
-
         try:
             latest_classifier_attempt = self.classifier_set.exclude(
                 status=Classifier.TRAIN_PENDING).latest('pk')
         except Classifier.DoesNotExist:
+            latest_classifier_attempt = None
+
+        return self.need_new_robot_from_stats(
+            nbr_confirmed_images_with_features, latest_classifier_attempt)
+
+    @staticmethod
+    def need_new_robot_from_stats(
+            nbr_confirmed_images_with_features: int,
+            latest_classifier_attempt: Classifier | None) -> Tuple[bool, str]:
+        """
+        need_new_robot() for an enabled-classifier source, given already
+        computed stats. This lets callers which look at many sources at
+        once compute the stats in bulk.
+        """
+        if (nbr_confirmed_images_with_features
+                < settings.TRAINING_MIN_IMAGES):
+            return False, "Not enough annotated images for initial training"
+
+        if latest_classifier_attempt is None:
             return True, "No classifier yet"
 
         if latest_classifier_attempt.status == Classifier.TRAIN_ERROR:
@@ -770,6 +786,19 @@ class Image(models.Model):
             self.process_date.day)
 
 
+class PendingImageDeletion(models.Model):
+    """
+    An image which has been requested for deletion. The
+    delete_source_images job deletes these images in the background,
+    along with their storage files.
+    """
+    image = models.OneToOneField(
+        Image, on_delete=models.CASCADE, related_name='pending_deletion')
+    source = models.ForeignKey(
+        Source, on_delete=models.CASCADE, editable=False)
+    request_date = models.DateTimeField(auto_now_add=True)
+
+
 class Point(models.Model):
     objects = PointQuerySet.as_manager()
 
@@ -828,8 +857,10 @@ class Point(models.Model):
 
         super().save(*args, **kwargs)
 
-        # The image's annotation status may need updating.
-        self.image.annoinfo.update_annotation_progress_fields()
+        # The image's annotation status may need updating. Saving a point
+        # doesn't change which labels are annotated, though.
+        self.image.annoinfo.update_annotation_progress_fields(
+            label_coverages=False)
 
     def delete(self, *args, **kwargs):
         return_values = super().delete(*args, **kwargs)
@@ -0,0 +1,554 @@
+"""
+Storage audit: compare the files in media storage against the database rows
+which reference them. Files which the database expects but storage doesn't
+have are reported as missing; files which no row references are reported
+as orphaned.
+
+Storage is listed page by page in sorted key order (the order S3 lists in),
+and each kind of file is compared against database rows streamed in the
+same order from a server-side cursor. So memory use doesn't grow with the
+number of files. Listings are split into key ranges (shards) which are
+fetched concurrently, since listing is the slow part on S3.
+"""
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+import posixpath
+import queue
+import re
+from string import ascii_lowercase, digits, Formatter
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.db.models import (
+    BooleanField, CharField, ExpressionWrapper, F, Q, Value)
+from django.db.models.functions import Cast, Collate, Concat
+
+from lib.storage_backends import MediaStorageS3
+from vision_backend.models import Classifier
+from .models import Image, Point
+
+# S3 returns at most 1000 keys per listing request.
+LISTING_PAGE_SIZE = 1000
+# Rows fetched per round trip from a server-side cursor.
+DB_CHUNK_SIZE = 2000
+# Pages each shard's lister may fetch ahead of the comparison.
+PREFETCH_PAGES = 50
+
+MISSING = 'missing'
+ORPHANED = 'orphaned'
+
+# Image filenames are random lowercase alphanumeric strings (see
+# lib.utils.rand_string()), so shards are split along these characters.
+SHARD_ALPHABET = digits + ascii_lowercase
+
+
+@dataclass
+class AuditIssue:
+    category: str
+    problem: str
+    key: str
+    object_id: Optional[int] = None
+
+
+class StorageLister:
+    """
+    Lists keys (paths relative to the storage root) which start with a
+    prefix, in sorted order, one page at a time.
+    """
+    def __init__(self, storage, page_size=LISTING_PAGE_SIZE):
+        self.storage = storage
+        self.page_size = page_size
+
+    def list_pages(self, prefix, start_after=None):
+        raise NotImplementedError
+
+    def iter_pages(self, prefix, start_after=None, end_at=None):
+        """
+        List keys which start with prefix, come after start_after, and
+        come no later than end_at.
+        """
+        for page in self.list_pages(prefix, start_after=start_after):
+            if end_at is not None and page and page[-1] > end_at:
+                yield [key for key in page if key <= end_at]
+                return
+            yield page
+
+
+class S3StorageLister(StorageLister):
+
+    def __init__(self, storage, **kwargs):
+        super().__init__(storage, **kwargs)
+        # Bucket keys are the storage location (like `media/`) followed by
+        # the name relative to the storage root.
+        self.key_prefix = storage._normalize_name('a')[:-1]
+
+    def list_pages(self, prefix, start_after=None):
+        # The storage's boto3 connection is per-thread, so this is safe
+        # to call from multiple threads.
+        client = self.storage.connection.meta.client
+        kwargs = dict(
+            Bucket=self.storage.bucket_name,
+            Prefix=self.key_prefix + prefix,
+            PaginationConfig=dict(PageSize=self.page_size),
+        )
+        if start_after is not None:
+            kwargs['StartAfter'] = self.key_prefix + start_after
+
+        prefix_length = len(self.key_prefix)
+        for response in client.get_paginator('list_objects_v2').paginate(
+                **kwargs):
+            yield [
+                obj['Key'][prefix_length:]
+                for obj in response.get('Contents', [])
+            ]
+
+
+class LocalStorageLister(StorageLister):
+    """
+    Filesystem counterpart of S3StorageLister, with the same paging
+    behavior. Used for local development and tests.
+    """
+    def list_pages(self, prefix, start_after=None):
+        root = self.storage.location
+        directory = posixpath.dirname(prefix)
+
+        keys = []
+        for dirpath, _, filenames in os.walk(os.path.join(root, directory)):
+            relative_dir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+            for filename in filenames:
+                if relative_dir == '.':
+                    key = filename
+                else:
+                    key = posixpath.join(relative_dir, filename)
+                if not key.startswith(prefix):
+                    continue
+                if start_after is not None and key <= start_after:
+                    continue
+                keys.append(key)
+        keys.sort()
+
+        for index in range(0, len(keys), self.page_size):
+            yield keys[index:index+self.page_size]
+
+
+def get_storage_lister(storage, **kwargs):
+    if isinstance(storage, MediaStorageS3):
+        return S3StorageLister(storage, **kwargs)
+    if isinstance(storage, FileSystemStorage):
+        return LocalStorageLister(storage, **kwargs)
+    raise ValueError(
+        f"Don't know how to list storage of type {type(storage).__name__}")
+
+
+def pattern_regex(pattern, **field_regexes):
+    """
+    Regex which matches keys formatted from a filepath pattern, such as
+    settings.ROBOT_MODEL_FILE_PATTERN, capturing the pattern's fields.
+    """
+    parts = []
+    for literal, field, _, _ in Formatter().parse(pattern):
+        parts.append(re.escape(literal))
+        if field is not None:
+            parts.append(f'(?P<{field}>{field_regexes.get(field, ".+")})')
+    return re.compile(''.join(parts) + '$')
+
+
+def pattern_expression(pattern, **field_expressions):
+    """
+    Database expression which formats a filepath pattern from field
+    expressions. Collated bytewise, so that ordering by it matches the
+    order storage keys are listed in.
+    """
+    parts = []
+    for literal, field, _, _ in Formatter().parse(pattern):
+        if literal:
+            parts.append(Value(literal))
+        if field is not None:
+            parts.append(field_expressions[field])
+    if len(parts) == 1:
+        expression = parts[0]
+    else:
+        expression = Concat(*parts, output_field=CharField())
+    return Collate(expression, 'C')
+
+
+class Category:
+    """
+    A kind of file in storage. Keys under the listing prefix which match
+    key_regex belong to the category; a key_regex of None matches any key
+    not claimed by the listing's other categories.
+    """
+    def __init__(self, name, key_regex=None):
+        self.name = name
+        self.key_regex = key_regex
+
+    def get_checker(self, audit, prefix, start_after, end_at):
+        raise NotImplementedError
+
+
+class UnauditedCategory(Category):
+    """Files we recognize but don't check, such as image thumbnails."""
+    def get_checker(self, audit, prefix, start_after, end_at):
+        return UnauditedChecker(self, audit)
+
+
+class SortedMergeCategory(Category):
+    """
+    Files which correspond one-to-one with database rows. Each row's
+    expected key is computed in the database, so that rows can be
+    streamed in key order and merged against the storage listing.
+    """
+    def __init__(
+            self, name, key_regex, queryset, key_expression,
+            required_q=None):
+        super().__init__(name, key_regex)
+        self.queryset = queryset
+        self.key_expression = key_expression
+        # Rows not matching this are allowed to have no file.
+        self.required_q = required_q
+
+    def get_rows(self, prefix, start_after=None, end_at=None):
+        """
+        (key, object_id, required) tuples for the rows whose keys fall in
+        the given range, in key order.
+        """
+        if self.required_q is None:
+            required = Value(True)
+        else:
+            required = ExpressionWrapper(
+                self.required_q, output_field=BooleanField())
+
+        rows = self.queryset.annotate(
+            audit_key=self.key_expression, audit_required=required,
+        ).filter(audit_key__startswith=prefix)
+        if start_after is not None:
+            rows = rows.filter(audit_key__gt=start_after)
+        if end_at is not None:
+            rows = rows.filter(audit_key__lte=end_at)
+
+        return (
+            rows.order_by('audit_key')
+            .values_list('audit_key', 'pk', 'audit_required')
+            # On PostgreSQL, this uses a server-side cursor.
+            .iterator(chunk_size=DB_CHUNK_SIZE)
+        )
+
+    def get_checker(self, audit, prefix, start_after, end_at):
+        return SortedMergeChecker(
+            self, audit, self.get_rows(prefix, start_after, end_at))
+
+
+class PatchCategory(Category):
+    """
+    Point patches are generated on demand, so a missing patch isn't a
+    problem; we only look for orphaned patches. Rather than streaming all
+    points, we look up the points named by each chunk of patch keys.
+    """
+    def get_checker(self, audit, prefix, start_after, end_at):
+        return PatchChecker(self, audit)
+
+
+class Checker:
+    """Checks a category's keys from one shard of a listing."""
+    def __init__(self, category, audit):
+        self.category = category
+        self.audit = audit
+
+    def check(self, key):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class UnauditedChecker(Checker):
+
+    def check(self, key):
+        self.audit.count(self.category, 'files')
+
+
+class SortedMergeChecker(Checker):
+
+    def __init__(self, category, audit, rows):
+        super().__init__(category, audit)
+        self.rows = iter(rows)
+        self.row = None
+        self._advance()
+
+    def _advance(self):
+        self.row = next(self.rows, None)
+        if self.row is not None:
+            self.audit.count(self.category, 'rows')
+
+    def _skip_row(self):
+        key, object_id, required = self.row
+        if required:
+            self.audit.report(self.category, MISSING, key, object_id)
+        self._advance()
+
+    def check(self, key):
+        self.audit.count(self.category, 'files')
+
+        while self.row is not None and self.row[0] < key:
+            self._skip_row()
+
+        if self.row is not None and self.row[0] == key:
+            # More than one row may reference the same file.
+            while self.row is not None and self.row[0] == key:
+                self._advance()
+        else:
+            self.audit.report(self.category, ORPHANED, key)
+
+    def finish(self):
+        while self.row is not None:
+            self._skip_row()
+
+
+class PatchChecker(Checker):
+
+    def __init__(self, category, audit):
+        super().__init__(category, audit)
+        self.pending = []
+
+    def check(self, key):
+        self.audit.count(self.category, 'files')
+        match = self.category.key_regex.match(key)
+        self.pending.append(
+            (key, int(match.group('point_pk')),
+             match.group('full_image_path')))
+        if len(self.pending) >= DB_CHUNK_SIZE:
+            self.finish()
+
+    def finish(self):
+        image_paths = dict(
+            Point.objects.filter(
+                pk__in=[point_pk for _, point_pk, _ in self.pending])
+            .values_list('pk', 'image__original_file')
+        )
+        for key, point_pk, image_path in self.pending:
+            if image_paths.get(point_pk) != image_path:
+                self.audit.report(self.category, ORPHANED, key, point_pk)
+        self.pending = []
+
+
+@dataclass
+class Listing:
+    prefix: str
+    categories: list
+    sharded: bool = False
+
+    def get_category(self, key):
+        for category in self.categories:
+            if category.key_regex is None or category.key_regex.match(key):
+                return category
+        return None
+
+    def get_shards(self, count):
+        """
+        Split the listing into contiguous key ranges, as
+        (start_after, end_at) pairs, in key order.
+        """
+        if not self.sharded or count <= 1:
+            return [(None, None)]
+        boundaries = sorted(set(
+            self.prefix + SHARD_ALPHABET[
+                index * len(SHARD_ALPHABET) // count]
+            for index in range(1, count)
+        ))
+        return list(zip([None] + boundaries, boundaries + [None]))
+
+
+def get_listings():
+    images_prefix = posixpath.dirname(settings.IMAGE_FILE_PATTERN) + '/'
+    # Differs from images_prefix only if the patterns are changed.
+    classifiers_prefix = \
+        posixpath.dirname(settings.ROBOT_MODEL_FILE_PATTERN) + '/'
+
+    original_path = Collate(F('original_file'), 'C')
+    pk_string = Cast('pk', output_field=CharField())
+
+    return [
+        Listing(
+            prefix=images_prefix,
+            sharded=True,
+            categories=[
+                PatchCategory(
+                    'patches',
+                    pattern_regex(
+                        settings.POINT_PATCH_FILE_PATTERN,
+                        point_pk=r'\d+'),
+                ),
+                SortedMergeCategory(
+                    'feature vectors',
+                    pattern_regex(settings.FEATURE_VECTOR_FILE_PATTERN),
+                    Image.objects.all(),
+                    pattern_expression(
+                        settings.FEATURE_VECTOR_FILE_PATTERN,
+                        full_image_path=F('original_file')),
+                    required_q=Q(features__extracted=True),
+                ),
+                # easy-thumbnails names, like
+                # `<original>.150x150_q85.jpg`. Those are checked (and
+                # regenerated) by easy-thumbnails itself.
+                UnauditedCategory(
+                    'thumbnails',
+                    re.compile(r'.+\.\d+x\d+(_[^./]*)*\.\w+$'),
+                ),
+                SortedMergeCategory(
+                    'originals', None, Image.objects.all(), original_path),
+            ],
+        ),
+        Listing(
+            prefix=classifiers_prefix,
+            categories=[
+                SortedMergeCategory(
+                    'classifier models',
+                    pattern_regex(
+                        settings.ROBOT_MODEL_FILE_PATTERN, pk=r'\d+'),
+                    Classifier.objects.all(),
+                    pattern_expression(
+                        settings.ROBOT_MODEL_FILE_PATTERN, pk=pk_string),
+                    required_q=Q(status=Classifier.ACCEPTED),
+                ),
+                SortedMergeCategory(
+                    'classifier valresults',
+                    pattern_regex(
+                        settings.ROBOT_MODEL_VALRESULT_PATTERN, pk=r'\d+'),
+                    Classifier.objects.all(),
+                    pattern_expression(
+                        settings.ROBOT_MODEL_VALRESULT_PATTERN, pk=pk_string),
+                    required_q=Q(status=Classifier.ACCEPTED),
+                ),
+                # Train/val data and anything else.
+                UnauditedCategory('other classifier files'),
+            ],
+        ),
+    ]
+
+
+class _ListingAborted(Exception):
+    pass
+
+
+class StorageAudit:
+    """
+    Usage:
+    audit = StorageAudit()
+    for issue in audit.run():
+        ...
+    Then audit.counts has per-category totals.
+    """
+    def __init__(self, storage=None, lister=None, threads=None):
+        self.storage = storage or get_storage_class()()
+        self.lister = lister or get_storage_lister(self.storage)
+        self.threads = threads or settings.STORAGE_AUDIT_THREADS
+        self.counts = defaultdict(Counter)
+        self._issues = []
+
+    def count(self, category, what):
+        self.counts[category.name][what] += 1
+
+    def report(self, category, problem, key, object_id=None):
+        self.counts[category.name][problem] += 1
+        self._issues.append(AuditIssue(category.name, problem, key, object_id))
+
+    def _list_shard(self, pages, prefix, start_after, end_at, stop):
+        def put(item):
+            while True:
+                if stop.is_set():
+                    raise _ListingAborted
+                try:
+                    pages.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            for page in self.lister.iter_pages(
+                    prefix, start_after=start_after, end_at=end_at):
+                put(page)
+        except _ListingAborted:
+            return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    @staticmethod
+    def _iter_queued_pages(pages):
+        while True:
+            page = pages.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+
+    def run(self):
+        """
+        Generator of AuditIssues, yielded as each shard finishes.
+
+        Listing runs in worker threads, while the database comparison
+        stays in the calling thread (and thus on its DB connection and
+        transaction).
+        """
+        listings = get_listings()
+        stop = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            shards = []
+            # Shards are submitted in the order they're consumed, so the
+            # shard being consumed always has a running lister.
+            for listing in listings:
+                for start_after, end_at in listing.get_shards(self.threads):
+                    pages = queue.Queue(maxsize=PREFETCH_PAGES)
+                    executor.submit(
+                        self._list_shard, pages, listing.prefix,
+                        start_after, end_at, stop)
+                    shards.append((listing, start_after, end_at, pages))
+
+            try:
+                for listing, start_after, end_at, pages in shards:
+                    self._audit_shard(
+                        listing, start_after, end_at,
+                        self._iter_queued_pages(pages))
+                    yield from self._issues
+                    self._issues = []
+            finally:
+                stop.set()
+
+        yield from self._check_unlisted_originals(listings[0].prefix)
+        self._issues = []
+
+    def _audit_shard(self, listing, start_after, end_at, pages):
+        checkers = dict()
+        for category in listing.categories:
+            checkers[category] = category.get_checker(
+                self, listing.prefix, start_after, end_at)
+
+        for page in pages:
+            for key in page:
+                category = listing.get_category(key)
+                checkers[category].check(key)
+
+        for checker in checkers.values():
+            checker.finish()
+
+    def _check_unlisted_originals(self, images_prefix):
+        # Images whose files are outside of the images directory won't
+        # show up in any listing. There shouldn't be any, but check each
+        # one individually if so.
+        category = Category('originals')
+        unlisted_images = (
+            Image.objects.exclude(original_file__startswith=images_prefix)
+            .values_list('pk', 'original_file')
+        )
+        for image_id, path in unlisted_images.iterator():
+            self.count(category, 'rows')
+            if not path or not self.storage.exists(path):
+                self.report(category, MISSING, path, image_id)
+        return self._issues
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import transaction
+
+from jobs.utils import job_runner
+from .models import Image, PendingImageDeletion
+from .utils import (
+    delete_images,
+    delete_storage_files,
+    get_image_storage_paths,
+    pop_image_thumbnail_paths,
+)
+
+
+def source_has_pending_deletions(source_id):
+    return PendingImageDeletion.objects.filter(source_id=source_id).exists()
+
+
+@job_runner(
+    job_name='delete_source_images',
+    has_more_work=source_has_pending_deletions)
+def delete_source_images(source_id):
+    """
+    Delete the source's images which are marked for deletion, along with
+    their storage files. Images are deleted in chunks, so that progress is
+    committed (and visible) as we go.
+    """
+    deleted_count = 0
+    failed_file_count = 0
+
+    while True:
+        image_ids = list(
+            PendingImageDeletion.objects.filter(source_id=source_id)
+            .order_by('image_id')
+            .values_list('image_id', flat=True)
+            [:settings.IMAGE_DELETION_CHUNK_SIZE]
+        )
+        if not image_ids:
+            break
+
+        paths = get_image_storage_paths(image_ids)
+        original_names = list(
+            Image.objects.filter(pk__in=image_ids)
+            .values_list('original_file', flat=True))
+
+        with transaction.atomic():
+            deleted_count += delete_images(
+                Image.objects.filter(pk__in=image_ids))
+            paths += pop_image_thumbnail_paths(original_names)
+
+        # Only delete files once the database deletions are committed.
+        failed_file_count += delete_storage_files(paths)
+
+    message = f"Deleted {deleted_count} image(s)"
+    if failed_file_count:
+        message += (
+            f"; {failed_file_count} storage file(s) couldn't be deleted")
+    return message
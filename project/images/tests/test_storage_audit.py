@@ -0,0 +1,168 @@
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from lib.storage_backends import MediaStorageLocal
+from lib.tests.utils import ClientTest
+from vision_backend.models import Classifier, Features
+from ..storage_audit import (
+    LocalStorageLister, MISSING, ORPHANED, StorageAudit)
+
+
+class FakeStorageMixin:
+    """
+    Audits a throwaway local storage directory instead of the real test
+    storage, so that each test controls exactly which files exist.
+    """
+    def setUp(self):
+        super().setUp()
+        storage_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_dir)
+        self.storage = MediaStorageLocal(location=storage_dir)
+
+    def add_files(self, *names):
+        for name in names:
+            self.storage.save(name, ContentFile(b'x'))
+
+    def run_audit(self, **kwargs):
+        lister = LocalStorageLister(self.storage, page_size=2)
+        audit = StorageAudit(storage=self.storage, lister=lister, **kwargs)
+        issues = set(
+            (issue.category, issue.problem, issue.key)
+            for issue in audit.run()
+        )
+        return audit, issues
+
+
+class StorageAuditTest(FakeStorageMixin, ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(cls.user)
+        cls.image_1 = cls.upload_image(cls.user, cls.source)
+        cls.image_2 = cls.upload_image(cls.user, cls.source)
+        Features.objects.filter(image=cls.image_1).update(extracted=True)
+
+    def test_all_present(self):
+        self.add_files(
+            self.image_1.original_file.name,
+            settings.FEATURE_VECTOR_FILE_PATTERN.format(
+                full_image_path=self.image_1.original_file.name),
+            self.image_2.original_file.name,
+        )
+        audit, issues = self.run_audit()
+
+        self.assertSetEqual(issues, set())
+        self.assertEqual(audit.counts['originals']['files'], 2)
+        self.assertEqual(audit.counts['originals']['rows'], 2)
+        self.assertEqual(audit.counts['feature vectors']['files'], 1)
+
+    def test_missing_files(self):
+        self.add_files(self.image_2.original_file.name)
+        _, issues = self.run_audit()
+
+        feature_path = settings.FEATURE_VECTOR_FILE_PATTERN.format(
+            full_image_path=self.image_1.original_file.name)
+        self.assertSetEqual(issues, {
+            ('originals', MISSING, self.image_1.original_file.name),
+            # Image 2 doesn't have extracted features, so it's not
+            # expected to have a feature vector.
+            ('feature vectors', MISSING, feature_path),
+        })
+
+    def test_orphaned_files(self):
+        point = self.image_1.point_set.first()
+        self.add_files(
+            self.image_1.original_file.name,
+            self.image_2.original_file.name,
+            # These sort before and after all image names, so they end up
+            # in the first and last shards.
+            'images/0orphan.png',
+            'images/zorphan.png',
+            'images/zorphan.png.featurevector',
+            # Features not extracted, but that's not an orphan.
+            settings.FEATURE_VECTOR_FILE_PATTERN.format(
+                full_image_path=self.image_2.original_file.name),
+            settings.POINT_PATCH_FILE_PATTERN.format(
+                full_image_path=self.image_1.original_file.name,
+                point_pk=point.pk),
+            settings.POINT_PATCH_FILE_PATTERN.format(
+                full_image_path=self.image_2.original_file.name,
+                point_pk=point.pk),
+            # Thumbnails aren't audited.
+            self.image_1.original_file.name + '.150x150_q85.jpg',
+        )
+        audit, issues = self.run_audit(threads=3)
+
+        feature_path = settings.FEATURE_VECTOR_FILE_PATTERN.format(
+            full_image_path=self.image_1.original_file.name)
+        self.assertSetEqual(issues, {
+            ('originals', ORPHANED, 'images/0orphan.png'),
+            ('originals', ORPHANED, 'images/zorphan.png'),
+            ('feature vectors', ORPHANED, 'images/zorphan.png.featurevector'),
+            ('feature vectors', MISSING, feature_path),
+            ('patches', ORPHANED, settings.POINT_PATCH_FILE_PATTERN.format(
+                full_image_path=self.image_2.original_file.name,
+                point_pk=point.pk)),
+        })
+        self.assertEqual(audit.counts['patches']['files'], 2)
+        self.assertEqual(audit.counts['thumbnails']['files'], 1)
+
+    def test_classifier_files(self):
+        accepted = Classifier(source=self.source, status=Classifier.ACCEPTED)
+        accepted.save()
+        rejected = Classifier(
+            source=self.source, status=Classifier.REJECTED_ACCURACY)
+        rejected.save()
+        self.add_files(
+            self.image_1.original_file.name,
+            settings.FEATURE_VECTOR_FILE_PATTERN.format(
+                full_image_path=self.image_1.original_file.name),
+            self.image_2.original_file.name,
+            settings.ROBOT_MODEL_FILE_PATTERN.format(pk=accepted.pk),
+            # Rejected classifiers may or may not have files.
+            settings.ROBOT_MODEL_FILE_PATTERN.format(pk=rejected.pk),
+            settings.ROBOT_MODEL_TRAINDATA_PATTERN.format(pk=accepted.pk),
+            # No such classifier.
+            settings.ROBOT_MODEL_VALRESULT_PATTERN.format(
+                pk=rejected.pk + 1000),
+        )
+        audit, issues = self.run_audit()
+
+        self.assertSetEqual(issues, {
+            ('classifier valresults', MISSING,
+             settings.ROBOT_MODEL_VALRESULT_PATTERN.format(pk=accepted.pk)),
+            ('classifier valresults', ORPHANED,
+             settings.ROBOT_MODEL_VALRESULT_PATTERN.format(
+                 pk=rejected.pk + 1000)),
+        })
+        self.assertEqual(audit.counts['classifier models']['files'], 2)
+        self.assertEqual(audit.counts['other classifier files']['files'], 1)
+
+
+class AuditStorageCommandTest(ClientTest):
+
+    def test_report(self):
+        user = self.create_user()
+        source = self.create_source(user)
+        self.upload_image(user, source)
+
+        csv_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, csv_dir)
+        stdout = StringIO()
+        call_command(
+            'audit_storage', csv=os.path.join(csv_dir, 'audit.csv'),
+            stdout=stdout)
+        stdout_text = stdout.getvalue()
+
+        # The uploaded image's file is in the test storage.
+        self.assertIn(
+            "originals: 1 files, 1 rows, 0 missing, 0 orphaned", stdout_text)
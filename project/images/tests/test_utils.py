@@ -0,0 +1,230 @@
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from annotations.models import Annotation
+from lib.tests.utils import ClientTest
+from ..models import Image
+from ..utils import (
+    delete_images,
+    get_image_order_index,
+    get_image_order_placement,
+    get_next_image,
+    get_prev_image,
+    ImageNameMatcher,
+)
+
+
+class ImageOrderIndexTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(cls.user)
+
+        cls.images = []
+        for name in ['3.png', '1.png', '4.png', '2.png']:
+            image = cls.upload_image(cls.user, cls.source)
+            image.metadata.name = name
+            image.metadata.save()
+            cls.images.append(image)
+        cls.img3, cls.img1, cls.img4, cls.img2 = cls.images
+
+    def image_set(self):
+        return self.source.image_set.order_by('metadata__name', 'pk')
+
+    def test_navigation(self):
+        self.assertEqual(
+            get_next_image(self.img2, self.image_set()).pk, self.img3.pk)
+        self.assertEqual(
+            get_prev_image(self.img2, self.image_set()).pk, self.img1.pk)
+        self.assertEqual(
+            get_image_order_placement(self.img2, self.image_set()), 2)
+
+    def test_wrap(self):
+        self.assertIsNone(get_next_image(self.img4, self.image_set()))
+        self.assertEqual(
+            get_next_image(self.img4, self.image_set(), wrap=True).pk,
+            self.img1.pk)
+        self.assertIsNone(get_prev_image(self.img1, self.image_set()))
+        self.assertEqual(
+            get_prev_image(self.img1, self.image_set(), wrap=True).pk,
+            self.img4.pk)
+
+    def test_current_image_not_in_results(self):
+        image_set = self.image_set().exclude(pk=self.img2.pk)
+        self.assertEqual(
+            get_next_image(self.img2, image_set).pk, self.img3.pk)
+        self.assertEqual(
+            get_prev_image(self.img2, image_set).pk, self.img1.pk)
+        self.assertEqual(get_image_order_placement(self.img2, image_set), 2)
+
+    def test_cached(self):
+        get_image_order_index(self.image_set(), self.source.pk)
+
+        with CaptureQueriesContext(connection) as context:
+            index = get_image_order_index(self.image_set(), self.source.pk)
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertListEqual(
+            index.ids,
+            [self.img1.pk, self.img2.pk, self.img3.pk, self.img4.pk])
+
+    def test_invalidated_on_metadata_edit(self):
+        get_image_order_index(self.image_set(), self.source.pk)
+
+        self.img1.metadata.name = '5.png'
+        self.img1.metadata.save()
+
+        index = get_image_order_index(self.image_set(), self.source.pk)
+        self.assertListEqual(
+            index.ids,
+            [self.img2.pk, self.img3.pk, self.img4.pk, self.img1.pk])
+
+    def test_invalidated_on_upload(self):
+        get_image_order_index(self.image_set(), self.source.pk)
+
+        new_image = self.upload_image(self.user, self.source)
+
+        index = get_image_order_index(self.image_set(), self.source.pk)
+        self.assertIn(new_image.pk, index.ids)
+
+    def test_invalidated_on_delete(self):
+        get_image_order_index(self.image_set(), self.source.pk)
+
+        delete_images(Image.objects.filter(pk=self.img2.pk))
+
+        index = get_image_order_index(self.image_set(), self.source.pk)
+        self.assertListEqual(
+            index.ids, [self.img1.pk, self.img3.pk, self.img4.pk])
+
+    def test_invalidated_on_annotation_change(self):
+        labels = self.create_labels(self.user, ['A', 'B'], 'GroupA')
+        self.create_labelset(self.user, self.source, labels)
+
+        unconfirmed_set = self.image_set().filter(
+            annoinfo__status='unclassified')
+        index = get_image_order_index(
+            unconfirmed_set, self.source.pk, annotation_dependent=True)
+        self.assertEqual(len(index), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_annotations(self.user, self.img1)
+
+        index = get_image_order_index(
+            unconfirmed_set, self.source.pk, annotation_dependent=True)
+        self.assertEqual(len(index), 3)
+
+    def test_not_invalidated_on_annotation_change(self):
+        labels = self.create_labels(self.user, ['A', 'B'], 'GroupA')
+        self.create_labelset(self.user, self.source, labels)
+        get_image_order_index(self.image_set(), self.source.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_annotations(self.user, self.img1)
+
+        with CaptureQueriesContext(connection) as context:
+            get_image_order_index(self.image_set(), self.source.pk)
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_annotation_invalidation_once_per_transaction(self):
+        labels = self.create_labels(self.user, ['A', 'B'], 'GroupA')
+        self.create_labelset(self.user, self.source, labels)
+
+        with mock.patch(
+            'images.utils.invalidate_image_order_indexes'
+        ) as mock_invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                for point in self.img1.point_set.all():
+                    Annotation(
+                        source=self.source, image=self.img1, point=point,
+                        user=self.user, label=labels[0],
+                    ).save()
+        mock_invalidate.assert_called_once_with(
+            self.source.pk, annotations_only=True)
+
+    def test_annotation_invalidation_after_rollback(self):
+        labels = self.create_labels(self.user, ['A', 'B'], 'GroupA')
+        self.create_labelset(self.user, self.source, labels)
+        point_1, point_2 = list(self.img1.point_set.order_by('pk'))[:2]
+
+        with mock.patch(
+            'images.utils.invalidate_image_order_indexes'
+        ) as mock_invalidate:
+            try:
+                with transaction.atomic():
+                    Annotation(
+                        source=self.source, image=self.img1, point=point_1,
+                        user=self.user, label=labels[0],
+                    ).save()
+                    raise ValueError
+            except ValueError:
+                pass
+
+            # The rolled-back invalidation shouldn't count as pending.
+            with self.captureOnCommitCallbacks(execute=True):
+                Annotation(
+                    source=self.source, image=self.img1, point=point_2,
+                    user=self.user, label=labels[0],
+                ).save()
+        mock_invalidate.assert_called_once_with(
+            self.source.pk, annotations_only=True)
+
+
+class ImageNameMatcherTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(cls.user)
+
+    def upload_image_with_name(self, name):
+        image = self.upload_image(self.user, self.source)
+        image.metadata.name = name
+        image.metadata.save()
+        return image.pk
+
+    def test_longest_suffix(self):
+        transect = self.upload_image_with_name(r'Transect 1\01.jpg')
+        bare = self.upload_image_with_name(r'01.jpg')
+        full = self.upload_image_with_name(r'D:\Site A\Transect 1\01.jpg')
+        matcher = ImageNameMatcher(self.source)
+
+        self.assertEqual(
+            matcher.match(r'D:\Site A\Transect 1\01.jpg'), full)
+        self.assertEqual(
+            matcher.match(r'E:\Site A\Transect 1\01.jpg'), transect)
+        self.assertEqual(matcher.match(r'E:\Transect 2\01.jpg'), bare)
+        self.assertIsNone(matcher.match(r'E:\Transect 1\001.jpg'))
+        self.assertIsNone(matcher.match(r'sect 1'))
+
+    def test_slashes(self):
+        forward = self.upload_image_with_name(r'/Transect 1/01.jpg')
+        back = self.upload_image_with_name(r'\Transect 2\01.jpg')
+        matcher = ImageNameMatcher(self.source)
+
+        self.assertEqual(matcher.match(r'D:\Transect 1\01.jpg'), forward)
+        self.assertEqual(matcher.match(r'D:/Transect 2/01.jpg'), back)
+        self.assertIsNone(matcher.match(r'D:\Transect 3\01.jpg'))
+
+    def test_same_components_first_image_wins(self):
+        first = self.upload_image_with_name(r'Transect 1/01.jpg')
+        self.upload_image_with_name(r'Transect 1\01.jpg')
+        matcher = ImageNameMatcher(self.source)
+
+        self.assertEqual(matcher.match(r'D:\Transect 1\01.jpg'), first)
+
+    def test_queries(self):
+        for number in range(10):
+            self.upload_image_with_name(f'Transect 1/{number:02}.jpg')
+
+        with CaptureQueriesContext(connection) as context:
+            matcher = ImageNameMatcher(self.source)
+            for number in range(10):
+                self.assertIsNotNone(
+                    matcher.match(f'D:\\Transect 1\\{number:02}.jpg'))
+        self.assertEqual(len(context.captured_queries), 1)
@@ -1,15 +1,33 @@
+from bisect import bisect_left
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import datetime
+import hashlib
+import logging
 import math
+from pathlib import PureWindowsPath
 import random
+import threading
+import uuid
+import weakref
 
 from django.conf import settings
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.files.storage import get_storage_class
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from easy_thumbnails.models import (
+    Source as ThumbnailSourceRecord, Thumbnail as ThumbnailRecord)
 
 from accounts.utils import get_alleviate_user
-from annotations.model_utils import AnnotationAreaUtils
+from annotations.model_utils import AnnotationAreaUtils, ImageAnnoStatuses
+from jobs.utils import queue_or_get_active_job
+from vision_backend.models import Classifier
 from .model_utils import PointGen
-from .models import Source, Point, Image, Metadata
+from .models import Source, PendingImageDeletion, Point, Image, Metadata
+
+logger = logging.getLogger(__name__)
 
 
 def _get_next_images_queryset(current_image, image_queryset):
@@ -81,7 +99,186 @@ def _get_next_images_queryset(current_image, image_queryset):
     return image_queryset.filter(filter_q)
 
 
-def get_next_image(current_image, image_queryset, wrap=False):
+class ImageOrderIndex:
+    """
+    The ordered IDs of the images matching an image queryset, so that
+    navigation and pagination don't have to re-run the queryset's filters
+    and ordering on every request.
+    """
+    def __init__(self, ids):
+        self.ids = ids
+        # Image ID -> position in the ordering, as two parallel lists
+        # sorted by image ID, so that positions can be looked up by
+        # bisection.
+        pairs = sorted((pk, position) for position, pk in enumerate(ids))
+        self._sorted_ids = [pk for pk, _ in pairs]
+        self._positions = [position for _, position in pairs]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, image_id):
+        """
+        Return the 0-based position of the image in the ordering, or None
+        if the image isn't in the index.
+        """
+        i = bisect_left(self._sorted_ids, image_id)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == image_id:
+            return self._positions[i]
+        return None
+
+
+class IndexedImageResults:
+    """
+    Sequence of the Images in an ImageOrderIndex, which only fetches the
+    images that are sliced out. Can be passed to a Paginator.
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            ids = self.index.ids[key]
+            images = Image.objects.in_bulk(ids)
+            # Images deleted since the index was built are skipped.
+            return [images[pk] for pk in ids if pk in images]
+        return Image.objects.get(pk=self.index.ids[key])
+
+
+def _image_order_index_token(source_id, kind):
+    # Random tokens rather than counters, so that if a token is evicted
+    # from the cache, stale indexes can't get picked up again.
+    key = f'image_order_index_token_{kind}_{source_id}'
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(key, token, None):
+            token = cache.get(key)
+    return token
+
+
+def invalidate_image_order_indexes(source_id, annotations_only=False):
+    """
+    Call this when a source's images are uploaded, deleted, or have their
+    metadata edited. If annotations_only is True, only invalidate the
+    indexes of searches which depend on annotation state.
+    """
+    kinds = ['annotations'] if annotations_only else ['images', 'annotations']
+    for kind in kinds:
+        cache.set(
+            f'image_order_index_token_{kind}_{source_id}',
+            uuid.uuid4().hex, None)
+
+
+# On-commit invalidations which are registered but haven't run yet, per
+# thread (as DB connections are per thread), keyed by source ID and
+# annotations_only. The values are weak references: if the transaction is
+# rolled back, Django drops its on-commit callbacks, and the entries go
+# away with them.
+_pending_invalidations = threading.local()
+
+
+def _get_pending_invalidations() -> weakref.WeakValueDictionary:
+    if not hasattr(_pending_invalidations, 'by_key'):
+        _pending_invalidations.by_key = weakref.WeakValueDictionary()
+    return _pending_invalidations.by_key
+
+
+@dataclass
+class _ImageOrderIndexInvalidation:
+    source_id: int
+    annotations_only: bool
+
+    def __call__(self):
+        _get_pending_invalidations().pop(
+            (self.source_id, self.annotations_only), None)
+        invalidate_image_order_indexes(
+            self.source_id, annotations_only=self.annotations_only)
+
+
+def invalidate_image_order_indexes_on_commit(
+        source_id, annotations_only=False):
+    """
+    Like invalidate_image_order_indexes(), but deferred until the current
+    transaction commits, and done at most once per transaction. Saving an
+    image's annotations saves many Annotations, and each save would
+    otherwise invalidate the indexes again.
+    """
+    pending = _get_pending_invalidations()
+    key = (source_id, annotations_only)
+    if key in pending:
+        return
+    invalidation = _ImageOrderIndexInvalidation(source_id, annotations_only)
+    pending[key] = invalidation
+    transaction.on_commit(invalidation)
+
+
+def get_image_order_index(
+        image_queryset, source_id, annotation_dependent=False):
+    """
+    Get the ImageOrderIndex of image_queryset, which must be an ordered
+    queryset of images from the given source. Indexes are cached per
+    source and per search (as identified by the queryset's SQL).
+
+    annotation_dependent should be True if the search filters or sorts on
+    annotation state (see BaseImageSearchForm.depends_on_annotations()),
+    so that the index also goes stale when annotations change.
+    """
+    if image_queryset.query.is_empty():
+        return ImageOrderIndex([])
+
+    sql = str(image_queryset.query)
+    token = _image_order_index_token(source_id, 'images')
+    if annotation_dependent:
+        token += _image_order_index_token(source_id, 'annotations')
+    search_hash = hashlib.sha1(sql.encode()).hexdigest()
+    cache_key = f'image_order_index_{source_id}_{token}_{search_hash}'
+
+    index = cache.get(cache_key)
+    if index is None:
+        index = ImageOrderIndex(
+            list(image_queryset.values_list('pk', flat=True)))
+        cache.set(
+            cache_key, index, settings.IMAGE_ORDER_INDEX_CACHE_SECONDS)
+    return index
+
+
+def _get_adjacent_image(current_image, image_queryset, wrap, step, index):
+    if index is None:
+        index = get_image_order_index(
+            image_queryset, current_image.source_id)
+    if len(index) <= 1:
+        return None
+
+    position = index.position(current_image.pk)
+    if position is None:
+        # The current image isn't in the results (for example, it no longer
+        # matches the search filters). Find where it would be placed based
+        # on its ordering values.
+        if step > 0:
+            adjacent_images = _get_next_images_queryset(
+                current_image, image_queryset)
+        else:
+            adjacent_images = _get_next_images_queryset(
+                current_image, image_queryset.reverse())
+        adjacent_image = adjacent_images.first()
+        if adjacent_image or not wrap:
+            return adjacent_image
+        adjacent_position = 0 if step > 0 else len(index) - 1
+    else:
+        adjacent_position = position + step
+        if not 0 <= adjacent_position < len(index):
+            if not wrap:
+                return None
+            adjacent_position %= len(index)
+
+    return Image.objects.filter(pk=index.ids[adjacent_position]).first()
+
+
+def get_next_image(current_image, image_queryset, wrap=False, index=None):
     """
     Get the next image in the image_queryset, relative to current_image.
     image_queryset should already be ordered, with an unambiguous ordering
@@ -90,34 +287,30 @@ def get_next_image(current_image, image_queryset, wrap=False):
     If wrap is True, then the definition of 'next' is extended to allow
     wrapping from the last image to the first.
 
+    index is image_queryset's ImageOrderIndex, if the caller already has
+    it.
+
     If there is no next image, return None.
     """
-    if image_queryset.count() <= 1:
-        return None
-
-    next_images = _get_next_images_queryset(current_image, image_queryset)
-
-    if next_images.exists():
-        return next_images[0]
-    elif wrap:
-        # No matching images after this image,
-        # so we wrap around to the first image.
-        return image_queryset[0]
-    else:
-        # No matching images after this image, and we're not allowed to wrap.
-        return None
+    return _get_adjacent_image(current_image, image_queryset, wrap, 1, index)
 
 
-def get_prev_image(current_image, image_queryset, wrap=False):
+def get_prev_image(current_image, image_queryset, wrap=False, index=None):
     """
     Get the previous image in the image_queryset, relative to current_image.
     """
-    # Finding the previous image is equivalent to
-    # finding the next image in the reverse queryset.
-    return get_next_image(current_image, image_queryset.reverse(), wrap)
+    return _get_adjacent_image(
+        current_image, image_queryset, wrap, -1, index)
 
 
-def get_image_order_placement(current_image, image_queryset):
+def get_image_order_placement(current_image, image_queryset, index=None):
+    if index is None:
+        index = get_image_order_index(
+            image_queryset, current_image.source_id)
+    position = index.position(current_image.pk)
+    if position is not None:
+        return position + 1
+
     prev_images = _get_next_images_queryset(
         current_image, image_queryset.reverse())
 
@@ -126,6 +319,71 @@ def get_image_order_placement(current_image, image_queryset):
     return prev_images.count() + 1
 
 
+class ImageNameMatcher:
+    """
+    Matches filepaths, such as the image filepaths referenced by CPC
+    files, to a source's image names.
+
+    Filepaths and image names are compared by path components, with either
+    slash direction accepted and leading slashes on image names ignored.
+    The best match is the image name which equals the longest trailing
+    run of the filepath's components. For example, for the filepath
+    D:\\Site A\\Transect 1\\01.jpg, the image name `Transect 1/01.jpg` is
+    a better match than `01.jpg`, and `sect 1/01.jpg` doesn't match.
+
+    The source's image names are loaded once into a trie keyed by
+    reversed path components, so each lookup takes time proportional to
+    the filepath's depth, regardless of the number of images.
+    """
+    def __init__(self, source):
+        # Each node is a dict of child nodes keyed by path component.
+        # The None key holds the ID of the image whose name ends at
+        # that node.
+        self._root = dict()
+
+        names = (
+            Image.objects.filter(source=source)
+            # If multiple names have the same components (only possible
+            # when they differ by slash direction), the first uploaded
+            # image wins, since it's inserted last.
+            .order_by('-pk')
+            .values_list('pk', 'metadata__name')
+        )
+        for image_id, name in names:
+            parts = self.path_parts(name)
+            # Ignore leading slashes.
+            if parts and parts[0] == '\\':
+                parts = parts[1:]
+            if not parts:
+                continue
+
+            node = self._root
+            for part in reversed(parts):
+                node = node.setdefault(part, dict())
+            node[None] = image_id
+
+    @staticmethod
+    def path_parts(filepath):
+        # CPCe only runs on Windows, and Windows paths accept either
+        # slash direction, so we parse with PureWindowsPath (WindowsPath
+        # can only be instantiated on a Windows OS).
+        return PureWindowsPath(filepath).parts
+
+    def match(self, filepath):
+        """
+        Return the ID of the best-matching image, or None if no image
+        name matches.
+        """
+        best_match = None
+        node = self._root
+        for part in reversed(self.path_parts(filepath)):
+            node = node.get(part)
+            if node is None:
+                break
+            best_match = node.get(None, best_match)
+        return best_match
+
+
 def metadata_field_names_to_labels(source):
     """
     Get an OrderedDict of Metadata field names to field labels.
@@ -173,13 +431,11 @@ def delete_images(image_queryset):
     Delete Image objects without leaving behind leftover related objects.
     Return the number of Images that were actually deleted.
 
-    We DON'T delete the original image file just yet, because if we did,
-    then a subsequent exception in this request/response cycle would leave
-    us in an inconsistent state. Leave original image deletion to a
-    management command or cronjob.
-
-    It would be reasonable to delete easy-thumbnails' image thumbnails now,
-    but best left for later again, for better user-end responsiveness.
+    We DON'T delete the original image file and other storage files here,
+    because if we did, then a subsequent exception in the current
+    transaction would leave us in an inconsistent state. The
+    delete_source_images job deletes storage files once its database
+    deletions are committed.
     """
     # These are ForeignKey fields of the Image, and thus deleting the Image
     # can't trigger a cascade delete on these objects. So we have to get
@@ -192,6 +448,9 @@ def delete_images(image_queryset):
     # https://docs.djangoproject.com/en/dev/ref/models/querysets/#when-querysets-are-evaluated
     metadata_pks = list(metadata_queryset.values_list('pk', flat=True))
     metadata_queryset = Metadata.objects.filter(pk__in=metadata_pks)
+    source_ids = list(
+        image_queryset.order_by().values_list('source_id', flat=True)
+        .distinct())
 
     # We call delete() on the querysets rather than the individual
     # objects for faster performance.
@@ -202,6 +461,9 @@ def delete_images(image_queryset):
     # PROTECT-related errors on those ForeignKeys.
     metadata_queryset.delete()
 
+    for source_id in source_ids:
+        invalidate_image_order_indexes(source_id)
+
     return delete_count
 
 
@@ -209,6 +471,104 @@ def delete_image(img):
     delete_images(Image.objects.filter(pk=img.pk))
 
 
+def queue_image_deletion(image_queryset, source):
+    """
+    Mark the given images of the source for deletion, and queue a
+    delete_source_images job to delete them in the background.
+    Return the number of images marked, and the deletion Job.
+    """
+    image_ids = list(
+        image_queryset.filter(source=source).values_list('pk', flat=True))
+    PendingImageDeletion.objects.bulk_create(
+        [
+            PendingImageDeletion(image_id=image_id, source=source)
+            for image_id in image_ids
+        ],
+        # Images may already be marked by an earlier request.
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    # Marked images are left out of searches right away.
+    invalidate_image_order_indexes(source.pk)
+
+    # If a deletion job for this source is already pending or in progress,
+    # it'll pick up these images too.
+    job = queue_or_get_active_job(
+        'delete_source_images', source.pk, source_id=source.pk)
+
+    return len(image_ids), job
+
+
+def get_image_storage_paths(image_ids):
+    """
+    Return the storage paths of files belonging to the given images:
+    original images, feature vectors, and label patches. easy-thumbnails
+    thumbnails are handled by pop_image_thumbnail_paths().
+    Not all of these files necessarily exist.
+    """
+    original_names = dict(
+        Image.objects.filter(pk__in=image_ids)
+        .values_list('pk', 'original_file'))
+
+    paths = []
+    for original_name in original_names.values():
+        paths.append(original_name)
+        paths.append(settings.FEATURE_VECTOR_FILE_PATTERN.format(
+            full_image_path=original_name))
+
+    # Patches are only generated for annotated points.
+    for point_id, image_id in (
+        Point.objects.filter(
+            image_id__in=image_ids, annotation__isnull=False)
+        .values_list('pk', 'image_id')
+    ):
+        paths.append(settings.POINT_PATCH_FILE_PATTERN.format(
+            full_image_path=original_names[image_id],
+            point_pk=point_id,
+        ))
+
+    return paths
+
+
+def pop_image_thumbnail_paths(original_names):
+    """
+    Delete easy-thumbnails' records of the thumbnails generated from the
+    given original image files, and return the thumbnails' storage paths.
+    """
+    thumbnail_paths = list(
+        ThumbnailRecord.objects.filter(source__name__in=original_names)
+        .values_list('name', flat=True))
+    # Thumbnail records cascade-delete along with their sources.
+    ThumbnailSourceRecord.objects.filter(name__in=original_names).delete()
+    return thumbnail_paths
+
+
+def delete_storage_files(paths):
+    """
+    Delete the given storage files with a bounded thread pool. Files which
+    don't exist are ignored.
+    Return the number of files which failed to delete.
+    """
+    if not paths:
+        return 0
+
+    storage = get_storage_class()()
+
+    def delete(path):
+        try:
+            storage.delete(path)
+        except Exception as e:
+            logger.warning(f"Couldn't delete storage file {path}: {e}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(
+        max_workers=min(settings.IMAGE_DELETION_STORAGE_THREADS, len(paths))
+    ) as executor:
+        results = list(executor.map(delete, paths))
+    return results.count(False)
+
+
 def calculate_points(img,
                      annotation_area=None,
                      point_generation_type=None,
@@ -373,6 +733,110 @@ def generate_points(img, usesourcemethod=True):
         ).save()
 
 
+def get_sources_robot_status(source_ids=None):
+    """
+    Status of the vision back-end for each of the given sources (or all
+    sources if None), as a list of dicts ordered by source ID.
+
+    The counts for all the sources are obtained with a few grouped queries,
+    rather than several queries per source, so this stays fast for pages
+    and monitoring endpoints which look at every source.
+    """
+    sources = Source.objects.order_by('pk')
+    images = Image.objects.not_pending_deletion()
+    classifiers = Classifier.objects.all()
+    if source_ids is not None:
+        sources = sources.filter(pk__in=source_ids)
+        images = images.filter(source_id__in=source_ids)
+        classifiers = classifiers.filter(source_id__in=source_ids)
+
+    confirmed_q = Q(annoinfo__status=ImageAnnoStatuses.CONFIRMED.value)
+    image_counts = dict(
+        (row['source_id'], row) for row in
+        images.order_by().values('source_id').annotate(
+            total=Count('pk'),
+            without_features=Count(
+                'pk', filter=Q(features__extracted=False)),
+            unclassified=Count('pk', filter=Q(
+                annoinfo__status=ImageAnnoStatuses.UNCLASSIFIED.value)),
+            confirmed=Count('pk', filter=confirmed_q),
+            confirmed_with_features=Count(
+                'pk', filter=confirmed_q & Q(features__extracted=True)),
+        )
+    )
+    classifier_counts = dict(
+        (row['source_id'], row) for row in
+        classifiers.order_by().values('source_id').annotate(
+            total=Count('pk'),
+            accepted=Count('pk', filter=Q(status=Classifier.ACCEPTED)),
+            current_id=Max('pk', filter=Q(status=Classifier.ACCEPTED)),
+            latest_attempt_id=Max(
+                'pk', filter=~Q(status=Classifier.TRAIN_PENDING)),
+        )
+    )
+    # The current classifiers and latest training attempts.
+    relevant_classifiers = Classifier.objects.only(
+        'status', 'nbr_train_images').in_bulk([
+            row[key] for row in classifier_counts.values()
+            for key in ['current_id', 'latest_attempt_id']
+            if row[key] is not None
+        ])
+
+    statuses = []
+    empty_image_counts = dict(
+        total=0, without_features=0, unclassified=0, confirmed=0,
+        confirmed_with_features=0)
+    empty_classifier_counts = dict(
+        total=0, accepted=0, current_id=None, latest_attempt_id=None)
+
+    for source in sources.values('pk', 'name', 'enable_robot_classifier'):
+        source_images = image_counts.get(source['pk'], empty_image_counts)
+        source_classifiers = classifier_counts.get(
+            source['pk'], empty_classifier_counts)
+        current_classifier = relevant_classifiers.get(
+            source_classifiers['current_id'])
+        latest_classifier_attempt = relevant_classifiers.get(
+            source_classifiers['latest_attempt_id'])
+
+        status = dict()
+        status['name'] = source['name']
+        status['name_short'] = source['name'][:40]
+        status['id'] = source['pk']
+        status['has_robot'] = current_classifier is not None
+        status['nbr_robots'] = source_classifiers['total']
+        status['nbr_accepted_robots'] = source_classifiers['accepted']
+
+        status['nbr_total_images'] = source_images['total']
+        status['nbr_images_needs_features'] = \
+            source_images['without_features']
+        status['nbr_unclassified_images'] = source_images['unclassified']
+        status['nbr_human_annotated_images'] = source_images['confirmed']
+
+        status['nbr_in_current_model'] = (
+            current_classifier.nbr_train_images
+            if status['has_robot'] else 0)
+        if status['has_robot']:
+            status['nbr_images_until_next_robot'] = status['nbr_in_current_model'] * settings.NEW_CLASSIFIER_TRAIN_TH - status['nbr_human_annotated_images']
+        else:
+            status['nbr_images_until_next_robot'] = settings.TRAINING_MIN_IMAGES - status['nbr_human_annotated_images']
+        status['nbr_images_until_next_robot'] = int(math.ceil(status['nbr_images_until_next_robot']))
+
+        if source['enable_robot_classifier']:
+            status['need_robot'], _ = Source.need_new_robot_from_stats(
+                source_images['confirmed_with_features'],
+                latest_classifier_attempt)
+        else:
+            status['need_robot'] = False
+        status['need_features'] = status['nbr_images_needs_features'] > 0
+        status['need_classification'] = status['has_robot'] and status['nbr_unclassified_images'] > 0
+
+        status['need_attention'] = source['enable_robot_classifier'] and (status['need_robot'] or status['need_features'] or status['need_classification'])
+
+        statuses.append(status)
+
+    return statuses
+
+
 def source_robot_status(source_id):
     """
     checks source with source_id to determine the status of the vision back-end for this source.
@@ -382,36 +846,10 @@ def source_robot_status(source_id):
     gives:
     several data point regarding the status of the vision backend for this source.
     """
-    status = dict()
-    source = Source.objects.get(id=source_id)
-    status['name'] = source.name
-    status['name_short'] = source.name[:40]
-    status['id'] = source.id
-    status['has_robot'] = source.has_robot()
-    status['nbr_robots'] = source.classifier_set.count()
-    status['nbr_accepted_robots'] = source.get_accepted_robots().count()
-
-    status['nbr_total_images'] = source.image_set.count()
-    status['nbr_images_needs_features'] = source.image_set.without_features().count()
-    status['nbr_unclassified_images'] = source.image_set.unclassified().count()
-    status['nbr_human_annotated_images'] = source.image_set.confirmed().count()
-
-    status['nbr_in_current_model'] = (
-        source.get_current_classifier().nbr_train_images
-        if status['has_robot'] else 0)
-    if source.has_robot():
-        status['nbr_images_until_next_robot'] = status['nbr_in_current_model'] * settings.NEW_CLASSIFIER_TRAIN_TH - status['nbr_human_annotated_images']
-    else:
-        status['nbr_images_until_next_robot'] = settings.TRAINING_MIN_IMAGES - status['nbr_human_annotated_images']
-    status['nbr_images_until_next_robot'] = int(math.ceil(status['nbr_images_until_next_robot']))
-
-    status['need_robot'], _ = source.need_new_robot()
-    status['need_features'] = status['nbr_images_needs_features'] > 0
-    status['need_classification'] = status['has_robot'] and status['nbr_unclassified_images'] > 0
-
-    status['need_attention'] = source.enable_robot_classifier and (status['need_robot'] or status['need_features'] or status['need_classification'])
-
-    return status
+    statuses = get_sources_robot_status([source_id])
+    if not statuses:
+        raise Source.DoesNotExist
+    return statuses[0]
 
 
 def filter_out_test_sources(source_queryset):
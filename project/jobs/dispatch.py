@@ -0,0 +1,147 @@
+"""
+Choosing which due jobs run_scheduled_jobs() dispatches on each run.
+
+With the 'fifo' policy, all due jobs are dispatched in the order they
+were queued. That means one source queueing tens of thousands of
+feature extractions can hold up every other source's jobs, and deploy
+API requests, until the flood is through.
+
+With the 'fair_share' policy:
+
+- Each job name belongs to a priority class. Due jobs of a more urgent
+  class are dispatched before those of a less urgent class.
+- Within a priority class, sources take turns (round-robin), so a source
+  with few due jobs isn't stuck behind a source with many. Each source's
+  turns rotate between its job names in that class. Jobs without a
+  source are treated as one more 'source'.
+- Job names can have a cap on the number of in-progress jobs.
+- At most a fixed number of jobs are dispatched per run.
+
+The plan is computed from due-job counts per job name and source, rather
+than from the due jobs themselves, so that a flood doesn't make each run
+load all of the flood's jobs.
+"""
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, Min
+
+from .models import Job
+
+
+@dataclass
+class DueJobGroup:
+    """Due jobs sharing a job name and source."""
+    job_name: str
+    source_id: Optional[int]
+    count: int
+    # pk of the group's earliest-queued job.
+    first_pk: int
+
+
+def plan_fair_share_dispatch(
+        groups: list[DueJobGroup],
+        in_progress_counts: dict[str, int],
+        budget: int,
+        priorities: dict[str, int],
+        default_priority: int,
+        concurrency_limits: dict[str, int]) -> list[tuple[str, int]]:
+    """
+    Returns (job_name, source_id) for each job to dispatch, in dispatch
+    order. Which job is dispatched from each group is up to the caller
+    (the earliest-queued ones, presumably).
+
+    This doesn't touch the DB, so it can be used to simulate the
+    dispatcher as well.
+    """
+    remaining = {
+        (group.job_name, group.source_id): group.count for group in groups}
+    running = Counter(in_progress_counts)
+
+    def has_capacity(job_name):
+        limit = concurrency_limits.get(job_name)
+        return limit is None or running[job_name] < limit
+
+    # priority -> source ID -> job names. Dicts keep insertion order, so
+    # sources whose jobs have waited longest get the first turns.
+    classes = dict()
+    for group in sorted(groups, key=lambda g: g.first_pk):
+        priority = priorities.get(group.job_name, default_priority)
+        classes.setdefault(priority, dict()).setdefault(
+            group.source_id, deque()).append(group.job_name)
+
+    picks = []
+    for priority in sorted(classes):
+        turns = deque(classes[priority].items())
+
+        while turns and len(picks) < budget:
+            source_id, job_names = turns.popleft()
+
+            for _ in range(len(job_names)):
+                job_name = job_names[0]
+                job_names.rotate(-1)
+                if (
+                    remaining[(job_name, source_id)] > 0
+                    and has_capacity(job_name)
+                ):
+                    picks.append((job_name, source_id))
+                    remaining[(job_name, source_id)] -= 1
+                    running[job_name] += 1
+                    # The source gets another turn later.
+                    turns.append((source_id, job_names))
+                    break
+            # Else, this source has nothing more it can dispatch on this
+            # run, at least in this priority class.
+
+        if len(picks) >= budget:
+            break
+
+    return picks
+
+
+def get_fair_share_jobs(jobs) -> list[Job]:
+    """
+    Given a queryset of due jobs ordered by pk, return the ones to
+    dispatch on this run, in dispatch order.
+
+    Besides a couple of aggregate queries, this takes one query per
+    (job name, source) combination which gets picked.
+    """
+    groups = [
+        DueJobGroup(**row) for row in
+        jobs.order_by().values('job_name', 'source_id').annotate(
+            count=Count('pk'), first_pk=Min('pk'))
+    ]
+    concurrency_limits = settings.JOB_CONCURRENCY_LIMITS
+    in_progress_counts = dict(
+        Job.objects.filter(
+            status=Job.Status.IN_PROGRESS,
+            job_name__in=concurrency_limits.keys(),
+        )
+        .order_by().values('job_name').annotate(count=Count('pk'))
+        .values_list('job_name', 'count')
+    )
+
+    picks = plan_fair_share_dispatch(
+        groups,
+        in_progress_counts,
+        budget=settings.JOB_DISPATCH_BUDGET,
+        priorities=settings.JOB_PRIORITIES,
+        default_priority=settings.JOB_DEFAULT_PRIORITY,
+        concurrency_limits=concurrency_limits,
+    )
+
+    group_jobs = dict()
+    for (job_name, source_id), count in Counter(picks).items():
+        group_jobs[(job_name, source_id)] = deque(
+            jobs.filter(job_name=job_name, source_id=source_id)[:count])
+
+    jobs_to_dispatch = []
+    for key in picks:
+        # A job may have been started by something else since the
+        # counts were taken.
+        if group_jobs[key]:
+            jobs_to_dispatch.append(group_jobs[key].popleft())
+    return jobs_to_dispatch
@@ -0,0 +1,200 @@
+"""
+Job latency metrics.
+
+When a Job finishes, its queue wait (scheduled start to actual start)
+and run time (start to finish) are added to the histograms for its job
+name, final status, and the hour it finished in. Summing the histograms
+over a time window tells us which kinds of jobs are waiting or running
+long, such as which stage of extract -> train -> classify is slow.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, JSONField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .models import Job, JobLatencyHistogram
+
+# Upper bounds of the histogram buckets. There's also a last bucket for
+# durations longer than all of these.
+LATENCY_BUCKET_SECONDS = [
+    1, 5, 15, 60, 5*60, 15*60, 60*60, 4*60*60, 24*60*60]
+
+
+def bucket_index(seconds):
+    for index, upper_bound in enumerate(LATENCY_BUCKET_SECONDS):
+        if seconds <= upper_bound:
+            return index
+    return len(LATENCY_BUCKET_SECONDS)
+
+
+def increment_bucket(field_name, index):
+    """
+    Expression which adds 1 to one element of a JSON array field, within
+    the UPDATE statement itself.
+    """
+    return RawSQL(
+        f"jsonb_set({field_name}, %s, to_jsonb(({field_name}->>%s)::int + 1))",
+        [f'{{{index}}}', index],
+        output_field=JSONField(),
+    )
+
+
+def record_job_latency(job: Job):
+    """
+    Add a finished Job to the latency histograms. Jobs which never went
+    in progress have no latency to speak of, and are skipped.
+
+    This is an atomic increment of the histogram row, so that concurrently
+    finishing jobs don't lose each other's counts.
+    """
+    if job.start_date is None or job.finish_date is None:
+        return
+
+    wait_seconds = max(
+        (job.start_date - job.scheduled_start_date).total_seconds(), 0)
+    run_seconds = max(
+        (job.finish_date - job.start_date).total_seconds(), 0)
+    period_start = job.finish_date.replace(
+        minute=0, second=0, microsecond=0)
+    histogram_kwargs = dict(
+        job_name=job.job_name,
+        status=job.status,
+        period_start=period_start,
+    )
+    wait_index = bucket_index(wait_seconds)
+    run_index = bucket_index(run_seconds)
+
+    def increment_existing():
+        return JobLatencyHistogram.objects.filter(**histogram_kwargs).update(
+            count=F('count') + 1,
+            wait_seconds_total=F('wait_seconds_total') + wait_seconds,
+            run_seconds_total=F('run_seconds_total') + run_seconds,
+            wait_buckets=increment_bucket('wait_buckets', wait_index),
+            run_buckets=increment_bucket('run_buckets', run_index),
+        )
+
+    if increment_existing():
+        return
+
+    num_buckets = len(LATENCY_BUCKET_SECONDS) + 1
+    wait_buckets = [0]*num_buckets
+    wait_buckets[wait_index] = 1
+    run_buckets = [0]*num_buckets
+    run_buckets[run_index] = 1
+    try:
+        # Savepoint, so that a failed create doesn't break any
+        # surrounding transaction.
+        with transaction.atomic():
+            JobLatencyHistogram.objects.create(
+                count=1,
+                wait_seconds_total=wait_seconds,
+                run_seconds_total=run_seconds,
+                wait_buckets=wait_buckets,
+                run_buckets=run_buckets,
+                **histogram_kwargs,
+            )
+    except IntegrityError:
+        # Another job created this histogram in the meantime.
+        increment_existing()
+
+
+def clean_up_old_latency_histograms():
+    x_days_ago = timezone.now() - timedelta(
+        days=settings.JOB_LATENCY_METRICS_MAX_DAYS)
+    JobLatencyHistogram.objects.filter(period_start__lt=x_days_ago).delete()
+
+
+def bucket_quantile(buckets, quantile):
+    """
+    Upper bound of the bucket containing the given quantile, or None if
+    it's the last (unbounded) bucket or there are no entries.
+    """
+    total = sum(buckets)
+    if total == 0:
+        return None
+    cumulative = 0
+    for index, count in enumerate(buckets):
+        cumulative += count
+        if cumulative >= quantile * total:
+            break
+    if index < len(LATENCY_BUCKET_SECONDS):
+        return LATENCY_BUCKET_SECONDS[index]
+    return None
+
+
+def get_latency_summary(hours):
+    """
+    Latency histograms summed over the last `hours` hours (including the
+    current hour), per job name and status, ordered by job name and
+    status.
+    """
+    since = (
+        timezone.now().replace(minute=0, second=0, microsecond=0)
+        - timedelta(hours=hours-1))
+    histograms = JobLatencyHistogram.objects.filter(
+        period_start__gte=since).order_by('job_name', 'status')
+
+    summary = dict()
+    for histogram in histograms:
+        key = (histogram.job_name, histogram.status)
+        if key not in summary:
+            summary[key] = dict(
+                job_name=histogram.job_name,
+                status=histogram.status,
+                count=0,
+                wait_seconds_total=0,
+                run_seconds_total=0,
+                wait_buckets=[0]*len(histogram.wait_buckets),
+                run_buckets=[0]*len(histogram.run_buckets),
+            )
+        entry = summary[key]
+        entry['count'] += histogram.count
+        entry['wait_seconds_total'] += histogram.wait_seconds_total
+        entry['run_seconds_total'] += histogram.run_seconds_total
+        for field in ['wait_buckets', 'run_buckets']:
+            entry[field] = [
+                a + b for a, b in zip(entry[field], getattr(histogram, field))]
+
+    entries = list(summary.values())
+    for entry in entries:
+        for stage in ['wait', 'run']:
+            buckets = entry[f'{stage}_buckets']
+            entry[f'{stage}_seconds_mean'] = (
+                entry[f'{stage}_seconds_total'] / entry['count'])
+            entry[f'{stage}_seconds_p50'] = bucket_quantile(buckets, 0.5)
+            entry[f'{stage}_seconds_p95'] = bucket_quantile(buckets, 0.95)
+    return entries
+
+
+def format_latency_metrics_text(entries):
+    """
+    Latency summary in the Prometheus text exposition format, with
+    cumulative buckets.
+    """
+    lines = []
+    for stage, description in [
+        ('wait', "Time from scheduled start to start of finished jobs."),
+        ('run', "Time from start to finish of finished jobs."),
+    ]:
+        metric = f'job_{stage}_seconds'
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+
+        for entry in entries:
+            labels = (
+                f'job_name="{entry["job_name"]}",status="{entry["status"]}"')
+            cumulative = 0
+            bounds = [str(b) for b in LATENCY_BUCKET_SECONDS] + ['+Inf']
+            for bound, count in zip(bounds, entry[f'{stage}_buckets']):
+                cumulative += count
+                lines.append(
+                    f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(
+                f'{metric}_sum{{{labels}}}'
+                f' {entry[f"{stage}_seconds_total"]}')
+            lines.append(f'{metric}_count{{{labels}}} {entry["count"]}')
+
+    return '\n'.join(lines) + '\n'
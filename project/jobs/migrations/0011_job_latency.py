@@ -0,0 +1,41 @@
+# Generated by Django 4.1.10 on 2026-10-17 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0010_unique_constraint_update_inprogress_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='finish_date',
+            field=models.DateTimeField(null=True, verbose_name='Date finished'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='start_date',
+            field=models.DateTimeField(null=True, verbose_name='Date started'),
+        ),
+        migrations.CreateModel(
+            name='JobLatencyHistogram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_name', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('in_progress', 'In Progress'), ('success', 'Success'), ('failure', 'Failure')], max_length=20)),
+                ('period_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('wait_seconds_total', models.FloatField(default=0)),
+                ('run_seconds_total', models.FloatField(default=0)),
+                ('wait_buckets', models.JSONField(default=list)),
+                ('run_buckets', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='joblatencyhistogram',
+            constraint=models.UniqueConstraint(fields=('job_name', 'status', 'period_start'), name='unique_job_latency_histogram'),
+        ),
+    ]
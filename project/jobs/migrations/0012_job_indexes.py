@@ -0,0 +1,30 @@
+# Generated by Django 4.1.10 on 2026-10-17 10:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The job table can be large, so we build the indexes without
+    # locking out writes, which can't be done in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('jobs', '0011_job_latency'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='job',
+            index=models.Index(fields=['job_name', 'arg_identifier'], name='job_name_args_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['scheduled_start_date'], name='pending_job_schedule_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='job',
+            index=models.Index(condition=models.Q(('persist', False)), fields=['modify_date'], name='job_cleanup_idx'),
+        ),
+    ]
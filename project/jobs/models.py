@@ -52,6 +52,11 @@ class Job(models.Model):
     # how long the Job took. This is useful info for tuning
     # task delays / periodic runs.
     modify_date = models.DateTimeField("Date modified", auto_now=True)
+    # Date/time the Job went in progress, and the date/time it finished.
+    # Unlike modify_date, these aren't overwritten by later updates,
+    # so they tell us the queue wait and run time.
+    start_date = models.DateTimeField("Date started", null=True)
+    finish_date = models.DateTimeField("Date finished", null=True)
 
     class Meta:
         constraints = [
@@ -63,6 +68,26 @@ class Job(models.Model):
                 name='unique_running_jobs',
             ),
         ]
+        indexes = [
+            # Looking up a job by name and args, such as when queueing or
+            # starting it.
+            models.Index(
+                fields=['job_name', 'arg_identifier'],
+                name='job_name_args_idx',
+            ),
+            # Finding the pending jobs that are due to run.
+            models.Index(
+                fields=['scheduled_start_date'],
+                condition=Q(status='pending'),
+                name='pending_job_schedule_idx',
+            ),
+            # Finding old jobs to clean up.
+            models.Index(
+                fields=['modify_date'],
+                condition=Q(persist=False),
+                name='job_cleanup_idx',
+            ),
+        ]
 
     def __str__(self):
         s = self.job_name
@@ -85,3 +110,32 @@ class Job(models.Model):
         if identifier == '':
             return []
         return identifier.split(',')
+
+
+class JobLatencyHistogram(models.Model):
+    """
+    Histograms of queue wait and run time for the Jobs of a particular
+    name and final status which finished during a particular hour.
+    These are recorded as Jobs finish, and they outlive the Jobs
+    themselves. See jobs/metrics.py.
+    """
+    job_name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, choices=Job.Status.choices)
+    period_start = models.DateTimeField()
+
+    count = models.IntegerField(default=0)
+    wait_seconds_total = models.FloatField(default=0)
+    run_seconds_total = models.FloatField(default=0)
+    # Job counts per duration bucket, as defined by
+    # metrics.LATENCY_BUCKET_SECONDS, plus a last bucket for anything
+    # longer.
+    wait_buckets = models.JSONField(default=list)
+    run_buckets = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['job_name', 'status', 'period_start'],
+                name='unique_job_latency_histogram',
+            ),
+        ]
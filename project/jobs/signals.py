@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by finish_job() when a Job goes from pending or in-progress to
+# success or failure. Arguments: job.
+job_finished = Signal()
@@ -6,8 +6,12 @@ from django.core.mail import mail_admins
 from django.utils import timezone
 from huey.contrib.djhuey import HUEY
 
+from .dispatch import get_fair_share_jobs
+from .metrics import clean_up_old_latency_histograms
 from .models import Job
 from .utils import (
+    cleanup_result_message,
+    delete_in_chunks,
     full_job,
     get_periodic_job_schedules,
     job_runner,
@@ -29,6 +33,17 @@ def get_scheduled_jobs():
     return jobs
 
 
+def get_jobs_to_dispatch():
+    """
+    Scheduled jobs to dispatch on this run of run_scheduled_jobs(), in
+    dispatch order, according to the JOB_DISPATCH_POLICY setting.
+    """
+    jobs = get_scheduled_jobs()
+    if settings.JOB_DISPATCH_POLICY == 'fair_share':
+        return get_fair_share_jobs(jobs)
+    return jobs
+
+
 @full_job(huey_interval_minutes=2)
 def run_scheduled_jobs():
     """
@@ -42,7 +57,7 @@ def run_scheduled_jobs():
     wrap_up_time = start + timedelta(minutes=settings.JOB_MAX_MINUTES)
     timed_out = False
 
-    jobs_to_run = get_scheduled_jobs()
+    jobs_to_run = get_jobs_to_dispatch()
     example_jobs = []
     jobs_ran = 0
 
@@ -98,8 +113,9 @@ def run_scheduled_jobs_until_empty():
 
 @job_runner(interval=timedelta(days=1))
 def clean_up_old_jobs():
-    current_time = timezone.now()
-    x_days_ago = current_time - timedelta(days=settings.JOB_MAX_DAYS)
+    start = timezone.now()
+    wrap_up_time = start + timedelta(minutes=settings.JOB_MAX_MINUTES)
+    x_days_ago = start - timedelta(days=settings.JOB_MAX_DAYS)
 
     # Clean up Jobs which are old enough since last modification,
     # don't have the persist flag set,
@@ -111,13 +127,13 @@ def clean_up_old_jobs():
         persist=False,
         apijobunit__isnull=True,
     )
-    count = jobs_to_clean_up.count()
-    jobs_to_clean_up.delete()
+    count, timed_out = delete_in_chunks(jobs_to_clean_up, wrap_up_time)
+    seconds = (timezone.now() - start).total_seconds()
 
-    if count > 0:
-        return f"Cleaned up {count} old job(s)"
-    else:
-        return "No old jobs to clean up"
+    # Latency histograms are kept separately from the Jobs they came from.
+    clean_up_old_latency_histograms()
+
+    return cleanup_result_message(count, "old job", seconds, timed_out)
 
 
 @job_runner(interval=timedelta(days=1))
@@ -0,0 +1,235 @@
+from unittest import mock
+
+from django.test.utils import override_settings
+
+from lib.tests.utils import BaseTest, ClientTest
+from ..dispatch import DueJobGroup, plan_fair_share_dispatch
+from ..models import Job
+from ..tasks import run_scheduled_jobs
+from ..utils import queue_job
+
+
+def plan(groups, in_progress_counts=None, budget=100, priorities=None,
+         concurrency_limits=None):
+    return plan_fair_share_dispatch(
+        [DueJobGroup(*group) for group in groups],
+        in_progress_counts or dict(),
+        budget=budget,
+        priorities=priorities or dict(),
+        default_priority=1,
+        concurrency_limits=concurrency_limits or dict(),
+    )
+
+
+class PlanFairShareDispatchTest(BaseTest):
+
+    def test_round_robin_between_sources(self):
+        picks = plan([
+            # job name, source ID, count, first pk
+            ('a', 1, 3, 10),
+            ('a', 2, 1, 20),
+            ('a', 3, 2, 30),
+        ])
+        self.assertListEqual(
+            picks,
+            [('a', 1), ('a', 2), ('a', 3), ('a', 1), ('a', 3), ('a', 1)])
+
+    def test_longest_waiting_source_first(self):
+        picks = plan([
+            ('a', 1, 1, 50),
+            ('a', 2, 1, 20),
+        ])
+        self.assertListEqual(picks, [('a', 2), ('a', 1)])
+
+    def test_rotate_job_names_within_source(self):
+        picks = plan([
+            ('a', 1, 2, 10),
+            ('b', 1, 2, 20),
+            ('a', None, 1, 30),
+        ])
+        self.assertListEqual(
+            picks,
+            [('a', 1), ('a', None), ('b', 1), ('a', 1), ('b', 1)])
+
+    def test_priority_classes(self):
+        picks = plan(
+            [
+                ('bulk', 1, 2, 10),
+                ('normal', 1, 1, 20),
+                ('urgent', 2, 1, 30),
+            ],
+            priorities=dict(urgent=0, bulk=2),
+        )
+        self.assertListEqual(
+            picks,
+            [('urgent', 2), ('normal', 1), ('bulk', 1), ('bulk', 1)])
+
+    def test_concurrency_limits(self):
+        picks = plan(
+            [
+                ('a', 1, 5, 10),
+                ('a', 2, 5, 20),
+                ('b', 1, 2, 30),
+            ],
+            in_progress_counts=dict(a=1),
+            concurrency_limits=dict(a=3),
+        )
+        # 1 in progress, so 2 more of 'a' can go.
+        self.assertListEqual(
+            picks, [('a', 1), ('a', 2), ('b', 1), ('b', 1)])
+
+    def test_budget(self):
+        picks = plan(
+            [
+                ('a', 1, 5, 10),
+                ('a', 2, 5, 20),
+            ],
+            budget=3,
+        )
+        self.assertListEqual(picks, [('a', 1), ('a', 2), ('a', 1)])
+
+
+class DispatchSimulationTest(BaseTest):
+    """
+    Simulate a flood of jobs from one source, with a few small sources
+    queueing jobs right after, and compare the policies' latency for the
+    small sources.
+    """
+    # Jobs the workers can get through between dispatcher runs.
+    WORKER_CAPACITY = 100
+    FLOOD_SIZE = 4000
+    SMALL_SOURCES = 10
+    SMALL_SOURCE_JOBS = 5
+
+    def make_jobs(self):
+        # (pk, job name, source ID)
+        jobs = [
+            (pk, 'extract_features', 1)
+            for pk in range(self.FLOOD_SIZE)]
+        for source_id in range(2, 2 + self.SMALL_SOURCES):
+            for _ in range(self.SMALL_SOURCE_JOBS):
+                jobs.append((len(jobs), 'classify_features', source_id))
+        return jobs
+
+    @staticmethod
+    def fifo_order(pending):
+        return sorted(pending)
+
+    def fair_share_order(self, pending):
+        groups = dict()
+        for pk, job_name, source_id in pending:
+            key = (job_name, source_id)
+            if key in groups:
+                groups[key].count += 1
+            else:
+                groups[key] = DueJobGroup(job_name, source_id, 1, pk)
+        picks = plan_fair_share_dispatch(
+            list(groups.values()), dict(),
+            budget=self.WORKER_CAPACITY,
+            priorities=dict(), default_priority=1, concurrency_limits=dict(),
+        )
+        group_jobs = dict()
+        for job in sorted(pending):
+            group_jobs.setdefault((job[1], job[2]), []).append(job)
+        return [group_jobs[key].pop(0) for key in picks]
+
+    def simulate(self, order_func):
+        """
+        Returns the number of dispatcher runs it took to finish all of
+        each source's jobs.
+        """
+        pending = self.make_jobs()
+        finished_at = dict()
+        run_number = 0
+        while pending:
+            run_number += 1
+            done = order_func(pending)[:self.WORKER_CAPACITY]
+            done_pks = set(job[0] for job in done)
+            pending = [job for job in pending if job[0] not in done_pks]
+            for _, _, source_id in done:
+                finished_at[source_id] = run_number
+        return finished_at
+
+    def test_small_source_tail_latency(self):
+        fifo = self.simulate(self.fifo_order)
+        fair_share = self.simulate(self.fair_share_order)
+
+        small_sources = range(2, 2 + self.SMALL_SOURCES)
+        fifo_tail = max(fifo[source_id] for source_id in small_sources)
+        fair_share_tail = max(
+            fair_share[source_id] for source_id in small_sources)
+
+        # FIFO: the small sources wait for the whole flood.
+        self.assertEqual(fifo_tail, 41)
+        # Fair share: the small sources are done within the first run.
+        self.assertEqual(fair_share_tail, 1)
+        # Either way, everything's done after the same number of runs.
+        self.assertEqual(max(fifo.values()), 41)
+        self.assertEqual(max(fair_share.values()), 41)
+
+
+def record_job_runs(runs):
+    def get_job_run_function(job_name):
+        def run(*args):
+            runs.append((job_name, *args))
+        return run
+    return get_job_run_function
+
+
+@override_settings(
+    JOB_DISPATCH_POLICY='fair_share',
+    JOB_PRIORITIES=dict(urgent=0),
+    JOB_DEFAULT_PRIORITY=1,
+    JOB_CONCURRENCY_LIMITS=dict(),
+)
+class FairShareRunScheduledJobsTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source_1 = cls.create_source(cls.user)
+        cls.source_2 = cls.create_source(cls.user)
+
+    def run_scheduled_jobs(self):
+        runs = []
+        with mock.patch(
+            'jobs.utils.get_job_run_function', record_job_runs(runs)
+        ):
+            run_scheduled_jobs()
+        return runs
+
+    def test_dispatch_order(self):
+        for i in range(3):
+            queue_job('test', f'1-{i}', source_id=self.source_1.pk)
+        queue_job('test', '2-0', source_id=self.source_2.pk)
+        queue_job('urgent', '2-1', source_id=self.source_2.pk)
+        queue_job('test', 'none')
+
+        self.assertListEqual(self.run_scheduled_jobs(), [
+            ('urgent', '2-1'),
+            ('test', '1-0'),
+            ('test', '2-0'),
+            ('test', 'none'),
+            ('test', '1-1'),
+            ('test', '1-2'),
+        ])
+
+    @override_settings(JOB_DISPATCH_BUDGET=2)
+    def test_budget(self):
+        for i in range(3):
+            queue_job('test', i, source_id=self.source_1.pk)
+
+        self.assertListEqual(
+            self.run_scheduled_jobs(), [('test', '0'), ('test', '1')])
+
+    @override_settings(JOB_CONCURRENCY_LIMITS=dict(test=2))
+    def test_concurrency_limit(self):
+        job = queue_job('test', 0, source_id=self.source_1.pk)
+        job.status = Job.Status.IN_PROGRESS
+        job.save()
+        for i in range(1, 4):
+            queue_job('test', i, source_id=self.source_1.pk)
+
+        self.assertListEqual(self.run_scheduled_jobs(), [('test', '1')])
@@ -0,0 +1,173 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from lib.tests.utils import BaseTest, ClientTest
+from ..metrics import clean_up_old_latency_histograms
+from ..models import Job, JobLatencyHistogram
+from ..utils import finish_job, queue_job, start_pending_job
+
+
+def create_started_job(name, wait, run):
+    """
+    Create an in-progress Job which waited `wait` past its scheduled
+    start, and has been running for `run`.
+    """
+    now = timezone.now()
+    job = queue_job(name, delay=timedelta(0))
+    job.status = Job.Status.IN_PROGRESS
+    job.start_date = now - run
+    job.scheduled_start_date = job.start_date - wait
+    job.save()
+    return job
+
+
+class RecordLatencyTest(BaseTest):
+
+    def test_lifecycle_dates(self):
+        job = queue_job('test', 1, delay=timedelta(0))
+        self.assertIsNone(job.start_date)
+
+        job = start_pending_job('test', '1')
+        self.assertIsNotNone(job.start_date)
+        self.assertIsNone(job.finish_date)
+
+        finish_job(job, success=True)
+        job.refresh_from_db()
+        self.assertGreaterEqual(job.finish_date, job.start_date)
+        self.assertGreaterEqual(job.start_date, job.create_date)
+
+        histogram = JobLatencyHistogram.objects.get(job_name='test')
+        self.assertEqual(histogram.status, Job.Status.SUCCESS)
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(sum(histogram.wait_buckets), 1)
+        self.assertEqual(sum(histogram.run_buckets), 1)
+
+    def test_buckets(self):
+        job = create_started_job(
+            'test', wait=timedelta(minutes=60), run=timedelta(minutes=10))
+        finish_job(job, success=False)
+        job = create_started_job(
+            'test', wait=timedelta(seconds=3), run=timedelta(minutes=10))
+        finish_job(job, success=False)
+
+        histogram = JobLatencyHistogram.objects.get(job_name='test')
+        self.assertEqual(histogram.status, Job.Status.FAILURE)
+        self.assertEqual(histogram.count, 2)
+        # <= 5 seconds, and <= 1 hour
+        self.assertListEqual(
+            histogram.wait_buckets, [0, 1, 0, 0, 0, 0, 1, 0, 0, 0])
+        # <= 15 minutes
+        self.assertListEqual(
+            histogram.run_buckets, [0, 0, 0, 0, 0, 2, 0, 0, 0, 0])
+        self.assertAlmostEqual(
+            histogram.run_seconds_total, 2 * 10 * 60, delta=5)
+
+    def test_finished_twice(self):
+        job = create_started_job(
+            'test', wait=timedelta(seconds=3), run=timedelta(minutes=10))
+        finish_job(job, success=True)
+        finish_job(job, success=True)
+
+        histogram = JobLatencyHistogram.objects.get(job_name='test')
+        self.assertEqual(histogram.count, 1)
+
+    def test_error_doesnt_stop_finish(self):
+        job = create_started_job(
+            'test', wait=timedelta(seconds=3), run=timedelta(minutes=10))
+        with mock.patch(
+            'jobs.utils.record_job_latency', side_effect=ValueError("Oops")
+        ):
+            with self.assertLogs('jobs.utils', level='ERROR'):
+                finish_job(job, success=True)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.SUCCESS)
+        self.assertFalse(JobLatencyHistogram.objects.exists())
+
+    def test_never_started(self):
+        job = queue_job('test', delay=timedelta(0))
+        finish_job(job, success=False, result_message="Aborted manually")
+        self.assertFalse(JobLatencyHistogram.objects.exists())
+
+    @override_settings(JOB_LATENCY_METRICS_MAX_DAYS=7)
+    def test_clean_up(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        JobLatencyHistogram(
+            job_name='old', status=Job.Status.SUCCESS,
+            period_start=hour - timedelta(days=8)).save()
+        JobLatencyHistogram(
+            job_name='new', status=Job.Status.SUCCESS,
+            period_start=hour - timedelta(days=6)).save()
+
+        clean_up_old_latency_histograms()
+        self.assertListEqual(
+            list(JobLatencyHistogram.objects.values_list(
+                'job_name', flat=True)),
+            ['new'])
+
+
+class LatencyMetricsViewsTest(ClientTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.superuser)
+
+        for wait_seconds in [2, 3, 100]:
+            job = create_started_job(
+                'extract_features', wait=timedelta(seconds=wait_seconds),
+                run=timedelta(seconds=30))
+            finish_job(job, success=True)
+        job = create_started_job(
+            'train_classifier', wait=timedelta(seconds=10),
+            run=timedelta(hours=2))
+        finish_job(job, success=False)
+
+    def test_json(self):
+        response = self.client.get(reverse('jobs:latency_metrics_json'))
+        response_json = response.json()
+        self.assertEqual(response_json['hours'], 24)
+
+        extract, train = response_json['jobs']
+        self.assertEqual(extract['job_name'], 'extract_features')
+        self.assertEqual(extract['status'], 'success')
+        self.assertEqual(extract['count'], 3)
+        self.assertEqual(extract['wait_seconds_p50'], 5)
+        self.assertEqual(extract['wait_seconds_p95'], 5*60)
+        self.assertEqual(extract['run_seconds_p50'], 60)
+
+        self.assertEqual(train['job_name'], 'train_classifier')
+        self.assertEqual(train['status'], 'failure')
+        self.assertEqual(train['count'], 1)
+        self.assertEqual(train['run_seconds_p50'], 4*60*60)
+
+    def test_window(self):
+        JobLatencyHistogram.objects.update(
+            period_start=timezone.now() - timedelta(hours=30))
+
+        response = self.client.get(reverse('jobs:latency_metrics_json'))
+        self.assertListEqual(response.json()['jobs'], [])
+        response = self.client.get(
+            reverse('jobs:latency_metrics_json') + '?hours=48')
+        self.assertEqual(len(response.json()['jobs']), 2)
+
+    def test_text(self):
+        response = self.client.get(reverse('jobs:latency_metrics_text'))
+        lines = response.content.decode().splitlines()
+
+        self.assertIn('# TYPE job_wait_seconds histogram', lines)
+        self.assertIn(
+            'job_wait_seconds_bucket'
+            '{job_name="extract_features",status="success",le="5"} 2',
+            lines)
+        self.assertIn(
+            'job_wait_seconds_bucket'
+            '{job_name="extract_features",status="success",le="+Inf"} 3',
+            lines)
+        self.assertIn(
+            'job_run_seconds_count'
+            '{job_name="train_classifier",status="failure"} 1',
+            lines)
@@ -121,12 +121,16 @@ class RunScheduledJobsTest(BaseTest):
 class CleanupTaskTest(BaseTest):
 
     @staticmethod
-    def run_and_get_result():
+    def run_and_get_full_result():
         job = queue_job('clean_up_old_jobs')
         clean_up_old_jobs()
         job.refresh_from_db()
         return job.result_message
 
+    def run_and_get_result(self):
+        # The first line, without the timing line.
+        return self.run_and_get_full_result().splitlines()[0]
+
     def test_zero_jobs_message(self):
         """
         Check the result message when there are no jobs to clean up.
@@ -233,6 +237,32 @@ class CleanupTaskTest(BaseTest):
             Job.objects.filter(job_name='no unit').exists(),
             "Should clean up no-unit job")
 
+    @override_settings(JOB_CLEANUP_CHUNK_SIZE=2)
+    def test_chunks(self):
+        for i in range(5):
+            queue_job_with_modify_date(
+                'old', i, modify_date=timezone.now() - timedelta(days=31))
+        queue_job('new')
+
+        result_lines = self.run_and_get_full_result().splitlines()
+        self.assertEqual(result_lines[0], "Cleaned up 5 old job(s)")
+        self.assertRegex(
+            result_lines[1], r"^[\d.]+ seconds, [\d.]+ rows per second$")
+        self.assertFalse(Job.objects.filter(job_name='old').exists())
+        self.assertTrue(Job.objects.filter(job_name='new').exists())
+
+    @override_settings(JOB_CLEANUP_CHUNK_SIZE=2, JOB_MAX_MINUTES=-1)
+    def test_time_out(self):
+        for i in range(5):
+            queue_job_with_modify_date(
+                'old', i, modify_date=timezone.now() - timedelta(days=31))
+
+        self.assertEqual(
+            self.run_and_get_result(),
+            "Cleaned up 2 old job(s)"
+            " (timed out; the rest will be cleaned up next run)")
+        self.assertEqual(Job.objects.filter(job_name='old').count(), 3)
+
 
 class ReportStuckJobsTest(BaseTest):
     """
@@ -3,6 +3,7 @@ from unittest import mock
 
 from django.db import connections, transaction
 from django.db.utils import DEFAULT_DB_ALIAS
+from django.test import override_settings
 from django.test.testcases import TransactionTestCase
 from django.utils import timezone
 
@@ -12,7 +13,8 @@ from ..exceptions import JobError
 from ..models import Job
 from ..utils import (
     finish_job, full_job, job_runner,
-    job_starter, queue_job, start_pending_job)
+    job_starter, queue_job, queue_jobs, queue_or_get_active_job,
+    start_pending_job, start_pending_jobs)
 
 
 class QueueJobTest(BaseTest, ErrorReportTestMixin):
@@ -160,6 +162,139 @@ class QueueJobTest(BaseTest, ErrorReportTestMixin):
         )
 
 
+class QueueOrGetActiveJobTest(BaseTest):
+
+    def test_queue_new(self):
+        job = queue_or_get_active_job('name', 1, source_id=None)
+        self.assertEqual(job.status, Job.Status.PENDING)
+        self.assertLessEqual(job.scheduled_start_date, timezone.now())
+
+    def test_get_active(self):
+        active_job = queue_job(
+            'name', 1, initial_status=Job.Status.IN_PROGRESS)
+        job = queue_or_get_active_job('name', 1)
+        self.assertEqual(job.pk, active_job.pk)
+
+    def test_active_job_finishes_before_lookup(self):
+        active_job = queue_job(
+            'name', 1, initial_status=Job.Status.IN_PROGRESS)
+
+        def finish_then_queue(*args, **kwargs):
+            # The active job finishes right after it's found by
+            # queue_job().
+            if active_job.status == Job.Status.IN_PROGRESS:
+                finish_job(active_job, success=True)
+                return None
+            return queue_job(*args, **kwargs)
+
+        with mock.patch('jobs.utils.queue_job', finish_then_queue):
+            job = queue_or_get_active_job('name', 1)
+
+        self.assertNotEqual(job.pk, active_job.pk)
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+    def test_queue_again_on_commit(self):
+        active_job = queue_job(
+            'name', 1, initial_status=Job.Status.IN_PROGRESS)
+        with self.captureOnCommitCallbacks() as callbacks:
+            queue_or_get_active_job('name', 1)
+        # The active job finishes before the caller's transaction commits.
+        finish_job(active_job, success=True)
+        for callback in callbacks:
+            callback()
+
+        Job.objects.get(job_name='name', status=Job.Status.PENDING)
+
+
+class QueueJobsTest(BaseTest, ErrorReportTestMixin):
+
+    def test_queue_new(self):
+        jobs = queue_jobs('name', [('1',), ('2',), ('3',)], source_id=None)
+
+        self.assertEqual(len(jobs), 3)
+        self.assertListEqual(
+            [job.arg_identifier for job in jobs], ['1', '2', '3'])
+        for job in jobs:
+            self.assertEqual(job.status, Job.Status.PENDING)
+            self.assertEqual(job.attempt_number, 1)
+            self.assertIsNotNone(job.pk, "Should be saved to the DB")
+
+    def test_skip_active_and_duplicate(self):
+        queue_job('name', '1')
+        queue_job('name', '2', initial_status=Job.Status.IN_PROGRESS)
+        queue_job('name', '3', initial_status=Job.Status.SUCCESS)
+
+        jobs = queue_jobs('name', [('1',), ('2',), ('3',), ('3',), ('4',)])
+
+        self.assertListEqual(
+            [job.arg_identifier for job in jobs], ['3', '4'],
+            "Should only queue jobs which aren't active, without dupes")
+        self.assertEqual(Job.objects.count(), 5)
+
+    def test_start_date_update(self):
+        job = queue_job('name', '1', delay=timedelta(hours=1))
+        original_start_date = job.scheduled_start_date
+
+        queue_jobs('name', [('1',)], delay=timedelta(hours=5))
+        job.refresh_from_db()
+        self.assertEqual(
+            job.scheduled_start_date, original_start_date,
+            msg="Start date shouldn't be updated when requesting a later date"
+        )
+
+        queue_jobs('name', [('1',)])
+        job.refresh_from_db()
+        self.assertLess(
+            job.scheduled_start_date, original_start_date,
+            msg="Start date should be updated when requesting an earlier date"
+        )
+
+    def test_attempt_numbers(self):
+        job = queue_job('name', '1', initial_status=Job.Status.IN_PROGRESS)
+        finish_job(job, success=False, result_message="An error")
+        job = queue_job('name', '2', initial_status=Job.Status.IN_PROGRESS)
+        finish_job(job, success=True)
+
+        jobs = queue_jobs('name', [('1',), ('2',), ('3',)])
+
+        self.assertListEqual(
+            [job.attempt_number for job in jobs], [2, 1, 1])
+
+    def test_repeated_failure(self):
+        for _ in range(5):
+            job = queue_job(
+                'name', 'arg', initial_status=Job.Status.IN_PROGRESS)
+            finish_job(job, success=False, result_message="An error")
+
+        [job] = queue_jobs('name', [('arg',)])
+        self.assert_error_email(
+            "Job has been failing repeatedly: name / arg, attempt 5",
+            ["Error info:\n\nAn error"],
+        )
+        self.assertAlmostEquals(
+            timezone.now() + timedelta(days=3),
+            job.scheduled_start_date,
+            delta=timedelta(minutes=10),
+            msg="Latest job should be pushed back to 3 days in the future",
+        )
+
+    @override_settings(JOB_BULK_QUEUE_CHUNK_SIZE=10)
+    def test_multiple_chunks(self):
+        queue_job('name', '15')
+
+        jobs = queue_jobs(
+            'name', [(str(n),) for n in range(25)], source_id=None)
+
+        self.assertEqual(len(jobs), 24)
+        self.assertEqual(Job.objects.count(), 25)
+
+    def test_query_count_independent_of_job_count(self):
+        with self.assertNumQueries(3):
+            queue_jobs('name', [(str(n),) for n in range(100)])
+        with self.assertNumQueries(3):
+            queue_jobs('other_name', [(str(n),) for n in range(500)])
+
+
 class StartPendingJobTest(BaseTest):
 
     def test_job_not_found(self):
@@ -203,6 +338,46 @@ class StartPendingJobTest(BaseTest):
             "Dupe jobs should have been deleted")
 
 
+class StartPendingJobsTest(BaseTest):
+
+    def test_start(self):
+        job_1 = queue_job('name', '1')
+        job_2 = queue_job('name', '2')
+        queue_job('name', '3')
+
+        started_jobs = start_pending_jobs([job_1.pk, job_2.pk])
+
+        self.assertListEqual(
+            [job.pk for job in started_jobs], [job_1.pk, job_2.pk])
+        self.assertListEqual(
+            list(
+                Job.objects.order_by('pk').values_list('status', flat=True)),
+            [Job.Status.IN_PROGRESS, Job.Status.IN_PROGRESS,
+             Job.Status.PENDING],
+        )
+
+    def test_skip_non_pending(self):
+        job_1 = queue_job('name', '1', initial_status=Job.Status.SUCCESS)
+        job_2 = queue_job('name', '2')
+
+        started_jobs = start_pending_jobs([job_1.pk, job_2.pk])
+
+        self.assertListEqual([job.pk for job in started_jobs], [job_2.pk])
+        job_1.refresh_from_db()
+        self.assertEqual(job_1.status, Job.Status.SUCCESS)
+
+    def test_skip_already_in_progress(self):
+        queue_job('name', '1', initial_status=Job.Status.IN_PROGRESS)
+        dupe_job = Job(job_name='name', arg_identifier='1')
+        dupe_job.save()
+
+        started_jobs = start_pending_jobs([dupe_job.pk])
+
+        self.assertListEqual(started_jobs, [])
+        dupe_job.refresh_from_db()
+        self.assertEqual(dupe_job.status, Job.Status.PENDING)
+
+
 class FinishJobTest(BaseTest):
 
     def test_periodic_job_queues_another_run(self):
@@ -232,6 +407,21 @@ class FinishJobTest(BaseTest):
         # Another PENDING job should exist now
         Job.objects.get(job_name='name', status=Job.Status.PENDING)
 
+    def test_more_work_queues_another_run(self):
+        checks = dict(name=lambda arg1: arg1 == 'more')
+
+        with mock.patch('jobs.utils.get_more_work_checks', lambda: checks):
+            job = queue_job(
+                'name', 'more', initial_status=Job.Status.IN_PROGRESS)
+            finish_job(job, success=False)
+            job_2 = queue_job(
+                'name', 'done', initial_status=Job.Status.IN_PROGRESS)
+            finish_job(job_2, success=True)
+
+        new_job = Job.objects.get(job_name='name', status=Job.Status.PENDING)
+        self.assertEqual(new_job.arg_identifier, 'more')
+        self.assertEqual(new_job.attempt_number, 2)
+
 
 @full_job()
 def full_job_example(arg1):
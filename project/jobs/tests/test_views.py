@@ -52,6 +52,20 @@ class PermissionTest(BasePermissionTest):
             url, self.SUPERUSER, template=template,
             deny_type=self.REQUIRE_LOGIN)
 
+    def test_latency_metrics_json(self):
+        url = reverse('jobs:latency_metrics_json')
+
+        self.assertPermissionLevel(
+            url, self.SUPERUSER, content_type='application/json',
+            deny_type=self.REQUIRE_LOGIN)
+
+    def test_latency_metrics_text(self):
+        url = reverse('jobs:latency_metrics_text')
+
+        self.assertPermissionLevel(
+            url, self.SUPERUSER, content_type='text/plain',
+            deny_type=self.REQUIRE_LOGIN)
+
     def test_source_job_list(self):
         url = reverse('jobs:source_job_list', args=[self.source.pk])
         template = 'jobs/source_job_list.html'
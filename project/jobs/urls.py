@@ -12,6 +12,10 @@ urlpatterns = [
          views.AllJobsListView.as_view(), name='all_jobs_list'),
     path(r'jobs/non_source_list/',
          views.NonSourceJobListView.as_view(), name='non_source_job_list'),
+    path(r'jobs/metrics/latency.json',
+         views.latency_metrics_json, name='latency_metrics_json'),
+    path(r'jobs/metrics/latency.txt',
+         views.latency_metrics_text, name='latency_metrics_text'),
     path(r'source/<int:source_id>/jobs/',
          views.SourceJobListView.as_view(), name='source_job_list'),
 ]
@@ -4,7 +4,7 @@ import math
 import random
 import sys
 import traceback
-from typing import Optional
+from typing import Callable, Iterable, Optional
 
 from django.conf import settings
 from django.core.mail import mail_admins
@@ -17,7 +17,9 @@ from huey.contrib.djhuey import db_periodic_task, db_task
 
 from errorlogs.utils import instantiate_error_log
 from .exceptions import JobError
+from .metrics import record_job_latency
 from .models import Job
+from .signals import job_finished
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +98,8 @@ def queue_job(
         status=initial_status,
         **job_kwargs
     )
+    if initial_status == Job.Status.IN_PROGRESS:
+        job.start_date = now
     try:
         job.save()
     except IntegrityError:
@@ -110,6 +114,278 @@ def queue_job(
     return job
 
 
+def queue_or_get_active_job(
+        name: str, *task_args, source_id: int = None) -> Optional[Job]:
+    """
+    For jobs which process a queue of pending rows (such as images marked
+    for deletion): after adding rows, call this to queue the job to start
+    right away, or if the same job is already pending or in progress,
+    get that job instead; it'll pick up the new rows.
+
+    The job should also define has_more_work, in case the active job was
+    already wrapping up without having seen the new rows.
+    Returns the queued or active Job. This is None only if other threads
+    keep finishing and queueing the same job in between our queries.
+    """
+    arg_identifier = Job.args_to_identifier(task_args)
+    job = None
+    # If the active job finishes between queue_job() and the lookup,
+    # queue_job() can be tried again.
+    for _ in range(2):
+        job = queue_job(
+            name, *task_args,
+            delay=timedelta(seconds=0), source_id=source_id)
+        if job:
+            break
+        job = Job.objects.filter(
+            job_name=name,
+            arg_identifier=arg_identifier,
+            status__in=[Job.Status.PENDING, Job.Status.IN_PROGRESS],
+        ).order_by('-pk').first()
+        if job:
+            break
+
+    # The caller's rows aren't visible to the active job until the
+    # caller's transaction commits. If the job checks for more work before
+    # then, it won't find any; so once committed, queue the job again if
+    # it has finished by then.
+    transaction.on_commit(lambda: queue_job(
+        name, *task_args, delay=timedelta(seconds=0), source_id=source_id))
+
+    return job
+
+
+def get_source_job_progress(
+        name: str, source_id: int, remaining: int,
+        description: str) -> dict:
+    """
+    Progress of a source's job which processes a queue of pending rows
+    (see queue_or_get_active_job()), for a progress-polling view.
+
+    :param remaining: Number of the source's pending rows left.
+    :param description: What the job does, for error messages,
+      such as "Image deletion".
+    """
+    jobs = Job.objects.filter(
+        job_name=name,
+        arg_identifier=Job.args_to_identifier([source_id]),
+    ).order_by('-pk')
+    job = jobs.first()
+
+    progress = dict(
+        job_id=job.pk if job else None,
+        status=job.status if job else None,
+        remaining=remaining,
+        done=(remaining == 0),
+    )
+
+    # A job which failed with rows remaining gets queued again, so the
+    # latest job may be the retry.
+    last_finished_job = jobs.filter(
+        status__in=[Job.Status.SUCCESS, Job.Status.FAILURE]).first()
+    if not (
+        last_finished_job
+        and last_finished_job.status == Job.Status.FAILURE
+    ):
+        return progress
+
+    if remaining > 0:
+        progress['done'] = True
+        progress['error'] = (
+            f"{description} failed with {remaining} image(s) remaining:"
+            f" {last_finished_job.result_message}")
+        if job.status != Job.Status.FAILURE:
+            progress['error'] += " (It will be retried.)"
+    elif job.pk == last_finished_job.pk:
+        # The job got through all the rows, but some of them failed.
+        progress['error'] = last_finished_job.result_message
+    return progress
+
+
+def queue_jobs(
+        name: str,
+        arg_tuples: Iterable[Iterable],
+        delay: timedelta = None,
+        source_id: int = None,
+        chunk_size: int = None) -> list[Job]:
+    """
+    Bulk version of queue_job(), for queueing many Jobs of the same name
+    at once (such as one per image in a source).
+
+    Each chunk of arg tuples costs a fixed number of set-based queries:
+    one to find already-active Jobs, one to update earlier-requested start
+    dates, one to look up the last attempts, and a bulk insert.
+    With queue_job(), each individual Job would cost about that much.
+
+    Like queue_job(), this is a best-effort check against duplicates, and
+    new Jobs are created as PENDING.
+
+    Returns the list of newly created Jobs.
+    """
+    if chunk_size is None:
+        chunk_size = settings.JOB_BULK_QUEUE_CHUNK_SIZE
+
+    # Dedupe the identifiers while preserving order.
+    arg_identifiers = list(dict.fromkeys(
+        Job.args_to_identifier(args) for args in arg_tuples))
+
+    created_jobs = []
+    for chunk_start in range(0, len(arg_identifiers), chunk_size):
+        chunk = arg_identifiers[chunk_start:chunk_start+chunk_size]
+        created_jobs.extend(_queue_jobs_chunk(
+            name, chunk, delay=delay, source_id=source_id))
+    return created_jobs
+
+
+def _queue_jobs_chunk(
+        name: str,
+        arg_identifiers: list[str],
+        delay: Optional[timedelta],
+        source_id: Optional[int]) -> list[Job]:
+
+    now = timezone.now()
+    if delay is None:
+        # Random jitter per Job, as in queue_job(). Jobs which already
+        # exist may get their start date moved up to the latest date
+        # that the jitter can produce.
+        start_dates = [
+            now + timedelta(seconds=random.randrange(5, 30))
+            for _ in arg_identifiers
+        ]
+        latest_start_date = now + timedelta(seconds=29)
+    else:
+        start_dates = [now + delay] * len(arg_identifiers)
+        latest_start_date = now + delay
+
+    jobs = Job.objects.filter(
+        job_name=name, arg_identifier__in=arg_identifiers)
+
+    # Skip Jobs which are already pending or in progress.
+    active_jobs = jobs.filter(
+        status__in=[Job.Status.PENDING, Job.Status.IN_PROGRESS])
+    active_identifiers = set(
+        active_jobs.values_list('arg_identifier', flat=True))
+    if active_identifiers:
+        logger.debug(
+            f"{len(active_identifiers)} [{name}] job(s) are already"
+            f" pending or in progress.")
+        # Update the scheduled start dates of pending Jobs if earlier
+        # dates were just requested.
+        active_jobs.filter(
+            status=Job.Status.PENDING,
+            scheduled_start_date__gt=latest_start_date,
+        ).update(scheduled_start_date=latest_start_date)
+
+    to_queue = [
+        (identifier, start_date)
+        for identifier, start_date in zip(arg_identifiers, start_dates)
+        if identifier not in active_identifiers
+    ]
+    if not to_queue:
+        return []
+
+    # Latest previous Job for each identifier, to see if the same job
+    # failed last time (if there was a last time).
+    last_jobs = (
+        jobs
+        .filter(arg_identifier__in=[
+            identifier for identifier, _ in to_queue])
+        .order_by('arg_identifier', '-pk')
+        .distinct('arg_identifier')
+    )
+    last_failed_jobs = {
+        last_job.arg_identifier: last_job
+        for last_job in last_jobs
+        if last_job.status == Job.Status.FAILURE
+    }
+
+    new_jobs = []
+    for identifier, scheduled_start_date in to_queue:
+        attempt_number = 1
+        last_job = last_failed_jobs.get(identifier)
+        if last_job:
+            attempt_number = last_job.attempt_number + 1
+
+            if attempt_number > 5:
+                # Notify admins on repeated failure.
+                mail_admins(
+                    f"Job has been failing repeatedly: {last_job}",
+                    f"Error info:\n\n{last_job.result_message}",
+                )
+                # Make sure it doesn't retry too quickly until the failure
+                # situation's resolved.
+                three_days_from_now = now + timedelta(days=3)
+                if scheduled_start_date < three_days_from_now:
+                    scheduled_start_date = three_days_from_now
+
+        new_jobs.append(Job(
+            job_name=name,
+            arg_identifier=identifier,
+            scheduled_start_date=scheduled_start_date,
+            attempt_number=attempt_number,
+            source_id=source_id,
+            status=Job.Status.PENDING,
+        ))
+
+    return Job.objects.bulk_create(new_jobs)
+
+
+def delete_in_chunks(
+        queryset, wrap_up_time: datetime,
+        chunk_size: int = None) -> tuple[int, bool]:
+    """
+    Delete the queryset's objects a chunk at a time, paging through them
+    by pk, so that no single delete locks a large part of the table for
+    long. Each chunk's delete re-applies the queryset's filters, in case
+    objects have changed since they were paged through.
+
+    Stops after the chunk which passes wrap_up_time.
+    Returns the number of objects deleted (not counting cascades), and
+    whether we stopped due to time.
+    """
+    if chunk_size is None:
+        chunk_size = settings.JOB_CLEANUP_CHUNK_SIZE
+
+    model_label = queryset.model._meta.label
+    deleted = 0
+    last_pk = None
+
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        pks = list(page.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted, False
+        last_pk = pks[-1]
+
+        with transaction.atomic():
+            _, counts = queryset.filter(pk__in=pks).delete()
+        deleted += counts.get(model_label, 0)
+
+        if len(pks) < chunk_size:
+            return deleted, False
+        if timezone.now() > wrap_up_time:
+            return deleted, True
+
+
+def cleanup_result_message(
+        count: int, description: str, seconds: float,
+        timed_out: bool) -> str:
+    """
+    Result message for a cleanup job which used delete_in_chunks().
+    """
+    if count == 0:
+        return f"No {description}s to clean up"
+
+    message = f"Cleaned up {count} {description}(s)"
+    if timed_out:
+        message += " (timed out; the rest will be cleaned up next run)"
+    rate = count / seconds if seconds > 0 else count
+    message += f"\n{seconds:.1f} seconds, {rate:.1f} rows per second"
+    return message
+
+
 def start_pending_job(job_name: str, arg_identifier: str) -> Optional[Job]:
     """
     Find a pending job matching the passed fields.
@@ -155,18 +431,80 @@ def start_pending_job(job_name: str, arg_identifier: str) -> Optional[Job]:
                 dupe_job.delete()
 
         job.status = Job.Status.IN_PROGRESS
+        job.start_date = timezone.now()
         job.save()
     return job
 
 
+def start_pending_jobs(job_ids: Iterable[int]) -> list[Job]:
+    """
+    Bulk version of start_pending_job(), for Jobs identified by pk.
+    This is for callers which process several Jobs together in one go.
+
+    Jobs are skipped if they're no longer pending, if they're locked by
+    another thread, or if an identical Job is already in progress.
+    Returns the Jobs which were updated to in-progress.
+    """
+    jobs_queryset = (
+        Job.objects.select_for_update(skip_locked=True)
+        .filter(pk__in=job_ids, status=Job.Status.PENDING)
+        .order_by('pk')
+    )
+    try:
+        with transaction.atomic():
+            jobs = list(jobs_queryset)
+            if not jobs:
+                return []
+
+            in_progress_keys = set(
+                Job.objects.filter(
+                    job_name__in=set(job.job_name for job in jobs),
+                    arg_identifier__in=set(
+                        job.arg_identifier for job in jobs),
+                    status=Job.Status.IN_PROGRESS,
+                ).values_list('job_name', 'arg_identifier')
+            )
+            jobs_to_start = []
+            for job in jobs:
+                key = (job.job_name, job.arg_identifier)
+                if key in in_progress_keys:
+                    logger.info(f"Job [{job}] already in progress.")
+                    continue
+                # Also guards against duplicate pending jobs in this batch.
+                in_progress_keys.add(key)
+                jobs_to_start.append(job)
+
+            # update() doesn't apply auto_now, so we set modify_date
+            # ourselves.
+            now = timezone.now()
+            Job.objects.filter(
+                pk__in=[job.pk for job in jobs_to_start]
+            ).update(
+                status=Job.Status.IN_PROGRESS, modify_date=now,
+                start_date=now)
+    except IntegrityError:
+        # Another thread started an identical job in the meantime.
+        logger.info("Jobs could not be started due to a race condition.")
+        return []
+
+    for job in jobs_to_start:
+        job.status = Job.Status.IN_PROGRESS
+        job.modify_date = now
+        job.start_date = now
+    return jobs_to_start
+
+
 def finish_job(job, success=False, result_message=None):
     """
     Update Job status from IN_PROGRESS to SUCCESS/FAILURE,
     and do associated bookkeeping.
     """
+    was_finished = job.status in [Job.Status.SUCCESS, Job.Status.FAILURE]
+
     # This field doesn't take None; no message is set as an empty string.
     job.result_message = result_message or ""
     job.status = Job.Status.SUCCESS if success else Job.Status.FAILURE
+    job.finish_date = timezone.now()
 
     # Successful jobs related to classifier history should persist in the DB.
     name = job.job_name
@@ -178,10 +516,26 @@ def finish_job(job, success=False, result_message=None):
         job.persist = True
 
     job.save()
+    if not was_finished:
+        try:
+            with transaction.atomic():
+                record_job_latency(job)
+        except Exception:
+            # Metrics shouldn't get in the way of finishing the job.
+            logger.exception(f"Couldn't record latency of job [{job}]")
+        job_finished.send(sender=Job, job=job)
 
     if job.result_message:
         logger.info(f"Job [{job}]: {job.result_message}")
 
+    more_work_check = get_more_work_checks().get(name, None)
+    if more_work_check:
+        task_args = Job.identifier_to_args(job.arg_identifier)
+        if more_work_check(*task_args):
+            # More work arrived while the job was wrapping up, or the job
+            # stopped partway due to an error.
+            queue_job(name, *task_args, source_id=job.source_id)
+
     if settings.ENABLE_PERIODIC_JOBS:
         # If it's a periodic job, schedule another run of it
         schedule = get_periodic_job_schedules().get(name, None)
@@ -195,11 +549,17 @@ class JobDecorator:
         self, job_name: str = None,
         interval: timedelta = None, offset: datetime = None,
         huey_interval_minutes: int = None,
+        has_more_work: Callable[..., bool] = None,
     ):
         # This can be left unspecified if the task name works as the
         # job name.
         self.job_name = job_name
 
+        # Optional function which takes the task args, and returns True
+        # if there's still work for the job to do. If so when the job
+        # finishes, the job is queued again.
+        self.has_more_work = has_more_work
+
         # This should be present if the job is to be run periodically
         # through run_scheduled_jobs().
         # This is an interval for next_run_delay().
@@ -240,6 +600,9 @@ class JobDecorator:
                     self.job_name, self.interval, self.offset)
             huey_decorator = db_task(name=self.job_name)
 
+        if self.has_more_work:
+            set_more_work_check(self.job_name, self.has_more_work)
+
         @huey_decorator
         def task_wrapper(*task_args):
             self.run_task_wrapper(task_func, task_args)
@@ -424,6 +787,22 @@ def set_periodic_job_schedule(name, interval, offset):
     _periodic_job_schedules[name] = (interval, offset)
 
 
+_more_work_checks = dict()
+
+
+def get_more_work_checks():
+    if len(_more_work_checks) == 0:
+        # Auto-discover.
+        # 'Running' the tasks modules should populate the dict.
+        autodiscover_modules('tasks')
+
+    return _more_work_checks
+
+
+def set_more_work_check(name, check):
+    _more_work_checks[name] = check
+
+
 def next_run_delay(interval: int, offset: int = 0) -> timedelta:
     """
     Given a periodic job with a periodic interval of `interval` and a period
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 
 from django.conf import settings
 from django.contrib.auth.decorators import permission_required
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils.decorators import method_decorator
 from django.views import View
@@ -10,6 +11,8 @@ from images.models import Source
 from lib.decorators import source_permission_required
 from lib.utils import paginate
 from .forms import JobSearchForm, JobSummaryForm
+from .metrics import (
+    format_latency_metrics_text, get_latency_summary, LATENCY_BUCKET_SECONDS)
 from .models import Job
 
 
@@ -258,3 +261,35 @@ class JobSummaryView(View):
         )
 
         return render(request, self.template_name, context)
+
+
+def get_metrics_hours(request):
+    """
+    Time window for the latency metrics views, from the `hours` GET
+    param. Defaults to the last day, and is capped by how long the
+    histograms are kept.
+    """
+    max_hours = settings.JOB_LATENCY_METRICS_MAX_DAYS * 24
+    try:
+        hours = int(request.GET.get('hours', 24))
+    except ValueError:
+        hours = 24
+    return min(max(hours, 1), max_hours)
+
+
+@permission_required('is_superuser')
+def latency_metrics_json(request):
+    hours = get_metrics_hours(request)
+    return JsonResponse(dict(
+        hours=hours,
+        bucket_seconds=LATENCY_BUCKET_SECONDS,
+        jobs=get_latency_summary(hours),
+    ))
+
+
+@permission_required('is_superuser')
+def latency_metrics_text(request):
+    hours = get_metrics_hours(request)
+    return HttpResponse(
+        format_latency_metrics_text(get_latency_summary(hours)),
+        content_type='text/plain; version=0.0.4')
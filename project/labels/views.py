@@ -23,7 +23,7 @@ from lib.decorators import (
 from lib.exceptions import FileProcessError
 from lib.forms import get_one_formset_error, get_one_form_error
 from upload.forms import CSVImportForm
-from visualization.utils import generate_patch_if_doesnt_exist, get_patch_url
+from visualization.utils import generate_patches, get_patch_url
 from .decorators import label_edit_permission_required
 from .forms import (
     LabelForm, LabelSearchForm, LabelSetForm, LocalLabelForm,
@@ -437,14 +437,15 @@ def label_example_patches_ajax(request, label_id):
     except (EmptyPage, InvalidPage):
         page_annotations = paginator.page(paginator.num_pages)
 
+    generate_patches(
+        [annotation.point_id for annotation in page_annotations.object_list])
+
     patches = []
     for index, annotation in enumerate(page_annotations.object_list):
         point = annotation.point
         image = point.image
         source = image.source
 
-        generate_patch_if_doesnt_exist(point.pk)
-
         if source.visible_to_user(request.user):
             dest_url = reverse('image_detail', args=[image.pk])
         else:
@@ -14,7 +14,7 @@ from storages.backends.s3boto3 import S3Boto3Storage
 
 from images.models import Source
 from labels.models import LabelGroup, Label, LabelSet, LocalLabel
-from .tests.utils import ClientTest
+from .tests.utils import ClientTest, confirm_annotations_upload
 
 User = get_user_model()
 
@@ -238,7 +238,8 @@ class VisionBackendRegressionTest(ClientTest):
             )
 
         def upload_anns():
-            return self.client.post(
+            return confirm_annotations_upload(
+                self.client,
                 reverse('upload_annotations_csv_confirm_ajax',
                         args=[self.source.pk]),
             )
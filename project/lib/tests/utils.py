@@ -36,6 +36,8 @@ from spacer.messages import ClassifyReturnMsg
 
 from images.model_utils import PointGen
 from images.models import Source, Point, Image
+from jobs.models import Job
+from jobs.utils import run_job
 from labels.models import LabelGroup, Label
 from vision_backend.models import Classifier
 import vision_backend.task_helpers as backend_task_helpers
@@ -1333,6 +1335,18 @@ def add_robot_annotations(robot, image, annotations=None):
         image.pk, clf_return_msg, global_labels, robot)
 
 
+def confirm_annotations_upload(client, url):
+    """
+    Post to an upload-annotations-confirm view with the given client, then
+    run the import_annotations job it queues right away, instead of waiting
+    for the job runner.
+    """
+    response = client.post(url)
+    if response.json().get('success'):
+        run_job(Job.objects.get(pk=response.json()['job_id']))
+    return response
+
+
 def scrambled_run(
     items_sort_order: list[Callable[[int], Any]]
 ) -> tuple[list[int], dict[int, Any]]:
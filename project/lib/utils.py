@@ -3,11 +3,27 @@
 import datetime
 import random
 import string
+from typing import Iterable, Iterator
 import urllib.parse
 
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 
 
+def chunked(items: Iterable, chunk_size: int) -> Iterator[list]:
+    """
+    Split an iterable into lists of (at most) chunk_size items, without
+    consuming more of the iterable than needed for the current chunk.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def filesize_display(num_bytes):
     """
     Return a human-readable filesize string in B, KB, MB, or GB.
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0002_pendingimagedeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAnnotationImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.JSONField()),
+                ('cpc_filename', models.CharField(default='', max_length=1000)),
+                ('cpc_content', models.TextField(default='')),
+                ('request_date', models.DateTimeField(auto_now_add=True)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_import', to='images.image')),
+                ('source', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='images.source')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+from images.models import Image, Source
+
+
+class PendingAnnotationImport(models.Model):
+    """
+    Uploaded points/annotations for an image, which have been confirmed
+    but not saved yet. The import_annotations job saves these in the
+    background, replacing the image's previous points and annotations.
+    """
+    image = models.OneToOneField(
+        Image, on_delete=models.CASCADE, related_name='pending_import')
+    source = models.ForeignKey(
+        Source, on_delete=models.CASCADE, editable=False)
+    # The user who confirmed the upload.
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # List of dicts with row, column, and (optionally) label code.
+    points = models.JSONField()
+    # Uploaded CPC file, if the upload was from CPC.
+    cpc_filename = models.CharField(default='', max_length=1000)
+    cpc_content = models.TextField(default='')
+    request_date = models.DateTimeField(auto_now_add=True)
@@ -88,7 +88,7 @@ var UploadAnnotationsHelper = (function() {
         }
         else if (newStatus === 'save_error') {
             $uploadStartButton.disable();
-            $statusDisplay.text("Error while saving; no points or annotations saved");
+            $statusDisplay.text("Error while saving points and annotations");
             $statusDetail.empty();
 
             // Fill $statusDetail with the error message,
@@ -234,17 +234,45 @@ var UploadAnnotationsHelper = (function() {
     }
 
     /* Callback after the Ajax response is received, indicating that
-     * the server upload and processing are done. */
+     * the server has queued the points and annotations to be saved. */
     function handleUploadResponse(response) {
         if (response['error']) {
-            updateStatus('save_error');
             csvFileError = response['error'];
+            updateStatus('save_error');
+            util.pageLeaveWarningDisable();
         }
         else {
-            updateStatus('saved');
+            pollSaveProgress(response['progress_url']);
         }
+    }
+
+    /* The points and annotations are saved by a background job. Poll
+     * its progress until it's done. */
+    function pollSaveProgress(progressUrl) {
+        $.ajax({
+            url: progressUrl,
+            type: 'GET',
+            success: handleSaveProgressResponse.bind(null, progressUrl),
+            error: util.handleServerError
+        });
+    }
 
-        util.pageLeaveWarningDisable();
+    function handleSaveProgressResponse(progressUrl, progress) {
+        if (progress['error']) {
+            csvFileError = progress['error'];
+            updateStatus('save_error');
+            util.pageLeaveWarningDisable();
+        }
+        else if (progress['done']) {
+            updateStatus('saved');
+            util.pageLeaveWarningDisable();
+        }
+        else {
+            $statusDisplay.text(
+                "Saving points and annotations... ({0} images remaining)"
+                .format(progress['remaining']));
+            window.setTimeout(pollSaveProgress.bind(null, progressUrl), 2000);
+        }
     }
 
 
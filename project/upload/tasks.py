@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.db import transaction
+import reversion
+
+from images.models import Source
+from jobs.exceptions import JobError
+from jobs.utils import job_runner
+from vision_backend.utils import queue_source_check
+from .models import PendingAnnotationImport
+from .utils import save_pending_annotation_imports
+
+
+def source_has_pending_imports(source_id):
+    return PendingAnnotationImport.objects.filter(
+        source_id=source_id).exists()
+
+
+@job_runner(
+    job_name='import_annotations',
+    has_more_work=source_has_pending_imports)
+def import_annotations(source_id):
+    """
+    Save the source's pending annotation imports, replacing the images'
+    previous points and annotations. Images are imported in chunks, so
+    that progress is committed (and visible) as we go.
+    """
+    source = Source.objects.get(pk=source_id)
+    imported_count = 0
+    # Names and unknown label codes of images which were skipped.
+    skipped_images = []
+
+    try:
+        while True:
+            pending_imports = list(
+                PendingAnnotationImport.objects.filter(source=source)
+                .select_related('image__metadata', 'user')
+                .order_by('pk')
+                [:settings.ANNOTATION_IMPORT_CHUNK_SIZE]
+            )
+            if not pending_imports:
+                break
+
+            # Different users may have confirmed uploads to the source.
+            imports_by_user = dict()
+            for pending in pending_imports:
+                imports_by_user.setdefault(pending.user_id, []).append(pending)
+
+            unknown_codes_by_image = dict()
+            with transaction.atomic():
+                for user_imports in imports_by_user.values():
+                    with reversion.create_revision():
+                        # The bulk-created annotation Versions go under a
+                        # Revision attributed to the user who confirmed
+                        # the upload.
+                        reversion.set_user(user_imports[0].user)
+                        unknown_codes_by_image.update(
+                            save_pending_annotation_imports(
+                                source, user_imports))
+                # Skipped images' pending imports are deleted too, so that
+                # they don't block the rest of the source's imports.
+                PendingAnnotationImport.objects.filter(
+                    pk__in=[pending.pk for pending in pending_imports]
+                ).delete()
+
+            for pending in pending_imports:
+                if pending.image_id in unknown_codes_by_image:
+                    codes = unknown_codes_by_image[pending.image_id]
+                    skipped_images.append(
+                        f"{pending.image.metadata.name}"
+                        f" ({', '.join(codes)})")
+            imported_count += (
+                len(pending_imports) - len(unknown_codes_by_image))
+    finally:
+        if imported_count:
+            # One check for the whole import, so that features get
+            # re-extracted for the new points.
+            queue_source_check(source_id)
+
+    message = f"Imported annotations for {imported_count} image(s)"
+    if skipped_images:
+        examples = ', '.join(skipped_images[:3])
+        if len(skipped_images) > 3:
+            examples += ", ..."
+        raise JobError(
+            f"{message}. Skipped {len(skipped_images)} image(s) with label"
+            f" codes that are no longer in the labelset: {examples}")
+    return message
@@ -50,7 +50,7 @@ class AnnotationsCSVFormatTest(ClientTest, UploadAnnotationsCsvTestMixin):
                 ),
             ),
         )
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[self.img1])
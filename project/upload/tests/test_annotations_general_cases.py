@@ -257,7 +257,7 @@ class GeneralCasesTest(
 
     def test_transaction_rollback(self):
         """
-        If the confirm view encounters an error after saving annotations,
+        If the import job encounters an error after saving annotations,
         then the saves should be rolled back.
         """
         rows = [
@@ -269,12 +269,11 @@ class GeneralCasesTest(
         csv_file = self.make_annotations_file('A.csv', rows)
         self.preview_annotations(self.user, self.source, csv_file)
 
-        def raise_error(self, *args, **kwargs):
+        def raise_error(*args, **kwargs):
             raise ValueError
 
-        with mock.patch('upload.views.reset_features', raise_error):
-            with self.assertRaises(ValueError):
-                self.upload_annotations(self.user, self.source)
+        with mock.patch('upload.utils.clear_features_in_bulk', raise_error):
+            self.upload_annotations(self.user, self.source)
 
         self.check_transaction_rollback()
 
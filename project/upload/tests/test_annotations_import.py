@@ -0,0 +1,215 @@
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from annotations.models import Annotation
+from images.models import Point
+from jobs.models import Job
+from jobs.tests.utils import run_pending_job
+from jobs.utils import finish_job, queue_job
+from lib.tests.utils import ClientTest
+from ..models import PendingAnnotationImport
+from .utils import UploadAnnotationsCsvTestMixin
+
+
+class ImportJobTest(ClientTest, UploadAnnotationsCsvTestMixin):
+    """
+    Saving confirmed annotations in the import_annotations job.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(cls.user)
+        labels = cls.create_labels(cls.user, ['A', 'B'], 'Group1')
+        cls.create_labelset(cls.user, cls.source, labels)
+        cls.img1 = cls.upload_image(
+            cls.user, cls.source,
+            image_options=dict(filename='1.png', width=100, height=100))
+        cls.img2 = cls.upload_image(
+            cls.user, cls.source,
+            image_options=dict(filename='2.png', width=100, height=100))
+        cls.img3 = cls.upload_image(
+            cls.user, cls.source,
+            image_options=dict(filename='3.png', width=100, height=100))
+
+        cls.confirm_url = reverse(
+            'upload_annotations_csv_confirm_ajax', args=[cls.source.pk])
+        cls.progress_url = reverse(
+            'upload_annotations_progress_ajax', args=[cls.source.pk])
+
+    def preview(self, rows):
+        csv_file = self.make_annotations_file(
+            'A.csv', [['Name', 'Column', 'Row', 'Label']] + rows)
+        self.preview_annotations(self.user, self.source, csv_file)
+
+    def confirm(self):
+        response = self.client.post(self.confirm_url)
+        response_json = response.json()
+        self.assertTrue(response_json['success'])
+        return response_json
+
+    def run_import_job(self):
+        return run_pending_job('import_annotations', str(self.source.pk))
+
+    def test_progress(self):
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+            ['2.png', 20, 20, 'B'],
+        ])
+        response_json = self.confirm()
+        self.assertEqual(response_json['count'], 2)
+        self.assertEqual(response_json['progress_url'], self.progress_url)
+        job_id = response_json['job_id']
+
+        # Annotations aren't saved until the job runs.
+        self.assertFalse(
+            Annotation.objects.filter(image__source=self.source).exists())
+        response = self.client.get(self.progress_url)
+        self.assertDictEqual(response.json(), dict(
+            job_id=job_id, status='pending', remaining=2, done=False))
+
+        job = self.run_import_job()
+        self.assertEqual(
+            job.result_message, "Imported annotations for 2 image(s)")
+
+        response = self.client.get(self.progress_url)
+        self.assertDictEqual(response.json(), dict(
+            job_id=job_id, status='success', remaining=0, done=True))
+        self.assertEqual(
+            Annotation.objects.filter(image__source=self.source).count(), 2)
+
+    @override_settings(ANNOTATION_IMPORT_CHUNK_SIZE=2)
+    def test_multiple_chunks(self):
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+            ['1.png', 20, 20, 'B'],
+            ['2.png', 30, 30, 'A'],
+            ['3.png', 40, 40, ''],
+        ])
+        self.confirm()
+        job = self.run_import_job()
+        self.assertEqual(
+            job.result_message, "Imported annotations for 3 image(s)")
+
+        values_set = set(
+            Point.objects.filter(image__source=self.source)
+            .values_list('column', 'row', 'point_number', 'image_id'))
+        self.assertSetEqual(values_set, {
+            (10, 10, 1, self.img1.pk),
+            (20, 20, 2, self.img1.pk),
+            (30, 30, 1, self.img2.pk),
+            (40, 40, 1, self.img3.pk),
+        })
+        values_set = set(
+            (a.label_code, a.point.point_number, a.image_id)
+            for a in Annotation.objects.filter(image__source=self.source)
+        )
+        self.assertSetEqual(values_set, {
+            ('A', 1, self.img1.pk),
+            ('B', 2, self.img1.pk),
+            ('A', 1, self.img2.pk),
+        })
+        self.assertFalse(PendingAnnotationImport.objects.exists())
+
+        # Features are to be re-extracted for the new points.
+        for image in [self.img1, self.img2, self.img3]:
+            image.features.refresh_from_db()
+            self.assertFalse(image.features.extracted)
+        self.assertEqual(
+            Job.objects.filter(
+                job_name='check_source', status=Job.Status.PENDING).count(),
+            1)
+
+    def test_second_upload_before_job_runs(self):
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+            ['2.png', 20, 20, 'A'],
+        ])
+        job_id = self.confirm()['job_id']
+        self.preview([
+            ['1.png', 30, 30, 'B'],
+        ])
+        self.assertEqual(self.confirm()['job_id'], job_id)
+
+        self.run_import_job()
+
+        # The second upload replaced the first one for image 1.
+        values_set = set(
+            (a.label_code, a.point.column, a.image_id)
+            for a in Annotation.objects.filter(image__source=self.source)
+        )
+        self.assertSetEqual(values_set, {
+            ('B', 30, self.img1.pk),
+            ('A', 20, self.img2.pk),
+        })
+
+    def test_confirmed_while_job_finishing(self):
+        # The job has already found no more pending imports, but hasn't
+        # finished yet.
+        finishing_job = queue_job(
+            'import_annotations', self.source.pk,
+            source_id=self.source.pk, initial_status=Job.Status.IN_PROGRESS)
+
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+        ])
+        self.assertEqual(self.confirm()['job_id'], finishing_job.pk)
+
+        finish_job(finishing_job, success=True)
+        # The job's queued again, since there are still pending imports.
+        self.run_import_job()
+        self.assertEqual(
+            Annotation.objects.filter(image__source=self.source).count(), 1)
+
+    def test_failure(self):
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+        ])
+        self.confirm()
+
+        # The label was removed from the labelset after confirming.
+        self.source.labelset.locallabel_set.filter(code='A').delete()
+        job = self.run_import_job()
+        self.assertEqual(job.status, Job.Status.FAILURE)
+        message = (
+            "Imported annotations for 0 image(s). Skipped 1 image(s) with"
+            " label codes that are no longer in the labelset: 1.png (A)")
+        self.assertEqual(job.result_message, message)
+
+        response = self.client.get(self.progress_url)
+        response_json = response.json()
+        self.assertTrue(response_json['done'])
+        self.assertEqual(response_json['error'], message)
+        # The image's previous points are intact.
+        self.assertEqual(self.img1.point_set.count(), 5)
+
+    def test_later_import_after_failure(self):
+        self.preview([
+            ['1.png', 10, 10, 'A'],
+            ['2.png', 20, 20, 'B'],
+        ])
+        self.confirm()
+        self.source.labelset.locallabel_set.filter(code='A').delete()
+        # The other image is still imported.
+        job = self.run_import_job()
+        self.assertIn(
+            "Imported annotations for 1 image(s)", job.result_message)
+        self.assertFalse(PendingAnnotationImport.objects.exists())
+
+        # The skipped image doesn't block later imports.
+        self.preview([
+            ['3.png', 30, 30, 'B'],
+        ])
+        self.confirm()
+        job = self.run_import_job()
+        self.assertEqual(job.status, Job.Status.SUCCESS)
+
+        values_set = set(
+            (a.label_code, a.point.column, a.image_id)
+            for a in Annotation.objects.filter(image__source=self.source)
+        )
+        self.assertSetEqual(values_set, {
+            ('B', 20, self.img2.pk),
+            ('B', 30, self.img3.pk),
+        })
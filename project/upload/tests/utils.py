@@ -11,7 +11,8 @@ from annotations.models import Annotation
 from annotations.tests.utils import AnnotationHistoryTestMixin
 from images.model_utils import PointGen
 from images.models import Point
-from lib.tests.utils import ClientTest
+from jobs.models import Job
+from lib.tests.utils import ClientTest, confirm_annotations_upload
 
 
 # Abstract class
@@ -49,7 +50,8 @@ class UploadAnnotationsCsvTestMixin(UploadAnnotationsTestMixin, ABC):
 
     def upload_annotations(self, user, source):
         self.client.force_login(user)
-        return self.client.post(
+        return confirm_annotations_upload(
+            self.client,
             reverse('upload_annotations_csv_confirm_ajax', args=[source.pk]),
         )
 
@@ -115,7 +117,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[self.img1, self.img2])
@@ -182,7 +184,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[self.img1, self.img2])
@@ -255,7 +257,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(
@@ -331,7 +333,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(
@@ -395,7 +397,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[self.img1])
@@ -438,7 +440,7 @@ class UploadAnnotationsGeneralCasesTest(
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[self.img1])
@@ -469,6 +471,14 @@ class UploadAnnotationsGeneralCasesTest(
 
     def check_transaction_rollback(self):
 
+        job = Job.objects.filter(
+            job_name='import_annotations').earliest('pk')
+        self.assertEqual(job.status, Job.Status.FAILURE)
+        # The import is queued again to retry.
+        self.assertTrue(Job.objects.filter(
+            job_name='import_annotations',
+            status=Job.Status.PENDING).exists())
+
         # No annotations should be saved
         annotations = Annotation.objects.filter(image__in=[self.img1])
         values_set = set(
@@ -540,7 +550,7 @@ class UploadAnnotationsMultipleSourcesTest(ClientTest, ABC):
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         # Check source 1 objects
 
@@ -643,7 +653,7 @@ class UploadAnnotationsFormatTest(ClientTest, ABC):
             ),
         )
 
-        self.assertDictEqual(upload_response.json(), dict(success=True))
+        self.assertTrue(upload_response.json()['success'])
 
         values_set = set(
             Point.objects.filter(image__in=[img])
@@ -27,4 +27,7 @@ urlpatterns = [
     path('annotations_csv_confirm_ajax/',
          views.AnnotationsUploadConfirmView.as_view(),
          name="upload_annotations_csv_confirm_ajax"),
+    path('annotations_progress_ajax/',
+         views.annotations_upload_progress_ajax,
+         name="upload_annotations_progress_ajax"),
 ]
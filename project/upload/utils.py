@@ -9,16 +9,23 @@ import charset_normalizer
 from django.conf import settings
 from django.urls import reverse
 
-from annotations.models import ImageAnnotationInfo
+from accounts.utils import get_imported_user
+from annotations.managers import update_progress_fields_for_images
+from annotations.model_utils import AnnotationAreaUtils
+from annotations.models import Annotation, ImageAnnotationInfo
 from images.forms import MetadataForm
-from images.models import Image, Metadata, Source
+from images.model_utils import PointGen
+from images.models import Image, Metadata, Point, Source
 from images.utils import (
     aux_label_name_collisions,
     generate_points,
     metadata_field_names_to_labels,
 )
+from jobs.utils import queue_or_get_active_job
 from lib.exceptions import FileProcessError
 from vision_backend.models import Features
+from vision_backend.utils import clear_features_in_bulk
+from .models import PendingAnnotationImport
 
 
 def text_file_to_unicode_stream(text_file):
@@ -483,3 +490,142 @@ def find_dupe_image(source, image_name):
         return image_matches[0]
     else:
         return None
+
+
+def queue_annotation_import(
+        source, user, uploaded_annotations, cpc_files=None):
+    """
+    Save confirmed uploaded annotations as pending imports, and queue an
+    import_annotations job to save them in the background.
+    Return the number of images to import, and the import Job.
+
+    :param uploaded_annotations: Dict of image ID -> list of point dicts,
+      as saved to the session by an upload-annotations-preview view.
+    :param cpc_files: For CPC uploads, dict of image ID -> dict of
+      cpc_content and filename.
+    """
+    # Since these dicts went through session serialization, the integer
+    # image ID keys became stringified.
+    source_image_ids = set(
+        Image.objects.filter(
+            source=source,
+            pk__in=[int(image_id) for image_id in uploaded_annotations])
+        .values_list('pk', flat=True))
+
+    pending_imports = []
+    for image_id, points in uploaded_annotations.items():
+        if int(image_id) not in source_image_ids:
+            continue
+        pending_import = PendingAnnotationImport(
+            image_id=int(image_id), source=source, user=user, points=points)
+        if cpc_files:
+            pending_import.cpc_content = \
+                cpc_files[str(image_id)]['cpc_content']
+            pending_import.cpc_filename = \
+                cpc_files[str(image_id)]['filename']
+        pending_imports.append(pending_import)
+
+    # A newer upload for an image replaces any import still pending for
+    # that image.
+    PendingAnnotationImport.objects.filter(
+        image_id__in=source_image_ids).delete()
+    PendingAnnotationImport.objects.bulk_create(
+        pending_imports, batch_size=1000)
+
+    # If an import job for this source is already pending or in progress,
+    # it'll pick up these images too.
+    job = queue_or_get_active_job(
+        'import_annotations', source.pk, source_id=source.pk)
+
+    return len(pending_imports), job
+
+
+def save_pending_annotation_imports(source, pending_imports):
+    """
+    Replace the images' points and annotations with those of the given
+    PendingAnnotationImports. This takes a fixed number of set-based
+    queries for the whole chunk of images, aside from updating each
+    image's annotation progress fields at the end.
+    The caller should queue a source check afterward.
+
+    The labelset may have changed since the upload was confirmed. Images
+    with label codes that are no longer in the labelset are skipped, and
+    left unchanged.
+    :return: Dict of skipped images' IDs to their unknown label codes.
+    """
+    # Codes are case insensitive.
+    label_ids_by_code = dict(
+        (code.lower(), global_label_id)
+        for code, global_label_id in source.labelset.get_labels()
+        .values_list('code', 'global_label_id')
+    )
+    unknown_codes_by_image = dict()
+    valid_imports = []
+    for pending_import in pending_imports:
+        unknown_codes = sorted(set(
+            point_dict['label']
+            for point_dict in pending_import.points
+            if point_dict.get('label')
+            and point_dict['label'].lower() not in label_ids_by_code
+        ))
+        if unknown_codes:
+            unknown_codes_by_image[pending_import.image_id] = unknown_codes
+        else:
+            valid_imports.append(pending_import)
+    pending_imports = valid_imports
+    if not pending_imports:
+        return unknown_codes_by_image
+
+    image_ids = [pending_import.image_id for pending_import in pending_imports]
+
+    # Deleting the points also deletes their annotations and scores.
+    # The progress fields are updated once the new points are in.
+    Point.objects.filter(image_id__in=image_ids).delete(
+        update_progress_fields=False)
+
+    new_points = []
+    point_label_codes = []
+    for pending_import in pending_imports:
+        for number, point_dict in enumerate(pending_import.points, 1):
+            new_points.append(Point(
+                row=point_dict['row'], column=point_dict['column'],
+                point_number=number, image_id=pending_import.image_id))
+            point_label_codes.append(point_dict.get('label'))
+    # bulk_create() sets the new points' IDs, so the annotations can
+    # refer to them without re-fetching the points.
+    new_points = Point.objects.bulk_create(
+        new_points, update_progress_fields=False)
+
+    imported_user = get_imported_user()
+    new_annotations = []
+    for point, label_code in zip(new_points, point_label_codes):
+        if not label_code:
+            continue
+        new_annotations.append(Annotation(
+            point=point, image_id=point.image_id, source=source,
+            label_id=label_ids_by_code[label_code.lower()],
+            user=imported_user))
+    # Versions (for annotation history) are created in bulk too.
+    Annotation.objects.bulk_create_with_versions(new_annotations)
+
+    images = []
+    for pending_import in pending_imports:
+        image = pending_import.image
+        image.point_generation_method = PointGen.args_to_db_format(
+            point_generation_type=PointGen.Types.IMPORTED,
+            imported_number_of_points=len(pending_import.points),
+        )
+        # Save uploaded CPC contents for future CPC exports, or clear
+        # previously-uploaded CPC info if this wasn't a CPC upload.
+        image.cpc_content = pending_import.cpc_content
+        image.cpc_filename = pending_import.cpc_filename
+        images.append(image)
+    Image.objects.bulk_update(
+        images, ['point_generation_method', 'cpc_content', 'cpc_filename'])
+    Metadata.objects.filter(image__in=image_ids).update(
+        annotation_area=AnnotationAreaUtils.IMPORTED_STR)
+
+    clear_features_in_bulk(image_ids)
+    update_progress_fields_for_images(image_ids)
+
+    return unknown_codes_by_image
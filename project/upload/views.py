@@ -7,26 +7,24 @@ from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views import View
 
-from accounts.utils import get_imported_user
-from annotations.model_utils import AnnotationAreaUtils
-from annotations.models import Annotation
 from images.forms import MetadataForm
-from images.model_utils import PointGen
-from images.models import Source, Metadata, Image, Point
+from images.models import Source, Metadata
 from images.utils import metadata_obj_to_dict, get_aux_labels, \
     metadata_field_names_to_labels
 from lib.decorators import source_permission_required, source_labelset_required
 from lib.exceptions import FileProcessError
 from lib.forms import get_one_form_error
+from jobs.utils import get_source_job_progress
 from lib.utils import filesize_display
-from vision_backend.utils import queue_source_check, reset_features
+from vision_backend.utils import queue_source_check
 from visualization.forms import ImageSpecifyByIdForm
 from .forms import (
     CSVImportForm, ImageUploadForm, ImageUploadFrontendForm)
+from .models import PendingAnnotationImport
 from .utils import (
     annotations_csv_to_dict,
     annotations_preview, find_dupe_image, metadata_csv_to_dict,
-    metadata_preview, upload_image_process)
+    metadata_preview, queue_annotation_import, upload_image_process)
 
 
 @source_permission_required('source_id', perm=Source.PermTypes.EDIT.code)
@@ -348,10 +346,13 @@ def upload_annotations_csv_preview_ajax(request, source_id):
 class AnnotationsUploadConfirmView(View):
     """
     This view gets the annotation data that was previously saved to the
-    session by an upload-annotations-preview view. Then it saves the data
-    to the database, while deleting all previous points/annotations for the
-    images involved.
+    session by an upload-annotations-preview view. Then it queues a
+    background job which saves the data to the database, while deleting
+    all previous points/annotations for the images involved.
     """
+    # Uploaded CPC file contents, for CPC uploads.
+    cpc_files = None
+
     def post(self, request, source_id):
         source = get_object_or_404(Source, id=source_id)
 
@@ -367,68 +368,33 @@ class AnnotationsUploadConfirmView(View):
 
         self.extra_source_level_actions(request, source)
 
-        for image_id, annotations_for_image in uploaded_annotations.items():
-
-            img = Image.objects.get(pk=image_id, source=source)
-
-            # Delete previous annotations and points for this image.
-            # Calling delete() on these querysets is more efficient
-            # than calling delete() on each of the individual objects.
-            Annotation.objects.filter(image=img).delete()
-            Point.objects.filter(image=img).delete()
-
-            # Create new points and annotations.
-            new_points = []
-            new_annotations = []
-
-            for num, point_dict in enumerate(annotations_for_image, 1):
-                # Create a Point.
-                point = Point(
-                    row=point_dict['row'], column=point_dict['column'],
-                    point_number=num, image=img)
-                new_points.append(point)
-            # Save to DB with an efficient bulk operation.
-            Point.objects.bulk_create(new_points)
-
-            for num, point_dict in enumerate(annotations_for_image, 1):
-                # Create an Annotation if a label is specified.
-                if point_dict.get('label'):
-                    label_obj = source.labelset.get_global_by_code(
-                        point_dict['label'])
-                    # TODO: Django 1.10 can set database IDs on newly created
-                    # objects, so re-fetching the points may not be needed:
-                    # https://docs.djangoproject.com/en/dev/releases/1.10/#database-backends
-                    new_annotations.append(Annotation(
-                        point=Point.objects.get(point_number=num, image=img),
-                        image=img, source=source,
-                        label=label_obj, user=get_imported_user()))
-            # Do NOT bulk-create the annotations so that the versioning signals
-            # (for annotation history) do not get bypassed.
-            # Create them one by one.
-            for annotation in new_annotations:
-                annotation.save()
-
-            # Update relevant image/metadata fields.
-            self.update_image_and_metadata_fields(img, new_points)
-
-            reset_features(img)
+        # Saving many images' points and annotations can take a long
+        # time, so it's done by a background job. The page polls the
+        # job's progress.
+        import_count, job = queue_annotation_import(
+            source, request.user, uploaded_annotations,
+            cpc_files=self.cpc_files)
 
         return JsonResponse(dict(
             success=True,
+            job_id=job.pk if job else None,
+            count=import_count,
+            progress_url=reverse(
+                'upload_annotations_progress_ajax', args=[source.pk]),
         ))
 
     def extra_source_level_actions(self, request, source):
         pass
 
-    def update_image_and_metadata_fields(self, image, new_points):
-        image.point_generation_method = PointGen.args_to_db_format(
-            point_generation_type=PointGen.Types.IMPORTED,
-            imported_number_of_points=len(new_points)
-        )
-        # Clear previously-uploaded CPC info.
-        image.cpc_content = ''
-        image.cpc_filename = ''
-        image.save()
 
-        image.metadata.annotation_area = AnnotationAreaUtils.IMPORTED_STR
-        image.metadata.save()
+@source_permission_required(
+    'source_id', perm=Source.PermTypes.EDIT.code, ajax=True)
+def annotations_upload_progress_ajax(request, source_id):
+    """
+    Progress of the source's background annotation import.
+    """
+    source = get_object_or_404(Source, id=source_id)
+
+    remaining = PendingAnnotationImport.objects.filter(source=source).count()
+    return JsonResponse(get_source_job_progress(
+        'import_annotations', source.pk, remaining, "Saving"))
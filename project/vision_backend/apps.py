@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
+
+
+def invalidate_cached_classifier(sender, instance, **kwargs):
+    from .classifier_cache import classifier_cache
+    classifier_cache.invalidate(instance.pk)
 
 
 class VisionBackendConfig(AppConfig):
     name = 'vision_backend'
+
+    def ready(self):
+        post_delete.connect(
+            invalidate_cached_classifier,
+            sender=self.get_model('Classifier'),
+            dispatch_uid='invalidate_cached_classifier',
+        )
@@ -0,0 +1,135 @@
+"""
+Per-process cache of loaded classifier models.
+
+Classifying an image in-process (classify_features jobs) only takes a few
+milliseconds once the classifier is loaded, but loading it means
+downloading and unpickling the model file each time. Classification jobs
+usually come in runs for the same source, so we keep recently used
+classifiers in memory here.
+
+Each worker process has its own cache. Entries are keyed by classifier pk,
+and the total size is capped by CLASSIFIER_CACHE_MAX_BYTES (estimated as
+the size of the stored model file).
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from spacer.storage import load_classifier
+
+
+def load_classifier_uncached(loc):
+    # Bypass spacer's own lru_cache, which is keyed by location only
+    # and isn't bounded by memory.
+    return load_classifier.__wrapped__(loc)
+
+
+@dataclass
+class CacheEntry:
+    source_id: int
+    clf: object
+    size: int
+
+
+class ClassifierCache:
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return settings.CLASSIFIER_CACHE_MAX_BYTES
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def get(self, classifier):
+        """
+        Returns the loaded model (a CalibratedClassifierCV) for the given
+        Classifier, loading it from storage if it isn't cached.
+        Other cached classifiers of the same source are assumed to be
+        superseded, and get evicted.
+        """
+        with self._lock:
+            entry = self._entries.get(classifier.pk)
+            if entry is not None:
+                self._entries.move_to_end(classifier.pk)
+                self.hits += 1
+                return entry.clf
+            self.misses += 1
+
+        # Load outside of the lock, since this is the slow part.
+        storage = get_storage_class()()
+        filepath = settings.ROBOT_MODEL_FILE_PATTERN.format(pk=classifier.pk)
+        size = storage.size(filepath)
+        clf = load_classifier_uncached(storage.spacer_data_loc(filepath))
+
+        with self._lock:
+            for pk in [
+                pk for pk, entry in self._entries.items()
+                if entry.source_id == classifier.source_id
+                and pk != classifier.pk
+            ]:
+                self._evict(pk)
+
+            if size > self.max_bytes:
+                # Too big to keep around; just use it for this call.
+                return clf
+
+            self._entries[classifier.pk] = CacheEntry(
+                source_id=classifier.source_id, clf=clf, size=size)
+            while self.total_bytes > self.max_bytes:
+                # Evict least recently used.
+                self._evict(next(iter(self._entries)))
+
+        return clf
+
+    def invalidate(self, classifier_id):
+        with self._lock:
+            if classifier_id in self._entries:
+                self._evict(classifier_id)
+
+    def invalidate_source(self, source_id):
+        with self._lock:
+            for pk in [
+                pk for pk, entry in self._entries.items()
+                if entry.source_id == source_id
+            ]:
+                self._evict(pk)
+
+    def _evict(self, classifier_id):
+        del self._entries[classifier_id]
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / lookups if lookups else None,
+                evictions=self.evictions,
+                entries=len(self._entries),
+                total_bytes=self.total_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+classifier_cache = ClassifierCache()
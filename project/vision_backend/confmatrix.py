@@ -14,28 +14,41 @@ class ConfMatrix:
       self.labelset = labelset
       self.cm = np.zeros((nclasses, nclasses), dtype=int)
 
-   def add(self, gtlabels, estlabels):
+   def add(self, gtlabels, estlabels, counts = None):
       """
       This method adds data to the confusion matrix
 
       Takes
       gtlabels: array of ground truth labels
       estlabels: array of estiamated labels of SAME SIZE as gtlabels
+      counts: optional array of SAME SIZE as gtlabels, with the number of
+         points each (gtlabel, estlabel) entry stands for. Default 1 each.
       """
 
       if not len(gtlabels) == len(estlabels):
          raise Exception('intput gtlabels and estlabels must have the same length')
-      for (gtl, estl) in zip(gtlabels, estlabels):
-         assert gtl > -1 and estl > -1, 'label index must be positive'
-         self.cm[gtl, estl] += 1
+      gtlabels = np.asarray(gtlabels, dtype=int)
+      estlabels = np.asarray(estlabels, dtype=int)
+      if gtlabels.size == 0:
+         return
+      assert gtlabels.min() > -1 and estlabels.min() > -1, 'label index must be positive'
+      if gtlabels.max() >= self.nclasses or estlabels.max() >= self.nclasses:
+         raise IndexError('label index out of range for {} classes'.format(self.nclasses))
+
+      # Count each (gt, est) pair in one pass, by flattening the pairs to
+      # indices into the (raveled) matrix.
+      totals = np.bincount(
+         gtlabels * self.nclasses + estlabels, weights=counts,
+         minlength=self.nclasses ** 2)
+      self.cm += totals.reshape(self.nclasses, self.nclasses).astype(self.cm.dtype)
 
    def add_select(self, gtlabels, estlabels, scores, th):
       """
       Calls add but only for scores above a certain threshold.
       """
-      gt = [g for (g, s) in zip(gtlabels, scores) if s > th]
-      est = [e for (e, s) in zip(estlabels, scores) if s > th]
-      self.add(gt, est)
+      keep = np.asarray(scores) > th
+      self.add(np.asarray(gtlabels, dtype=int)[keep],
+               np.asarray(estlabels, dtype=int)[keep])
 
    def sort(self, sort_index = None):
       """
@@ -72,20 +85,17 @@ class ConfMatrix:
       new class collapsemap[i]. Since this changes the confmatrix, a new labelset must also be provided.
       """
 
-      collapsemap = np.asarray(collapsemap)
-      cmin = self.cm
-      nnew  = max(collapsemap) + 1
-      cmint = np.zeros((self.nclasses, nnew)) #intermediate representation
-      cmout = np.zeros((nnew, nnew))
+      collapsemap = np.asarray(collapsemap, dtype=int)
+      nnew = collapsemap.max() + 1
 
-      for i in range(nnew):
-         cmint[:, i] = np.sum(cmin[:, collapsemap == i], axis = 1)
+      # One-hot matrix which maps old class i to new class collapsemap[i].
+      # Summing the rows and columns of each new class is then
+      # projection.T * cm * projection.
+      projection = np.zeros((self.nclasses, nnew), dtype=self.cm.dtype)
+      projection[np.arange(self.nclasses), collapsemap] = 1
 
-      for i in range(nnew):
-         cmout[i, :] = np.sum(cmint[collapsemap == i, :], axis = 0)
-
-      self.labelset = new_labelset   
-      self.cm = cmout
+      self.labelset = new_labelset
+      self.cm = projection.T @ self.cm @ projection
 
    def render_for_heatmap(self):
       """
@@ -0,0 +1,131 @@
+"""
+Cache of classifier evaluation data for the backend page.
+
+The backend page shows a confusion matrix for a selectable confidence
+threshold and labelmode, along with accuracy-vs-threshold (alleviate)
+curves, all computed from the classifier's validation results. Loading
+those results from storage and going over all their points on every page
+view is slow, so when a classifier is accepted, we condense them into:
+
+- The number of validation points for each combination of ground-truth
+  class, estimated class, and threshold bucket. A point's bucket is the
+  number of integer-percent confidence thresholds which its score is
+  above. This is usually much smaller than the list of points, and gives
+  the confusion matrix for any threshold and class mapping with one
+  bincount.
+- The alleviate curves for the full labelset and for functional groups.
+
+These are kept in the (cross-process) Django cache, keyed by classifier
+pk. If an entry is missing, such as when it's been culled from the cache,
+it's rebuilt from the validation results on demand.
+"""
+from dataclasses import dataclass
+
+from django.core.cache import cache
+import numpy as np
+
+from .confmatrix import ConfMatrix
+from .utils import get_alleviate, labelset_mapper, map_labels
+
+# Confidence thresholds which can be selected on the backend page.
+THRESHOLD_PERCENTS = np.arange(101)
+
+
+def threshold_buckets(scores):
+    """
+    For each score, the number of threshold percents t such that
+    score > t / 100. So a point counts toward the confusion matrix at
+    threshold t if t is less than its bucket.
+    """
+    return np.searchsorted(
+        THRESHOLD_PERCENTS / 100, np.asarray(scores, dtype=float),
+        side='left')
+
+
+@dataclass
+class ClassifierEvaluation:
+    # Label IDs of the classes, in valres class-index order.
+    classes: list[int]
+    # One entry per distinct (gt, est, bucket) combination, along with
+    # the number of validation points having that combination.
+    gt: np.ndarray
+    est: np.ndarray
+    buckets: np.ndarray
+    counts: np.ndarray
+    # Alleviate curves, as [confidence threshold, value] pairs.
+    alleviate: dict
+
+    @classmethod
+    def from_valres(cls, valres, source):
+        gt = np.asarray(valres.gt, dtype=int)
+        est = np.asarray(valres.est, dtype=int)
+        buckets = threshold_buckets(valres.scores)
+
+        nclasses = len(valres.classes)
+        nbuckets = len(THRESHOLD_PERCENTS) + 1
+        keys = (gt * nclasses + est) * nbuckets + buckets
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        pair_keys, unique_buckets = np.divmod(unique_keys, nbuckets)
+        unique_gt, unique_est = np.divmod(pair_keys, nclasses)
+
+        class_dtype = np.min_scalar_type(max(nclasses - 1, 0))
+        return cls(
+            classes=list(valres.classes),
+            gt=unique_gt.astype(class_dtype),
+            est=unique_est.astype(class_dtype),
+            buckets=unique_buckets.astype(np.uint8),
+            counts=counts.astype(np.min_scalar_type(counts.max(initial=0))),
+            alleviate=cls.compute_alleviate(valres, source),
+        )
+
+    @staticmethod
+    def compute_alleviate(valres, source):
+        acc_full, ratios, confs = get_alleviate(
+            valres.gt, valres.est, valres.scores)
+        classmap, _ = labelset_mapper('func', valres.classes, source)
+        acc_func, _, _ = get_alleviate(
+            map_labels(valres.gt, classmap),
+            map_labels(valres.est, classmap),
+            valres.scores)
+        return dict(
+            acc_full=[[conf, val] for val, conf in zip(acc_full, confs)],
+            acc_func=[[conf, val] for val, conf in zip(acc_func, confs)],
+            ratios=[[conf, val] for val, conf in zip(ratios, confs)],
+        )
+
+    def get_confmatrix(self, classmap, classnames, confidence_threshold):
+        """
+        Confusion matrix of the points scoring above the threshold
+        (in percent), with classes mapped by classmap as returned by
+        labelset_mapper().
+        """
+        keep = self.buckets > confidence_threshold
+        cm = ConfMatrix(len(classnames), labelset=classnames)
+        cm.add(
+            map_labels(self.gt[keep], classmap),
+            map_labels(self.est[keep], classmap),
+            counts=self.counts[keep])
+        return cm
+
+
+def _cache_key(classifier_id):
+    return f'classifier_evaluation_{classifier_id}'
+
+
+def cache_classifier_evaluation(classifier, valres=None):
+    """
+    Compute the classifier's evaluation from its validation results
+    (loaded from storage if not given), and cache it.
+    """
+    if valres is None:
+        valres = classifier.valres
+    evaluation = ClassifierEvaluation.from_valres(valres, classifier.source)
+    cache.set(_cache_key(classifier.pk), evaluation, None)
+    return evaluation
+
+
+def get_classifier_evaluation(classifier):
+    evaluation = cache.get(_cache_key(classifier.pk))
+    if evaluation is None:
+        evaluation = cache_classifier_evaluation(classifier)
+    return evaluation
@@ -0,0 +1,176 @@
+"""
+Cache of deploy API images' features.
+
+Clients often deploy the same images more than once, such as against a
+newer classifier. Without this cache, each deploy sends spacer a
+classify_image task, which downloads the image and runs the feature
+extractor on it all over again. That takes seconds per image, while
+classifying already-extracted features takes milliseconds.
+
+With DEPLOY_FEATURE_CACHE_ENABLED, the deploy task looks up features by a
+key made from the extractor, the image URL, and the point rowcols (in
+request order, which is the order of the results):
+
+- Hit: the cached features are classified in-process, and the deploy job
+  is done right away. If the cached file can't be loaded, the entry is
+  deleted and it's treated as a miss.
+- Miss: spacer gets an extract_features task which downloads the image
+  from the URL, and writes the features into the cache. Once that's
+  collected, the features are classified in-process as on a hit.
+
+Client-supplied URLs are only ever fetched by spacer, as without the
+cache; our own workers never download them. Since the key can't include
+the image content, entries expire after DEPLOY_FEATURE_CACHE_MAX_AGE_DAYS,
+in case the image at a URL changes.
+
+Cached feature files are tracked by DeployFeatureCacheEntry, so that the
+total size can be kept under DEPLOY_FEATURE_CACHE_MAX_BYTES by evicting
+the least recently used entries. Hits and misses are counted per day in
+DeployFeatureCacheStats.
+"""
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from spacer.data_classes import ImageFeatures
+from spacer.messages import DataLocation
+
+from .models import DeployFeatureCacheEntry, DeployFeatureCacheStats
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(extractor_choice: str, url: str, rowcols) -> str:
+    key_data = json.dumps(
+        [extractor_choice, url, [list(rc) for rc in rowcols]])
+    return hashlib.sha256(key_data.encode()).hexdigest()
+
+
+def feature_path(key: str) -> str:
+    return settings.DEPLOY_FEATURE_CACHE_FILE_PATTERN.format(key=key)
+
+
+def feature_loc(key: str) -> DataLocation:
+    storage = get_storage_class()()
+    return storage.spacer_data_loc(feature_path(key))
+
+
+def key_from_feature_loc(loc: DataLocation) -> str:
+    # The location's key is the storage path, possibly absolute.
+    filename = os.path.basename(loc.key)
+    return os.path.splitext(filename)[0]
+
+
+def _count(field):
+    stats, _ = DeployFeatureCacheStats.objects.get_or_create(
+        date=timezone.now().date())
+    DeployFeatureCacheStats.objects.filter(pk=stats.pk).update(
+        **{field: F(field) + 1})
+
+
+def get_entry(key: str):
+    """
+    Returns the cache entry for the key, or None if there isn't one or
+    it's expired. Counts as a hit or miss accordingly.
+    """
+    try:
+        entry = DeployFeatureCacheEntry.objects.get(key=key)
+    except DeployFeatureCacheEntry.DoesNotExist:
+        _count('misses')
+        return None
+
+    max_age = timedelta(days=settings.DEPLOY_FEATURE_CACHE_MAX_AGE_DAYS)
+    if entry.create_date < timezone.now() - max_age:
+        # The image at this URL may have changed since.
+        get_storage_class()().delete(entry.file_path)
+        entry.delete()
+        _count('misses')
+        return None
+
+    DeployFeatureCacheEntry.objects.filter(pk=entry.pk).update(
+        hits=F('hits') + 1, last_used_date=timezone.now())
+    _count('hits')
+    return entry
+
+
+def load_features(entry) -> Optional[ImageFeatures]:
+    """
+    Load a hit entry's features. If that fails, such as when another job
+    evicted the file since the lookup, the entry is deleted and None is
+    returned, so that the caller can treat it as a miss.
+    """
+    try:
+        return ImageFeatures.load(feature_loc(entry.key))
+    except Exception as e:
+        logger.warning(
+            f"Couldn't load cached features {entry.file_path}: {e}")
+        DeployFeatureCacheEntry.objects.filter(pk=entry.pk).delete()
+        return None
+
+
+def add_entry(key: str):
+    """
+    Call after spacer has written the key's features to the cache.
+    Evicts other entries if the cache is now over its size limit.
+    """
+    storage = get_storage_class()()
+    DeployFeatureCacheEntry.objects.get_or_create(
+        key=key, defaults=dict(size=storage.size(feature_path(key))))
+    evict(exclude_key=key)
+
+
+def evict(max_bytes=None, exclude_key=None) -> int:
+    """
+    Delete least recently used entries until the cache's total size is
+    within max_bytes (DEPLOY_FEATURE_CACHE_MAX_BYTES by default).
+    Returns the number of entries evicted.
+    """
+    if max_bytes is None:
+        max_bytes = settings.DEPLOY_FEATURE_CACHE_MAX_BYTES
+
+    entries = DeployFeatureCacheEntry.objects.all()
+    total_bytes = entries.aggregate(total=Sum('size'))['total'] or 0
+    if total_bytes <= max_bytes:
+        return 0
+
+    storage = get_storage_class()()
+    evicted = 0
+    for entry in (
+        entries.exclude(key=exclude_key).order_by('last_used_date').iterator()
+    ):
+        if total_bytes <= max_bytes:
+            break
+        storage.delete(entry.file_path)
+        entry.delete()
+        total_bytes -= entry.size
+        evicted += 1
+    return evicted
+
+
+def get_stats(days: int) -> dict:
+    """
+    Hit and miss counts over the last `days` days (including today), and
+    the cache's current size.
+    """
+    since = timezone.now().date() - timedelta(days=days-1)
+    counts = DeployFeatureCacheStats.objects.filter(
+        date__gte=since).aggregate(hits=Sum('hits'), misses=Sum('misses'))
+    hits = counts['hits'] or 0
+    misses = counts['misses'] or 0
+    entries = DeployFeatureCacheEntry.objects.aggregate(
+        count=Count('pk'), total_bytes=Sum('size'))
+    return dict(
+        days=days,
+        hits=hits,
+        misses=misses,
+        hit_rate=hits / (hits + misses) if hits + misses else None,
+        entries=entries['count'],
+        total_bytes=entries['total_bytes'] or 0,
+    )
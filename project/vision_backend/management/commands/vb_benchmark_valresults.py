@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from ...confmatrix import ConfMatrix
+from ...utils import get_alleviate, map_labels
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the confusion-matrix and alleviate-curve computations of the"
+        " backend page on randomly generated validation results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--points', type=int, default=1000000,
+            help="Number of validation points.")
+        parser.add_argument(
+            '--classes', type=int, default=200,
+            help="Number of classes.")
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Random seed, for repeatable runs.")
+
+    def handle(self, *args, **options):
+        num_points = options['points']
+        num_classes = options['classes']
+        rng = np.random.default_rng(options['seed'])
+
+        gt = rng.integers(num_classes, size=num_points)
+        # Mostly-correct estimates, like an actual classifier's.
+        est = np.where(
+            rng.random(num_points) < 0.7,
+            gt, rng.integers(num_classes, size=num_points))
+        scores = rng.random(num_points)
+        # Map classes to about a tenth as many functional groups.
+        classmap = dict(
+            (class_index, class_index // 10)
+            for class_index in range(num_classes))
+        num_groups = max(classmap.values()) + 1
+
+        self.stdout.write(
+            f"{num_points} points, {num_classes} classes")
+
+        def timed(description, func):
+            start_time = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start_time
+            self.stdout.write(f"{description}: {seconds:.3f} s")
+            return result
+
+        def build_confmatrix():
+            cm = ConfMatrix(
+                num_classes, labelset=[str(i) for i in range(num_classes)])
+            cm.add_select(gt, est, scores, 0.5)
+            cm.sort()
+            cm.cut(50)
+            return cm
+
+        timed("Confusion matrix (add_select, sort, cut)", build_confmatrix)
+        gt_mapped = timed(
+            "map_labels", lambda: map_labels(gt, classmap))
+        est_mapped = map_labels(est, classmap)
+
+        def build_func_confmatrix():
+            cm = ConfMatrix(
+                num_groups, labelset=[str(i) for i in range(num_groups)])
+            cm.add_select(gt_mapped, est_mapped, scores, 0.5)
+            return cm
+
+        timed("Functional-group confusion matrix", build_func_confmatrix)
+        timed("get_alleviate", lambda: get_alleviate(est, gt, scores))
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.10 on 2026-10-17 11:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vision_backend', '0018_remove_features_runtime_core'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeployFeatureCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('hits', models.IntegerField(default=0)),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+                ('last_used_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_date'], name='deploy_feature_cache_lru_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeployFeatureCacheStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('hits', models.IntegerField(default=0)),
+                ('misses', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
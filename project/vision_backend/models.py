@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.files.storage import get_storage_class
 from django.db import models
+from django.utils import timezone
 from spacer.data_classes import ValResults
 from spacer.messages import DataLocation
 
@@ -193,3 +194,44 @@ class BatchJob(models.Model):
             f'{settings.SPACER_JOB_HASH}'
             f'-{self.internal_job.job_name}'
             f'-{self.internal_job.pk}')
+
+
+class DeployFeatureCacheEntry(models.Model):
+    """
+    A feature-vector file in the deploy feature cache. See
+    vision_backend.feature_cache.
+    """
+    # Hex digest identifying the extractor, image URL, and rowcols.
+    key = models.CharField(max_length=64, unique=True)
+
+    # Size of the stored feature file, in bytes.
+    size = models.BigIntegerField()
+
+    # Number of deploys which have used this entry, besides the one which
+    # filled it.
+    hits = models.IntegerField(default=0)
+
+    create_date = models.DateTimeField("Date created", auto_now_add=True)
+
+    # Least recently used entries are evicted first.
+    last_used_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['last_used_date'],
+                name='deploy_feature_cache_lru_idx'),
+        ]
+
+    @property
+    def file_path(self):
+        return settings.DEPLOY_FEATURE_CACHE_FILE_PATTERN.format(key=self.key)
+
+
+class DeployFeatureCacheStats(models.Model):
+    """
+    Daily deploy feature cache hit and miss counts.
+    """
+    date = models.DateField(unique=True)
+    hits = models.IntegerField(default=0)
+    misses = models.IntegerField(default=0)
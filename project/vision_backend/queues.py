@@ -1,10 +1,11 @@
 import abc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from io import BytesIO
 import json
 import logging
 import sys
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 import boto3
 from django.conf import settings
@@ -15,7 +16,9 @@ from django.utils.module_loading import import_string
 from spacer.messages import JobMsg, JobReturnMsg
 from spacer.tasks import process_job
 
+from jobs.models import Job
 from jobs.utils import finish_job
+from lib.utils import chunked
 from .models import BatchJob
 
 logger = logging.getLogger(__name__)
@@ -44,6 +47,9 @@ def get_queue_class():
     return import_string(settings.SPACER_QUEUE_CHOICE)
 
 
+CollectResult = tuple[Optional[JobReturnMsg], str]
+
+
 class BaseQueue(abc.ABC):
 
     def __init__(self):
@@ -58,9 +64,45 @@ class BaseQueue(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def collect_job(self, job) -> tuple[Optional[JobReturnMsg], str]:
+    def collect_jobs(self, jobs: Iterable) -> Iterator[list[CollectResult]]:
+        """
+        Collects the given jobs (from get_collectable_jobs()) in chunks.
+        Yields a list of (return msg, status) tuples per chunk, one tuple
+        per job, in job order.
+
+        Work for a chunk isn't started until the previous chunk's results
+        have been consumed, so the caller can stop iterating between
+        chunks without abandoning any job results.
+        """
         raise NotImplementedError
 
+    def collect_job(self, job) -> CollectResult:
+        [[result]] = list(self.collect_jobs([job]))
+        return result
+
+    def load_results_concurrently(
+        self, filepaths: list[str],
+    ) -> list[JobReturnMsg | Exception]:
+        """
+        Loads job result messages from storage with a bounded thread pool.
+        Each list element is either the loaded message, or the exception
+        that was raised while loading it.
+        """
+        def load(filepath):
+            try:
+                with self.storage.open(filepath) as results_file:
+                    return JobReturnMsg.deserialize(json.load(results_file))
+            except Exception as e:
+                return e
+
+        if not filepaths:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(
+                settings.SPACER_COLLECT_THREADS, len(filepaths))
+        ) as executor:
+            return list(executor.map(load, filepaths))
+
 
 def get_batch_client():
     return boto3.client(
@@ -109,70 +151,132 @@ class BatchQueue(BaseQueue):
         batch_job.batch_token = resp['jobId']
         batch_job.save()
 
-    @staticmethod
-    def handle_job_failure(batch_job, error_message):
+    def get_internal_jobs(self, batch_job: BatchJob) -> list[Job]:
+        """
+        A spacer job may contain multiple tasks, each corresponding to an
+        internal Job. Only the first of those Jobs is linked to the
+        BatchJob; the others are found from the stored job message.
+        """
+        jobs = [batch_job.internal_job]
+
+        job_msg_loc = self.storage.spacer_data_loc(batch_job.job_key)
+        try:
+            job_msg = JobMsg.load(job_msg_loc)
+        except IOError:
+            return jobs
+
+        other_job_ids = [
+            int(task.job_token) for task in job_msg.tasks
+            if int(task.job_token) != batch_job.internal_job_id
+        ]
+        jobs.extend(
+            Job.objects.filter(
+                pk__in=other_job_ids, status=Job.Status.IN_PROGRESS)
+            .order_by('pk')
+        )
+        return jobs
+
+    def handle_job_failure(self, batch_job, error_message):
         batch_job.status = 'FAILED'
         batch_job.save()
+        self.fail_internal_jobs(batch_job, error_message)
 
-        finish_job(
-            batch_job.internal_job, success=False, result_message=error_message)
+    def fail_internal_jobs(self, batch_job, error_message):
+        for job in self.get_internal_jobs(batch_job):
+            finish_job(job, success=False, result_message=error_message)
 
     def get_collectable_jobs(self):
         # Not-yet-collected BatchJobs.
         return BatchJob.objects.exclude(
             status__in=['SUCCEEDED', 'FAILED']
-        )
-
-    def collect_job(self, job: BatchJob) -> tuple[Optional[JobReturnMsg], str]:
-        if job.batch_token is None:
-            # Didn't get a batch token from AWS Batch. May indicate AWS
-            # service problems (see coralnet issue 458) or it may just be
-            # unlucky timing between submit and collect. Check the
-            # create_date to be sure.
-            if timezone.now() - job.create_date > timedelta(minutes=30):
-                # Likely an AWS service problem.
+        ).select_related('internal_job').order_by('pk')
+
+    # AWS Batch's limit for the number of jobs per describe_jobs call.
+    DESCRIBE_JOBS_MAX = 100
+
+    def collect_jobs(
+        self, jobs: Iterable[BatchJob],
+    ) -> Iterator[list[CollectResult]]:
+        for chunk in chunked(jobs, self.DESCRIBE_JOBS_MAX):
+            yield self.collect_jobs_chunk(chunk)
+
+    def collect_jobs_chunk(
+        self, jobs: list[BatchJob],
+    ) -> list[CollectResult]:
+        results: dict[int, CollectResult] = dict()
+
+        submitted_jobs = []
+        for job in jobs:
+            if job.batch_token is None:
+                # Didn't get a batch token from AWS Batch. May indicate AWS
+                # service problems (see coralnet issue 458) or it may just
+                # be unlucky timing between submit and collect. Check the
+                # create_date to be sure.
+                if timezone.now() - job.create_date > timedelta(minutes=30):
+                    # Likely an AWS service problem.
+                    self.handle_job_failure(
+                        job, "Failed to get AWS Batch token.")
+                    results[job.pk] = None, 'DROPPED'
+                else:
+                    # Let's wait a bit longer.
+                    results[job.pk] = None, 'NOT SUBMITTED'
+            else:
+                submitted_jobs.append(job)
+
+        if submitted_jobs:
+            resp = self.batch_client.describe_jobs(
+                jobs=[job.batch_token for job in submitted_jobs])
+            aws_statuses = {
+                str(aws_job['jobId']): aws_job['status']
+                for aws_job in resp['jobs']
+            }
+        else:
+            aws_statuses = dict()
+
+        changed_jobs = []
+        failed_jobs = []
+        succeeded_jobs = []
+        for job in submitted_jobs:
+            if job.batch_token not in aws_statuses:
                 self.handle_job_failure(
-                    job, "Failed to get AWS Batch token.")
-                return None, 'DROPPED'
+                    job, f"Batch job [{job}] not found in AWS.")
+                results[job.pk] = None, 'DROPPED'
+                continue
+
+            status = aws_statuses[job.batch_token]
+            if status != job.status:
+                job.status = status
+                changed_jobs.append(job)
+
+            if status == 'FAILED':
+                failed_jobs.append(job)
+            elif status == 'SUCCEEDED':
+                succeeded_jobs.append(job)
             else:
-                # Let's wait a bit longer.
-                return None, 'NOT SUBMITTED'
-
-        resp = self.batch_client.describe_jobs(jobs=[job.batch_token])
-
-        if len(resp['jobs']) == 0:
-            self.handle_job_failure(
-                job, f"Batch job [{job}] not found in AWS.")
-            return None, 'DROPPED'
+                results[job.pk] = None, status
 
-        job.status = resp['jobs'][0]['status']
-        job.save()
+        BatchJob.objects.bulk_update(changed_jobs, ['status'])
 
-        if job.status == 'FAILED':
-            self.handle_job_failure(
+        for job in failed_jobs:
+            self.fail_internal_jobs(
                 job, f"Batch job [{job}] marked as FAILED by AWS.")
-            return None, job.status
-
-        if job.status != 'SUCCEEDED':
-            return None, job.status
-
-        # Else: 'SUCCEEDED'
-        logger.info(f"Entering collection of Batch job [{job}].")
-        job_res_loc = self.storage.spacer_data_loc(job.res_key)
+            results[job.pk] = None, job.status
 
-        try:
-            return_msg = JobReturnMsg.load(job_res_loc)
-        except IOError as e:
-            self.handle_job_failure(
-                job,
-                f"Batch job [{job}] succeeded,"
-                f" but couldn't get output at the expected location."
-                f" ({e})")
-            return None, job.status
+        return_msgs = self.load_results_concurrently(
+            [job.res_key for job in succeeded_jobs])
+        for job, return_msg in zip(succeeded_jobs, return_msgs):
+            if isinstance(return_msg, Exception):
+                self.handle_job_failure(
+                    job,
+                    f"Batch job [{job}] succeeded,"
+                    f" but couldn't get output at the expected location."
+                    f" ({return_msg})")
+                results[job.pk] = None, job.status
+            else:
+                logger.info(f"Collected Batch job [{job}].")
+                results[job.pk] = return_msg, job.status
 
-        # All went well
-        logger.info(f"Exiting collection of Batch job [{job}].")
-        return return_msg, job.status
+        return [results[job.pk] for job in jobs]
 
 
 class LocalQueue(BaseQueue):
@@ -203,16 +307,26 @@ class LocalQueue(BaseQueue):
         filenames.sort()
         return filenames
 
-    def collect_job(
-            self, job_filename: str) -> tuple[Optional[JobReturnMsg], str]:
-
-        # Read the job result message
-        filepath = self.storage.path_join('backend_job_res', job_filename)
-        with self.storage.open(filepath) as results_file:
-            return_msg = JobReturnMsg.deserialize(json.load(results_file))
-        # Delete the job result file
-        self.storage.delete(filepath)
-
-        # Unlike BatchQueue, LocalQueue is only aware of the
-        # jobs that successfully output their results.
-        return return_msg, 'SUCCEEDED'
+    # Number of result files to read per chunk.
+    COLLECT_CHUNK_SIZE = 100
+
+    def collect_jobs(
+        self, job_filenames: Iterable[str],
+    ) -> Iterator[list[CollectResult]]:
+        for chunk in chunked(job_filenames, self.COLLECT_CHUNK_SIZE):
+            filepaths = [
+                self.storage.path_join('backend_job_res', job_filename)
+                for job_filename in chunk
+            ]
+            return_msgs = self.load_results_concurrently(filepaths)
+
+            results = []
+            for filepath, return_msg in zip(filepaths, return_msgs):
+                if isinstance(return_msg, Exception):
+                    raise return_msg
+                # Delete the job result file
+                self.storage.delete(filepath)
+                # Unlike BatchQueue, LocalQueue is only aware of the
+                # jobs that successfully output their results.
+                results.append((return_msg, 'SUCCEEDED'))
+            yield results
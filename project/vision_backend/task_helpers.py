@@ -2,23 +2,29 @@
 This file contains helper functions to vision_backend.tasks.
 """
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import re
+import time
 from typing import List, Optional
 
 import numpy as np
 from django.conf import settings
 from django.core.files.storage import get_storage_class
 from django.core.mail import mail_admins
+from django.db import transaction
 from django.db.models import F
 from django.utils.timezone import now
 from reversion import revisions
-from spacer.data_classes import ImageLabels
+from spacer.data_classes import ImageFeatures, ImageLabels
 from spacer.messages import \
     ExtractFeaturesMsg, \
+    ExtractFeaturesReturnMsg, \
     TrainClassifierMsg, \
+    TrainClassifierReturnMsg, \
     ClassifyImageMsg, \
     ClassifyReturnMsg, \
+    DataLocation, \
     JobReturnMsg
 
 from annotations.models import Annotation
@@ -28,14 +34,170 @@ from events.models import ClassifyImageEvent
 from images.models import Image, Point
 from jobs.exceptions import JobError
 from jobs.models import Job
-from jobs.utils import finish_job
+from jobs.tasks import get_scheduled_jobs
+from jobs.utils import finish_job, start_pending_jobs
 from labels.models import Label, LabelSet
+from . import feature_cache
+from .classifier_cache import classifier_cache
+from .evaluation import cache_classifier_evaluation
 from .models import Classifier, Score
 from .utils import queue_source_check
 
 logger = logging.getLogger(__name__)
 
 
+def get_point_scores(res: ClassifyReturnMsg, points) -> np.ndarray:
+    """
+    Stacks the scores from the spacer return message into a
+    (points x classes) array, with rows in the same order as `points`.
+
+    From spacer 0.2 we store row, col locations in features and in
+    classifier scores. This allows us to match scores to points
+    based on (row, col) locations. If not, we have to rely on
+    the points always being ordered as order_by('id').
+    """
+    all_scores = np.array(
+        [scores for _, _, scores in res.scores], dtype=float)
+
+    if res.valid_rowcol:
+        rowcol_to_index = dict(
+            ((row, col), index)
+            for index, (row, col, _) in enumerate(res.scores))
+        indices = [
+            rowcol_to_index[(point.row, point.column)] for point in points]
+    else:
+        indices = list(range(len(points)))
+
+    return all_scores[indices].reshape(len(indices), len(res.classes))
+
+
+def top_scores_indices(scores: np.ndarray, count: int) -> np.ndarray:
+    """
+    For each row of a (points x classes) score array, get the class
+    indices of the top `count` scores, in descending order of score.
+    """
+    count = min(count, scores.shape[1])
+    if count < scores.shape[1]:
+        # Partial sort to get the top scores in arbitrary order.
+        top_indices = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+    else:
+        top_indices = np.tile(np.arange(count), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, top_indices, axis=1)
+    # Then order just those top scores.
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top_indices, order, axis=1)
+
+
+def _classify_return_msg(
+        features: ImageFeatures, probabilities: np.ndarray, classes: list,
+        runtime: float) -> ClassifyReturnMsg:
+    scores = [
+        (pf.row, pf.col, point_probabilities)
+        for pf, point_probabilities
+        in zip(features.point_features, probabilities.tolist())
+    ]
+    return ClassifyReturnMsg(
+        runtime=runtime,
+        scores=scores,
+        classes=classes,
+        valid_rowcol=features.valid_rowcol)
+
+
+def _feature_array(features: ImageFeatures) -> np.ndarray:
+    return np.array([pf.data for pf in features.point_features])
+
+
+def classify_features(
+        feature_loc: DataLocation, clf) -> ClassifyReturnMsg:
+    """
+    Same as spacer's classify_features task, except that it takes an
+    already-loaded classifier, and runs one predict call for all of the
+    image's points instead of one per point.
+    """
+    t0 = time.time()
+    features = ImageFeatures.load(feature_loc)
+    return classify_loaded_features(features, clf, t0)
+
+
+def classify_loaded_features(
+        features: ImageFeatures, clf,
+        t0: Optional[float] = None) -> ClassifyReturnMsg:
+    """
+    Like classify_features, but for already-loaded features. t0 is the
+    start time to count the runtime from, if not now.
+    """
+    if t0 is None:
+        t0 = time.time()
+    probabilities = clf.predict_proba(_feature_array(features))
+    return _classify_return_msg(
+        features, probabilities, clf.classes_.tolist(), time.time() - t0)
+
+
+def classify_features_batch(
+    feature_locs: dict[int, DataLocation], clf,
+) -> tuple[dict[int, ClassifyReturnMsg], dict[int, str]]:
+    """
+    Like classify_features, but for several images at once. The feature
+    files are downloaded concurrently, and all points of all images are
+    classified with one predict call.
+
+    :param feature_locs: Feature-vector locations, keyed by image ID.
+    :param clf: Loaded classifier.
+    :return: (results, errors), both keyed by image ID. Each image ends up
+      in exactly one of the two; errors values are error strings.
+    """
+    t0 = time.time()
+    classes = clf.classes_.tolist()
+    results = dict()
+    errors = dict()
+
+    features_by_image = dict()
+    with ThreadPoolExecutor(
+        max_workers=settings.CLASSIFICATION_BATCH_LOAD_THREADS
+    ) as executor:
+        futures = {
+            image_id: executor.submit(ImageFeatures.load, loc)
+            for image_id, loc in feature_locs.items()
+        }
+        for image_id, future in futures.items():
+            try:
+                features_by_image[image_id] = future.result()
+            except Exception as e:
+                errors[image_id] = f"{type(e).__name__}: {e}"
+
+    if not features_by_image:
+        return results, errors
+
+    arrays = [
+        _feature_array(features) for features in features_by_image.values()]
+    try:
+        probabilities = clf.predict_proba(np.concatenate(arrays))
+    except ValueError:
+        # Probably some images' features don't match the classifier's
+        # dimensionality. Classify individually so that only those fail.
+        per_image_probabilities = []
+        for image_id, array in zip(features_by_image.keys(), arrays):
+            try:
+                per_image_probabilities.append(clf.predict_proba(array))
+            except ValueError as e:
+                errors[image_id] = f"{type(e).__name__}: {e}"
+                per_image_probabilities.append(None)
+    else:
+        split_indices = np.cumsum([len(array) for array in arrays])[:-1]
+        per_image_probabilities = np.split(probabilities, split_indices)
+
+    # Spread the runtime evenly over the images.
+    runtime = (time.time() - t0) / len(feature_locs)
+    for (image_id, features), image_probabilities in zip(
+            features_by_image.items(), per_image_probabilities):
+        if image_probabilities is None:
+            continue
+        results[image_id] = _classify_return_msg(
+            features, image_probabilities, classes, runtime)
+
+    return results, errors
+
+
 # This function is generally called outside of Django views, so the
 # middleware which do atomic transactions and create revisions aren't
 # active. This decorator enables both of those things.
@@ -57,35 +219,30 @@ def add_annotations(image_id: int,
     responsible for handling the error. In this error case, no annotations
     are saved due to the `atomic=True` in the decorator.
 
-    This function slowly saves annotations one by one, because bulk-saving
-    annotations would skip signal firing, and thus would not trigger
-    django-reversion's revision creation.
-    So this is slow on a database-ops timescale, although perhaps not on a
-    vision-backend-tasks timescale.
+    Annotations are saved in bulk, with django-reversion Versions also
+    created in bulk, so the number of queries doesn't depend on the
+    number of points.
     """
-    img = Image.objects.get(pk=image_id)
-    points = Point.objects.filter(image=img).order_by('id')
-    event_details = dict()
-
-    # From spacer 0.2 we store row, col locations in features and in
-    # classifier scores. This allows us to match scores to points
-    # based on (row, col) locations. If not, we have to rely on
-    # the points always being ordered as order_by('id').
-    for itt, point in enumerate(points):
-        if res.valid_rowcol:
-            # Retrieve score vector for (row, column) location
-            scores = res[(point.row, point.column)]
-        else:
-            _, _, scores = res.scores[itt]
-        label = label_objs[int(np.argmax(scores))]
+    img = Image.objects.select_related('source').get(pk=image_id)
+    points = list(img.point_set.order_by('id'))
+
+    # Top label for each point.
+    label_indices = np.argmax(get_point_scores(res, points), axis=1)
+    points_and_labels = [
+        (point, label_objs[int(label_index)])
+        for point, label_index in zip(points, label_indices)
+    ]
+
+    results = Annotation.objects.update_point_annotations_if_applicable(
+        image=img,
+        points_and_labels=points_and_labels,
+        now_confirmed=False,
+        user_or_robot_version=classifier)
 
-        result = Annotation.objects.update_point_annotation_if_applicable(
-            point=point,
-            label=label,
-            now_confirmed=False,
-            user_or_robot_version=classifier)
-
-        event_details[point.point_number] = dict(label=label.pk, result=result)
+    event_details = dict()
+    for point, label in points_and_labels:
+        event_details[point.point_number] = dict(
+            label=label.pk, result=results[point.pk])
 
     event = ClassifyImageEvent(
         source_id=img.source_id,
@@ -108,34 +265,35 @@ def add_scores(image_id: int,
       source's labelset.
     """
     img = Image.objects.get(pk=image_id)
+    points = list(Point.objects.filter(image=img).order_by('id'))
 
-    # First, delete all scores associated with this image.
-    Score.objects.filter(image=img).delete()
-
-    # Figure out how many of the (top) scores to store.
-    nbr_scores = min(settings.NBR_SCORES_PER_ANNOTATION, len(res.classes))
+    # Figure out the (top) scores to store for each point.
+    scores = get_point_scores(res, points)
+    top_indices = top_scores_indices(
+        scores, settings.NBR_SCORES_PER_ANNOTATION)
+    top_values = np.rint(
+        np.take_along_axis(scores, top_indices, axis=1) * 100).astype(int)
 
-    # Now, go through and create new ones.
-    points = Point.objects.filter(image=img).order_by('id')
-    
+    label_ids = [label.pk for label in label_objs]
     score_objs = []
-    for itt, point in enumerate(points):
-        if res.valid_rowcol:
-            scores = res[(point.row, point.column)]
-        else:
-            _, _, scores = res.scores[itt]
-        inds = np.argsort(scores)[::-1][:nbr_scores]
-        for ind in inds:
+    for point, point_indices, point_values in zip(
+            points, top_indices.tolist(), top_values.tolist()):
+        for ind, value in zip(point_indices, point_values):
             score_objs.append(
                 Score(
-                    source=img.source,
-                    image=img,
-                    label=label_objs[int(ind)],
-                    point=point,
-                    score=int(round(scores[ind]*100))
+                    source_id=img.source_id,
+                    image_id=img.pk,
+                    label_id=label_ids[ind],
+                    point_id=point.pk,
+                    score=value,
                 )
             )
-    Score.objects.bulk_create(score_objs)
+
+    # Replace all scores associated with this image.
+    with transaction.atomic():
+        Score.objects.filter(image=img).delete()
+        Score.objects.bulk_create(
+            score_objs, batch_size=settings.SCORE_BULK_CREATE_BATCH_SIZE)
 
 
 def make_dataset(images: List[Image]) -> ImageLabels:
@@ -159,14 +317,79 @@ def make_dataset(images: List[Image]) -> ImageLabels:
     return labels
 
 
+def image_batch_bytes(width: int, height: int) -> int:
+    """
+    Estimated size of an image for feature-extraction batching purposes:
+    the size of the decoded RGB pixel data.
+    """
+    return width * height * 3
+
+
+def start_extraction_batch_peers(
+        lead_job: Job, lead_image: Image) -> list[tuple[Job, Image]]:
+    """
+    Helper function for submit_features.
+    Starts other pending feature extractions from the lead image's source,
+    so that they can be submitted in the same spacer job as the lead image.
+    The batch is capped by FEATURE_EXTRACTION_BATCH_SIZE and
+    FEATURE_EXTRACTION_BATCH_MAX_BYTES.
+
+    Retries aren't batched, so that a problematic image ends up getting
+    isolated from other images.
+
+    Returns (Job, Image) pairs for the started peer extractions.
+    """
+    max_peers = settings.FEATURE_EXTRACTION_BATCH_SIZE - 1
+    if max_peers <= 0 or lead_job.attempt_number > 1:
+        return []
+
+    candidate_jobs = list(
+        get_scheduled_jobs()
+        .filter(
+            job_name='extract_features',
+            source_id=lead_image.source_id,
+            attempt_number=1,
+        )
+        .exclude(pk=lead_job.pk)
+        # Leave some leeway for candidates being skipped.
+        [:max_peers*2]
+    )
+    images = Image.objects.in_bulk(
+        [int(job.arg_identifier) for job in candidate_jobs])
+
+    budget = settings.FEATURE_EXTRACTION_BATCH_MAX_BYTES - image_batch_bytes(
+        lead_image.original_width, lead_image.original_height)
+    chosen_jobs = []
+    for job in candidate_jobs:
+        if len(chosen_jobs) >= max_peers:
+            break
+        image = images.get(int(job.arg_identifier))
+        if image is None:
+            # Let this job run by itself, to report the missing image.
+            continue
+        image_bytes = image_batch_bytes(
+            image.original_width, image.original_height)
+        if image_bytes > budget:
+            continue
+        budget -= image_bytes
+        chosen_jobs.append(job)
+
+    started_jobs = start_pending_jobs([job.pk for job in chosen_jobs])
+    return [
+        (job, images[int(job.arg_identifier)]) for job in started_jobs
+    ]
+
+
 class SpacerResultHandler(ABC):
     """
     Each type of collectable spacer job should define a subclass
     of this base class.
     """
-    # This must match the corresponding Job's job_name AND the
-    # spacer JobMsg's task_name (which are assumed to be the same).
+    # This must match the corresponding Job's job_name.
     job_name = None
+    # This must match the spacer JobMsg's task_name. If None, it's assumed
+    # to be the same as job_name.
+    task_name = None
 
     @classmethod
     def handle(cls, job_res: JobReturnMsg):
@@ -206,28 +429,37 @@ class SpacerResultHandler(ABC):
         else:
             spacer_error = None
 
-        # CoralNet currently only submits spacer jobs containing a single
-        # task.
-        task = job_res.original_job.tasks[0]
-
-        success = False
-        result_message = None
-        try:
-            result_message = cls.handle_spacer_task_result(
-                task, job_res, spacer_error)
-            success = True
-        except JobError as e:
-            result_message = str(e)
-        finally:
-            internal_job_id = task.job_token
-
-            job = Job.objects.get(pk=internal_job_id)
-            finish_job(job, success=success, result_message=result_message)
-
-            if job.source:
-                # If this is a source's job, chances are there might
-                # be another job to do for the source.
-                queue_source_check(job.source_id)
+        # A spacer job may contain multiple tasks (such as a batch of
+        # feature extractions). Each task corresponds to an internal Job.
+        source_ids_to_check = set()
+        for task_index, task in enumerate(job_res.original_job.tasks):
+            if spacer_error:
+                task_res = None
+            else:
+                task_res = job_res.results[task_index]
+
+            success = False
+            result_message = None
+            try:
+                result_message = cls.handle_spacer_task_result(
+                    task, task_res, spacer_error)
+                success = True
+            except JobError as e:
+                result_message = str(e)
+            finally:
+                internal_job_id = task.job_token
+
+                job = Job.objects.get(pk=internal_job_id)
+                finish_job(
+                    job, success=success, result_message=result_message)
+
+                if job.source:
+                    source_ids_to_check.add(job.source_id)
+
+        # If this is a source's job, chances are there might
+        # be another job to do for the source.
+        for source_id in sorted(source_ids_to_check):
+            queue_source_check(source_id)
 
     @classmethod
     def get_internal_job(cls, task):
@@ -238,10 +470,11 @@ class SpacerResultHandler(ABC):
             raise JobError(f"Job {internal_job_id} doesn't exist anymore.")
 
     @classmethod
-    def handle_spacer_task_result(cls, task, job_res, spacer_error):
+    def handle_spacer_task_result(cls, task, task_res, spacer_error):
         """
         Handles the result of a spacer task (a sub-unit within a spacer job)
         and raises a JobError if an error is found.
+        task_res is None if there was a spacer error.
         """
         raise NotImplementedError
 
@@ -253,7 +486,7 @@ class SpacerFeatureResultHandler(SpacerResultHandler):
     def handle_spacer_task_result(
             cls,
             task: ExtractFeaturesMsg,
-            job_res: JobReturnMsg,
+            task_res: Optional[ExtractFeaturesReturnMsg],
             spacer_error: Optional[str]) -> None:
 
         internal_job = cls.get_internal_job(task)
@@ -267,9 +500,6 @@ class SpacerFeatureResultHandler(SpacerResultHandler):
             # Error from spacer when running the spacer job.
             raise JobError(spacer_error)
 
-        # If there was no spacer error, then a task result is available.
-        task_res = job_res.results[0]
-
         # Double-check that the row-col information is still correct.
         rowcols = [(p.row, p.column) for p in Point.objects.filter(image=img)]
         if not set(rowcols) == set(task.rowcols):
@@ -294,7 +524,7 @@ class SpacerTrainResultHandler(SpacerResultHandler):
     def handle_spacer_task_result(
             cls,
             task: TrainClassifierMsg,
-            job_res: JobReturnMsg,
+            task_res: Optional[TrainClassifierReturnMsg],
             spacer_error: Optional[str]) -> Optional[str]:
 
         # Parse out pk for current and previous classifiers.
@@ -333,9 +563,6 @@ class SpacerTrainResultHandler(SpacerResultHandler):
             classifier.save()
             raise JobError(spacer_error)
 
-        # If there was no spacer error, then a task result is available.
-        task_res = job_res.results[0]
-
         if len(prev_classifier_ids) != len(task_res.pc_accs):
             raise JobError(
                 f"Number of previous classifiers doesn't match between"
@@ -385,6 +612,10 @@ class SpacerTrainResultHandler(SpacerResultHandler):
         classifier.status = Classifier.ACCEPTED
         classifier.save()
 
+        # Condense the validation results for the backend page now, rather
+        # than on its first view.
+        cache_classifier_evaluation(classifier)
+
         return f"New classifier accepted: {classifier.pk}"
 
 
@@ -395,33 +626,55 @@ class SpacerClassifyResultHandler(SpacerResultHandler):
     def handle_spacer_task_result(
             cls,
             task: ClassifyImageMsg,
-            job_res: JobReturnMsg,
+            task_res: Optional[ClassifyReturnMsg],
             spacer_error: Optional[str]) -> None:
 
         internal_job = cls.get_internal_job(task)
-        try:
-            job_unit = ApiJobUnit.objects.get(internal_job=internal_job)
-        except ApiJobUnit.DoesNotExist:
-            raise JobError(
-                f"API job unit for internal-job {internal_job.pk}"
-                f" does not exist.")
+        job_unit = cls.get_job_unit(internal_job)
 
         if spacer_error:
             # Error from spacer when running the spacer job.
             raise JobError(spacer_error)
 
-        # If there was no spacer error, then a task result is available.
-        task_res = job_res.results[0]
+        classifier = cls.get_classifier(job_unit)
+        cls.save_result(job_unit, classifier, task_res)
+
+    @classmethod
+    def classify_cached_features(
+            cls, job_unit: ApiJobUnit, classifier: Classifier,
+            features: ImageFeatures) -> None:
+        """
+        Classify a deploy image's features in-process, instead of having
+        spacer classify the image.
+        """
+        clf = classifier_cache.get(classifier)
+        res = classify_loaded_features(features, clf)
+        cls.save_result(job_unit, classifier, res)
+
+    @staticmethod
+    def get_job_unit(internal_job: Job) -> ApiJobUnit:
+        try:
+            return ApiJobUnit.objects.get(internal_job=internal_job)
+        except ApiJobUnit.DoesNotExist:
+            raise JobError(
+                f"API job unit for internal-job {internal_job.pk}"
+                f" does not exist.")
 
+    @staticmethod
+    def get_classifier(job_unit: ApiJobUnit) -> Classifier:
         classifier_id = job_unit.request_json['classifier_id']
         try:
-            classifier = Classifier.objects.get(pk=classifier_id)
+            return Classifier.objects.get(pk=classifier_id)
         except Classifier.DoesNotExist:
             raise JobError(f"Classifier of id {classifier_id} does not exist.")
 
+    @classmethod
+    def save_result(
+            cls, job_unit: ApiJobUnit, classifier: Classifier,
+            res: ClassifyReturnMsg) -> None:
         job_unit.result_json = dict(
             url=job_unit.request_json['url'],
-            points=cls.build_points_dicts(task_res, classifier.source.labelset)
+            points=cls.build_points_dicts(res, classifier.source.labelset)
         )
         job_unit.save()
 
@@ -443,10 +696,14 @@ class SpacerClassifyResultHandler(SpacerResultHandler):
             local_label = labelset.locallabel_set.get(global_label__pk=class_)
             local_labels.append(local_label)
 
+        all_scores = np.array(
+            [scores for _, _, scores in res.scores], dtype=float,
+        ).reshape(len(res.scores), len(res.classes))
+        # grab the index of the highest indices
+        all_inds = top_scores_indices(all_scores, nbr_scores)
+
         data = []
-        for row, col, scores in res.scores:
-            # grab the index of the highest indices
-            inds = np.argsort(scores)[::-1][:nbr_scores]
+        for (row, col, scores), inds in zip(res.scores, all_inds.tolist()):
             classifications = []
             for ind in inds:
                 local_label = local_labels[ind]
@@ -463,10 +720,42 @@ class SpacerClassifyResultHandler(SpacerResultHandler):
         return data
 
 
+class SpacerDeployFeatureCacheResultHandler(SpacerResultHandler):
+    """
+    A deploy job which missed the feature cache has spacer extract the
+    image's features into the cache, instead of classifying the image.
+    The features are then classified here.
+    """
+    job_name = 'classify_image'
+    task_name = 'extract_features'
+
+    @classmethod
+    def handle_spacer_task_result(
+            cls,
+            task: ExtractFeaturesMsg,
+            task_res: Optional[ExtractFeaturesReturnMsg],
+            spacer_error: Optional[str]) -> None:
+
+        internal_job = cls.get_internal_job(task)
+        job_unit = SpacerClassifyResultHandler.get_job_unit(internal_job)
+
+        if spacer_error:
+            # Error from spacer when running the spacer job.
+            raise JobError(spacer_error)
+
+        key = feature_cache.key_from_feature_loc(task.feature_loc)
+        feature_cache.add_entry(key)
+
+        classifier = SpacerClassifyResultHandler.get_classifier(job_unit)
+        SpacerClassifyResultHandler.classify_cached_features(
+            job_unit, classifier, ImageFeatures.load(task.feature_loc))
+
+
 handler_classes = [
     SpacerFeatureResultHandler,
     SpacerTrainResultHandler,
     SpacerClassifyResultHandler,
+    SpacerDeployFeatureCacheResultHandler,
 ]
 
 
@@ -474,8 +763,24 @@ def handle_spacer_result(job_res: JobReturnMsg):
     """Handles the job results found in queue. """
 
     task_name = job_res.original_job.task_name
-    for HandlerClass in handler_classes:
-        if task_name == HandlerClass.job_name:
-            HandlerClass.handle(job_res)
-            return
+    matching_classes = [
+        HandlerClass for HandlerClass in handler_classes
+        if task_name == (HandlerClass.task_name or HandlerClass.job_name)
+    ]
+
+    if len(matching_classes) > 1:
+        # More than one kind of Job uses this spacer task, such as
+        # extract_features for both feature extraction and deploy. Tell
+        # them apart by the Job of the spacer job's first task.
+        job_name = Job.objects.filter(
+            pk=job_res.original_job.tasks[0].job_token
+        ).values_list('job_name', flat=True).first()
+        matching_classes = [
+            HandlerClass for HandlerClass in matching_classes
+            if job_name == HandlerClass.job_name
+        ]
+
+    if matching_classes:
+        matching_classes[0].handle(job_res)
+        return
     logger.error(f"Spacer task name [{task_name}] not recognized")
@@ -12,22 +12,23 @@ from django.utils import timezone
 from spacer.messages import \
     ExtractFeaturesMsg, \
     TrainClassifierMsg, \
-    ClassifyFeaturesMsg, \
     ClassifyImageMsg, \
     ClassifyReturnMsg, \
     JobMsg, \
     DataLocation
-from spacer.tasks import classify_features as spacer_classify_features
 
 from annotations.models import Annotation
 from api_core.models import ApiJobUnit
 from events.models import ClassifyImageEvent
-from images.models import Source, Image, Point
+from images.models import Source, Image, Point, PendingImageDeletion
 from jobs.exceptions import JobError
 from jobs.models import Job
-from jobs.utils import job_runner, job_starter, queue_job
+from jobs.utils import (
+    finish_job, job_runner, job_starter, queue_job, queue_jobs)
 from labels.models import Label
-from . import task_helpers as th
+from upload.models import PendingAnnotationImport
+from . import feature_cache, task_helpers as th
+from .classifier_cache import classifier_cache
 from .common import CLASSIFIER_MAPPINGS
 from .models import Classifier, Score
 from .queues import get_queue_class
@@ -68,20 +69,26 @@ def check_source(source_id):
     except Source.DoesNotExist:
         raise JobError(f"Can't find source {source_id}")
 
-    start = timezone.now()
-    wrap_up_time = start + timedelta(minutes=settings.JOB_MAX_MINUTES)
-    timed_out = False
+    # The deletion and import jobs normally queue themselves again until
+    # their pending rows are all processed, but in case that was
+    # interrupted, make sure there are jobs to process them.
+    if PendingImageDeletion.objects.filter(source=source).exists():
+        queue_job('delete_source_images', source_id, source_id=source_id)
+    if PendingAnnotationImport.objects.filter(source=source).exists():
+        queue_job('import_annotations', source_id, source_id=source_id)
 
     done_caveat = None
 
     # Feature extraction
 
-    not_extracted = source.image_set.without_features()
+    not_extracted = source.image_set.not_pending_deletion() \
+        .without_features()
     not_extracted = not_extracted.annotate(
         num_pixels=F('original_width') * F('original_height'))
     cant_extract = not_extracted.filter(
         num_pixels__gt=settings.SPACER['MAX_IMAGE_PIXELS'])
-    to_extract = not_extracted.difference(cant_extract)
+    to_extract = not_extracted.filter(
+        num_pixels__lte=settings.SPACER['MAX_IMAGE_PIXELS'])
 
     if to_extract.exists():
         active_training_jobs = Job.objects.filter(
@@ -107,48 +114,23 @@ def check_source(source_id):
                 f"Feature extraction(s) ready, but not"
                 f" submitted due to training in progress")
 
-        active_extraction_jobs = Job.objects.filter(
-            job_name='extract_features',
+        # Try to queue extractions (will not be queued if an extraction for
+        # the same image is already active). This is done in bulk so that
+        # sources with many new images can get all of them queued in one
+        # pass.
+        image_ids = to_extract.order_by('pk').values_list('pk', flat=True)
+        queued_jobs = queue_jobs(
+            'extract_features',
+            [(image_id,) for image_id in image_ids],
             source_id=source_id,
-            status__in=[Job.Status.PENDING, Job.Status.IN_PROGRESS]
         )
-        active_extraction_image_ids = set([
-            int(str_id) for str_id in
-            active_extraction_jobs.values_list('arg_identifier', flat=True)
-        ])
-
-        # Try to queue extractions (will not be queued if an extraction for
-        # the same image is already active)
-        num_queued_extractions = 0
-        for image in to_extract:
-            if image.pk in active_extraction_image_ids:
-                # Very quick short-circuit without additional DB check.
-                continue
-
-            # This hits the DB to check for a race condition (identical
-            # active job), then to create a job as appropriate.
-            job = queue_job('extract_features', image.pk, source_id=source_id)
-            if not job:
-                continue
-
-            num_queued_extractions += 1
-
-            if (
-                num_queued_extractions % 10 == 0
-                and timezone.now() > wrap_up_time
-            ):
-                timed_out = True
-                break
+        num_queued_extractions = len(queued_jobs)
 
         # If there are extractions to be done, then having that overlap with
         # training can lead to desynced rowcols, so we return and worry about
         # training later.
         if num_queued_extractions > 0:
-            result_str = (
-                f"Queued {num_queued_extractions} feature extraction(s)")
-            if timed_out:
-                result_str += " (timed out)"
-            return result_str
+            return f"Queued {num_queued_extractions} feature extraction(s)"
         else:
             return "Waiting for feature extraction(s) to finish"
 
@@ -175,7 +157,8 @@ def check_source(source_id):
     if not source.has_robot():
         return f"Can't train first classifier: {reason}"
 
-    classifiable_images = source.image_set.incomplete().with_features()
+    classifiable_images = (
+        source.image_set.not_pending_deletion().incomplete().with_features())
     unclassified_images = classifiable_images.unclassified()
 
     # Here we detect whether the current classifier has been used for ANY
@@ -206,42 +189,58 @@ def check_source(source_id):
 
     if images_to_classify.exists():
 
-        active_classify_jobs = Job.objects.filter(
-            job_name='classify_features',
+        # Leave out images which an active batch with the current
+        # classifier will get to. Anything else, such as the images of a
+        # batch which failed, gets queued.
+        active_batch_identifiers = Job.objects.filter(
+            job_name='classify_features_batch',
             source_id=source_id,
-            status__in=[Job.Status.PENDING, Job.Status.IN_PROGRESS]
-        )
-        active_classify_image_ids = set([
-            int(str_id) for str_id in
-            active_classify_jobs.values_list('arg_identifier', flat=True)
-        ])
-
-        # Try to queue classifications
-        num_queued_classifications = 0
-        for image in images_to_classify:
-            if image.pk in active_classify_image_ids:
-                # Very quick short-circuit without additional DB check.
+            status__in=[Job.Status.PENDING, Job.Status.IN_PROGRESS],
+        ).values_list('arg_identifier', flat=True)
+        for arg_identifier in active_batch_identifiers:
+            classifier_id, first_image_id, last_image_id = (
+                Job.identifier_to_args(arg_identifier))
+            if int(classifier_id) != current_classifier.pk:
                 continue
+            images_to_classify = images_to_classify.exclude(
+                pk__range=(int(first_image_id), int(last_image_id)))
 
-            job = queue_job('classify_features', image.pk, source_id=source_id)
-            if not job:
-                continue
+        # Try to queue classifications
+        image_ids = list(images_to_classify.order_by('pk').values_list(
+            'pk', flat=True))
+        if not image_ids:
+            return "Waiting for image classification(s) to finish"
 
-            num_queued_classifications += 1
+        batch_size = settings.CLASSIFICATION_BATCH_SIZE
+        if not current_classifier_used and len(image_ids) > batch_size:
+            # A new classifier needs to take a pass on many images, so
+            # classify them in batches. Each batch is identified by its
+            # first and last image ID.
+            chunks = [
+                image_ids[i:i+batch_size]
+                for i in range(0, len(image_ids), batch_size)
+            ]
+            queued_jobs = queue_jobs(
+                'classify_features_batch',
+                [(current_classifier.pk, chunk[0], chunk[-1])
+                 for chunk in chunks],
+                source_id=source_id,
+            )
+            return (
+                f"Queued {len(image_ids)} image classification(s)"
+                f" in {len(queued_jobs)} batch(es)")
 
-            if (
-                num_queued_classifications % 10 == 0
-                and timezone.now() > wrap_up_time
-            ):
-                timed_out = True
-                break
+        queued_jobs = queue_jobs(
+            'classify_features',
+            [(image_id,) for image_id in image_ids],
+            source_id=source_id,
+        )
+        num_queued_classifications = len(queued_jobs)
 
         if num_queued_classifications > 0:
-            result_str = (
-                f"Queued {num_queued_classifications} image classification(s)")
-            if timed_out:
-                result_str += " (timed out)"
-            return result_str
+            return (
+                f"Queued {num_queued_classifications}"
+                f" image classification(s)")
         else:
             return "Waiting for image classification(s) to finish"
 
@@ -257,36 +256,68 @@ def check_source(source_id):
 
 @job_starter(job_name='extract_features')
 def submit_features(image_id, job_id):
-    """ Submits a feature extraction job. """
+    """
+    Submits a feature extraction job.
+
+    Other pending extractions from the same source may be submitted in the
+    same spacer job, with one task per image. See
+    FEATURE_EXTRACTION_BATCH_SIZE.
+    """
     try:
         img = Image.objects.get(pk=image_id)
     except Image.DoesNotExist:
         raise JobError(f"Image {image_id} does not exist.")
 
-    # Setup the job payload.
-    storage = get_storage_class()()
-
-    # Assemble row column information
-    rowcols = [(p.row, p.column) for p in Point.objects.filter(image=img)]
+    job = Job.objects.get(pk=job_id)
+    peers = th.start_extraction_batch_peers(job, img)
+    batch = [(job, img), *peers]
 
-    # Assemble task.
-    task = ExtractFeaturesMsg(
-        job_token=str(job_id),
-        extractor=get_extractor(img.source.feature_extractor),
-        rowcols=rowcols,
-        image_loc=storage.spacer_data_loc(img.original_file.name),
-        feature_loc=storage.spacer_data_loc(
-            settings.FEATURE_VECTOR_FILE_PATTERN.format(
-                full_image_path=img.original_file.name))
-    )
-
-    msg = JobMsg(task_name='extract_features', tasks=[task])
-
-    # Submit.
-    queue = get_queue_class()()
-    queue.submit_job(msg, job_id)
-
-    logger.info(f"Submitted feature extraction for {img}")
+    try:
+        # Setup the job payload.
+        storage = get_storage_class()()
+        extractor = get_extractor(img.source.feature_extractor)
+
+        # Assemble row column information
+        rowcols_by_image = {image.pk: [] for _, image in batch}
+        points = Point.objects.filter(
+            image_id__in=rowcols_by_image.keys()).order_by('pk')
+        for point_image_id, row, column in points.values_list(
+                'image_id', 'row', 'column'):
+            rowcols_by_image[point_image_id].append((row, column))
+
+        # Assemble tasks, each tied to its own internal Job.
+        tasks = []
+        for batch_job, image in batch:
+            tasks.append(ExtractFeaturesMsg(
+                job_token=str(batch_job.pk),
+                extractor=extractor,
+                rowcols=rowcols_by_image[image.pk],
+                image_loc=storage.spacer_data_loc(image.original_file.name),
+                feature_loc=storage.spacer_data_loc(
+                    settings.FEATURE_VECTOR_FILE_PATTERN.format(
+                        full_image_path=image.original_file.name))
+            ))
+
+        msg = JobMsg(task_name='extract_features', tasks=tasks)
+
+        # Submit.
+        queue = get_queue_class()()
+        queue.submit_job(msg, job_id)
+    except Exception as e:
+        # The decorator only finishes the lead job, so the peer jobs must
+        # be finished here to avoid leaving them stuck in progress.
+        for peer_job, _ in peers:
+            finish_job(
+                peer_job, success=False,
+                result_message=f"Batch submission failed - {e}")
+        raise
+
+    if peers:
+        logger.info(
+            f"Submitted feature extraction for {img}"
+            f" and {len(peers)} other image(s)")
+    else:
+        logger.info(f"Submitted feature extraction for {img}")
     return msg
 
 
@@ -300,7 +331,9 @@ def submit_classifier(source_id, job_id):
 
     # Create new classifier model
     IMAGE_LIMIT = 1e5
-    images = source.image_set.confirmed().with_features()[:IMAGE_LIMIT]
+    images = (
+        source.image_set.not_pending_deletion().confirmed().with_features()
+        [:IMAGE_LIMIT])
     classifier = Classifier(
         source=source, train_job_id=job_id, nbr_train_images=len(images))
     classifier.save()
@@ -366,7 +399,10 @@ def submit_classifier(source_id, job_id):
 
 @job_starter(job_name='classify_image')
 def deploy(api_job_id, api_unit_order, job_id):
-    """ Submits a deploy job. """
+    """
+    Submits a deploy job. With a feature cache hit, the deploy is done
+    right here instead.
+    """
     try:
         api_job_unit = ApiJobUnit.objects.get(
             parent_id=api_job_id, order_in_parent=api_unit_order)
@@ -384,21 +420,57 @@ def deploy(api_job_id, api_unit_order, job_id):
         raise JobError(error_message)
 
     storage = get_storage_class()()
-
-    task = ClassifyImageMsg(
-        job_token=str(job_id),
-        image_loc=DataLocation(
-            storage_type='url',
-            key=api_job_unit.request_json['url']
-        ),
-        extractor=get_extractor(classifier.source.feature_extractor),
-        rowcols=[(point['row'], point['column']) for point in
-                 api_job_unit.request_json['points']],
-        classifier_loc=storage.spacer_data_loc(
-            settings.ROBOT_MODEL_FILE_PATTERN.format(pk=classifier.pk))
-    )
-    # Note the 'deploy' is called 'classify_image' in spacer.
-    msg = JobMsg(task_name='classify_image', tasks=[task])
+    url = api_job_unit.request_json['url']
+    extractor = get_extractor(classifier.source.feature_extractor)
+    rowcols = [(point['row'], point['column']) for point in
+               api_job_unit.request_json['points']]
+
+    if settings.DEPLOY_FEATURE_CACHE_ENABLED:
+        key = feature_cache.make_key(
+            classifier.source.feature_extractor, url, rowcols)
+
+        features = None
+        entry = feature_cache.get_entry(key)
+        if entry:
+            features = feature_cache.load_features(entry)
+
+        if features:
+            th.SpacerClassifyResultHandler.classify_cached_features(
+                api_job_unit, classifier, features)
+            finish_job(Job.objects.get(pk=job_id), success=True)
+            logger.info(
+                f"Deploy done from cached features:"
+                f" ApiJobUnit {api_job_unit.pk}, Image URL [{url}]")
+            return None
+
+        # Extract features into the cache. The classification's done
+        # when the result is collected; see
+        # SpacerDeployFeatureCacheResultHandler.
+        task = ExtractFeaturesMsg(
+            job_token=str(job_id),
+            extractor=extractor,
+            rowcols=rowcols,
+            image_loc=DataLocation(
+                storage_type='url',
+                key=url
+            ),
+            feature_loc=feature_cache.feature_loc(key),
+        )
+        msg = JobMsg(task_name='extract_features', tasks=[task])
+    else:
+        task = ClassifyImageMsg(
+            job_token=str(job_id),
+            image_loc=DataLocation(
+                storage_type='url',
+                key=url
+            ),
+            extractor=extractor,
+            rowcols=rowcols,
+            classifier_loc=storage.spacer_data_loc(
+                settings.ROBOT_MODEL_FILE_PATTERN.format(pk=classifier.pk))
+        )
+        # Note the 'deploy' is called 'classify_image' in spacer.
+        msg = JobMsg(task_name='classify_image', tasks=[task])
 
     # Submit.
     queue = get_queue_class()()
@@ -406,7 +478,7 @@ def deploy(api_job_id, api_unit_order, job_id):
 
     logger.info(
         f"Deploy submission made: ApiJobUnit {api_job_unit.pk},"
-        f" Image URL [{api_job_unit.request_json['url']}]")
+        f" Image URL [{url}]")
 
     return msg
 
@@ -430,25 +502,22 @@ def classify_image(image_id):
             f"Image {image_id} can't be classified;"
             f" its source doesn't have a classifier.")
 
-    # Create task message
+    # Process job right here since it is so fast, using the
+    # per-process classifier cache to skip reloading the model each time.
+    # This is spacer's classify_features task, since the features are
+    # already extracted.
+    clf = classifier_cache.get(classifier)
     storage = get_storage_class()()
-    msg = ClassifyFeaturesMsg(
-        job_token=str(image_id),
-        feature_loc=storage.spacer_data_loc(
+    res: ClassifyReturnMsg = th.classify_features(
+        storage.spacer_data_loc(
             settings.FEATURE_VECTOR_FILE_PATTERN.format(
                 full_image_path=img.original_file.name)),
-        classifier_loc=storage.spacer_data_loc(
-            settings.ROBOT_MODEL_FILE_PATTERN.format(pk=classifier.pk)
-        )
+        clf,
     )
 
-    # Process job right here since it is so fast.
-    # In spacer, this task is called classify_features since that
-    # is actually what we are doing (the feature are already extracted).
-    res: ClassifyReturnMsg = spacer_classify_features(msg)
-
     # Pre-fetch label objects
-    label_objs = [Label.objects.get(pk=pk) for pk in res.classes]
+    labels = Label.objects.in_bulk(res.classes)
+    label_objs = [labels[pk] for pk in res.classes]
 
     # Add annotations if image isn't already confirmed    
     if not img.annoinfo.confirmed:
@@ -467,6 +536,95 @@ def classify_image(image_id):
     return f"Used classifier {classifier.pk}"
 
 
+@job_runner(job_name='classify_features_batch')
+def classify_image_batch(classifier_id, first_image_id, last_image_id):
+    """
+    Executes a classify_features_batch job: classifies the source's
+    not-yet-confirmed images with IDs from first_image_id to last_image_id
+    (inclusive), using one classifier load and one predict call.
+
+    An image which fails doesn't stop the others from being saved; failed
+    images are re-queued as individual classify_features jobs.
+    """
+    try:
+        classifier = Classifier.objects.select_related('source').get(
+            pk=classifier_id)
+    except Classifier.DoesNotExist:
+        raise JobError(f"Classifier {classifier_id} does not exist.")
+
+    source = classifier.source
+    current_classifier = source.get_current_classifier()
+    if not current_classifier or current_classifier.pk != classifier.pk:
+        # A source check will queue classifications with the
+        # current classifier.
+        return (
+            f"Classifier {classifier_id} is no longer the source's"
+            f" current classifier")
+
+    images = list(
+        source.image_set.not_pending_deletion().incomplete().with_features()
+        .filter(pk__gte=first_image_id, pk__lte=last_image_id)
+        .select_related('annoinfo')
+        .order_by('pk')
+    )
+    if not images:
+        return "No images to classify"
+
+    clf = classifier_cache.get(classifier)
+    storage = get_storage_class()()
+    results, errors = th.classify_features_batch(
+        {
+            img.pk: storage.spacer_data_loc(
+                settings.FEATURE_VECTOR_FILE_PATTERN.format(
+                    full_image_path=img.original_file.name))
+            for img in images
+        },
+        clf,
+    )
+
+    # Pre-fetch label objects
+    classes = clf.classes_.tolist()
+    labels = Label.objects.in_bulk(classes)
+    label_objs = [labels[pk] for pk in classes]
+
+    for img in images:
+        if img.pk in errors:
+            continue
+        res = results[img.pk]
+        try:
+            if not img.annoinfo.confirmed:
+                th.add_annotations(img.pk, res, label_objs, classifier)
+            th.add_scores(img.pk, res, label_objs)
+        except Exception as e:
+            errors[img.pk] = f"{type(e).__name__}: {e}"
+
+    if errors:
+        for image_id, error in errors.items():
+            logger.warning(
+                f"Batch classification of image {image_id} with"
+                f" classifier {classifier_id} failed: {error}")
+        queue_jobs(
+            'classify_features',
+            [(image_id,) for image_id in sorted(errors)],
+            source_id=source.pk,
+        )
+
+    classified_count = len(images) - len(errors)
+    if classified_count == 0:
+        raise JobError(
+            f"Failed to classify all {len(images)} image(s)"
+            f" with classifier {classifier_id}."
+            f" Example error: {next(iter(errors.values()))[:200]}")
+
+    message = (
+        f"Used classifier {classifier_id} on"
+        f" {classified_count} image(s)")
+    if errors:
+        message += (
+            f"; {len(errors)} failed and were re-queued individually")
+    return message
+
+
 @job_runner(interval=timedelta(minutes=1))
 def collect_spacer_jobs():
     """
@@ -483,15 +641,15 @@ def collect_spacer_jobs():
     queue = get_queue_class()()
     job_statuses = []
 
-    for job in queue.get_collectable_jobs():
-        job_res, job_status = queue.collect_job(job)
-        job_statuses.append(job_status)
-        if job_res:
-            th.handle_spacer_result(job_res)
+    for chunk_results in queue.collect_jobs(queue.get_collectable_jobs()):
+        for job_res, job_status in chunk_results:
+            job_statuses.append(job_status)
+            if job_res:
+                th.handle_spacer_result(job_res)
 
         if timezone.now() > wrap_up_time:
-            # As long as collect_jobs() is implemented with `yield`,
-            # this loop-break won't abandon any job results.
+            # collect_jobs() only starts work on a chunk when we ask for
+            # it, so this loop-break won't abandon any job results.
             timed_out = True
             break
 
@@ -530,6 +688,7 @@ def reset_classifiers_for_source(source_id):
     """
     Score.objects.filter(source_id=source_id).delete()
     Classifier.objects.filter(source_id=source_id).delete()
+    classifier_cache.invalidate_source(source_id)
     Annotation.objects.filter(source_id=source_id).unconfirmed().delete()
 
     # Can probably train a new classifier.
@@ -1,19 +1,22 @@
 import re
 from unittest import mock
 
+from django.conf import settings
 from django.core.cache import cache
+from django.core.files.storage import get_storage_class
 from django.test import override_settings
 import numpy as np
 
-from accounts.utils import get_robot_user, is_robot_user
+from accounts.utils import is_robot_user
 from annotations.models import Annotation
 from annotations.tests.utils import AnnotationHistoryTestMixin
 from events.models import ClassifyImageEvent
 from images.models import Point
 from jobs.models import Job
 from jobs.tasks import run_scheduled_jobs, run_scheduled_jobs_until_empty
-from jobs.tests.utils import queue_and_run_job, queue_job, JobUtilsMixin
-from ...models import Score
+from jobs.tests.utils import (
+    do_job, queue_and_run_job, queue_job, JobUtilsMixin)
+from ...models import Classifier, Score
 from ...utils import clear_features
 from .utils import BaseTaskTest, queue_and_run_collect_spacer_jobs
 
@@ -203,16 +206,18 @@ class SourceCheckTest(BaseTaskTest, JobUtilsMixin):
                 msg="Image that was last classified by the current classifier"
                     " should not have been queued")
 
-    def test_time_out(self):
+    @override_settings(JOB_BULK_QUEUE_CHUNK_SIZE=5)
+    def test_bulk_queue(self):
         for _ in range(12):
             self.upload_image_for_classification()
 
-        with override_settings(JOB_MAX_MINUTES=-1):
-            self.source_check_and_assert_message(
-                "Queued 10 image classification(s) (timed out)")
+        # All classifications should get queued in one pass, across
+        # multiple bulk-queueing chunks.
+        self.source_check_and_assert_message(
+            "Queued 12 image classification(s)")
 
         self.source_check_and_assert_message(
-            "Queued 2 image classification(s)")
+            "Waiting for image classification(s) to finish")
 
 
 class ClassifyImageTest(
@@ -606,6 +611,111 @@ class ClassifyImageTest(
             "Applied labels match the given scores")
 
 
+@override_settings(CLASSIFICATION_BATCH_SIZE=2)
+class ClassifyBatchTest(BaseTaskTest, JobUtilsMixin):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.upload_data_and_train_classifier()
+        cls.classifier = cls.source.get_current_classifier()
+        cls.images = [
+            cls.upload_image_for_classification() for _ in range(3)]
+
+    def assert_classified(self, image):
+        image.annoinfo.refresh_from_db()
+        self.assertTrue(image.annoinfo.classified)
+        self.assertEqual(
+            image.annotation_set.filter(
+                robot_version=self.classifier).count(),
+            5)
+        self.assertEqual(Score.objects.filter(image=image).count(), 10)
+
+    def test_source_check_queues_batches(self):
+        self.source_check_and_assert_message(
+            "Queued 3 image classification(s) in 2 batch(es)")
+        self.source_check_and_assert_message(
+            "Waiting for image classification(s) to finish")
+
+        run_scheduled_jobs()
+
+        for image in self.images:
+            self.assert_classified(image)
+        self.assertEqual(
+            Job.objects.filter(
+                job_name='classify_features_batch',
+                status=Job.Status.SUCCESS).count(),
+            2)
+        self.assertFalse(
+            Job.objects.filter(job_name='classify_features').exists(),
+            "Shouldn't have queued individual classifications")
+
+    def test_source_check_requeues_failed_batch(self):
+        self.source_check_and_assert_message(
+            "Queued 3 image classification(s) in 2 batch(es)")
+
+        # Such as if the worker died partway through the first batch.
+        first_batch = Job.objects.filter(
+            job_name='classify_features_batch').earliest('pk')
+        first_batch.status = Job.Status.FAILURE
+        first_batch.save()
+
+        # The second batch is still active, but only covers the last
+        # image.
+        self.source_check_and_assert_message(
+            "Queued 2 image classification(s)")
+
+        run_scheduled_jobs()
+
+        for image in self.images:
+            self.assert_classified(image)
+
+    def test_few_images_not_batched(self):
+        with override_settings(CLASSIFICATION_BATCH_SIZE=3):
+            self.source_check_and_assert_message(
+                "Queued 3 image classification(s)")
+
+    def test_one_image_fails(self):
+        image_1, image_2, image_3 = self.images
+        # Remove image 2's features from storage.
+        storage = get_storage_class()()
+        storage.delete(settings.FEATURE_VECTOR_FILE_PATTERN.format(
+            full_image_path=image_2.original_file.name))
+
+        do_job(
+            'classify_features_batch',
+            self.classifier.pk, image_1.pk, image_3.pk,
+            source_id=self.source.pk)
+        self.assert_job_result_message(
+            'classify_features_batch',
+            f"Used classifier {self.classifier.pk} on 2 image(s);"
+            f" 1 failed and were re-queued individually")
+
+        self.assert_classified(image_1)
+        self.assert_classified(image_3)
+        image_2.annoinfo.refresh_from_db()
+        self.assertFalse(image_2.annoinfo.classified)
+
+        job = Job.objects.get(job_name='classify_features')
+        self.assertEqual(job.arg_identifier, str(image_2.pk))
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+    def test_superseded_classifier(self):
+        # Simulate a newer classifier having been accepted.
+        self.classifier.status = Classifier.REJECTED_ACCURACY
+        self.classifier.save()
+
+        do_job(
+            'classify_features_batch',
+            self.classifier.pk, self.images[0].pk, self.images[-1].pk,
+            source_id=self.source.pk)
+        self.assert_job_result_message(
+            'classify_features_batch',
+            f"Classifier {self.classifier.pk} is no longer the source's"
+            f" current classifier")
+
+
 class AbortCasesTest(BaseTaskTest, JobUtilsMixin):
     """Test cases where the task would abort before reaching the end."""
 
@@ -671,45 +781,39 @@ class AbortCasesTest(BaseTaskTest, JobUtilsMixin):
 
     def test_integrity_error_when_saving_annotations(self):
 
-        class UnexpectedPointOrderError(Exception):
-            pass
+        update_annotations = \
+            Annotation.objects.update_point_annotations_if_applicable
 
-        def mock_update_annotation(
-                point, label, now_confirmed, user_or_robot_version):
+        def mock_update_annotations(
+                image, points_and_labels, now_confirmed,
+                user_or_robot_version):
             """
-            When the save_annotations_ajax view tries to actually save the
-            annotations to the DB, this patched function should save the
-            annotation for point 1, then raise an IntegrityError for point 2.
-            This should make the view return an appropriate
-            error message, and should make point 1 get rolled back.
+            When classification tries to actually save the annotations to
+            the DB, this patched function should save the annotations,
+            then raise an IntegrityError by saving a second annotation for
+            point 1. This should make the job return an appropriate
+            error message, and should make all the annotations get
+            rolled back.
 
             And this should only happen ONCE. Due to auto-retries and
             HUEY['immediate'], if we always raised the error,
             we'd infinite-loop.
             """
-            # This is a simple saving case (for brevity) which works for this
-            # particular test.
-            new_annotation = Annotation(
-                point=point, image=point.image,
-                source=point.image.source, label=label,
-                user=get_robot_user(),
-                robot_version=user_or_robot_version)
-            new_annotation.save()
-
-            if point.point_number == 1:
-                cache.set('point_1_processed', True)
-            if point.point_number == 2:
-                if not cache.get('point_1_processed'):
-                    # The point order, which the test depends on, isn't as
-                    # expected. Raise a non-IntegrityError to fail the test.
-                    raise UnexpectedPointOrderError
-                if not cache.get('raised_integrity_error'):
-                    cache.set('raised_integrity_error', True)
-                    # Save another Annotation for this Point, simulating a
-                    # race condition of some kind.
-                    # Should get an IntegrityError.
-                    new_annotation.pk = None
-                    new_annotation.save()
+            results = update_annotations(
+                image, points_and_labels, now_confirmed,
+                user_or_robot_version)
+
+            if not cache.get('raised_integrity_error'):
+                cache.set('raised_integrity_error', True)
+                # Save another Annotation for point 1, simulating a
+                # race condition of some kind.
+                # Should get an IntegrityError.
+                new_annotation = image.annotation_set.get(
+                    point__point_number=1)
+                new_annotation.pk = None
+                new_annotation.save()
+
+            return results
 
         self.upload_data_and_train_classifier()
         classifier = self.source.get_current_classifier()
@@ -719,8 +823,8 @@ class AbortCasesTest(BaseTaskTest, JobUtilsMixin):
         # Try to classify
         with mock.patch(
             'annotations.models.Annotation.objects'
-            '.update_point_annotation_if_applicable',
-            mock_update_annotation
+            '.update_point_annotations_if_applicable',
+            mock_update_annotations
         ):
             run_scheduled_jobs_until_empty()
 
@@ -732,9 +836,8 @@ class AbortCasesTest(BaseTaskTest, JobUtilsMixin):
             classify_job.result_message,
             "Job should have the expected error")
 
-        # Although the error occurred on point 2, nothing should have been
-        # saved, including point 1.
+        # Nothing should have been saved.
         self.assertEqual(
             img.annotation_set.count(), 0,
-            "Point 1's annotation should have been rolled back"
+            "The annotations should have been rolled back"
         )
@@ -7,6 +7,7 @@ from spacer.data_classes import ImageFeatures
 from spacer.exceptions import SpacerInputError
 
 from errorlogs.tests.utils import ErrorReportTestMixin
+from jobs.models import Job
 from jobs.tasks import run_scheduled_jobs, run_scheduled_jobs_until_empty
 from jobs.tests.utils import JobUtilsMixin, queue_and_run_job, run_pending_job
 from .utils import BaseTaskTest, queue_and_run_collect_spacer_jobs
@@ -38,22 +39,24 @@ class ExtractFeaturesTest(BaseTaskTest, JobUtilsMixin):
             'check_source',
             "Waiting for feature extraction(s) to finish")
 
-    @override_settings(JOB_MAX_MINUTES=-1)
-    def test_source_check_time_out(self):
+    @override_settings(JOB_BULK_QUEUE_CHUNK_SIZE=5)
+    def test_source_check_bulk_queue(self):
         for _ in range(12):
             self.upload_image(self.user, self.source)
 
+        # All extractions should get queued in one pass, across
+        # multiple bulk-queueing chunks.
         run_pending_job('check_source', self.source.pk)
         self.assert_job_result_message(
             'check_source',
-            "Queued 10 feature extraction(s) (timed out)")
+            "Queued 12 feature extraction(s)")
 
         queue_and_run_job(
             'check_source', self.source.pk,
             source_id=self.source.pk)
         self.assert_job_result_message(
             'check_source',
-            "Queued 2 feature extraction(s)")
+            "Waiting for feature extraction(s) to finish")
 
     def test_success(self):
         # After an image upload, features are ready to be submitted.
@@ -141,6 +144,91 @@ class ExtractFeaturesTest(BaseTaskTest, JobUtilsMixin):
             f" Not enough annotated images for initial training")
 
 
+class BatchedExtractFeaturesTest(
+        BaseTaskTest, ErrorReportTestMixin, JobUtilsMixin):
+    """
+    Multiple images' feature extractions submitted in one spacer job.
+    """
+    @staticmethod
+    def result_file_count():
+        # With LocalQueue, each submitted spacer job outputs one result file.
+        storage = get_storage_class()()
+        _, filenames = storage.listdir('backend_job_res')
+        return len(filenames)
+
+    def upload_images_and_submit(self, count):
+        images = [
+            self.upload_image(self.user, self.source) for _ in range(count)]
+        # Check source.
+        run_scheduled_jobs()
+        # Submit feature extractions.
+        run_scheduled_jobs()
+        return images
+
+    @override_settings(FEATURE_EXTRACTION_BATCH_SIZE=3)
+    def test_batch_size(self):
+        images = self.upload_images_and_submit(5)
+
+        self.assertEqual(
+            self.result_file_count(), 2,
+            "5 images should be submitted in 2 spacer jobs")
+
+        queue_and_run_collect_spacer_jobs()
+
+        for image in images:
+            image.features.refresh_from_db()
+            self.assertTrue(image.features.extracted)
+        for job in Job.objects.filter(job_name='extract_features'):
+            self.assertEqual(
+                job.status, Job.Status.SUCCESS,
+                "Every image's job should be finished")
+
+    @override_settings(
+        FEATURE_EXTRACTION_BATCH_SIZE=10,
+        # Enough for two 200x200 images, but not three.
+        FEATURE_EXTRACTION_BATCH_MAX_BYTES=250000,
+    )
+    def test_byte_budget(self):
+        self.upload_images_and_submit(5)
+
+        self.assertEqual(
+            self.result_file_count(), 3,
+            "5 images should be submitted in 3 spacer jobs")
+
+    @override_settings(FEATURE_EXTRACTION_BATCH_SIZE=3)
+    def test_spacer_error(self):
+        self.upload_image(self.user, self.source)
+        self.upload_image(self.user, self.source)
+        # Check source.
+        run_scheduled_jobs()
+
+        def raise_error(*args):
+            raise ValueError("A spacer error")
+        with mock.patch('spacer.tasks.extract_features', raise_error):
+            run_scheduled_jobs()
+        queue_and_run_collect_spacer_jobs()
+
+        jobs = Job.objects.filter(job_name='extract_features')
+        self.assertEqual(jobs.count(), 2)
+        for job in jobs:
+            self.assertEqual(job.status, Job.Status.FAILURE)
+            self.assertEqual(job.result_message, "ValueError: A spacer error")
+
+    @override_settings(FEATURE_EXTRACTION_BATCH_SIZE=3)
+    def test_retries_not_batched(self):
+        self.upload_image(self.user, self.source)
+        self.upload_image(self.user, self.source)
+        run_scheduled_jobs()
+        Job.objects.filter(job_name='extract_features').update(
+            attempt_number=2)
+
+        run_scheduled_jobs()
+
+        self.assertEqual(
+            self.result_file_count(), 2,
+            "Retried extractions should be submitted individually")
+
+
 class AbortCasesTest(BaseTaskTest, ErrorReportTestMixin, JobUtilsMixin):
     """
     Test cases where the task or collection would abort before reaching the
@@ -4,11 +4,13 @@ from django.test.utils import override_settings
 from django.urls import reverse
 
 from annotations.models import Annotation
-from images.models import Image
+from images.models import Image, PendingImageDeletion
 from jobs.models import Job
 from jobs.tasks import run_scheduled_jobs_until_empty
+from jobs.tests.utils import run_pending_job
 from jobs.utils import queue_job
 from lib.tests.utils import ClientTest
+from upload.models import PendingAnnotationImport
 from ...models import Score, Classifier
 from ...tasks import check_all_sources
 from .utils import BaseTaskTest, queue_and_run_collect_spacer_jobs
@@ -236,14 +238,16 @@ class CollectSpacerJobsTest(BaseTaskTest):
             self.run_and_get_result(), "Jobs checked/collected: 0")
 
     @override_settings(JOB_MAX_MINUTES=-1)
+    @mock.patch('vision_backend.queues.LocalQueue.COLLECT_CHUNK_SIZE', 1)
     def test_time_out(self):
         # Run 2 extract-features jobs.
         self.upload_image(self.user, self.source)
         self.upload_image(self.user, self.source)
         run_scheduled_jobs_until_empty()
 
-        # Collect jobs; this should time out after collecting 1st job and
-        # before collecting 2nd job (as that's when the 1st time-check is done)
+        # Collect jobs; this should time out after collecting 1st chunk
+        # (1st job) and before collecting 2nd chunk (as that's when the
+        # 1st time-check is done)
         self.assertEqual(
             self.run_and_get_result(),
             "Jobs checked/collected: 1 SUCCEEDED (timed out)")
@@ -286,6 +290,33 @@ class CollectSpacerJobsTest(BaseTaskTest):
             "Should not have accepted the second run")
 
 
+class CheckSourceTest(BaseTaskTest):
+
+    def test_queue_leftover_image_deletion(self):
+        img = self.upload_image(self.user, self.source)
+        # Marked for deletion, but there's no job to delete it, such as if
+        # the job was interrupted.
+        PendingImageDeletion(image=img, source=self.source).save()
+
+        run_pending_job('check_source', self.source.pk)
+
+        Job.objects.get(
+            job_name='delete_source_images', arg_identifier=self.source.pk,
+            status=Job.Status.PENDING)
+
+    def test_queue_leftover_annotation_import(self):
+        img = self.upload_image(self.user, self.source)
+        PendingAnnotationImport(
+            image=img, source=self.source, user=self.user,
+            points=[dict(row=10, column=10)]).save()
+
+        run_pending_job('check_source', self.source.pk)
+
+        Job.objects.get(
+            job_name='import_annotations', arg_identifier=self.source.pk,
+            status=Job.Status.PENDING)
+
+
 class CheckAllSourcesTest(ClientTest):
 
     @classmethod
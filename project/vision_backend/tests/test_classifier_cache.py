@@ -0,0 +1,88 @@
+from unittest import mock
+
+from jobs.tests.utils import do_job
+from ..classifier_cache import (
+    ClassifierCache, classifier_cache, load_classifier_uncached)
+from ..models import Classifier
+from .tasks.utils import BaseTaskTest
+
+
+class ClassifierCacheTest(BaseTaskTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.upload_data_and_train_classifier()
+        cls.classifier = cls.source.get_current_classifier()
+
+    def setUp(self):
+        super().setUp()
+        classifier_cache.clear()
+
+    def test_hit_and_miss(self):
+        cache = ClassifierCache()
+        clf = cache.get(self.classifier)
+        self.assertIs(cache.get(self.classifier), clf)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['entries'], 1)
+        self.assertGreater(stats['total_bytes'], 0)
+
+    def test_superseded_classifier_evicted(self):
+        cache = ClassifierCache()
+        cache.get(self.classifier)
+
+        # Train a newer classifier for the same source.
+        self.upload_data_and_train_classifier(new_train_images_count=1)
+        new_classifier = self.source.get_current_classifier()
+        self.assertNotEqual(
+            new_classifier.pk, self.classifier.pk, "Sanity check")
+
+        cache.get(new_classifier)
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_memory_cap(self):
+        cache = ClassifierCache()
+        cache.get(self.classifier)
+        size = cache.stats()['total_bytes']
+
+        # Cap below the size of one model: nothing is kept.
+        cache = ClassifierCache(max_bytes=size - 1)
+        cache.get(self.classifier)
+        cache.get(self.classifier)
+        stats = cache.stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 0)
+
+    def test_invalidate_on_delete(self):
+        classifier_cache.get(self.classifier)
+        self.assertEqual(classifier_cache.stats()['entries'], 1)
+
+        Classifier.objects.filter(pk=self.classifier.pk).delete()
+        self.assertEqual(classifier_cache.stats()['entries'], 0)
+
+    def test_classify_uses_cache(self):
+        image_1 = self.upload_image_for_classification()
+        image_2 = self.upload_image_for_classification()
+
+        with mock.patch(
+            'vision_backend.classifier_cache.load_classifier_uncached',
+            wraps=load_classifier_uncached,
+        ) as mock_load:
+            do_job('classify_features', image_1.pk, source_id=self.source.pk)
+            do_job('classify_features', image_2.pk, source_id=self.source.pk)
+
+        self.assertEqual(
+            mock_load.call_count, 1, "Model should only be loaded once")
+        stats = classifier_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+        image_2.annoinfo.refresh_from_db()
+        self.assertTrue(image_2.annoinfo.classified)
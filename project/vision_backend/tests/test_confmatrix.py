@@ -138,3 +138,31 @@ class ConfMatrixBasics(BaseTest):
         # pe = (((2+1)/9) * ((2+3)/9)) + (((3+3)/9) * ((1+3)/9)) = 0.48148148
         # cohens_kappa = (5/9 - 0.48148148) / (1 - 0.48148148)
         self.assertAlmostEqual(cohens_kappa, 0.1428571)
+
+    def test_add_select(self):
+        gt = [0, 0, 1, 1]
+        est = [0, 1, 1, 1]
+        scores = [0.9, 0.2, 0.8, 0.5]
+
+        cm = ConfMatrix(2)
+        cm.add_select(gt, est, scores, 0.5)
+        # Only the points with scores above 0.5 are added.
+        self.assertListEqual(cm.cm.tolist(), [[1, 0], [0, 1]])
+
+    def test_add_accumulates(self):
+        cm = ConfMatrix(3)
+        cm.add([0, 2, 2], [0, 1, 2])
+        cm.add([2, 2], [1, 1])
+        self.assertListEqual(
+            cm.cm.tolist(), [[1, 0, 0], [0, 0, 0], [0, 3, 1]])
+
+    def test_collapse(self):
+        gt = [0, 1, 2, 3, 3]
+        est = [1, 0, 3, 2, 3]
+
+        cm = ConfMatrix(4, labelset=self.makelabelset(4))
+        cm.add(gt, est)
+        # Classes a, b -> x and c, d -> y.
+        cm.collapse([0, 0, 1, 1], ['x', 'y'])
+        self.assertListEqual(cm.cm.tolist(), [[2, 0], [0, 3]])
+        self.assertListEqual(cm.labelset, ['x', 'y'])
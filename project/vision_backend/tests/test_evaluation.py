@@ -0,0 +1,104 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.urls import reverse
+import numpy as np
+from spacer.data_classes import ValResults
+
+from labels.models import Label
+from lib.tests.utils import ClientTest
+from ..confmatrix import ConfMatrix
+from ..evaluation import (
+    cache_classifier_evaluation, ClassifierEvaluation,
+    get_classifier_evaluation)
+from ..models import Classifier
+from ..utils import labelset_mapper, map_labels
+from .tasks.utils import BaseTaskTest
+
+
+class ClassifierEvaluationTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(cls.user)
+        cls.create_labels(cls.user, ['A', 'B'], 'Group1')
+        cls.create_labels(cls.user, ['C', 'D'], 'Group2')
+        labels = Label.objects.all()
+        cls.create_labelset(cls.user, cls.source, labels)
+        cls.classes = [
+            labels.get(name=name).pk for name in ['A', 'B', 'C', 'D']]
+
+        rng = np.random.default_rng(0)
+        cls.valres = ValResults(
+            classes=cls.classes,
+            gt=rng.integers(4, size=2000).tolist(),
+            est=rng.integers(4, size=2000).tolist(),
+            # Includes scores landing exactly on thresholds.
+            scores=np.round(rng.random(2000), 2).tolist(),
+        )
+
+    def test_confmatrix_matches_points(self):
+        evaluation = ClassifierEvaluation.from_valres(
+            self.valres, self.source)
+
+        for labelmode in ['full', 'func']:
+            classmap, classnames = labelset_mapper(
+                labelmode, self.classes, self.source)
+            for threshold in [0, 1, 37, 50, 99, 100]:
+                expected = ConfMatrix(len(classnames), labelset=classnames)
+                expected.add_select(
+                    map_labels(self.valres.gt, classmap),
+                    map_labels(self.valres.est, classmap),
+                    self.valres.scores, threshold / 100)
+
+                cm = evaluation.get_confmatrix(
+                    classmap, classnames, threshold)
+                self.assertListEqual(
+                    cm.cm.tolist(), expected.cm.tolist(),
+                    f"{labelmode} mode, threshold {threshold}")
+
+    def test_compact(self):
+        evaluation = ClassifierEvaluation.from_valres(
+            self.valres, self.source)
+        self.assertLess(len(evaluation.counts), len(self.valres.gt))
+        self.assertEqual(evaluation.counts.sum(), len(self.valres.gt))
+        self.assertEqual(evaluation.gt.dtype, np.uint8)
+
+    def test_cache_miss_loads_valres(self):
+        classifier = self.create_robot(self.source)
+
+        with mock.patch.object(
+            Classifier, 'valres', new_callable=mock.PropertyMock,
+            return_value=self.valres,
+        ) as mock_valres:
+            get_classifier_evaluation(classifier)
+            get_classifier_evaluation(classifier)
+        # Only loaded once; then it's cached.
+        mock_valres.assert_called_once()
+
+    def test_backend_main_doesnt_use_session(self):
+        classifier = self.create_robot(self.source)
+        cache_classifier_evaluation(classifier, self.valres)
+
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('backend_main', args=[self.source.pk])
+            + '?labelmode=func')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('valres', self.client.session)
+        self.assertNotIn('alleviate', self.client.session)
+
+
+class AcceptedClassifierTest(BaseTaskTest):
+
+    def test_evaluation_cached_on_acceptance(self):
+        self.upload_data_and_train_classifier()
+        classifier = self.source.get_current_classifier()
+
+        evaluation = cache.get(f'classifier_evaluation_{classifier.pk}')
+        self.assertIsNotNone(evaluation)
+        self.assertEqual(
+            evaluation.counts.sum(), len(classifier.valres.gt))
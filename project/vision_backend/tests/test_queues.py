@@ -33,6 +33,7 @@ class MockBotoClient:
         self.response_type = response_type
         self.jobId = 0
         self.jobs = dict()
+        self.describe_jobs_calls = 0
 
     def submit_job(self, containerOverrides=None, **kwargs):
         self.jobId += 1
@@ -86,12 +87,18 @@ class MockBotoClient:
         return dict(jobId=self.jobId)
 
     def describe_jobs(self, jobs=None):
+        if len(jobs) > 100:
+            # AWS Batch accepts at most 100 job IDs per call.
+            raise ValueError("Too many jobs in describe_jobs() call")
+        self.describe_jobs_calls += 1
+
         jobs_to_return = []
 
         for batch_token in jobs:
             if batch_token not in self.jobs:
                 continue
-            jobs_to_return.append(dict(status=self.jobs[batch_token]))
+            jobs_to_return.append(
+                dict(jobId=batch_token, status=self.jobs[batch_token]))
 
         return dict(jobs=jobs_to_return)
 
@@ -103,6 +110,7 @@ def mock_boto_client(response_type='succeeded'):
     Use this as a context manager. Each usage of this context manager
     gets its own mock-boto-client instance. Make sure the instance is the
     same from job-submit time to job-collect time.
+    The context manager's target is a function returning that instance.
     """
     client = MockBotoClient(response_type)
 
@@ -182,6 +190,17 @@ class LocalQueueBasicTest(QueueBasicTest):
     def test_job_gets_consumed(self):
         self.do_test_job_gets_consumed()
 
+    @mock.patch('vision_backend.queues.LocalQueue.COLLECT_CHUNK_SIZE', 2)
+    def test_collect_in_chunks(self):
+        images = [self.upload_image(self.user, self.source) for _ in range(3)]
+        run_scheduled_jobs_until_empty()
+        queue_and_run_collect_spacer_jobs()
+        self.assert_job_result_message(
+            'collect_spacer_jobs', "Jobs checked/collected: 3 SUCCEEDED")
+        for image in images:
+            image.features.refresh_from_db()
+            self.assertTrue(image.features.extracted)
+
 
 @batch_queue_decorator
 class BatchQueueBasicTest(QueueBasicTest):
@@ -375,6 +394,45 @@ class BatchQueueSpecificsTest(BaseTaskTest, JobUtilsMixin):
 
         self.assertEqual(job.result_message, expected_error)
 
+    @mock.patch('vision_backend.queues.BatchQueue.DESCRIBE_JOBS_MAX', 2)
+    def test_describe_jobs_in_chunks(self):
+        for _ in range(5):
+            self.upload_image(self.user, self.source)
+
+        with mock_boto_client() as get_client:
+            self.extract_and_assert_collect_count("5 SUCCEEDED")
+            self.assertEqual(get_client().describe_jobs_calls, 3)
+
+        self.assertEqual(
+            BatchJob.objects.filter(status='SUCCEEDED').count(), 5)
+        self.assertEqual(
+            Job.objects.filter(
+                job_name='extract_features',
+                status=Job.Status.SUCCESS).count(),
+            5)
+
+    @mock.patch('vision_backend.queues.BatchQueue.DESCRIBE_JOBS_MAX', 2)
+    @override_settings(JOB_MAX_MINUTES=-1)
+    def test_time_out_between_chunks(self):
+        for _ in range(3):
+            self.upload_image(self.user, self.source)
+
+        with mock_boto_client():
+            # Only the first chunk gets collected before timing out.
+            self.extract_and_assert_collect_count(
+                "2 SUCCEEDED (timed out)")
+            # The rest is left for the next run.
+            queue_and_run_collect_spacer_jobs()
+            self.assert_job_result_message(
+                'collect_spacer_jobs',
+                "Jobs checked/collected: 1 SUCCEEDED (timed out)")
+
+        self.assertEqual(
+            Job.objects.filter(
+                job_name='extract_features',
+                status=Job.Status.SUCCESS).count(),
+            3)
+
     def test_job_in_progress(self):
         """BatchJob has not succeeded or failed yet; still in progress."""
         self.upload_image(self.user, self.source)
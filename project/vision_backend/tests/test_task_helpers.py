@@ -1,11 +1,14 @@
-from lib.tests.utils import ClientTest
+import numpy as np
+
+from lib.tests.utils import BaseTest, ClientTest
 
 from annotations.models import Label
 
 from api_core.models import ApiJob, ApiJobUnit
 from jobs.models import Job
 from jobs.utils import queue_job
-from ..task_helpers import SpacerClassifyResultHandler
+from ..task_helpers import (
+    get_point_scores, SpacerClassifyResultHandler, top_scores_indices)
 from ..utils import get_extractor
 
 from spacer.messages import ClassifyImageMsg, JobMsg, JobReturnMsg, \
@@ -127,3 +130,39 @@ class TestDeployCollector(ClientTest):
         self.assertEqual(
             api_job_unit.result_message,
             'SomeError: File not found')
+
+
+class TopScoresTest(BaseTest):
+
+    def test_top_scores_indices(self):
+        scores = np.array([
+            [.1, .4, .2, .3],
+            [.5, .1, .3, .1],
+        ])
+        self.assertListEqual(
+            top_scores_indices(scores, 2).tolist(), [[1, 3], [0, 2]])
+        self.assertListEqual(
+            top_scores_indices(scores, 4).tolist(),
+            [[1, 3, 2, 0], [0, 2, 1, 3]])
+
+    def test_count_above_class_count(self):
+        scores = np.array([[.2, .8]])
+        self.assertListEqual(
+            top_scores_indices(scores, 5).tolist(), [[1, 0]])
+
+    def test_point_scores_by_rowcol(self):
+        class MockPoint:
+            def __init__(self, row, column):
+                self.row = row
+                self.column = column
+
+        res = ClassifyReturnMsg(
+            runtime=1.0,
+            scores=[(100, 100, [.3, .7]), (200, 200, [.9, .1])],
+            classes=[1, 2],
+            valid_rowcol=True,
+        )
+        # Points in a different order from the scores.
+        points = [MockPoint(200, 200), MockPoint(100, 100)]
+        self.assertListEqual(
+            get_point_scores(res, points).tolist(), [[.9, .1], [.3, .7]])
@@ -239,6 +239,18 @@ class AlleviateTester(BaseTest):
         self.assertEqual(ratios[0], 100)
         self.assertEqual(ratios[-1], 0)
 
+    def test_values(self):
+        gt = [0, 0, 1, 1]
+        est = [0, 1, 1, 0]
+        scores = [0.2, 0.4, 0.6, 0.8]
+
+        accs, ratios, ths = utils.get_alleviate(est, gt, scores)
+        self.assertListEqual(ths, [19.0, 20.0, 40.0, 60.0, 80.0, 81.0])
+        # Points with scores above each threshold: all 4 (2 correct), then
+        # 3 (1 correct), 2 (1 correct), 1 (0 correct), then none.
+        self.assertListEqual(accs, [50.0, 33.3, 50.0, 0.0, 100.0, 100.0])
+        self.assertListEqual(ratios, [100.0, 75.0, 50.0, 25.0, 0.0, 0.0])
+
     def test_long(self):
         for k in [248, 249, 250, 300, 3000]:
             gt = random.sample(range(k), k)
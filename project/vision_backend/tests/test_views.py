@@ -1,13 +1,26 @@
 from bs4 import BeautifulSoup
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from spacer.data_classes import ValResults
 
 from export.tests.utils import BaseExportTest
+from images.utils import get_sources_robot_status
 from jobs.tests.utils import do_job
 from labels.models import Label
 from lib.tests.utils import BasePermissionTest, ClientTest, HtmlAssertionsMixin
+from ..evaluation import cache_classifier_evaluation
 from .tasks.utils import queue_and_run_collect_spacer_jobs
 
 
+def set_valres(classifier, valres):
+    """
+    Cache the classifier's evaluation from the given valres dict, so that
+    we don't have to create valres in storage.
+    """
+    cache_classifier_evaluation(classifier, ValResults.deserialize(valres))
+
+
 class BackendViewPermissions(BasePermissionTest):
 
     def test_backend_main(self):
@@ -30,6 +43,13 @@ class BackendViewPermissions(BasePermissionTest):
             url, self.SUPERUSER, template=template,
             deny_type=self.REQUIRE_LOGIN)
 
+    def test_backend_overview_json(self):
+        url = reverse('backend_overview_json')
+
+        self.assertPermissionLevel(
+            url, self.SUPERUSER, content_type='application/json',
+            deny_type=self.REQUIRE_LOGIN)
+
     def test_cm_test(self):
         url = reverse('cm_test')
         template = 'vision_backend/cm_test.html'
@@ -74,16 +94,7 @@ class BackendMainTest(ClientTest):
             scores=[.8]*10,
         )
 
-        # Add valres to the session so that we don't have to create it in S3.
-        #
-        # "Be careful: To modify the session and then save it,
-        # it must be stored in a variable first (because a new SessionStore
-        # is created every time this property is accessed)"
-        # http://stackoverflow.com/a/4454671/
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         self.client.force_login(self.user)
         response = self.client.get(self.url)
@@ -141,10 +152,7 @@ class BackendMainTest(ClientTest):
             scores=[.8]*102,
         )
 
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         self.client.force_login(self.user)
         response = self.client.get(reverse('backend_main', args=[source.pk]))
@@ -247,6 +255,92 @@ class BackendOverviewTest(ClientTest, HtmlAssertionsMixin):
             },
         ])
 
+    def test_json(self):
+        image1a = self.upload_image(self.user, self.source1)
+        self.upload_image(self.user, self.source1)
+        self.add_annotations(self.user, image1a)
+        classifier2 = self.create_robot(self.source2)
+        image2a = self.upload_image(self.user, self.source2)
+        self.add_robot_annotations(classifier2, image2a)
+
+        self.client.force_login(self.superuser)
+        response = self.client.get(reverse('backend_overview_json'))
+        response_json = response.json()
+
+        self.assertDictEqual(response_json['img_stats'], dict(
+            total=3,
+            confirmed=1,
+            unconfirmed=1,
+            unclassified_with_features=0,
+            unclassified_without_features=1,
+        ))
+        self.assertDictEqual(response_json['clf_stats'], dict(
+            nclassifiers=1,
+            nacceptedclassifiers=1,
+            nsources=2,
+        ))
+        self.assertListEqual(
+            [source['id'] for source in response_json['sources']],
+            [self.source2.pk, self.source1.pk])
+        source2_status = response_json['sources'][0]
+        self.assertEqual(source2_status['nbr_total_images'], 1)
+        self.assertEqual(source2_status['nbr_accepted_robots'], 1)
+        self.assertEqual(
+            source2_status['nbr_in_current_model'],
+            classifier2.nbr_train_images)
+        self.assertTrue(source2_status['has_robot'])
+
+
+class SourcesRobotStatusTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.labels = cls.create_labels(cls.user, ['A', 'B'], "Group1")
+
+    def create_source_with_images(self, with_robot):
+        source = self.create_source(self.user)
+        self.create_labelset(self.user, source, self.labels)
+        image = self.upload_image(self.user, source)
+        self.add_annotations(self.user, image)
+        self.upload_image(self.user, source)
+        if with_robot:
+            self.create_robot(source)
+        return source
+
+    def test_query_count_doesnt_depend_on_source_count(self):
+        self.create_source_with_images(with_robot=False)
+        self.create_source_with_images(with_robot=True)
+        with CaptureQueriesContext(connection) as context:
+            get_sources_robot_status()
+        num_queries = len(context.captured_queries)
+
+        for with_robot in [False, True, True]:
+            self.create_source_with_images(with_robot=with_robot)
+        with self.assertNumQueries(num_queries):
+            statuses = get_sources_robot_status()
+        self.assertEqual(len(statuses), 5)
+
+    def test_need_robot(self):
+        source = self.create_source_with_images(with_robot=False)
+        # Not enough confirmed images with features.
+        status = get_sources_robot_status([source.pk])[0]
+        self.assertFalse(status['need_robot'])
+
+        with self.settings(TRAINING_MIN_IMAGES=0):
+            status = get_sources_robot_status([source.pk])[0]
+            self.assertTrue(status['need_robot'])
+            self.assertTrue(status['need_attention'])
+            self.assertEqual(status['need_robot'], source.need_new_robot()[0])
+
+            source.enable_robot_classifier = False
+            source.save()
+            status = get_sources_robot_status([source.pk])[0]
+            self.assertFalse(status['need_robot'])
+            self.assertFalse(status['need_attention'])
+
 
 class BackendMainConfusionMatrixExportTest(BaseExportTest):
 
@@ -275,11 +369,7 @@ class BackendMainConfusionMatrixExportTest(BaseExportTest):
             scores=[.8]*10,
         )
 
-        # Add valres to the session so that we don't have to create it in S3.
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         self.client.force_login(self.user)
         response = self.client.post(
@@ -300,10 +390,7 @@ class BackendMainConfusionMatrixExportTest(BaseExportTest):
             est=[0, 0, 1, 1, 1, 1, 1, 1, 1, 0],
             scores=[.9, .9, .9, .8, .8, .8, .8, .7, .7, .7],
         )
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         self.client.force_login(self.user)
         response = self.client.post(
@@ -329,10 +416,7 @@ class BackendMainConfusionMatrixExportTest(BaseExportTest):
             est=[0, 1, 2, 0, 1, 2, 0, 1, 1, 2],
             scores=[.8]*10,
         )
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         self.client.force_login(self.user)
         response = self.client.post(
@@ -353,10 +437,7 @@ class BackendMainConfusionMatrixExportTest(BaseExportTest):
             est=[0, 0, 1, 1, 1, 1, 1, 1, 1, 0],
             scores=[.8]*10,
         )
-        session = self.client.session
-        session['valres'] = valres
-        session['ccpk'] = robot.pk
-        session.save()
+        set_valres(robot, valres)
 
         local_label_a = self.source.labelset.get_labels().get(code='A')
         local_label_a.code = 'あ'
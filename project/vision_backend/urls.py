@@ -4,6 +4,8 @@ from . import views
 
 general_urlpatterns = [
     path('backend_overview/', views.backend_overview, name='backend_overview'),
+    path('backend_overview/json/', views.backend_overview_json,
+         name='backend_overview_json'),
     path('cm_test/', views.cm_test, name='cm_test'),
 ]
 
@@ -12,7 +12,7 @@ from images.models import Point
 from jobs.utils import queue_job
 from labels.models import Label, LocalLabel
 from .common import Extractors
-from .models import Score
+from .models import Features, Score
 
 
 def acc(gt, est):
@@ -70,44 +70,65 @@ def get_alleviate(estlabels, gtlabels, scores):
         raise ValueError('inputs must have length > 0')
     
     # convert to numpy for easy indexing
-    scores = np.asarray(scores)
+    scores = np.asarray(scores, dtype=float)
     gtlabels = np.asarray(gtlabels, dtype=int)
     estlabels = np.asarray(estlabels, dtype=int)
-    
-    # Figure out teh appropriate thresholds to use
-    ths = sorted(scores)
 
+    # Sort the points by score once. Then the points above any threshold
+    # are a suffix of the sorted points, and cumulative sums give the
+    # number of correct points in each suffix.
+    order = np.argsort(scores, kind='stable')
+    sorted_scores = scores[order]
+    correct_cumsum = np.concatenate(
+        ([0], np.cumsum(estlabels[order] == gtlabels[order])))
+
+    # Figure out teh appropriate thresholds to use.
     # Append something slightly lower and higher to ensure we
     # include ratio = 0 and 100%
-    ths.insert(0, max(min(ths) - 0.01, 0))
-    ths.append(min(max(ths) + 0.01, 1.00))
-    
-    ths = np.asarray(ths)  # Convert back to numpy.
+    ths = np.concatenate((
+        [max(sorted_scores[0] - 0.01, 0)],
+        sorted_scores,
+        [min(sorted_scores[-1] + 0.01, 1.00)],
+    ))
     # cap at 250
     if len(ths) > 250:
         ths = ths[np.linspace(0, len(ths) - 1, 250, dtype=int)]  # max 250!
-    
-    # do the actual sweep.
-    accs, ratios = [], []
-    for th in ths:
-        keep_ind = scores > th
-        this_acc = acc(estlabels[keep_ind], gtlabels[keep_ind])
-        accs.append(round(100 * this_acc, 1))
-        ratios.append(round(100 * np.sum(keep_ind) / len(estlabels), 1))
-    ths = [round(100 * th, 1) for th in ths]
-    
+
+    # do the actual sweep, for all thresholds at once.
+    # Points with score > th start at this index in sorted order.
+    first_kept = np.searchsorted(sorted_scores, ths, side='right')
+    kept_counts = len(scores) - first_kept
+    kept_correct = correct_cumsum[-1] - correct_cumsum[first_kept]
+    # Accuracy is 1 if no points are kept (same as acc()).
+    accs = np.divide(
+        kept_correct, kept_counts,
+        out=np.ones(len(ths)), where=(kept_counts > 0))
+
+    accs = np.round(100 * accs, 1).tolist()
+    ratios = np.round(100 * kept_counts / len(scores), 1).tolist()
+    ths = np.round(100 * ths, 1).tolist()
+
     return accs, ratios, ths
 
 
 def map_labels(labellist, classmap):
     """
     Helper function to map integer labels to new labels.
+    Returns a numpy array.
     """
     labellist = np.asarray(labellist, dtype=int)
     newlist = -1 * np.ones(len(labellist), dtype=int)
-    for key in classmap.keys():
-        newlist[labellist == key] = classmap[key]
-    return list(newlist)
+    if not classmap or len(labellist) == 0:
+        return newlist
+
+    # Map with one lookup-table indexing operation instead of one pass
+    # over the labels per class. Labels not in the classmap map to -1.
+    lookup_size = max(max(classmap.keys()), labellist.max()) + 1
+    lookup = -1 * np.ones(lookup_size, dtype=int)
+    lookup[list(classmap.keys())] = list(classmap.values())
+    valid = labellist >= 0
+    newlist[valid] = lookup[labellist[valid]]
+    return newlist
 
 
 def labelset_mapper(labelmode, classids, source):
@@ -117,26 +138,32 @@ def labelset_mapper(labelmode, classids, source):
     if labelmode == 'full':
         
         # Label names are the abbreviated full names with code in parethesis.
-        classnames = [Label.objects.get(id=classid).name
-                      for classid in classids]
-        codes = [LocalLabel.objects.get(global_label__id=class_id,
-                                        labelset=source.labelset).code
-                 for class_id in classids]
+        names = dict(
+            Label.objects.filter(pk__in=classids).values_list('pk', 'name'))
+        codes = dict(
+            LocalLabel.objects.filter(
+                global_label__in=classids, labelset=source.labelset)
+            .values_list('global_label_id', 'code'))
         classmap = dict()
-        for i in range(len(classnames)):
-            if len(classnames[i]) > 30:
-                classnames[i] = classnames[i][:27] + '...'
-            classnames[i] = classnames[i] + ' (' + codes[i] + ')'
+        classnames = []
+        for i, classid in enumerate(classids):
+            classname = names[classid]
+            if len(classname) > 30:
+                classname = classname[:27] + '...'
+            classnames.append(classname + ' (' + codes[classid] + ')')
             classmap[i] = i
 
     elif labelmode == 'func':
+        group_names = dict(
+            Label.objects.filter(pk__in=classids)
+            .values_list('pk', 'group__name'))
         classmap = dict()
         classnames = []
-        for classid in classids:
-            fcnname = Label.objects.get(pk=classid).group.name
+        for i, classid in enumerate(classids):
+            fcnname = group_names[classid]
             if fcnname not in classnames:
                 classnames.append(fcnname)
-            classmap[classids.index(classid)] = classnames.index(fcnname)
+            classmap[i] = classnames.index(fcnname)
     
     else:
         raise Exception('labelmode {} not recognized'.format(labelmode))
@@ -159,6 +186,14 @@ def clear_features(image):
     features.save()
 
 
+def clear_features_in_bulk(image_ids):
+    """
+    Bulk version of clear_features(), using a single update query.
+    The caller should queue a source check afterward.
+    """
+    Features.objects.filter(image_id__in=image_ids).update(extracted=False)
+
+
 def reset_features(image):
     clear_features(image)
     # Try to re-extract features
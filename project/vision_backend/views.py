@@ -4,63 +4,68 @@ import json
 import numpy as np
 
 from django.contrib.auth.decorators import permission_required
-from django.http import HttpResponse
+from django.db.models import Count, Q
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
-from spacer.data_classes import ValResults
 
+from annotations.model_utils import ImageAnnoStatuses
 from images.models import Source, Image
-from images.utils import source_robot_status
+from images.utils import get_sources_robot_status
 from lib.decorators import source_visibility_required
+from . import feature_cache
 from .confmatrix import ConfMatrix
+from .evaluation import get_classifier_evaluation
 from .forms import TreshForm, CmTestForm
-from .models import Classifier
-from .utils import labelset_mapper, map_labels, get_alleviate
+from .utils import labelset_mapper
+
+
+def get_backend_overview_stats():
+    """
+    Site-wide image and classifier counts, and the vision-backend status of
+    each source. The source statuses are ordered with the sources needing
+    attention first, then by descending ID.
+    """
+    unclassified_q = Q(annoinfo__status=ImageAnnoStatuses.UNCLASSIFIED.value)
+    img_stats = Image.objects.aggregate(
+        total=Count('pk'),
+        confirmed=Count('pk', filter=Q(
+            annoinfo__status=ImageAnnoStatuses.CONFIRMED.value)),
+        unconfirmed=Count('pk', filter=Q(
+            annoinfo__status=ImageAnnoStatuses.UNCONFIRMED.value)),
+        unclassified_with_features=Count(
+            'pk', filter=unclassified_q & Q(features__extracted=True)),
+        unclassified_without_features=Count(
+            'pk', filter=unclassified_q & Q(features__extracted=False)),
+    )
+
+    sources = get_sources_robot_status()
+    clf_stats = {
+        'nclassifiers': sum(source['nbr_robots'] for source in sources),
+        'nacceptedclassifiers': sum(
+            source['nbr_accepted_robots'] for source in sources),
+        'nsources': len(sources),
+    }
+
+    sources.sort(key=lambda k: (-k['need_attention'], -k['id']))
+    return img_stats, clf_stats, sources
 
 
 @permission_required('is_superuser')
 def backend_overview(request):
-    total = Image.objects.filter().count()
-
-    confirmed = Image.objects.confirmed().count()
-    unconfirmed = Image.objects.unconfirmed().count()
-    unclassified_with_features = \
-        Image.objects.unclassified().with_features().count()
-    unclassified_without_features = \
-        Image.objects.unclassified().without_features().count()
+    img_stats, clf_stats, laundry_list = get_backend_overview_stats()
 
     def percent_display(numerator, denominator):
         return format(100*numerator / denominator, '.1f') + "%"
 
-    img_stats = {
-        'total': total,
-        'confirmed': confirmed,
-        'unconfirmed': unconfirmed,
-        'unclassified_with_features': unclassified_with_features,
-        'unclassified_without_features': unclassified_without_features,
-        'pct_confirmed': percent_display(confirmed, total),
-        'pct_unconfirmed': percent_display(unconfirmed, total),
-        'pct_unclassified_with_features': percent_display(
-            unclassified_with_features, total),
-        'pct_unclassified_without_features': percent_display(
-            unclassified_without_features, total),
-    }
-
-    clf_stats = {
-        'nclassifiers': Classifier.objects.filter().count(),
-        'nacceptedclassifiers': Classifier.objects.filter(
-            status=Classifier.ACCEPTED).count(),
-        'nsources': Source.objects.filter().count(),
-        'accepted_ratio': '{:.1f}'.format(
-            Classifier.objects.filter(status=Classifier.ACCEPTED).count()
-            / Source.objects.filter().count())
-    }
-
-    laundry_list = []
-    for source in Source.objects.filter().order_by('-id'):
-        laundry_list.append(source_robot_status(source.id))
+    total = img_stats['total']
+    for key in [
+        'confirmed', 'unconfirmed',
+        'unclassified_with_features', 'unclassified_without_features',
+    ]:
+        img_stats['pct_' + key] = percent_display(img_stats[key], total)
 
-    laundry_list = sorted(laundry_list,
-                          key=lambda k: (-k['need_attention'], -k['id']))
+    clf_stats['accepted_ratio'] = '{:.1f}'.format(
+        clf_stats['nacceptedclassifiers'] / clf_stats['nsources'])
 
     return render(request, 'vision_backend/overview.html', {
         'laundry_list': laundry_list,
@@ -69,6 +74,20 @@ def backend_overview(request):
     })
 
 
+@permission_required('is_superuser')
+def backend_overview_json(request):
+    """
+    The backend overview's stats in JSON, for monitoring.
+    """
+    img_stats, clf_stats, sources = get_backend_overview_stats()
+    return JsonResponse(dict(
+        img_stats=img_stats,
+        clf_stats=clf_stats,
+        sources=sources,
+        deploy_feature_cache=feature_cache.get_stats(days=7),
+    ))
+
+
 @source_visibility_required('source_id')
 def backend_main(request, source_id):
     # Read plotting input from the request.
@@ -98,29 +117,17 @@ def backend_main(request, source_id):
             'source': source,
         })
 
-    cc = source.get_current_classifier()
-    if 'valres' in request.session.keys() and \
-            'ccpk' in request.session.keys() and \
-            request.session['ccpk'] == cc.pk:
-        pass
-    else:
-        valres: ValResults = cc.valres
-        request.session['valres'] = valres.serialize()
-        request.session['ccpk'] = cc.pk
-    
-    # Load stored variables to local namespace
-    valres: ValResults = ValResults.deserialize(request.session['valres'])
-    
-    # find classmap and class names for selected label-mode
-    classmap, classnames = labelset_mapper(labelmode, valres.classes, source)
+    # Confusion matrices and alleviate curves come from the classifier's
+    # cached evaluation, which serves any threshold and labelmode.
+    evaluation = get_classifier_evaluation(source.get_current_classifier())
 
-    # Initialize confusion matrix
-    cm = ConfMatrix(len(classnames), labelset=classnames)
+    # find classmap and class names for selected label-mode
+    classmap, classnames = labelset_mapper(
+        labelmode, evaluation.classes, source)
 
-    # Add data-points above the threshold.
-    cm.add_select(map_labels(valres.gt, classmap),
-                  map_labels(valres.est, classmap), valres.scores,
-                  confidence_threshold / 100)
+    # Confusion matrix of data-points above the threshold.
+    cm = evaluation.get_confmatrix(
+        classmap, classnames, confidence_threshold)
 
     # Sort by descending order.
     cm.sort()
@@ -141,20 +148,6 @@ def backend_main(request, source_id):
     cm_render['css_height'] = max(500, cm.nclasses * 22 + 320)
     cm_render['css_width'] = max(600, cm.nclasses * 22 + 360)
 
-    # Prepare the alleviate plot if not allready in session
-    if 'alleviate_data' not in request.session.keys():
-        acc_full, ratios, confs = get_alleviate(valres.gt, valres.est,
-                                                valres.scores)
-        classmap, _ = labelset_mapper('func', valres.classes, source)
-        acc_func, _, _ = get_alleviate(map_labels(valres.gt, classmap),
-                                       map_labels(valres.est, classmap),
-                                       valres.scores)
-        request.session['alleviate'] = dict()
-        for member in ['acc_full', 'acc_func', 'ratios']:
-            request.session['alleviate'][member] = [[conf, val] for val, conf
-                                                    in
-                                                    zip(eval(member), confs)]
-
     # Handle the case where we are exporting the confusion matrix.
     if request.method == 'POST' and request.POST.get('export_cm', None):
         vecfmt = np.vectorize(myfmt)
@@ -179,7 +172,7 @@ def backend_main(request, source_id):
         'has_classifier': True,
         'source': source,
         'cm': cm_render,
-        'alleviate': request.session['alleviate'],
+        'alleviate': evaluation.alleviate,
     })
 
 
@@ -4,7 +4,9 @@ import operator
 from unittest import mock
 
 from django.conf import settings
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from spacer.exceptions import SpacerInputError
@@ -15,7 +17,7 @@ from errorlogs.tests.utils import ErrorReportTestMixin
 from jobs.models import Job
 from jobs.tasks import run_scheduled_jobs
 from jobs.tests.utils import JobUtilsMixin
-from jobs.utils import queue_job
+from jobs.utils import finish_job, queue_job
 from vision_backend.models import Classifier
 from vision_backend.tests.tasks.utils import queue_and_run_collect_spacer_jobs
 from .utils import DeployBaseTest
@@ -146,8 +148,7 @@ class DeployAccessTest(BaseAPIPermissionTest):
         # Finish one of the original user's jobs
         job = ApiJob.objects.get(pk=job_ids[0])
         for unit in job.apijobunit_set.all():
-            unit.internal_job.status = Job.Status.SUCCESS
-            unit.internal_job.save()
+            finish_job(unit.internal_job, success=True)
 
         # Try submitting again as the original user
         response = self.client.post(
@@ -598,6 +599,43 @@ class SuccessTest(DeployBaseTest):
             classifications_without_scores,
             "Classifications JSON besides scores should be as expected")
 
+        deploy_job.refresh_from_db()
+        self.assertEqual(deploy_job.total_units, 1)
+        self.assertEqual(deploy_job.success_units, 1)
+        self.assertEqual(deploy_job.failure_units, 0)
+
+    def test_bulk_intake(self):
+        """
+        The number of queries to accept a request shouldn't depend on
+        the number of images.
+        """
+        def make_data(image_count):
+            images = [
+                dict(type='image', attributes=dict(
+                    url=f'URL {n}', points=[dict(row=10, column=10)]))
+                for n in range(1, image_count+1)
+            ]
+            return json.dumps(dict(data=images))
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(
+                self.deploy_url, make_data(1), **self.request_kwargs)
+        num_queries = len(context.captured_queries)
+
+        with self.assertNumQueries(num_queries):
+            self.client.post(
+                self.deploy_url, make_data(20), **self.request_kwargs)
+
+        deploy_job = ApiJob.objects.latest('pk')
+        self.assertEqual(deploy_job.total_units, 20)
+        units = deploy_job.apijobunit_set.order_by('order_in_parent')
+        self.assertListEqual(
+            [unit.request_json['url'] for unit in units],
+            [f'URL {n}' for n in range(1, 20+1)])
+        self.assertListEqual(
+            [unit.internal_job.arg_identifier for unit in units],
+            [f'{deploy_job.pk},{n}' for n in range(1, 20+1)])
+
 
 class TaskErrorsTest(DeployBaseTest, ErrorReportTestMixin, JobUtilsMixin):
     """
@@ -0,0 +1,186 @@
+from datetime import timedelta
+import json
+from unittest import mock
+
+from django.core.files.storage import get_storage_class
+from django.test import override_settings
+from django.utils import timezone
+from spacer.exceptions import SpacerInputError
+
+from api_core.models import ApiJobUnit
+from jobs.models import Job
+from jobs.tasks import run_scheduled_jobs_until_empty
+from vision_backend import feature_cache
+from vision_backend.models import (
+    DeployFeatureCacheEntry, DeployFeatureCacheStats)
+from vision_backend.tests.tasks.utils import queue_and_run_collect_spacer_jobs
+from .utils import DeployBaseTest
+
+
+@override_settings(DEPLOY_FEATURE_CACHE_ENABLED=True)
+class DeployFeatureCacheTest(DeployBaseTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.train_classifier()
+
+    def deploy(self, points=None, collect=True):
+        images = [
+            dict(type='image', attributes=dict(
+                url='URL 1',
+                points=points or [dict(row=10, column=10)]))]
+        self.client.post(
+            self.deploy_url, json.dumps(dict(data=images)),
+            **self.request_kwargs)
+        self.run_scheduled_jobs_including_deploy()
+        if collect:
+            queue_and_run_collect_spacer_jobs()
+        return ApiJobUnit.objects.latest('pk')
+
+    def assert_counts(self, hits, misses):
+        stats = DeployFeatureCacheStats.objects.get()
+        self.assertEqual(stats.hits, hits)
+        self.assertEqual(stats.misses, misses)
+
+    def test_miss_then_hit(self):
+        unit_1 = self.deploy()
+        self.assertEqual(unit_1.status, Job.Status.SUCCESS)
+        self.assertEqual(unit_1.result_json['points'][0]['row'], 10)
+        self.assert_counts(hits=0, misses=1)
+        entry = DeployFeatureCacheEntry.objects.get()
+        self.assertGreater(entry.size, 0)
+
+        # The repeat deploy is done without a spacer job.
+        with mock.patch(
+            'vision_backend.queues.LocalQueue.submit_job'
+        ) as mock_submit:
+            unit_2 = self.deploy(collect=False)
+        mock_submit.assert_not_called()
+
+        self.assertEqual(unit_2.status, Job.Status.SUCCESS)
+        self.assertDictEqual(unit_2.result_json, unit_1.result_json)
+        self.assertEqual(unit_2.parent.success_units, 1)
+        self.assert_counts(hits=1, misses=1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.hits, 1)
+
+    def test_different_points_miss(self):
+        self.deploy()
+        unit = self.deploy(points=[dict(row=20, column=20)])
+
+        self.assertEqual(unit.status, Job.Status.SUCCESS)
+        self.assertEqual(unit.result_json['points'][0]['row'], 20)
+        self.assert_counts(hits=0, misses=2)
+        self.assertEqual(DeployFeatureCacheEntry.objects.count(), 2)
+
+    def test_eviction(self):
+        self.deploy()
+        entry_1 = DeployFeatureCacheEntry.objects.get()
+
+        with override_settings(DEPLOY_FEATURE_CACHE_MAX_BYTES=entry_1.size):
+            self.deploy(points=[dict(row=20, column=20)])
+
+        # The least recently used entry was evicted to make room.
+        entry_2 = DeployFeatureCacheEntry.objects.get()
+        self.assertNotEqual(entry_2.key, entry_1.key)
+        storage = get_storage_class()()
+        self.assertFalse(storage.exists(entry_1.file_path))
+        self.assertTrue(storage.exists(entry_2.file_path))
+
+    def test_cached_file_missing(self):
+        unit_1 = self.deploy()
+        entry = DeployFeatureCacheEntry.objects.get()
+        storage = get_storage_class()()
+        # Such as if another job evicted it after this job's lookup.
+        storage.delete(entry.file_path)
+
+        unit_2 = self.deploy()
+
+        # Treated as a miss: the features are extracted again.
+        self.assertEqual(unit_2.status, Job.Status.SUCCESS)
+        self.assertDictEqual(unit_2.result_json, unit_1.result_json)
+        entry = DeployFeatureCacheEntry.objects.get()
+        self.assertTrue(storage.exists(entry.file_path))
+
+    def test_extraction_uses_url(self):
+        """
+        On a miss, spacer fetches the image from the URL, same as without
+        the cache. Our own workers never download it.
+        """
+        with mock.patch(
+            'vision_backend.queues.LocalQueue.submit_job'
+        ) as mock_submit:
+            self.deploy(collect=False)
+
+        msg = mock_submit.call_args.args[0]
+        self.assertEqual(msg.task_name, 'extract_features')
+        image_loc = msg.tasks[0].image_loc
+        self.assertEqual(image_loc.storage_type, 'url')
+        self.assertEqual(image_loc.key, 'URL 1')
+
+    def test_url_error(self):
+        """
+        If spacer can't download the image, the error's reported as usual,
+        and nothing's cached.
+        """
+        images = [
+            dict(type='image', attributes=dict(
+                url='URL 1', points=[dict(row=10, column=10)]))]
+        self.client.post(
+            self.deploy_url, json.dumps(dict(data=images)),
+            **self.request_kwargs)
+
+        def raise_error(*args):
+            raise SpacerInputError("Couldn't access URL")
+        with mock.patch('spacer.storage.URLStorage.load', raise_error):
+            run_scheduled_jobs_until_empty()
+            queue_and_run_collect_spacer_jobs()
+
+        unit = ApiJobUnit.objects.latest('pk')
+        self.assertEqual(unit.status, Job.Status.FAILURE)
+        self.assertEqual(
+            unit.result_message.splitlines()[-1],
+            "spacer.exceptions.SpacerInputError: Couldn't access URL")
+        self.assertFalse(DeployFeatureCacheEntry.objects.exists())
+
+    def test_expired(self):
+        self.deploy()
+        entry = DeployFeatureCacheEntry.objects.get()
+        # Older than DEPLOY_FEATURE_CACHE_MAX_AGE_DAYS.
+        DeployFeatureCacheEntry.objects.filter(pk=entry.pk).update(
+            create_date=timezone.now() - timedelta(days=31))
+
+        unit = self.deploy()
+
+        # Treated as a miss: the features are extracted again.
+        self.assertEqual(unit.status, Job.Status.SUCCESS)
+        self.assert_counts(hits=0, misses=2)
+        new_entry = DeployFeatureCacheEntry.objects.get()
+        self.assertNotEqual(new_entry.pk, entry.pk)
+        self.assertEqual(new_entry.key, entry.key)
+        storage = get_storage_class()()
+        self.assertTrue(storage.exists(new_entry.file_path))
+
+    @override_settings(DEPLOY_FEATURE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.deploy()
+        unit = self.deploy()
+
+        self.assertEqual(unit.status, Job.Status.SUCCESS)
+        self.assertFalse(DeployFeatureCacheEntry.objects.exists())
+        self.assertFalse(DeployFeatureCacheStats.objects.exists())
+
+    def test_stats(self):
+        self.deploy()
+        self.deploy()
+        self.deploy()
+
+        stats = feature_cache.get_stats(days=7)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 2/3)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(
+            stats['total_bytes'],
+            DeployFeatureCacheEntry.objects.get().size)
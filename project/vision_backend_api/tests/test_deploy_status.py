@@ -2,13 +2,16 @@ import copy
 import json
 
 from django.conf import settings
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
 from api_core.models import ApiJob, ApiJobUnit
 from api_core.tests.utils import BaseAPIPermissionTest
 from jobs.models import Job
+from jobs.utils import finish_job
 from vision_backend.tests.tasks.utils import queue_and_run_collect_spacer_jobs
 from .utils import DeployBaseTest
 
@@ -218,8 +221,7 @@ class DeployStatusEndpointTest(DeployBaseTest):
         self.assertEqual(job_units.count(), 2)
 
         unit = job_units[0]
-        unit.internal_job.status = Job.Status.SUCCESS
-        unit.internal_job.save()
+        finish_job(unit.internal_job, success=True)
 
         response = self.get_job_status(job)
 
@@ -244,8 +246,7 @@ class DeployStatusEndpointTest(DeployBaseTest):
 
         # Mark one unit's status as failure
         job_unit = ApiJobUnit.objects.filter(parent=job).latest('pk')
-        job_unit.internal_job.status = Job.Status.FAILURE
-        job_unit.internal_job.save()
+        finish_job(job_unit.internal_job, success=False)
 
         response = self.get_job_status(job)
 
@@ -289,15 +290,9 @@ class DeployStatusEndpointTest(DeployBaseTest):
         job = self.queue_deploy()
 
         # Mark both units' status as done: one success, one failure.
-        #
-        # Note: We must bind the units to separate names, since assigning an
-        # attribute using an index access (like units[0].status = ...)
-        # doesn't seem to work as desired (the attribute doesn't change).
         unit_1, unit_2 = ApiJobUnit.objects.filter(parent=job)
-        unit_1.internal_job.status = Job.Status.SUCCESS
-        unit_1.internal_job.save()
-        unit_2.internal_job.status = Job.Status.FAILURE
-        unit_2.internal_job.save()
+        finish_job(unit_1.internal_job, success=True)
+        finish_job(unit_2.internal_job, success=False)
 
         response = self.get_job_status(job)
 
@@ -313,3 +308,45 @@ class DeployStatusEndpointTest(DeployBaseTest):
             response['Location'],
             reverse('api:deploy_result', args=[job.pk]),
             "Location header should be as expected")
+
+    def test_unit_counts(self):
+        job = self.queue_deploy()
+        self.assertEqual(job.total_units, 2)
+
+        self.run_scheduled_jobs_including_deploy()
+        queue_and_run_collect_spacer_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.success_units, 2)
+        self.assertEqual(job.failure_units, 0)
+
+    def test_unit_finished_again(self):
+        job = self.queue_deploy()
+        unit = ApiJobUnit.objects.filter(parent=job).latest('pk')
+        finish_job(unit.internal_job, success=False)
+        # For example, a job aborted after it had already failed.
+        finish_job(unit.internal_job, success=False)
+
+        job.refresh_from_db()
+        self.assertEqual(job.failure_units, 1)
+
+    def test_query_count(self):
+        """
+        Polling the status shouldn't take more queries for more units.
+        """
+        job = self.queue_deploy()
+        with CaptureQueriesContext(connection) as context:
+            self.get_job_status(job)
+        num_queries = len(context.captured_queries)
+
+        images = [
+            dict(type='image', attributes=dict(
+                url=f'URL {n}', points=[dict(row=10, column=10)]))
+            for n in range(10)
+        ]
+        self.client.post(
+            self.deploy_url, json.dumps(dict(data=images)),
+            **self.request_kwargs)
+        job = ApiJob.objects.latest('pk')
+        with self.assertNumQueries(num_queries):
+            self.get_job_status(job)
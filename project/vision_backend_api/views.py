@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db import transaction
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
@@ -10,7 +11,7 @@ from rest_framework.views import APIView
 from api_core.exceptions import ApiRequestDataError
 from api_core.models import ApiJob, ApiJobUnit
 from jobs.models import Job
-from jobs.utils import queue_job
+from jobs.utils import queue_jobs
 from vision_backend.models import Classifier
 from .forms import validate_deploy
 
@@ -22,14 +23,16 @@ class Deploy(APIView):
     def post(self, request, classifier_id):
 
         # Check to see if we should throttle based on already-active jobs.
-        all_jobs = ApiJob.objects.filter(user=request.user).order_by('pk')
-        active_jobs = [
-            job for job in all_jobs
-            if job.status in [ApiJob.PENDING, ApiJob.IN_PROGRESS]]
         max_job_count = settings.MAX_CONCURRENT_API_JOBS_PER_USER
+        active_job_ids = list(
+            ApiJob.objects.filter(user=request.user)
+            .filter(ApiJob.active_filter())
+            .order_by('pk')
+            .values_list('pk', flat=True)[:max_job_count]
+        )
 
-        if len(active_jobs) >= max_job_count:
-            ids = ', '.join([str(job.pk) for job in active_jobs[:5]])
+        if len(active_job_ids) >= max_job_count:
+            ids = ', '.join([str(job_id) for job_id in active_job_ids[:5]])
             detail = (
                 "You already have {max} jobs active".format(max=max_job_count)
                 + " (IDs: {ids}).".format(ids=ids)
@@ -66,29 +69,42 @@ class Deploy(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Create a deploy job object, which can be queried via DeployStatus.
-        deploy_job = ApiJob(
-            type='deploy',
-            user=request.user)
-        deploy_job.save()
-
-        # Create job units to make it easier to track all the separate deploy
-        # operations (one per image).
-        for image_number, image_json in enumerate(images_data, 1):
-
-            internal_job = queue_job(
-                'classify_image', deploy_job.pk, image_number)
-            job_unit = ApiJobUnit(
-                parent=deploy_job,
-                order_in_parent=image_number,
-                internal_job=internal_job,
-                request_json=dict(
-                    classifier_id=int(classifier_id),
-                    url=image_json['url'],
-                    points=image_json['points'],
+        with transaction.atomic():
+            # Create a deploy job object, which can be queried via
+            # DeployStatus.
+            deploy_job = ApiJob(
+                type='deploy',
+                user=request.user,
+                total_units=len(images_data))
+            deploy_job.save()
+
+            # Create job units to make it easier to track all the separate
+            # deploy operations (one per image). The internal jobs and the
+            # units are each created in bulk.
+            image_numbers = range(1, len(images_data) + 1)
+            internal_jobs = queue_jobs(
+                'classify_image',
+                [(deploy_job.pk, image_number)
+                 for image_number in image_numbers])
+            internal_jobs_by_identifier = dict(
+                (job.arg_identifier, job) for job in internal_jobs)
+
+            ApiJobUnit.objects.bulk_create([
+                ApiJobUnit(
+                    parent=deploy_job,
+                    order_in_parent=image_number,
+                    internal_job=internal_jobs_by_identifier[
+                        Job.args_to_identifier(
+                            [deploy_job.pk, image_number])],
+                    request_json=dict(
+                        classifier_id=int(classifier_id),
+                        url=image_json['url'],
+                        points=image_json['points'],
+                    )
                 )
-            )
-            job_unit.save()
+                for image_number, image_json
+                in zip(image_numbers, images_data)
+            ])
 
         # Respond with the status endpoint's URL.
         return Response(
@@ -115,7 +131,8 @@ class DeployStatus(APIView):
                 dict(errors=[dict(detail=detail)]),
                 status=status.HTTP_404_NOT_FOUND)
 
-        job_status = deploy_job.full_status()
+        # Based on maintained counts, since clients poll this frequently.
+        job_status = deploy_job.counted_status()
 
         if job_status['overall_status'] == ApiJob.DONE:
             return Response(
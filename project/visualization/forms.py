@@ -490,6 +490,19 @@ class BaseImageSearchForm(EnhancedForm):
         """
         return image_search_kwargs_to_queryset(self.cleaned_data, self.source)
 
+    def depends_on_annotations(self):
+        """
+        Whether the search results can change when annotations change,
+        i.e. the search filters or sorts on annotation state.
+        """
+        data = self.cleaned_data
+        return bool(
+            data.get('annotation_status')
+            or data.get('last_annotated')
+            or data.get('last_annotator')
+            or data.get('sort_method') == 'last_annotation_date'
+        )
+
     def get_choice_verbose(self, field_name):
         choices = self.fields[field_name].choices
         return dict(choices)[self.cleaned_data[field_name]]
@@ -748,9 +761,13 @@ class ImageSpecifyByIdForm(forms.Form):
         """
         # TODO: If coming from Browse Images, the ordering specified in Browse
         # isn't preserved, which can be confusing.
-        return self.source.image_set.filter(pk__in=self.cleaned_data['ids']) \
+        return self.source.image_set.not_pending_deletion() \
+            .filter(pk__in=self.cleaned_data['ids']) \
             .order_by('metadata__name', 'pk')
 
+    def depends_on_annotations(self):
+        return False
+
     def get_applied_search_display(self):
         return "Filtering to a specific set of images"
 
@@ -81,7 +81,7 @@ class BrowseActionHelper {
         else if (action === 'delete_images') {
             formId = 'delete-images-ajax-form';
             this.isAjax = true;
-            this.actionAfterAjax = this.refreshBrowse.bind(this);
+            this.actionAfterAjax = this.pollDeleteProgress.bind(this);
             this.confirmMessage =
                 "Are you sure you want to delete these images?" +
                 " You won't be able to undo this." +
@@ -223,7 +223,34 @@ class BrowseActionHelper {
         this.actionSelectField.disabled = false;
     }
 
-    refreshBrowse() {
+    pollDeleteProgress(response) {
+        // Images are deleted by a background job. Poll its progress
+        // until it's done, then refresh Browse.
+        let progressUrl = response['progress_url'];
+        if (!progressUrl) {
+            this.refreshBrowse();
+            return;
+        }
+        let poll = () => {
+            util.fetch(progressUrl, {method: 'GET'}, (progress) => {
+                if (progress['error']) {
+                    alert("Error: " + progress['error']);
+                }
+                if (progress['done']) {
+                    this.refreshBrowse();
+                    return;
+                }
+                this.actionSubmitButton.disabled = true;
+                this.actionSubmitButton.textContent =
+                    `Deleting... (${progress['remaining']} remaining)`;
+                this.actionSelectField.disabled = true;
+                window.setTimeout(poll, 2000);
+            });
+        };
+        poll();
+    }
+
+        refreshBrowse() {
         // Re-fetch the current browse page, including the search/filter fields
         // that got us the current set of images.
         // TODO: And also the current page number.
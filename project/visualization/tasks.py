@@ -0,0 +1,26 @@
+from annotations.models import Annotation
+from jobs.exceptions import JobError
+from jobs.utils import job_runner
+from .utils import generate_patches
+
+
+@job_runner(job_name='generate_patches')
+def generate_patches_for_image(image_id):
+    """
+    Pre-generate patches for an image's confirmed annotations, so that
+    pages such as Browse Patches don't have to wait on them.
+    """
+    point_ids = list(
+        Annotation.objects.filter(image_id=image_id).confirmed()
+        .values_list('point_id', flat=True)
+    )
+    failure_count = generate_patches(point_ids)
+    if failure_count and failure_count == len(point_ids):
+        raise JobError(
+            f"Couldn't generate patches for any of the"
+            f" {len(point_ids)} point(s)")
+
+    message = f"Generated any missing patches for {len(point_ids)} point(s)"
+    if failure_count:
+        message += f"; {failure_count} couldn't be generated"
+    return message
@@ -1,8 +1,19 @@
+from unittest import mock
+
 from bs4 import BeautifulSoup
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.test import override_settings
 from django.urls import reverse
+from easy_thumbnails.files import get_thumbnailer
 
-from images.models import Image, Metadata
+from images.models import Image, Metadata, PendingImageDeletion
+from images.utils import queue_image_deletion
+from jobs.models import Job
+from jobs.tests.utils import run_pending_job
+from jobs.utils import finish_job, queue_job
 from vision_backend.models import Features
+from visualization.utils import generate_patch_if_doesnt_exist, get_patch_path
 from lib.tests.utils import BasePermissionTest, ClientTest
 
 
@@ -20,6 +31,14 @@ class PermissionTest(BasePermissionTest):
         self.assertPermissionLevel(
             url, self.SOURCE_EDIT, is_json=True, post_data={})
 
+    def test_browse_delete_progress_ajax(self):
+        url = reverse('browse_delete_progress_ajax', args=[self.source.pk])
+
+        self.source_to_private()
+        self.assertPermissionLevel(url, self.SOURCE_EDIT, is_json=True)
+        self.source_to_public()
+        self.assertPermissionLevel(url, self.SOURCE_EDIT, is_json=True)
+
 
 class BaseDeleteTest(ClientTest):
     @classmethod
@@ -45,6 +64,24 @@ class BaseDeleteTest(ClientTest):
             sort_method='name', sort_direction='asc',
         )
 
+    def submit_delete(self, post_data):
+        """
+        Submit the delete form, then run the deletion job it queues.
+        """
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, post_data)
+        response_json = response.json()
+        self.assertTrue(response_json['success'])
+
+        job = Job.objects.get(pk=response_json['job_id'])
+        self.assertEqual(job.job_name, 'delete_source_images')
+        self.assertEqual(job.status, Job.Status.PENDING)
+        run_pending_job(job.job_name, job.arg_identifier)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.SUCCESS)
+        return response_json
+
     def assert_image_deleted(self, image_id, name):
         msg = f"Image {name} should be deleted"
         with self.assertRaises(Image.DoesNotExist, msg=msg):
@@ -66,7 +103,7 @@ class BaseDeleteTest(ClientTest):
         response = self.client.get(browse_url)
         self.assertContains(
             response,
-            f"The {count} selected images have been deleted.")
+            f"Deletion of the {count} selected images has started.")
 
 
 class FormAvailabilityTest(BaseDeleteTest):
@@ -116,9 +153,7 @@ class SuccessTest(BaseDeleteTest):
         """
         Delete all images in the source.
         """
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, self.default_search_params)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(self.default_search_params)
 
         self.assert_image_deleted(self.img1.pk, "img1")
         self.assert_image_deleted(self.img2.pk, "img2")
@@ -136,9 +171,7 @@ class SuccessTest(BaseDeleteTest):
         post_data = self.default_search_params.copy()
         post_data['aux1'] = 'SiteA'
 
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, post_data)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(post_data)
 
         self.assert_image_deleted(self.img1.pk, "img1")
         self.assert_image_not_deleted(self.img2.pk, "img2")
@@ -155,9 +188,7 @@ class SuccessTest(BaseDeleteTest):
             ids=','.join([str(self.img1.pk), str(self.img3.pk)])
         )
 
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, post_data)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(post_data)
 
         self.assert_image_deleted(self.img1.pk, "img1")
         self.assert_image_not_deleted(self.img2.pk, "img2")
@@ -180,9 +211,7 @@ class SuccessTest(BaseDeleteTest):
         features_2_id = self.img2.features.pk
         features_3_id = self.img3.features.pk
 
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, post_data)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(post_data)
 
         with self.assertRaises(Metadata.DoesNotExist, msg="Should delete"):
             Metadata.objects.get(pk=metadata_1_id)
@@ -203,6 +232,153 @@ class SuccessTest(BaseDeleteTest):
             Features.objects.get(pk=features_3_id)
 
 
+class BackgroundJobTest(BaseDeleteTest):
+    """
+    Test the background job which does the actual deleting.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+
+        cls.img1 = cls.upload_image(cls.user, cls.source)
+        cls.img2 = cls.upload_image(cls.user, cls.source)
+        cls.img3 = cls.upload_image(cls.user, cls.source)
+
+        cls.progress_url = reverse(
+            'browse_delete_progress_ajax', args=[cls.source.pk])
+
+    def test_storage_files_deleted(self):
+        storage = get_storage_class()()
+
+        self.add_annotations(self.user, self.img1, {1: 'A'})
+        point = self.img1.point_set.get(point_number=1)
+        generate_patch_if_doesnt_exist(point.pk)
+        patch_path = get_patch_path(point.pk)
+        thumbnail = get_thumbnailer(self.img1.original_file).get_thumbnail(
+            dict(size=(150, 150)), generate=True)
+        feature_path = storage.save(
+            f'{self.img1.original_file.name}.featurevector',
+            ContentFile(b'features'))
+        original_path = self.img1.original_file.name
+
+        for path in [original_path, patch_path, thumbnail.name, feature_path]:
+            self.assertTrue(storage.exists(path), f"Sanity check: {path}")
+
+        self.submit_delete(dict(
+            image_form_type='ids', ids=str(self.img1.pk)))
+
+        for path in [original_path, patch_path, thumbnail.name, feature_path]:
+            self.assertFalse(storage.exists(path), f"Should delete {path}")
+        # Other images' files are left alone.
+        self.assertTrue(storage.exists(self.img2.original_file.name))
+
+    @override_settings(IMAGE_DELETION_CHUNK_SIZE=2)
+    def test_multiple_chunks(self):
+        self.submit_delete(self.default_search_params)
+
+        self.assert_image_deleted(self.img1.pk, "img1")
+        self.assert_image_deleted(self.img2.pk, "img2")
+        self.assert_image_deleted(self.img3.pk, "img3")
+
+        job = Job.objects.get(job_name='delete_source_images')
+        self.assertEqual(job.result_message, "Deleted 3 image(s)")
+
+    def test_progress(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, self.default_search_params)
+        response_json = response.json()
+        self.assertEqual(response_json['count'], 3)
+        job_id = response_json['job_id']
+
+        # Images aren't deleted until the job runs.
+        self.assert_image_not_deleted(self.img1.pk, "img1")
+        response = self.client.get(self.progress_url)
+        self.assertDictEqual(response.json(), dict(
+            job_id=job_id, status='pending', remaining=3, done=False))
+
+        run_pending_job('delete_source_images', str(self.source.pk))
+
+        response = self.client.get(self.progress_url)
+        self.assertDictEqual(response.json(), dict(
+            job_id=job_id, status='success', remaining=0, done=True))
+
+    def test_marked_images_hidden_before_deletion(self):
+        browse_url = reverse('browse_images', args=[self.source.pk])
+        self.client.force_login(self.user)
+        # Cache Browse's results before the deletion request.
+        self.client.get(browse_url)
+
+        self.client.post(self.url, dict(
+            image_form_type='ids', ids=str(self.img1.pk)))
+        self.assert_image_not_deleted(self.img1.pk, "img1")
+
+        response = self.client.get(browse_url)
+        self.assertListEqual(
+            response.context['page_image_ids'], [self.img2.pk, self.img3.pk])
+        response = self.client.post(browse_url, self.default_search_params)
+        self.assertListEqual(
+            response.context['page_image_ids'], [self.img2.pk, self.img3.pk])
+
+    def test_second_request_uses_same_job(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, dict(
+            image_form_type='ids', ids=str(self.img1.pk)))
+        job_id = response.json()['job_id']
+        response = self.client.post(self.url, dict(
+            image_form_type='ids', ids=str(self.img2.pk)))
+        self.assertEqual(response.json()['job_id'], job_id)
+
+        run_pending_job('delete_source_images', str(self.source.pk))
+
+        self.assert_image_deleted(self.img1.pk, "img1")
+        self.assert_image_deleted(self.img2.pk, "img2")
+        self.assert_image_not_deleted(self.img3.pk, "img3")
+
+    def test_failure(self):
+        self.client.force_login(self.user)
+        self.client.post(self.url, self.default_search_params)
+
+        with mock.patch(
+            'images.tasks.delete_images', side_effect=ValueError("Oops")
+        ):
+            run_pending_job('delete_source_images', str(self.source.pk))
+
+        self.assertEqual(
+            PendingImageDeletion.objects.filter(source=self.source).count(),
+            3)
+        response = self.client.get(self.progress_url)
+        response_json = response.json()
+        # The job's queued again to retry the remaining images.
+        self.assertEqual(response_json['status'], 'pending')
+        self.assertTrue(response_json['done'])
+        self.assertEqual(
+            response_json['error'],
+            "Image deletion failed with 3 image(s) remaining:"
+            " ValueError: Oops (It will be retried.)")
+
+        run_pending_job('delete_source_images', str(self.source.pk))
+        self.assert_image_deleted(self.img1.pk, "img1")
+
+    def test_marked_while_job_finishing(self):
+        # The job has already found no more images to delete, but hasn't
+        # finished yet.
+        finishing_job = queue_job(
+            'delete_source_images', self.source.pk,
+            source_id=self.source.pk, initial_status=Job.Status.IN_PROGRESS)
+
+        count, job = queue_image_deletion(
+            Image.objects.filter(pk=self.img1.pk), self.source)
+        self.assertEqual(job.pk, finishing_job.pk)
+
+        finish_job(finishing_job, success=True)
+        # The job's queued again, since there are still images marked.
+        run_pending_job('delete_source_images', str(self.source.pk))
+        self.assert_image_deleted(self.img1.pk, "img1")
+
+
 class OtherSourceTest(BaseDeleteTest):
     """
     Ensure that the UI doesn't allow deleting other sources' images.
@@ -222,9 +398,7 @@ class OtherSourceTest(BaseDeleteTest):
         Sanity check that the search form only picks up images in the current
         source.
         """
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, self.default_search_params)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(self.default_search_params)
 
         self.assert_image_deleted(self.img1.pk, "img1")
         self.assert_image_deleted(self.img2.pk, "img2")
@@ -242,9 +416,7 @@ class OtherSourceTest(BaseDeleteTest):
             ids=','.join([str(self.img1.pk), str(self.img22.pk)])
         )
 
-        self.client.force_login(self.user)
-        response = self.client.post(self.url, post_data)
-        self.assertDictEqual(response.json(), dict(success=True))
+        self.submit_delete(post_data)
 
         self.assert_image_deleted(self.img1.pk, "img1")
         self.assert_image_not_deleted(self.img22.pk, "img22")
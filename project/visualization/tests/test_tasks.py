@@ -0,0 +1,101 @@
+from unittest import mock
+
+from django.core.files.storage import get_storage_class
+from django.urls import reverse
+
+from images.model_utils import PointGen
+from jobs.models import Job
+from jobs.tests.utils import do_job
+from lib.tests.utils import ClientTest
+from ..utils import get_patch_path
+
+
+class GeneratePatchesJobTest(ClientTest):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=3,
+        )
+        labels = cls.create_labels(cls.user, ['A', 'B'], 'GroupA')
+        cls.create_labelset(cls.user, cls.source, labels)
+
+        cls.img = cls.upload_image(cls.user, cls.source)
+
+    def test_queued_on_annotation_tool_save(self):
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('save_annotations_ajax', args=[self.img.pk]),
+            dict(
+                label_1='A', label_2='B', label_3='',
+                robot_1='false', robot_2='false', robot_3='null',
+            ),
+        )
+
+        job = Job.objects.get(job_name='generate_patches')
+        self.assertEqual(job.arg_identifier, str(self.img.pk))
+        self.assertEqual(job.source_id, self.source.pk)
+
+    def test_not_queued_if_nothing_saved(self):
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('save_annotations_ajax', args=[self.img.pk]),
+            dict(
+                label_1='', label_2='', label_3='',
+                robot_1='null', robot_2='null', robot_3='null',
+            ),
+        )
+
+        self.assertFalse(
+            Job.objects.filter(job_name='generate_patches').exists())
+
+    def test_confirmed_points_only(self):
+        robot = self.create_robot(self.source)
+        self.add_robot_annotations(robot, self.img, {1: 'A', 2: 'A', 3: 'B'})
+        self.add_annotations(self.user, self.img, {1: 'B', 2: 'A'})
+
+        job = do_job('generate_patches', self.img.pk, source_id=self.source.pk)
+        self.assertEqual(job.status, Job.Status.SUCCESS)
+        self.assertEqual(
+            job.result_message, "Generated any missing patches for 2 point(s)")
+
+        storage = get_storage_class()()
+        points = {
+            point.point_number: point for point in self.img.point_set.all()}
+        self.assertTrue(storage.exists(get_patch_path(points[1].pk)))
+        self.assertTrue(storage.exists(get_patch_path(points[2].pk)))
+        self.assertFalse(storage.exists(get_patch_path(points[3].pk)))
+
+    def test_some_failures(self):
+        self.add_annotations(self.user, self.img, {1: 'A', 2: 'B'})
+
+        def mock_generate_patches(point_ids):
+            return 1
+        with mock.patch(
+            'visualization.tasks.generate_patches', mock_generate_patches
+        ):
+            job = do_job(
+                'generate_patches', self.img.pk, source_id=self.source.pk)
+
+        self.assertEqual(job.status, Job.Status.SUCCESS)
+        self.assertEqual(
+            job.result_message,
+            "Generated any missing patches for 2 point(s);"
+            " 1 couldn't be generated")
+
+    def test_all_failed(self):
+        img = self.upload_image(self.user, self.source)
+        self.add_annotations(self.user, img, {1: 'A', 2: 'B'})
+        img.original_file.delete(save=False)
+
+        job = do_job('generate_patches', img.pk, source_id=self.source.pk)
+
+        self.assertEqual(job.status, Job.Status.FAILURE)
+        self.assertEqual(
+            job.result_message,
+            "Couldn't generate patches for any of the 2 point(s)")
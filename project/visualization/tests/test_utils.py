@@ -3,15 +3,18 @@ import os
 from unittest import mock
 
 from PIL import Image as PILImage
+from PIL.JpegImagePlugin import JpegImageFile
 from PIL.Image import SAVE as PIL_SAVE
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import get_storage_class
 from django.test import override_settings
 
+from images.model_utils import PointGen
 from images.models import Point
 from lib.tests.utils import ClientTest
-from visualization.utils import generate_patch_if_doesnt_exist, get_patch_path
+from visualization.utils import (
+    generate_patch_if_doesnt_exist, generate_patches, get_patch_path)
 
 
 class LabelPatchGenerationTest(ClientTest):
@@ -73,6 +76,131 @@ class LabelPatchGenerationTest(ClientTest):
                       .format(repr(e)))
 
 
+class BatchPatchGenerationTest(ClientTest):
+    """
+    Test generating patches for multiple points at once.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.user = cls.create_user()
+        cls.source = cls.create_source(
+            cls.user,
+            point_generation_type=PointGen.Types.SIMPLE,
+            simple_number_of_points=5,
+        )
+        labels = cls.create_labels(cls.user, ['label1'], 'group1')
+        cls.labelset = cls.create_labelset(cls.user, cls.source, labels)
+
+    def assertPatchesGenerated(self, point_ids):
+        storage = get_storage_class()()
+        for point_id in point_ids:
+            with storage.open(get_patch_path(point_id)) as fp:
+                patch = PILImage.open(fp)
+                self.assertEqual(
+                    patch.size,
+                    (settings.LABELPATCH_NCOLS, settings.LABELPATCH_NROWS))
+                self.assertEqual(patch.mode, 'RGB')
+
+    def test_each_image_opened_once(self):
+        img1 = self.upload_image(self.user, self.source)
+        img2 = self.upload_image(self.user, self.source)
+        point_ids = list(
+            Point.objects.filter(image__in=[img1, img2])
+            .values_list('pk', flat=True))
+
+        ready = []
+        with mock.patch.object(
+            PILImage, 'open', wraps=PILImage.open
+        ) as mock_open:
+            generate_patches(
+                point_ids,
+                on_patch_ready=lambda point_id, path: ready.append(point_id))
+
+        self.assertEqual(mock_open.call_count, 2)
+        self.assertSetEqual(set(ready), set(point_ids))
+        self.assertPatchesGenerated(point_ids)
+
+    def test_existing_patches_skipped(self):
+        img = self.upload_image(self.user, self.source)
+        point_ids = list(img.point_set.values_list('pk', flat=True))
+        generate_patch_if_doesnt_exist(point_ids[0])
+
+        ready = []
+        with mock.patch.object(
+            get_storage_class(), 'save', autospec=True,
+            side_effect=get_storage_class().save,
+        ) as mock_save:
+            generate_patches(
+                point_ids,
+                on_patch_ready=lambda point_id, path: ready.append(point_id))
+
+        self.assertEqual(mock_save.call_count, len(point_ids) - 1)
+        self.assertSetEqual(set(ready), set(point_ids))
+        self.assertPatchesGenerated(point_ids)
+
+    def test_image_error_doesnt_stop_other_images(self):
+        img1 = self.upload_image(self.user, self.source)
+        img2 = self.upload_image(self.user, self.source)
+        img1.original_file.delete(save=False)
+        img2_point_ids = list(img2.point_set.values_list('pk', flat=True))
+        point_ids = (
+            list(img1.point_set.values_list('pk', flat=True))
+            + img2_point_ids)
+
+        ready = []
+        failure_count = generate_patches(
+            point_ids,
+            on_patch_ready=lambda point_id, path: ready.append(point_id))
+
+        self.assertEqual(failure_count, len(point_ids) - len(img2_point_ids))
+        self.assertSetEqual(set(ready), set(img2_point_ids))
+        self.assertPatchesGenerated(img2_point_ids)
+
+    def test_unexpected_error_raised(self):
+        img = self.upload_image(self.user, self.source)
+        point_ids = list(img.point_set.values_list('pk', flat=True))
+
+        with mock.patch.object(
+            PILImage.Image, 'crop', side_effect=ValueError("Oops")
+        ):
+            with self.assertRaises(ValueError):
+                generate_patches(point_ids)
+
+    def test_all_patches_exist(self):
+        img = self.upload_image(self.user, self.source)
+        point_ids = list(img.point_set.values_list('pk', flat=True))
+        generate_patches(point_ids)
+
+        with mock.patch.object(
+            PILImage, 'open', wraps=PILImage.open
+        ) as mock_open:
+            generate_patches(point_ids)
+
+        self.assertEqual(
+            mock_open.call_count, 0,
+            "Image shouldn't be opened if its patches all exist")
+
+    def test_jpeg_draft_mode(self):
+        # Patch regions are 400x400 here, so the JPEG can be decoded at
+        # 1/2 scale while still having enough resolution for 150x150
+        # patches.
+        img = self.upload_image(
+            self.user, self.source,
+            image_options=dict(filetype='JPEG', width=2000, height=1500))
+        point_ids = list(img.point_set.values_list('pk', flat=True))
+
+        with mock.patch.object(
+            JpegImageFile, 'draft', autospec=True,
+            side_effect=JpegImageFile.draft,
+        ) as mock_draft:
+            generate_patches(point_ids)
+
+        mock_draft.assert_called_once()
+        self.assertPatchesGenerated(point_ids)
+
+
 def always_save_png(self, fp, format=None, **params):
     """
     Mock version of PIL's Image.save().
@@ -19,6 +19,9 @@ source_urlpatterns = [
 
     path('delete_ajax/',
          views.browse_delete_ajax, name="browse_delete_ajax"),
+    path('delete_progress_ajax/',
+         views.browse_delete_progress_ajax,
+         name="browse_delete_progress_ajax"),
     path('edit_metadata_ajax/',
          views.edit_metadata_ajax, name="edit_metadata_ajax"),
 
@@ -1,18 +1,25 @@
+from collections import defaultdict
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import math
 import operator
 import re
 from functools import reduce
 from io import BytesIO
+import logging
 
 import django.db.models.fields as model_fields
 from PIL import Image as PILImage
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.files.storage import get_storage_class
-from django.db.models import Q
+from django.db.models import Q, Sum
 
 from accounts.utils import get_alleviate_user, get_imported_user, get_robot_user
+from annotations.models import ImageLabelCoverage
 from images.models import Point, Metadata
 
+logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
@@ -75,7 +82,8 @@ def image_search_kwargs_to_queryset(search_kwargs, source):
 
     # AND all of the constraints so far, and remember to search within
     # the source
-    image_results = source.image_set.filter(reduce(operator.and_, qs))
+    image_results = source.image_set.not_pending_deletion().filter(
+        reduce(operator.and_, qs))
 
     # Sorting
 
@@ -107,6 +115,43 @@ def image_search_kwargs_to_queryset(search_kwargs, source):
     return image_results
 
 
+def get_yearly_label_counts(images, include_robot):
+    """
+    Count annotations per photo-date year, both per label and per label
+    group, over the given images. This aggregates the precomputed
+    ImageLabelCoverage table in one grouped query.
+
+    :param images: Image queryset.
+    :param include_robot: If False, only count confirmed annotations.
+    :return: (label_counts, group_counts) where label_counts is
+      {year: {label_id: count}} and group_counts is
+      {year: {group_id: count}}. Images without a photo date are not
+      counted.
+    """
+    count_field = 'annotation_count' if include_robot else 'confirmed_count'
+    rows = (
+        ImageLabelCoverage.objects
+        .filter(
+            image__in=images.order_by().values('pk'),
+            image__metadata__photo_date__isnull=False)
+        .order_by()
+        .values(
+            'image__metadata__photo_date__year', 'label_id',
+            'label__group_id')
+        .annotate(total=Sum(count_field))
+    )
+
+    label_counts = defaultdict(lambda: defaultdict(int))
+    group_counts = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        if not row['total']:
+            continue
+        year = row['image__metadata__photo_date__year']
+        label_counts[year][row['label_id']] += row['total']
+        group_counts[year][row['label__group_id']] += row['total']
+    return label_counts, group_counts
+
+
 def get_annotation_tool_users(source):
     """
     Return a queryset of users who have made annotations using the annotation
@@ -145,19 +190,115 @@ def generate_patch_if_doesnt_exist(point_id):
     :param point_id: Primary key to point object to generate a patch for
     :return: None
     """
+    generate_patches([point_id])
+
 
-    # Get the storage class, then get an instance of it.
+def generate_patches(point_ids, on_patch_ready=None):
+    """
+    Generate image patch files for any of the given points which don't
+    have one yet.
+
+    Points are grouped by image so that each original image is only opened
+    and decoded once, no matter how many of its points are requested.
+    Images are decoded, and patches saved, across a pool of threads.
+    :param point_ids: Primary keys of the points to generate patches for.
+    :param on_patch_ready: Optional function which is called with
+      (point_id, patch_relative_path) as soon as each point's patch is
+      available. It's called from the calling thread.
+    :return: Number of points whose patches couldn't be generated because
+      the original image file is missing or unreadable, or the patch
+      couldn't be saved. Those are logged, the other images are still
+      processed, and the callback isn't called for those points. Any
+      other error is raised.
+    """
     storage = get_storage_class()()
 
-    # Check if patch exists for the point
-    patch_relative_path = get_patch_path(point_id)
-    if storage.exists(patch_relative_path):
-        return
+    points_by_image = defaultdict(list)
+    images = dict()
+    for point in (
+        Point.objects.filter(pk__in=point_ids)
+        .select_related('image')
+        .order_by('pk')
+    ):
+        points_by_image[point.image_id].append(point)
+        images[point.image_id] = point.image
+
+    if not images:
+        return 0
+
+    def patch_ready(point_id, patch_relative_path):
+        if on_patch_ready:
+            on_patch_ready(point_id, patch_relative_path)
+
+    with ThreadPoolExecutor(
+        max_workers=min(
+            settings.PATCH_GENERATION_THREADS,
+            sum(len(points) for points in points_by_image.values()))
+    ) as executor:
+        image_futures = {
+            executor.submit(
+                _create_image_patches,
+                storage, images[image_id], points): image_id
+            for image_id, points in points_by_image.items()
+        }
+        save_futures = dict()
+        failure_count = 0
+
+        for image_future in as_completed(image_futures):
+            image_id = image_futures[image_future]
+            try:
+                patches = image_future.result()
+            except OSError as e:
+                # Missing file, or not a readable image. PIL's
+                # UnidentifiedImageError is an OSError too.
+                logger.warning(
+                    f"Couldn't generate patches for image {image_id}: {e}")
+                failure_count += len(points_by_image[image_id])
+                continue
+            for point_id, patch_relative_path, patch_bytes in patches:
+                if patch_bytes is None:
+                    # Already exists.
+                    patch_ready(point_id, patch_relative_path)
+                    continue
+                save_future = executor.submit(
+                    storage.save,
+                    patch_relative_path, ContentFile(patch_bytes))
+                save_futures[save_future] = (point_id, patch_relative_path)
+
+        for save_future in as_completed(save_futures):
+            point_id, patch_relative_path = save_futures[save_future]
+            try:
+                save_future.result()
+            except OSError as e:
+                logger.warning(
+                    f"Couldn't save patch {patch_relative_path}: {e}")
+                failure_count += 1
+                continue
+            patch_ready(point_id, patch_relative_path)
+
+    return failure_count
+
+
+def _create_image_patches(storage, image, points):
+    """
+    Create the missing patches for the given points of a single image.
+    Returns a list of (point_id, patch_relative_path, patch_bytes) tuples;
+    patch_bytes is None if the patch file already exists.
+    """
+    patches = []
+    points_to_generate = []
+    for point in points:
+        patch_relative_path = settings.POINT_PATCH_FILE_PATTERN.format(
+            full_image_path=image.original_file.name,
+            point_pk=point.pk,
+        )
+        if storage.exists(patch_relative_path):
+            patches.append((point.pk, patch_relative_path, None))
+        else:
+            points_to_generate.append((point, patch_relative_path))
 
-    # Locate the image.
-    point = Point.objects.get(pk=point_id)
-    image = point.image
-    original_image_relative_path = image.original_file.name
+    if not points_to_generate:
+        return patches
 
     # Figure out the size to crop out of the original image. Base it on the
     # larger of the two image dimensions.
@@ -165,42 +306,61 @@ def generate_patch_if_doesnt_exist(point_id):
                              * settings.LABELPATCH_SIZE_FRACTION)
 
     # Open the image file.
-    with storage.open(original_image_relative_path) as original_image_file:
+    with storage.open(image.original_file.name) as original_image_file:
 
         # Load the image with Pillow.
         im = PILImage.open(original_image_file)
+        full_width = im.width
+
+        if im.format == 'JPEG':
+            # Let the JPEG decoder downscale (by 1/2, 1/4, or 1/8) while
+            # decoding, as long as each cropped region still has at least
+            # the resolution of the final patch. This makes decoding large
+            # images much faster.
+            im.draft('RGB', (
+                math.ceil(im.width * settings.LABELPATCH_NCOLS
+                          / max(approx_region_size, 1)),
+                math.ceil(im.height * settings.LABELPATCH_NROWS
+                          / max(approx_region_size, 1)),
+            ))
 
         # Convert to RGB, since the input may have an alpha (transparency)
         # channel, and we're saving the thumbnail as JPEG which doesn't
         # have alpha.
         im = im.convert('RGB')
 
-    # Crop.
-    # - Both CoralNet coordinates and Pillow coordinates start from 0 at the
-    # top left.
-    # https://pillow.readthedocs.io/en/stable/handbook/concepts.html#coordinate-system
-    # - crop() includes the low bounds and excludes the high bounds, so we
-    # add +1 to the high bounds so that the point ends up in the center of the
-    # region, rather than a half-pixel off.
-    # - The region is always odd-sized, and either equal to or 1 greater
-    # than the approx_region_size.
-    region = im.crop((
-        point.column - (approx_region_size // 2),
-        point.row - (approx_region_size // 2),
-        point.column + (approx_region_size // 2) + 1,
-        point.row + (approx_region_size // 2) + 1
-    ))
-
-    # Resize to the desired size for the final patch.
-    region = region.resize((settings.LABELPATCH_NCOLS,
-                            settings.LABELPATCH_NROWS))
-
-    # Save the patch image.
-    # First use Pillow's save() method on an IO stream
-    # (so we don't have to create a temporary file).
-    # Then save the image, using the path constructed earlier
-    # and the contents of the stream.
-    # This approach should work with both local and remote storage.
-    with BytesIO() as stream:
-        region.save(stream, 'JPEG')
-        storage.save(patch_relative_path, stream)
+    # Point coordinates are in terms of the full-size image.
+    scale = im.width / full_width
+
+    for point, patch_relative_path in points_to_generate:
+
+        # Crop.
+        # - Both CoralNet coordinates and Pillow coordinates start from 0 at
+        # the top left.
+        # https://pillow.readthedocs.io/en/stable/handbook/concepts.html#coordinate-system
+        # - crop() includes the low bounds and excludes the high bounds, so
+        # we add +1 to the high bounds so that the point ends up in the
+        # center of the region, rather than a half-pixel off.
+        # - The region is always odd-sized, and either equal to or 1 greater
+        # than the approx_region_size.
+        box = (
+            point.column - (approx_region_size // 2),
+            point.row - (approx_region_size // 2),
+            point.column + (approx_region_size // 2) + 1,
+            point.row + (approx_region_size // 2) + 1
+        )
+        region = im.crop(tuple(round(coord * scale) for coord in box))
+
+        # Resize to the desired size for the final patch.
+        region = region.resize((settings.LABELPATCH_NCOLS,
+                                settings.LABELPATCH_NROWS))
+
+        # Encode the patch image on an IO stream (so we don't have to
+        # create a temporary file). The caller then saves the contents
+        # to storage, which works with both local and remote storage.
+        with BytesIO() as stream:
+            region.save(stream, 'JPEG')
+            patches.append(
+                (point.pk, patch_relative_path, stream.getvalue()))
+
+    return patches
@@ -14,8 +14,10 @@ from calcification.utils import get_default_calcify_tables
 from cpce.forms import CpcExportForm
 from export.forms import ExportAnnotationsForm, ExportImageCoversForm
 from images.forms import MetadataFormForGrid, BaseMetadataFormSet
-from images.models import Source, Image, Metadata
-from images.utils import delete_images
+from images.models import Source, Image, Metadata, PendingImageDeletion
+from images.utils import (
+    get_image_order_index, IndexedImageResults, queue_image_deletion)
+from jobs.utils import get_source_job_progress
 from labels.models import LabelGroup, Label
 from lib.decorators import source_visibility_required, source_permission_required
 from lib.utils import paginate
@@ -26,7 +28,9 @@ from .forms import (
     ImageSearchForm,
     MetadataEditSearchForm,
     PatchSearchForm,
+    StatisticsSearchForm,
 )
+from .utils import get_yearly_label_counts, image_search_kwargs_to_queryset
 
 
 @source_visibility_required('source_id')
@@ -44,10 +48,13 @@ def browse_images(request, source_id):
     # The primary way to filter images is by POST params due to the possible
     # length of some of the params. However, in some cases like the source main
     # page's image-status links, it can be easier to use GET.
+    annotation_dependent = False
+
     image_form = create_image_filter_form(request.POST or request.GET, source)
     if image_form:
         if image_form.is_valid():
             image_results = image_form.get_images()
+            annotation_dependent = image_form.depends_on_annotations()
             hidden_image_form = HiddenForm(forms=[image_form])
         else:
             empty_message = "Search parameters were invalid."
@@ -60,20 +67,23 @@ def browse_images(request, source_id):
             image_search_form = image_form
     else:
         # Coming from a straight link or URL entry
-        image_results = source.image_set.order_by('metadata__name', 'pk')
+        image_results = source.image_set.not_pending_deletion().order_by(
+            'metadata__name', 'pk')
 
+    # Paginate over the search's cached image-ID index, so that page loads
+    # don't have to re-run the search's filters and ordering.
+    image_index = get_image_order_index(
+        image_results, source.pk, annotation_dependent=annotation_dependent)
     page_results, _ = paginate(
-        image_results,
+        IndexedImageResults(image_index),
         settings.BROWSE_DEFAULT_THUMBNAILS_PER_PAGE,
         request.POST)
 
     if page_results.paginator.count > 0:
-        page_image_ids = [
-            int(pk)
-            for pk in page_results.object_list.values_list('pk', flat=True)]
+        page_image_ids = [image.pk for image in page_results.object_list]
         links = dict(
             annotation_tool_first_result=
-                reverse('annotation_tool', args=[image_results[0].pk]),
+                reverse('annotation_tool', args=[image_index.ids[0]]),
             annotation_tool_page_results=
                 [reverse('annotation_tool', args=[pk])
                  for pk in page_image_ids],
@@ -347,14 +357,35 @@ def browse_delete_ajax(request, source_id):
         ))
 
     image_set = image_form.get_images()
-    delete_count = delete_images(image_set)
+    # Deleting many images can take a long time, so it's done by a
+    # background job. The page polls the job's progress, and reloads
+    # Browse once it's done.
+    delete_count, job = queue_image_deletion(image_set, source)
 
     # This should appear on the next browse load.
     messages.success(
-        request, 'The {num} selected images have been deleted.'.format(
-            num=delete_count))
+        request,
+        f"Deletion of the {delete_count} selected images has started.")
 
-    return JsonResponse(dict(success=True))
+    return JsonResponse(dict(
+        success=True,
+        job_id=job.pk if job else None,
+        count=delete_count,
+        progress_url=reverse('browse_delete_progress_ajax', args=[source.pk]),
+    ))
+
+
+@source_permission_required(
+    'source_id', perm=Source.PermTypes.EDIT.code, ajax=True)
+def browse_delete_progress_ajax(request, source_id):
+    """
+    Progress of the source's background image deletion.
+    """
+    source = get_object_or_404(Source, id=source_id)
+
+    remaining = PendingImageDeletion.objects.filter(source=source).count()
+    return JsonResponse(get_source_job_progress(
+        'delete_source_images', source.pk, remaining, "Image deletion"))
 
 
 @source_visibility_required('source_id')
@@ -381,9 +412,6 @@ def generate_statistics(request, source_id):
             labels = form.cleaned_data['labels']
             groups = form.cleaned_data['groups']
 
-            # TODO: Fix
-            imageArgs = image_search_args_to_queryset_args(form.cleaned_data, source)
-
             #Check that the specified set of images and/or labels was found
             if not labels and not groups:
                 errors.append("Sorry you didn't specify any labels or groups!")
@@ -392,18 +420,16 @@ def generate_statistics(request, source_id):
             # coverage on the y axis, and year on the x axis
             if not errors:
 
-                images = Image.objects.filter(source=source, **imageArgs).distinct().select_related()
-                patchArgs = dict([('image__'+k, imageArgs[k]) for k in imageArgs])
-
-                #get all annotations for the source that contain the label
-                if request.GET and request.GET.get('include_robot', ''):
-                    all_annotations = Annotation.objects.filter(source=source, **patchArgs)
-                else:
-                    all_annotations = Annotation.objects.filter(source=source, **patchArgs).confirmed()
+                images = image_search_kwargs_to_queryset(
+                    form.cleaned_data, source)
 
+                # Annotation counts per year, from the precomputed
+                # per-image label coverages (one grouped query).
+                label_counts, group_counts = get_yearly_label_counts(
+                    images, form.cleaned_data['include_robot'])
 
                 #check that we found annotations
-                if all_annotations:
+                if label_counts:
                     #holds the data that gets passed to the graphing code
                     data = []
 
@@ -415,76 +441,50 @@ def generate_statistics(request, source_id):
                     legends = []
 
                     #gets the years we have data for from the specified set of images
-                    for image in images:
-                        date = image.metadata.photo_date
-                        if not date is None:
-                            if not years.count(date.year):
-                               years.append(date.year)
-                    years.sort()
-
-                    for label in labels:
-                        table_yearly_counts = []
-                        graph_yearly_counts = []
-                        #get yearly counts that become y values for the label's line
-                        for year in years:
-                            #get the most recent for each point for every label specified
-                            total_year_annotations =  all_annotations.filter(image__metadata__photo_date__year=year)
-                            total_year_annotations_count = total_year_annotations.count()
-                            label_year_annotations_count = total_year_annotations.filter(label=label).count()
-
-                            #add up # of annotations, divide by total annotations, and times 100 to get % coverage
-                            # done the way it is b/c we need to cast either num or denom as float to get float result,
-                            # convert to %, round, then truncate by casting to int
-                            try:
-                                percent_coverage = (float(label_year_annotations_count)/total_year_annotations_count)*100
-                            except ZeroDivisionError:
-                                percent_coverage = 0
-                            table_yearly_counts.append(round(percent_coverage,2))
-                            table_yearly_counts.append(label_year_annotations_count)
-                            graph_yearly_counts.append(int(percent_coverage))
-
-                        data.append(graph_yearly_counts)
-
-                        #add label name to legends
-                        name = Label.objects.get(id=int(label)).name
-                        legends.append(str(name))
-
-                        #create table row to display
-                        table_row = [name]
-                        table_row.extend(table_yearly_counts)
-                        label_table.append(table_row)
-                        
-                    for group in groups:
-                        table_yearly_counts = []
-                        graph_yearly_counts = []
-                        #get yearly counts that become y values for the label's line
-                        for year in years:
-                            #get the most recent for each point for every label specified
-                            total_year_annotations =  all_annotations.filter(image__metadata__photo_date__year=year)
-                            total_year_annotations_count = total_year_annotations.count()
-                            label_year_annotations_count = total_year_annotations.filter(label__group=group).count()
-
-                            #add up # of annotations, divide by total annotations, and times 100 to get % coverage
-                            # done the way it is b/c we need to cast either num or denom as float to get float result,
-                            # convert to %, round, then truncate by casting to int
-                            try:
-                                percent_coverage = (float(label_year_annotations_count)/total_year_annotations_count)*100
-                            except ZeroDivisionError:
-                                percent_coverage = 0
-                            table_yearly_counts.append(round(percent_coverage,2))
-                            table_yearly_counts.append(label_year_annotations_count)
-                            graph_yearly_counts.append(int(percent_coverage))
-
-                        data.append(graph_yearly_counts)
-
-                        #add label name to legends
-                        name = LabelGroup.objects.get(id=int(group)).name
-                        legends.append(str(name))
-
-                        #create table row to display
-                        table_row = [name]
-                        table_row.extend(table_yearly_counts)
-                        group_table.append(table_row)
+                    years = sorted(label_counts.keys())
+                    year_totals = {
+                        year: sum(label_counts[year].values())
+                        for year in years
+                    }
+
+                    label_names = dict(
+                        Label.objects.filter(pk__in=labels)
+                        .values_list('pk', 'name'))
+                    group_names = dict(
+                        LabelGroup.objects.filter(pk__in=groups)
+                        .values_list('pk', 'name'))
+
+                    for table, names, counts, pks in [
+                        (label_table, label_names, label_counts, labels),
+                        (group_table, group_names, group_counts, groups),
+                    ]:
+                        for pk in pks:
+                            pk = int(pk)
+                            table_yearly_counts = []
+                            graph_yearly_counts = []
+                            #get yearly counts that become y values for the line
+                            for year in years:
+                                count = counts[year][pk]
+
+                                #divide by total annotations, and times 100 to get % coverage
+                                try:
+                                    percent_coverage = (count / year_totals[year]) * 100
+                                except ZeroDivisionError:
+                                    percent_coverage = 0
+                                table_yearly_counts.append(round(percent_coverage,2))
+                                table_yearly_counts.append(count)
+                                graph_yearly_counts.append(int(percent_coverage))
+
+                            data.append(graph_yearly_counts)
+
+                            #add name to legends
+                            name = names[pk]
+                            legends.append(str(name))
+
+                            #create table row to display
+                            table_row = [name]
+                            table_row.extend(table_yearly_counts)
+                            table.append(table_row)
                     """
                     #Create string of colors
                     colors_string = str(bucket[0: (len(labels)+len(groups))]).replace(' ', '').replace('[','').replace(']','').replace('\'', '')